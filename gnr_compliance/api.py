@@ -3,20 +3,36 @@ import frappe
 from frappe import _
 from io import BytesIO
 
+from gnr_compliance.gnr_compliance.doctype.gnr_daily_ledger.gnr_daily_ledger import resoudre_societe
+from gnr_compliance.gnr_compliance.doctype.gnr_export_cache.gnr_export_cache import obtenir_export
+from gnr_compliance.utils.period_dataset import get_dataset_periode
+
 @frappe.whitelist()
-def generate_export(export_format, from_date, to_date, periode_type="Trimestrielle", inclure_details=False):
+def generate_export(export_format, from_date, to_date, periode_type="Trimestrielle", inclure_details=False, company=None):
     """API pour génération d'exports GNR dans différents formats"""
+    company = resoudre_societe(company)
     
-    # Récupérer les données selon les filtres
-    data = get_gnr_data(from_date, to_date, periode_type)
-    
-    if "Excel" in export_format:
-        return generate_excel_export(data, from_date, to_date, inclure_details)
-    else:
+    if "Excel" not in export_format:
         frappe.throw(_("Format d'export non supporté: {0}").format(export_format))
+    
+    # Récupérer les données selon les filtres (fichier repris du cache si
+    # aucun mouvement de la période n'a changé)
+    export = obtenir_export(
+        "export_gnr_details" if inclure_details else "export_gnr", company, from_date, to_date,
+        lambda: {
+            "data": get_gnr_data(from_date, to_date, periode_type, company),
+            "clients_data": get_clients_data_for_period(from_date, to_date, company) if inclure_details else None,
+        },
+        lambda donnees: (
+            f"Arrete_GNR_{from_date}_{to_date}.xlsx",
+            generate_excel_export(donnees["data"], from_date, to_date, donnees["clients_data"]),
+        ),
+    )
+    
+    return {"file_url": export.file_url}
 
-def generate_excel_export(data, from_date, to_date, inclure_details):
-    """Génération export Excel format arrêté trimestriel"""
+def generate_excel_export(data, from_date, to_date, clients_data=None):
+    """Génération export Excel format arrêté trimestriel (liste clients en seconde feuille si fournie)"""
     import xlsxwriter
     
     output = BytesIO()
@@ -70,8 +86,7 @@ def generate_excel_export(data, from_date, to_date, inclure_details):
     worksheet.write(row + 1, 7, total_taxe, header_format)
     
     # Feuille détails clients si demandée
-    if inclure_details:
-        clients_data = get_clients_data_for_period(from_date, to_date)
+    if clients_data is not None:
         clients_sheet = workbook.add_worksheet('Liste Clients Semestrielle')
         
         client_headers = ['Code Client', 'Nom Client', 'SIRET', 'Quantité (hL)', 'Montant HT (€)']
@@ -86,50 +101,31 @@ def generate_excel_export(data, from_date, to_date, inclure_details):
             clients_sheet.write(idx, 4, client.get('montant_ht', 0))
     
     workbook.close()
-    output.seek(0)
-    
-    # Créer fichier
-    file_doc = frappe.get_doc({
-        "doctype": "File",
-        "file_name": f"Arrete_GNR_{from_date}_{to_date}.xlsx",
-        "content": output.getvalue()
-    })
-    file_doc.save()
-    
-    return {"file_url": file_doc.file_url}
+    return output.getvalue()
 
-def get_clients_data_for_period(from_date, to_date):
-    """Récupération des données clients pour la période"""
-    return frappe.db.sql("""
-        SELECT 
-            c.name as code_client,
-            c.customer_name as nom_client,
-            c.tax_id as siret,
-            SUM(m.quantite) as quantite_totale,
-            SUM(m.quantite * m.prix_unitaire) as montant_ht
-        FROM `tabMouvement GNR` m
-        LEFT JOIN `tabCustomer` c ON m.client = c.name
-        WHERE m.date_mouvement BETWEEN %s AND %s
-        AND m.docstatus = 1
-        AND m.type_mouvement = 'Vente'
-        GROUP BY m.client
-        ORDER BY quantite_totale DESC
-    """, (from_date, to_date), as_dict=True)
+def get_clients_data_for_period(from_date, to_date, company=None):
+    """Récupération des données clients de la société pour la période (volume décroissant)"""
+    clients = get_dataset_periode(from_date, to_date, resoudre_societe(company)).clients()
+    return [
+        frappe._dict(
+            code_client=client.code_client,
+            nom_client=client.nom_client,
+            siret=client.siret,
+            quantite_totale=client.quantite_totale,
+            montant_ht=client.montant_ht_reel,
+        )
+        for client in sorted(clients, key=lambda client: -client.quantite_totale)
+    ]
 
-def get_gnr_data(from_date, to_date, periode_type):
-    """Récupération des données GNR pour la période"""
-    return frappe.db.sql("""
-        SELECT 
-            m.code_produit,
-            i.item_name as designation,
-            SUM(CASE WHEN m.type_mouvement IN ('Achat', 'Entrée') THEN m.quantite ELSE 0 END) as entrees,
-            SUM(CASE WHEN m.type_mouvement IN ('Vente', 'Sortie') THEN m.quantite ELSE 0 END) as sorties,
-            m.taux_gnr,
-            SUM(m.montant_taxe_gnr) as montant_taxe
-        FROM `tabMouvement GNR` m
-        LEFT JOIN `tabItem` i ON m.code_produit = i.item_code
-        WHERE m.date_mouvement BETWEEN %s AND %s
-        AND m.docstatus = 1
-        GROUP BY m.code_produit, m.taux_gnr
-        ORDER BY m.code_produit
-    """, (from_date, to_date), as_dict=True)
\ No newline at end of file
+def get_gnr_data(from_date, to_date, periode_type, company=None):
+    """Récupération des données GNR de la société pour la période (stocks depuis le jeu de données de la période)"""
+    dataset = get_dataset_periode(from_date, to_date, resoudre_societe(company))
+    data = [frappe._dict(produit) for produit in dataset.produits()]
+    
+    # Stock début/fin par produit, reporté sur la première ligne du produit
+    soldes = dataset.grand_livre(par_produit=True).soldes_par_produit()
+    for item in data:
+        if item.code_produit in soldes:
+            item.stock_debut, item.stock_fin = soldes.pop(item.code_produit)
+    
+    return data
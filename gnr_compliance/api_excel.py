@@ -8,12 +8,31 @@ from frappe.utils import today, add_days, add_months, getdate
 from datetime import datetime
 import calendar
 from gnr_compliance.utils.excel_generators import (
-    generate_arrete_trimestriel, 
-    generate_liste_clients
+    ArreteTrimestrielGenerator,
+    ListeClientsGenerator,
+    get_arrete_trimestriel_data,
+    get_clients_data_for_period,
+    get_liste_clients_data,
+    get_stock_movements_for_period,
 )
+from gnr_compliance.gnr_compliance.doctype.gnr_daily_ledger.gnr_daily_ledger import resoudre_societe
+from gnr_compliance.gnr_compliance.doctype.gnr_export_cache.gnr_export_cache import obtenir_export
+from gnr_compliance.utils.gnr_aggregates import PERIODES_CACHE_KEY
+
+# Bornes (MM-JJ) et libellés des trimestres et semestres
+TRIMESTRES = {
+    1: ("01-01", "03-31", "Janvier - Mars"),
+    2: ("04-01", "06-30", "Avril - Juin"),
+    3: ("07-01", "09-30", "Juillet - Septembre"),
+    4: ("10-01", "12-31", "Octobre - Décembre"),
+}
+SEMESTRES = {
+    1: ("01-01", "06-30", "Janvier - Juin"),
+    2: ("07-01", "12-31", "Juillet - Décembre"),
+}
 
 @frappe.whitelist()
-def download_arrete_trimestriel(period_start=None, period_end=None, quarter=None, year=None):
+def download_arrete_trimestriel(period_start=None, period_end=None, quarter=None, year=None, company=None):
     """
     Télécharger l'arrêté trimestriel de stock au format Excel exact
     
@@ -22,6 +41,7 @@ def download_arrete_trimestriel(period_start=None, period_end=None, quarter=None
         period_end: Date de fin (YYYY-MM-DD)
         quarter: Trimestre (1-4) 
         year: Année
+        company: Société déclarante (défaut : celle de l'utilisateur)
     """
     try:
         # Si trimestre et année fournis, calculer les dates
@@ -61,15 +81,12 @@ def download_arrete_trimestriel(period_start=None, period_end=None, quarter=None
                 period_start = f"{current_year}-10-01"
                 period_end = f"{current_year}-12-31"
         
-        # Générer le fichier Excel
-        excel_data = generate_arrete_trimestriel(period_start, period_end)
+        company = resoudre_societe(company)
         
         # Nom du fichier basé sur les dates
         start_date = datetime.strptime(period_start, '%Y-%m-%d')
         end_date = datetime.strptime(period_end, '%Y-%m-%d')
         
-        company = frappe.defaults.get_user_default("Company") or frappe.get_all("Company", limit=1)[0].name
-        
         quarter_names = {
             1: "Janvier à Mars",
             2: "Avril à Juin", 
@@ -82,6 +99,15 @@ def download_arrete_trimestriel(period_start=None, period_end=None, quarter=None
         
         filename = f"TIPAccEne - Arrêté Trimestriel de Stock - Détaillé - {start_date.year} {quarter_text}.xlsx"
         
+        # Générer le fichier Excel (repris du cache si la période n'a pas changé)
+        export = obtenir_export(
+            "arrete_trimestriel", company, period_start, period_end,
+            lambda: get_arrete_trimestriel_data(period_start, period_end, company),
+            lambda donnees: (filename, ArreteTrimestrielGenerator().generate(**donnees)),
+            is_private=1,
+        )
+        excel_data = frappe.get_doc("File", export.fichier).get_content()
+        
         # Retourner le fichier pour téléchargement
         frappe.response.update({
             "type": "download",
@@ -94,7 +120,7 @@ def download_arrete_trimestriel(period_start=None, period_end=None, quarter=None
 
 
 @frappe.whitelist()
-def download_liste_clients(period_start=None, period_end=None, semester=None, year=None):
+def download_liste_clients(period_start=None, period_end=None, semester=None, year=None, company=None):
     """
     Télécharger la liste semestrielle des clients au format Excel exact
     
@@ -103,6 +129,7 @@ def download_liste_clients(period_start=None, period_end=None, semester=None, ye
         period_end: Date de fin (YYYY-MM-DD)
         semester: Semestre (1 ou 2)
         year: Année
+        company: Société déclarante (défaut : celle de l'utilisateur)
     """
     try:
         # Si semestre et année fournis, calculer les dates
@@ -132,8 +159,7 @@ def download_liste_clients(period_start=None, period_end=None, semester=None, ye
                 period_end = f"{current_year}-12-31"
                 semester = 2
         
-        # Générer le fichier Excel
-        excel_data = generate_liste_clients(period_start, period_end)
+        company = resoudre_societe(company)
         
         # Nom du fichier basé sur les dates
         start_date = datetime.strptime(period_start, '%Y-%m-%d')
@@ -151,6 +177,15 @@ def download_liste_clients(period_start=None, period_end=None, semester=None, ye
         
         filename = f"TIPAccEne - Liste Semestrielle des Clients - Douane - {start_date.year} {semester_text}.xlsx"
         
+        # Générer le fichier Excel (repris du cache si la période n'a pas changé)
+        export = obtenir_export(
+            "liste_clients", company, period_start, period_end,
+            lambda: get_liste_clients_data(period_start, period_end, company),
+            lambda donnees: (filename, ListeClientsGenerator().generate(**donnees)),
+            is_private=1,
+        )
+        excel_data = frappe.get_doc("File", export.fichier).get_content()
+        
         # Retourner le fichier pour téléchargement
         frappe.response.update({
             "type": "download",
@@ -163,108 +198,81 @@ def download_liste_clients(period_start=None, period_end=None, semester=None, ye
 
 
 @frappe.whitelist()
-def get_available_periods():
+def get_available_periods(company=None):
     """
     Récupérer les périodes disponibles pour les déclarations
+    
+    Args:
+        company: Société déclarante (défaut : celle de l'utilisateur)
     """
     try:
-        # Récupérer les dates min/max des mouvements GNR
-        date_range = frappe.db.sql("""
-            SELECT MIN(date) as min_date, MAX(date) as max_date
-            FROM `tabMouvement GNR`
-            WHERE docstatus = 1
-        """, as_dict=True)[0]
-        
-        periods = {
-            "quarters": [],
-            "semesters": []
-        }
-        
-        if date_range.min_date and date_range.max_date:
-            min_date = getdate(date_range.min_date)
-            max_date = getdate(date_range.max_date)
-            
-            # Générer les trimestres disponibles
-            current_year = min_date.year
-            end_year = max_date.year
-            
-            while current_year <= end_year:
-                for quarter in range(1, 5):
-                    if quarter == 1:
-                        q_start = f"{current_year}-01-01"
-                        q_end = f"{current_year}-03-31"
-                        q_label = f"Q1 {current_year} (Janvier - Mars)"
-                    elif quarter == 2:
-                        q_start = f"{current_year}-04-01"
-                        q_end = f"{current_year}-06-30"
-                        q_label = f"Q2 {current_year} (Avril - Juin)"
-                    elif quarter == 3:
-                        q_start = f"{current_year}-07-01"
-                        q_end = f"{current_year}-09-30"
-                        q_label = f"Q3 {current_year} (Juillet - Septembre)"
-                    else:
-                        q_start = f"{current_year}-10-01"
-                        q_end = f"{current_year}-12-31"
-                        q_label = f"Q4 {current_year} (Octobre - Décembre)"
-                    
-                    # Vérifier si le trimestre a des données
-                    has_data = frappe.db.sql("""
-                        SELECT COUNT(*) as count
-                        FROM `tabMouvement GNR`
-                        WHERE date BETWEEN %s AND %s
-                        AND docstatus = 1
-                    """, (q_start, q_end))[0][0]
-                    
-                    if has_data > 0:
-                        periods["quarters"].append({
-                            "quarter": quarter,
-                            "year": current_year,
-                            "start_date": q_start,
-                            "end_date": q_end,
-                            "label": q_label,
-                            "count": has_data
-                        })
-                
-                # Générer les semestres disponibles
-                for semester in range(1, 3):
-                    if semester == 1:
-                        s_start = f"{current_year}-01-01"
-                        s_end = f"{current_year}-06-30"
-                        s_label = f"S1 {current_year} (Janvier - Juin)"
-                    else:
-                        s_start = f"{current_year}-07-01"
-                        s_end = f"{current_year}-12-31"
-                        s_label = f"S2 {current_year} (Juillet - Décembre)"
-                    
-                    # Vérifier si le semestre a des données
-                    has_data = frappe.db.sql("""
-                        SELECT COUNT(*) as count
-                        FROM `tabMouvement GNR`
-                        WHERE date BETWEEN %s AND %s
-                        AND docstatus = 1
-                        AND purpose = 'Material Issue'
-                    """, (s_start, s_end))[0][0]
-                    
-                    if has_data > 0:
-                        periods["semesters"].append({
-                            "semester": semester,
-                            "year": current_year,
-                            "start_date": s_start,
-                            "end_date": s_end,
-                            "label": s_label,
-                            "count": has_data
-                        })
-                
-                current_year += 1
-        
+        company = resoudre_societe(company)
+        periods = frappe.cache().hget(PERIODES_CACHE_KEY, company)
+        if periods is None:
+            periods = calculer_periodes_disponibles(company)
+            frappe.cache().hset(PERIODES_CACHE_KEY, company, periods)
         return periods
         
     except Exception as e:
         frappe.throw(_("Erreur lors de la récupération des périodes: {0}").format(str(e)))
 
 
+def calculer_periodes_disponibles(company):
+    """
+    Trimestres et semestres ayant des mouvements soumis pour la société,
+    en une requête groupée (index company, docstatus, date_mouvement)
+    """
+    comptes = frappe.db.sql("""
+        SELECT
+            YEAR(date_mouvement) as annee,
+            QUARTER(date_mouvement) as trimestre,
+            COUNT(*) as total,
+            SUM(type_mouvement = 'Vente') as ventes
+        FROM `tabMouvement GNR`
+        WHERE company = %s
+        AND docstatus = 1
+        GROUP BY annee, trimestre
+        ORDER BY annee, trimestre
+    """, (company,), as_dict=True)
+    
+    periods = {
+        "quarters": [],
+        "semesters": []
+    }
+    ventes_semestres = {}
+    
+    for compte in comptes:
+        annee, quarter = compte.annee, compte.trimestre
+        q_start, q_end, q_label = TRIMESTRES[quarter]
+        periods["quarters"].append({
+            "quarter": quarter,
+            "year": annee,
+            "start_date": f"{annee}-{q_start}",
+            "end_date": f"{annee}-{q_end}",
+            "label": f"Q{quarter} {annee} ({q_label})",
+            "count": compte.total
+        })
+        semestre = (annee, 1 if quarter <= 2 else 2)
+        ventes_semestres[semestre] = ventes_semestres.get(semestre, 0) + int(compte.ventes or 0)
+    
+    # Les semestres ne comptent que les ventes (liste clients)
+    for (annee, semester), ventes in ventes_semestres.items():
+        if ventes > 0:
+            s_start, s_end, s_label = SEMESTRES[semester]
+            periods["semesters"].append({
+                "semester": semester,
+                "year": annee,
+                "start_date": f"{annee}-{s_start}",
+                "end_date": f"{annee}-{s_end}",
+                "label": f"S{semester} {annee} ({s_label})",
+                "count": ventes
+            })
+    
+    return periods
+
+
 @frappe.whitelist()
-def preview_declaration_data(declaration_type, period_start, period_end):
+def preview_declaration_data(declaration_type, period_start, period_end, company=None):
     """
     Prévisualiser les données qui seront incluses dans la déclaration
     
@@ -272,29 +280,21 @@ def preview_declaration_data(declaration_type, period_start, period_end):
         declaration_type: "arrete_trimestriel" ou "liste_clients"
         period_start: Date de début
         period_end: Date de fin
+        company: Société déclarante (défaut : celle de l'utilisateur)
     """
     try:
+        company = resoudre_societe(company)
+        
         if declaration_type == "arrete_trimestriel":
-            # Prévisualiser les données de l'arrêté trimestriel
-            movements = frappe.db.sql("""
-                SELECT 
-                    date,
-                    SUM(CASE WHEN purpose = 'Receipt' THEN qty_in_liters ELSE 0 END) as entrees,
-                    SUM(CASE WHEN purpose = 'Material Issue' AND customer_category = 'Agricole' 
-                        THEN qty_in_liters ELSE 0 END) as sorties_agricole,
-                    SUM(CASE WHEN purpose = 'Material Issue' AND (customer_category != 'Agricole' OR customer_category IS NULL) 
-                        THEN qty_in_liters ELSE 0 END) as sorties_sans_attestation,
-                    COUNT(*) as nb_operations
-                FROM `tabMouvement GNR`
-                WHERE date BETWEEN %s AND %s
-                AND docstatus = 1
-                GROUP BY date
-                ORDER BY date
-            """, (period_start, period_end), as_dict=True)
+            # Prévisualiser les données de l'arrêté trimestriel (jours avec opérations)
+            movements = [
+                m for m in get_stock_movements_for_period(period_start, period_end, company)
+                if m["nb_operations"]
+            ]
             
-            total_entrees = sum(m.entrees for m in movements)
-            total_sorties_agricole = sum(m.sorties_agricole for m in movements)
-            total_sorties_sans_attestation = sum(m.sorties_sans_attestation for m in movements)
+            total_entrees = sum(m["entrees"] for m in movements)
+            total_sorties_agricole = sum(m["sorties_agricole"] for m in movements)
+            total_sorties_sans_attestation = sum(m["sorties_sans_attestation"] for m in movements)
             
             return {
                 "type": "arrete_trimestriel",
@@ -312,28 +312,11 @@ def preview_declaration_data(declaration_type, period_start, period_end):
             
         elif declaration_type == "liste_clients":
             # Prévisualiser les données de la liste clients
-            clients = frappe.db.sql("""
-                SELECT 
-                    c.customer_name as raison_sociale,
-                    c.tax_id as siren,
-                    SUM(m.qty_in_liters / 100) as volume_hl,
-                    CASE 
-                        WHEN m.customer_category = 'Agricole' THEN 3.86
-                        ELSE 24.81 
-                    END as tarif_accise,
-                    COUNT(*) as nb_livraisons
-                FROM `tabMouvement GNR` m
-                JOIN `tabCustomer` c ON m.customer = c.name
-                WHERE m.date BETWEEN %s AND %s
-                AND m.purpose = 'Material Issue'
-                AND m.docstatus = 1
-                GROUP BY c.name, m.customer_category
-                ORDER BY c.customer_name
-            """, (period_start, period_end), as_dict=True)
+            clients = get_clients_data_for_period(period_start, period_end, company)
             
-            total_volume = sum(c.volume_hl for c in clients)
-            nb_clients_agricole = len([c for c in clients if c.tarif_accise == 3.86])
-            nb_clients_autres = len([c for c in clients if c.tarif_accise == 24.81])
+            total_volume = sum(c["volume_hl"] for c in clients)
+            nb_clients_agricole = len([c for c in clients if c["avec_attestation"]])
+            nb_clients_autres = len(clients) - nb_clients_agricole
             
             return {
                 "type": "liste_clients",
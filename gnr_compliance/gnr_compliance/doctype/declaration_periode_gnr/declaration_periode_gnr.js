@@ -2,6 +2,14 @@
 
 frappe.ui.form.on("Declaration Periode GNR", {
 	refresh: function (frm) {
+		// Totaux calculés sur des mouvements qui ont changé depuis
+		if (frm.doc.__onload && frm.doc.__onload.donnees_perimees) {
+			frm.set_intro(
+				"⚠️ Des mouvements GNR de la période ont changé : enregistrez pour recalculer les totaux.",
+				"orange"
+			);
+		}
+
 		// Ajouter boutons d'action simples
 		if (frm.doc.docstatus === 0) {
 			frm.add_custom_button("📊 Générer", function () {
@@ -268,6 +276,8 @@ function export_format(frm, format_type) {
 						type_doc = "📊 Arrêté Trimestriel de Stock Détaillé";
 					} else if (frm.doc.type_periode === "Semestriel") {
 						type_doc = "👥 Liste Semestrielle des Clients Douane";
+					} else if (frm.doc.type_periode === "Annuel") {
+						type_doc = "🗜️ Export Annuel (archive ZIP)";
 					}
 
 					frappe.show_alert({
@@ -337,7 +347,7 @@ function export_format_exact(frm) {
 	} else if (frm.doc.type_periode === "Semestriel") {
 		doc_type = "Liste Semestrielle des Clients Douane";
 	} else if (frm.doc.type_periode === "Annuel") {
-		doc_type = "Export Annuel (Déclaration + Liste Clients)";
+		doc_type = "Export Annuel (Arrêtés + Listes Clients, archive ZIP)";
 	}
 
 	frappe.show_progress("Export...", 70, `Génération ${doc_type}`);
@@ -388,6 +398,13 @@ function export_format_exact(frm) {
 						<p>📊 Volumes en hectolitres (hL)</p>
 						<p>📋 Distinction avec/sans attestation automatique</p>
 					`;
+					} else if (frm.doc.type_periode === "Annuel") {
+						details_message = `
+						<p><strong>✅ Export Annuel généré</strong></p>
+						<p>📊 Arrêté annuel et arrêtés des quatre trimestres</p>
+						<p>👥 Listes clients des deux semestres</p>
+						<p>🗜️ Tous les fichiers réunis dans une archive ZIP</p>
+					`;
 					}
 
 					frappe.msgprint({
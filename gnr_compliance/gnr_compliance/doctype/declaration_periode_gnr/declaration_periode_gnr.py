@@ -2,14 +2,58 @@
 
 import frappe
 from frappe.model.document import Document
-from frappe.utils import getdate
-from gnr_compliance.utils.export_formats_exacts import generer_declaration_trimestrielle_exacte, generer_liste_semestrielle_exacte
+from frappe.utils import cint, getdate
+from gnr_compliance.gnr_compliance.doctype.gnr_daily_ledger.gnr_daily_ledger import (
+    get_totaux_periode,
+    resoudre_societe,
+)
+from gnr_compliance.gnr_compliance.doctype.gnr_period_version.gnr_period_version import get_version_periode
+from gnr_compliance.utils.export_formats_exacts import (
+    creer_declaration_trimestrielle,
+    creer_export_annuel,
+    creer_liste_semestrielle,
+)
+from gnr_compliance.utils.period_dataset import get_dataset_periode
+from gnr_compliance.utils.period_snapshot import (
+    charger_instantane,
+    depuis_colonnes,
+    enregistrer_instantane,
+    oublier_instantane,
+)
 
 class DeclarationPeriodeGNR(Document):
+    def before_insert(self):
+        """Société de la déclaration, avant le nommage (DECL-{abbr_societe}-...)"""
+        self.company = resoudre_societe(self.company)
+        self.abbr_societe = frappe.get_cached_value("Company", self.company, "abbr")
+    
     def validate(self):
         """Validation avant sauvegarde AVEC CALCULS RÉELS"""
+        self.company = resoudre_societe(self.company)
         self.calculer_dates_automatiques()
-        self.calculer_donnees_periode_reelles()
+        if self.totaux_a_recalculer():
+            self.calculer_donnees_periode_reelles()
+    
+    def onload(self):
+        """Indique au formulaire si les totaux sont périmés"""
+        if self.docstatus == 0 and self.date_debut and self.date_fin:
+            self.set_onload("donnees_perimees", self.donnees_perimees())
+    
+    def donnees_perimees(self):
+        """Des mouvements de la période ont changé depuis le dernier calcul"""
+        return cint(self.version_donnees) != get_version_periode(self.date_debut, self.date_fin, self.company)
+    
+    def totaux_a_recalculer(self):
+        """Nouvelle déclaration, société ou période modifiée, ou données périmées"""
+        if not self.date_debut or not self.date_fin:
+            return False
+        return (
+            self.is_new()
+            or self.has_value_changed("company")
+            or self.has_value_changed("date_debut")
+            or self.has_value_changed("date_fin")
+            or self.donnees_perimees()
+        )
         
     def calculer_dates_automatiques(self):
         """Calcule automatiquement les dates selon la période"""
@@ -49,66 +93,37 @@ class DeclarationPeriodeGNR(Document):
             return
             
         try:
-            # Debug : vérifier s'il y a des mouvements
-            count_mouvements = frappe.db.count("Mouvement GNR", {
-                "date_mouvement": ["between", [self.date_debut, self.date_fin]],
-                "docstatus": 1
-            })
+            # Version lue avant les totaux : un mouvement concurrent laissera la déclaration périmée
+            self.version_donnees = get_version_periode(self.date_debut, self.date_fin, self.company)
             
-            frappe.logger().info(f"Debug Declaration GNR: {count_mouvements} mouvements trouvés entre {self.date_debut} et {self.date_fin}")
+            # Totaux RÉELS depuis le journal quotidien GNR (précalculé à chaque mouvement)
+            journal = get_totaux_periode(self.date_debut, self.date_fin, self.company)
             
-            # Calculer les totaux RÉELS depuis les mouvements GNR avec info attestation
-            totaux = frappe.db.sql("""
-                SELECT 
-                    SUM(CASE WHEN m.type_mouvement = 'Vente' THEN m.quantite ELSE 0 END) as total_ventes,
-                    SUM(CASE WHEN m.type_mouvement IN ('Achat', 'Entrée') THEN m.quantite ELSE 0 END) as total_entrees,
-                    SUM(CASE WHEN m.type_mouvement IN ('Vente', 'Sortie') THEN m.quantite ELSE 0 END) as total_sorties,
-                    -- UTILISER LES VRAIS MONTANTS DE TAXE ENREGISTRÉS
-                    SUM(COALESCE(m.montant_taxe_gnr, 0)) as total_taxe_gnr_reel,
-                    -- CALCULER LE CHIFFRE D'AFFAIRES RÉEL
-                    SUM(CASE WHEN m.type_mouvement = 'Vente' THEN COALESCE(m.quantite * m.prix_unitaire, 0) ELSE 0 END) as ca_reel,
-                    -- CALCULER LES TAUX MOYENS RÉELS
-                    CASE 
-                        WHEN SUM(CASE WHEN m.type_mouvement = 'Vente' THEN m.quantite ELSE 0 END) > 0
-                        THEN SUM(COALESCE(m.montant_taxe_gnr, 0)) / SUM(CASE WHEN m.type_mouvement = 'Vente' THEN m.quantite ELSE 0 END)
-                        ELSE 0
-                    END as taux_moyen_reel,
-                    COUNT(DISTINCT CASE WHEN m.client IS NOT NULL THEN m.client END) as nb_clients,
-                    -- STATISTIQUES PAR TYPE D'ATTESTATION (CHAMPS RÉELS DU CLIENT)
-                    SUM(CASE 
-                        WHEN m.type_mouvement = 'Vente' 
-                        AND c.custom_n_dossier_ IS NOT NULL 
-                        AND c.custom_n_dossier_ != '' 
-                        AND c.custom_date_de_depot IS NOT NULL 
-                        THEN m.quantite 
-                        ELSE 0 
-                    END) as volume_avec_attestation_reel,
-                    SUM(CASE 
-                        WHEN m.type_mouvement = 'Vente' 
-                        AND (c.custom_n_dossier_ IS NULL OR c.custom_n_dossier_ = '' OR c.custom_date_de_depot IS NULL)
-                        THEN m.quantite 
-                        ELSE 0 
-                    END) as volume_sans_attestation_reel,
-                    -- MONTANTS DE TAXE PAR TYPE D'ATTESTATION
-                    SUM(CASE 
-                        WHEN m.type_mouvement = 'Vente' 
-                        AND c.custom_n_dossier_ IS NOT NULL 
-                        AND c.custom_n_dossier_ != '' 
-                        AND c.custom_date_de_depot IS NOT NULL 
-                        THEN COALESCE(m.montant_taxe_gnr, 0)
-                        ELSE 0 
-                    END) as taxe_avec_attestation_reel,
-                    SUM(CASE 
-                        WHEN m.type_mouvement = 'Vente' 
-                        AND (c.custom_n_dossier_ IS NULL OR c.custom_n_dossier_ = '' OR c.custom_date_de_depot IS NULL)
-                        THEN COALESCE(m.montant_taxe_gnr, 0)
-                        ELSE 0 
-                    END) as taxe_sans_attestation_reel
+            frappe.logger().info(f"Debug Declaration GNR: {journal.nb_mouvements} mouvements trouvés entre {self.date_debut} et {self.date_fin}")
+            
+            # Le nombre de clients distincts ne se cumule pas par jour
+            nb_clients = frappe.db.sql("""
+                SELECT COUNT(DISTINCT m.client)
                 FROM `tabMouvement GNR` m
-                LEFT JOIN `tabCustomer` c ON m.client = c.name
                 WHERE m.date_mouvement BETWEEN %s AND %s
+                AND m.company = %s
                 AND m.docstatus = 1
-            """, (self.date_debut, self.date_fin), as_dict=True)
+                AND m.client IS NOT NULL
+            """, (self.date_debut, self.date_fin, self.company))[0][0]
+            
+            totaux = [frappe._dict(
+                total_ventes=journal.volume_ventes,
+                total_entrees=journal.entrees,
+                total_sorties=journal.sorties,
+                total_taxe_gnr_reel=journal.montant_taxe,
+                ca_reel=journal.chiffre_affaires,
+                taux_moyen_reel=journal.montant_taxe / journal.volume_ventes if journal.volume_ventes > 0 else 0,
+                nb_clients=nb_clients,
+                volume_avec_attestation_reel=journal.volume_agricole,
+                volume_sans_attestation_reel=journal.volume_sans_attestation,
+                taxe_avec_attestation_reel=journal.taxe_agricole,
+                taxe_sans_attestation_reel=journal.taxe_sans_attestation,
+            )] if journal.nb_mouvements else []
             
             if totaux and len(totaux) > 0:
                 result = totaux[0]
@@ -141,6 +156,7 @@ class DeclarationPeriodeGNR(Document):
             self.total_ventes = 0
             self.total_taxe_gnr = 0
             self.nb_clients = 0
+            self.version_donnees = 0
     
     @frappe.whitelist()
     def calculer_donnees_forcees(self):
@@ -187,6 +203,11 @@ class DeclarationPeriodeGNR(Document):
     @frappe.whitelist()
     def diagnostiquer_donnees(self):
         """Diagnostic des données disponibles avec VRAIS MONTANTS ET TAUX"""
+        instantane = charger_instantane(self)
+        if instantane:
+            # Déclaration soumise : diagnostic figé au dépôt
+            return instantane["diagnostic"]
+        
         try:
             if not self.date_debut or not self.date_fin:
                 return {"error": "Dates non définies"}
@@ -201,16 +222,16 @@ class DeclarationPeriodeGNR(Document):
                     SUM(COALESCE(m.montant_taxe_gnr, 0)) as taxe_reelle,
                     -- CALCULER LES VRAIS CHIFFRES D'AFFAIRES
                     SUM(COALESCE(m.quantite * m.prix_unitaire, 0)) as ca_reel,
-                    -- VOLUMES PAR TYPE D'ATTESTATION (CHAMPS RÉELS)
+                    -- VOLUMES PAR TYPE D'ATTESTATION (RELEVÉE SUR LE MOUVEMENT)
                     SUM(CASE 
                         WHEN m.type_mouvement = 'Vente' 
-                        AND (c.custom_n_dossier_ IS NOT NULL AND c.custom_n_dossier_ != '' AND c.custom_date_de_depot IS NOT NULL) 
+                        AND m.avec_attestation = 1
                         THEN m.quantite 
                         ELSE 0 
                     END) as quantite_avec_attestation,
                     SUM(CASE 
                         WHEN m.type_mouvement = 'Vente' 
-                        AND (c.custom_n_dossier_ IS NULL OR c.custom_n_dossier_ = '' OR c.custom_date_de_depot IS NULL) 
+                        AND COALESCE(m.avec_attestation, 0) = 0
                         THEN m.quantite 
                         ELSE 0 
                     END) as quantite_sans_attestation,
@@ -226,11 +247,11 @@ class DeclarationPeriodeGNR(Document):
                     COUNT(CASE WHEN m.taux_gnr IN (1.77, 3.86, 6.83, 2.84, 24.81) THEN 1 END) as nb_taux_suspects,
                     COUNT(CASE WHEN m.taux_gnr = 0 THEN 1 END) as nb_taux_zero
                 FROM `tabMouvement GNR` m
-                LEFT JOIN `tabCustomer` c ON m.client = c.name
                 WHERE m.date_mouvement BETWEEN %s AND %s
+                AND m.company = %s
                 AND m.docstatus = 1
                 GROUP BY m.type_mouvement
-            """, (self.date_debut, self.date_fin), as_dict=True)
+            """, (self.date_debut, self.date_fin, self.company), as_dict=True)
             
             # Calculer les totaux
             total_mouvements = sum([m.count for m in mouvements_stats])
@@ -253,14 +274,14 @@ class DeclarationPeriodeGNR(Document):
             clients_stats = frappe.db.sql("""
                 SELECT 
                     COUNT(DISTINCT m.client) as count,
-                    COUNT(DISTINCT CASE WHEN (c.custom_n_dossier_ IS NOT NULL AND c.custom_n_dossier_ != '' AND c.custom_date_de_depot IS NOT NULL) THEN m.client END) as clients_avec_attestation,
-                    COUNT(DISTINCT CASE WHEN (c.custom_n_dossier_ IS NULL OR c.custom_n_dossier_ = '' OR c.custom_date_de_depot IS NULL) THEN m.client END) as clients_sans_attestation
+                    COUNT(DISTINCT CASE WHEN m.avec_attestation = 1 THEN m.client END) as clients_avec_attestation,
+                    COUNT(DISTINCT CASE WHEN COALESCE(m.avec_attestation, 0) = 0 THEN m.client END) as clients_sans_attestation
                 FROM `tabMouvement GNR` m
-                LEFT JOIN `tabCustomer` c ON m.client = c.name
                 WHERE m.date_mouvement BETWEEN %s AND %s
+                AND m.company = %s
                 AND m.docstatus = 1
                 AND m.client IS NOT NULL
-            """, (self.date_debut, self.date_fin), as_dict=True)
+            """, (self.date_debut, self.date_fin, self.company), as_dict=True)
             
             clients_data = clients_stats[0] if clients_stats else {}
             
@@ -314,62 +335,29 @@ class DeclarationPeriodeGNR(Document):
         """Génère l'export selon le type de période et format EXACT AVEC VRAIS TAUX"""
         
         try:
+            # Déclaration soumise : données figées au dépôt, sinon calcul sur la période
+            instantane = charger_instantane(self)
+            mouvements_journaliers = depuis_colonnes(instantane["mouvements_journaliers"]) if instantane else None
+            clients_data = depuis_colonnes(instantane["clients"]) if instantane else None
+            version_donnees = instantane.get("version_donnees") if instantane else None
+            
             if self.type_periode == "Trimestriel":
                 # Générer la Déclaration Trimestrielle au format exact avec vrais taux
-                return generer_declaration_trimestrielle_exacte(self.date_debut, self.date_fin)
+                return creer_declaration_trimestrielle(self.date_debut, self.date_fin, mouvements_journaliers, self.company, version_donnees)
                 
             elif self.type_periode == "Semestriel":
                 # Générer la Liste Semestrielle des Clients au format exact avec vrais tarifs
-                return generer_liste_semestrielle_exacte(self.date_debut, self.date_fin)
+                return creer_liste_semestrielle(self.date_debut, self.date_fin, clients_data, self.company, version_donnees)
                 
             elif self.type_periode == "Annuel":
-                # Pour l'annuel, on génère les deux types de documents avec vrais montants
-                try:
-                    # Générer la déclaration trimestrielle pour l'année
-                    arrete = generer_declaration_trimestrielle_exacte(self.date_debut, self.date_fin)
-                    
-                    # Générer la liste clients pour l'année
-                    liste_clients = generer_liste_semestrielle_exacte(self.date_debut, self.date_fin)
-                    
-                    # Vérifier si au moins un des deux a réussi
-                    if arrete and arrete.get("success"):
-                        if liste_clients and liste_clients.get("success"):
-                            # Les deux ont réussi
-                            return {
-                                "success": True,
-                                "arrete_url": arrete["file_url"],
-                                "clients_url": liste_clients["file_url"],
-                                "message": "Déclaration annuelle et liste clients générées avec taux réels"
-                            }
-                        else:
-                            # Seule la déclaration a réussi
-                            return {
-                                "success": True,
-                                "file_url": arrete["file_url"],
-                                "file_name": arrete["file_name"],
-                                "message": "Déclaration annuelle générée avec taux réels (liste clients échouée)"
-                            }
-                    elif liste_clients and liste_clients.get("success"):
-                        # Seule la liste clients a réussi
-                        return {
-                            "success": True,
-                            "file_url": liste_clients["file_url"],
-                            "file_name": liste_clients["file_name"],
-                            "message": "Liste clients annuelle générée avec tarifs réels (déclaration échouée)"
-                        }
-                    else:
-                        # Les deux ont échoué
-                        return {
-                            "success": False,
-                            "message": "Échec de la génération des exports annuels avec taux réels"
-                        }
-                        
-                except Exception as e:
-                    frappe.log_error(f"Erreur export annuel avec vrais taux: {str(e)}")
-                    return {
-                        "success": False,
-                        "message": f"Erreur lors de la génération annuelle avec taux réels: {str(e)}"
+                # Arrêtés de l'année et des trimestres, listes des semestres : une archive ZIP
+                clients_semestres = None
+                if instantane:
+                    clients_semestres = {
+                        semestre: depuis_colonnes(clients)
+                        for semestre, clients in instantane.get("clients_semestres", {}).items()
                     }
+                return creer_export_annuel(self.date_debut, self.date_fin, mouvements_journaliers, clients_semestres, self.company, version_donnees)
             
             else:
                 return {
@@ -390,31 +378,16 @@ class DeclarationPeriodeGNR(Document):
         Valide la cohérence des données GNR pour cette déclaration
         Vérifie que les taux sont réels et non des valeurs par défaut
         """
+        instantane = charger_instantane(self)
+        if instantane:
+            return instantane["coherence"]
+        
         try:
             if not self.date_debut or not self.date_fin:
                 return {"success": False, "message": "Dates de période manquantes"}
             
-            # Analyser la qualité des données
-            analyse = frappe.db.sql("""
-                SELECT 
-                    COUNT(*) as total_mouvements,
-                    COUNT(CASE WHEN taux_gnr IN (1.77, 3.86, 6.83, 2.84, 24.81) THEN 1 END) as taux_suspects,
-                    COUNT(CASE WHEN taux_gnr = 0 THEN 1 END) as taux_zero,
-                    COUNT(CASE WHEN taux_gnr < 0.1 OR taux_gnr > 50 THEN 1 END) as taux_aberrants,
-                    COUNT(CASE WHEN montant_taxe_gnr != (quantite * taux_gnr) THEN 1 END) as calculs_incorrects,
-                    AVG(taux_gnr) as taux_moyen,
-                    MIN(taux_gnr) as taux_min,
-                    MAX(taux_gnr) as taux_max
-                FROM `tabMouvement GNR`
-                WHERE date_mouvement BETWEEN %s AND %s
-                AND docstatus = 1
-                AND quantite > 0
-            """, (self.date_debut, self.date_fin), as_dict=True)
-            
-            if not analyse:
-                return {"success": False, "message": "Aucun mouvement GNR trouvé"}
-            
-            stats = analyse[0]
+            # Qualité des taux depuis le jeu de données de la période
+            stats = get_dataset_periode(self.date_debut, self.date_fin, self.company).qualite()
             
             # Calculer les pourcentages
             total = stats.total_mouvements
@@ -500,7 +473,10 @@ class DeclarationPeriodeGNR(Document):
     def on_submit(self):
         """Actions après soumission"""
         self.statut = "Validée"
+        # Les lectures suivantes ne réinterrogent plus les mouvements
+        enregistrer_instantane(self)
     
     def on_cancel(self):
         """Actions après annulation"""
-        self.statut = "Annulée"
\ No newline at end of file
+        self.statut = "Annulée"
+        oublier_instantane(self)
\ No newline at end of file
@@ -0,0 +1,364 @@
+# Copyright (c) 2025, Mohamed Kachtit and Contributors
+# See license.txt
+
+import json
+import zipfile
+from collections import Counter
+from datetime import date, timedelta
+from io import BytesIO
+from unittest.mock import patch
+
+import frappe
+from frappe.tests.utils import FrappeTestCase
+from openpyxl import load_workbook
+
+from gnr_compliance.api_excel import get_available_periods
+from gnr_compliance.gnr_compliance.doctype.declaration_periode_gnr.declaration_periode_gnr import (
+	DeclarationPeriodeGNR,
+)
+from gnr_compliance.gnr_compliance.doctype.gnr_daily_ledger.test_gnr_daily_ledger import creer_mouvements_test
+from gnr_compliance.utils import period_dataset
+from gnr_compliance.utils.excel_generators import ListeClientsGenerator, StyleRegistry
+from gnr_compliance.utils.export_formats_exacts import (
+	calculer_mouvements_journaliers_reels,
+	creer_export_annuel,
+	donnees_declaration_trimestrielle,
+	donnees_liste_semestrielle,
+	nom_declaration_trimestrielle,
+	nom_liste_semestrielle,
+)
+from gnr_compliance.utils.gnr_aggregates import invalider_periodes_disponibles
+from gnr_compliance.utils.period_dataset import (
+	GNRPeriodDataset,
+	get_dataset_periode,
+	oublier_datasets_periode,
+)
+from gnr_compliance.utils.period_snapshot import (
+	VERSION_INSTANTANE,
+	charger_instantane,
+	depuis_colonnes,
+	en_colonnes,
+	oublier_instantane,
+)
+from gnr_compliance.utils.xlsx_streaming import (
+	rendre_declaration_trimestrielle,
+	rendre_en_parallele,
+	rendre_liste_semestrielle,
+)
+
+SOCIETE_TEST = "_Test Company"
+AUTRE_SOCIETE = "_Test Company 1"
+DEBUT_ANNEE = date(2019, 1, 1)
+FIN_ANNEE = date(2019, 12, 31)
+TRIMESTRES = [
+	(date(2019, 1, 1), date(2019, 3, 31)),
+	(date(2019, 4, 1), date(2019, 6, 30)),
+	(date(2019, 7, 1), date(2019, 9, 30)),
+	(date(2019, 10, 1), date(2019, 12, 31)),
+]
+SEMESTRES = {"1": (date(2019, 1, 1), date(2019, 6, 30)), "2": (date(2019, 7, 1), date(2019, 12, 31))}
+CLIENTS_SEMESTRES = {
+	"1": [
+		{"nom_client": "Client Test A", "siret": "12345678900011", "quantite_totale": 15000, "taux_reel_par_hl": 386},
+		{"nom_client": "Client Test B", "siret": "98765432100022", "quantite_totale": 4200, "taux_reel_par_hl": 2481},
+	],
+	"2": [
+		{"nom_client": "Client Test A", "siret": "12345678900011", "quantite_totale": 18000, "taux_reel_par_hl": 386},
+	],
+}
+
+
+def jours_annee():
+	"""Stock journalier figé de l'année, comme dans l'instantané d'une déclaration"""
+	jours = []
+	stock = 10000
+	for decalage in range((FIN_ANNEE - DEBUT_ANNEE).days + 1):
+		jour = DEBUT_ANNEE + timedelta(days=decalage)
+		entrees = 3000 if jour.day == 1 else 0
+		sorties = 80 + decalage % 5 * 10
+		jours.append(
+			{
+				"date_format": jour.strftime("%d/%m/%Y"),
+				"stock_initial": stock,
+				"entrees": entrees,
+				"sorties": sorties,
+				"stock_final": stock + entrees - sorties,
+				"volume_agricole_reel": sorties // 2,
+				"volume_sans_attestation_reel": sorties - sorties // 2,
+			}
+		)
+		stock += entrees - sorties
+	return jours
+
+
+def nouvelle_declaration(company=SOCIETE_TEST):
+	"""Déclaration du premier trimestre de l'année de test"""
+	return frappe.get_doc(
+		{
+			"doctype": "Declaration Periode GNR",
+			"type_periode": "Trimestriel",
+			"periode": "T1",
+			"annee": 2019,
+			"company": company,
+		}
+	).insert()
+
+
+def valeurs_classeur(contenu):
+	feuille = load_workbook(BytesIO(contenu), read_only=True).active
+	return [list(ligne) for ligne in feuille.iter_rows(values_only=True)]
+
+
+class TestExportAnnuel(FrappeTestCase):
+	def setUp(self):
+		self.addCleanup(frappe.db.rollback)
+		self.jours = jours_annee()
+
+	def exports_par_periode(self):
+		"""Déclarations rendues une à une, comme les exports de chaque période"""
+		rendus = {}
+		for debut, fin in TRIMESTRES:
+			tranche = self.jours[(debut - DEBUT_ANNEE).days : (fin - DEBUT_ANNEE).days + 1]
+			rendus[nom_declaration_trimestrielle(debut, fin)] = (
+				rendre_declaration_trimestrielle,
+				donnees_declaration_trimestrielle(debut, fin, SOCIETE_TEST, tranche),
+			)
+		for semestre, (debut, fin) in SEMESTRES.items():
+			rendus[nom_liste_semestrielle(debut, fin)] = (
+				rendre_liste_semestrielle,
+				donnees_liste_semestrielle(debut, fin, SOCIETE_TEST, CLIENTS_SEMESTRES[semestre]),
+			)
+		return rendus
+
+	def test_archive_identique_aux_exports_par_periode(self):
+		attendus = {nom: fonction(**arguments) for nom, (fonction, arguments) in self.exports_par_periode().items()}
+
+		# Requête web (rendu séquentiel) et job en arrière-plan (rendu parallèle)
+		for parallele in (False, True):
+			resultat = creer_export_annuel(
+				DEBUT_ANNEE,
+				FIN_ANNEE,
+				mouvements_journaliers=self.jours,
+				clients_semestres=CLIENTS_SEMESTRES,
+				company=SOCIETE_TEST,
+				parallele=parallele,
+			)
+			self.assertTrue(resultat["success"], resultat.get("message"))
+
+			fichier = frappe.get_doc("File", {"file_url": resultat["file_url"]})
+			self.addCleanup(fichier.delete)
+			archive = zipfile.ZipFile(BytesIO(frappe.safe_encode(fichier.get_content())))
+
+			# Arrêté annuel en plus des déclarations de chaque période
+			self.assertEqual(len(archive.namelist()), len(attendus) + 1)
+			for nom, contenu in attendus.items():
+				with self.subTest(parallele=parallele, fichier=nom):
+					self.assertEqual(valeurs_classeur(archive.read(nom)), valeurs_classeur(contenu))
+
+	def test_rendu_parallele_identique_au_rendu_sequentiel(self):
+		rendus = self.exports_par_periode()
+		paralleles = rendre_en_parallele(rendus, nb_processus=2)
+		sequentiels = rendre_en_parallele(rendus, nb_processus=1)
+
+		self.assertEqual(list(paralleles), list(rendus))
+		for nom in rendus:
+			with self.subTest(fichier=nom):
+				self.assertEqual(valeurs_classeur(paralleles[nom]), valeurs_classeur(sequentiels[nom]))
+
+
+class TestDeclarationPerimee(FrappeTestCase):
+	def setUp(self):
+		self.addCleanup(frappe.db.rollback)
+
+	def test_totaux_recalcules_seulement_si_perimes(self):
+		declaration = nouvelle_declaration()
+		self.assertFalse(declaration.donnees_perimees())
+		total_ventes = declaration.total_ventes
+
+		# Une modification sans rapport avec les données ne relance pas le calcul
+		declaration.observations = "Relue"
+		with patch.object(DeclarationPeriodeGNR, "calculer_donnees_periode_reelles") as calcul:
+			declaration.save()
+		calcul.assert_not_called()
+
+		# Des mouvements soumis dans la période la rendent périmée
+		creer_mouvements_test()
+		self.assertTrue(declaration.donnees_perimees())
+
+		declaration.save()
+		self.assertFalse(declaration.donnees_perimees())
+		self.assertEqual(declaration.total_ventes, total_ventes + 3500)
+
+
+	def test_declarations_separees_par_societe(self):
+		declarations = {societe: nouvelle_declaration(societe) for societe in (SOCIETE_TEST, AUTRE_SOCIETE)}
+		self.assertNotEqual(declarations[SOCIETE_TEST].name, declarations[AUTRE_SOCIETE].name)
+		totaux = {societe: declaration.total_ventes for societe, declaration in declarations.items()}
+
+		# Les mouvements d'une société ne touchent pas la déclaration de l'autre
+		creer_mouvements_test([(date(2019, 2, 3), "Vente", 700)], company=AUTRE_SOCIETE)
+		self.assertFalse(declarations[SOCIETE_TEST].donnees_perimees())
+		self.assertTrue(declarations[AUTRE_SOCIETE].donnees_perimees())
+
+		for declaration in declarations.values():
+			declaration.save()
+		self.assertEqual(declarations[SOCIETE_TEST].total_ventes, totaux[SOCIETE_TEST])
+		self.assertEqual(declarations[AUTRE_SOCIETE].total_ventes, totaux[AUTRE_SOCIETE] + 700)
+
+
+class TestInstantaneDeclaration(FrappeTestCase):
+	def setUp(self):
+		self.addCleanup(frappe.db.rollback)
+
+	def test_colonnes_aller_retour(self):
+		jours = jours_annee()
+		colonnes = en_colonnes(jours)
+		self.assertEqual(list(colonnes), list(jours[0]))
+		self.assertEqual(depuis_colonnes(colonnes), jours)
+		self.assertEqual(depuis_colonnes(json.loads(json.dumps(colonnes))), jours)
+
+		self.assertEqual(en_colonnes([]), {})
+		self.assertEqual(depuis_colonnes({}), [])
+
+	def test_instantane_fige_a_la_soumission(self):
+		creer_mouvements_test()
+		declaration = nouvelle_declaration()
+		declaration.submit()
+		self.addCleanup(oublier_instantane, declaration)
+
+		# Relu depuis le fichier attaché (le cache n'est rempli qu'au commit)
+		oublier_instantane(declaration)
+		instantane = charger_instantane(declaration)
+		self.assertEqual(instantane["version"], VERSION_INSTANTANE)
+		self.assertEqual(instantane["version_donnees"], declaration.version_donnees)
+		mouvements_journaliers = calculer_mouvements_journaliers_reels(
+			str(declaration.date_debut), str(declaration.date_fin), SOCIETE_TEST
+		)
+		self.assertEqual(
+			depuis_colonnes(instantane["mouvements_journaliers"]),
+			json.loads(frappe.as_json(mouvements_journaliers)),
+		)
+
+		# Un mouvement postérieur au dépôt ne modifie pas les données déclarées
+		creer_mouvements_test([(date(2019, 2, 10), "Vente", 400)])
+		oublier_instantane(declaration)
+		self.assertEqual(charger_instantane(declaration), instantane)
+
+
+class TestPeriodesDisponibles(FrappeTestCase):
+	def setUp(self):
+		# Après le rollback : le cache ne doit pas garder les périodes du test
+		self.addCleanup(invalider_periodes_disponibles)
+		self.addCleanup(frappe.db.rollback)
+
+	def periodes_attendues(self):
+		"""(année, trimestre, mouvements) et (année, semestre, ventes) recomptés un à un"""
+		mouvements = frappe.get_all(
+			"Mouvement GNR",
+			filters={"company": SOCIETE_TEST, "docstatus": 1},
+			fields=["date_mouvement", "type_mouvement"],
+		)
+		trimestres = Counter(
+			(mouvement.date_mouvement.year, (mouvement.date_mouvement.month - 1) // 3 + 1) for mouvement in mouvements
+		)
+		semestres = Counter(
+			(mouvement.date_mouvement.year, 1 if mouvement.date_mouvement.month <= 6 else 2)
+			for mouvement in mouvements
+			if mouvement.type_mouvement == "Vente"
+		)
+		return sorted((*cle, total) for cle, total in trimestres.items()), sorted(
+			(*cle, total) for cle, total in semestres.items()
+		)
+
+	def periodes_servies(self):
+		periodes = get_available_periods(SOCIETE_TEST)
+		return [(periode["year"], periode["quarter"], periode["count"]) for periode in periodes["quarters"]], [
+			(periode["year"], periode["semester"], periode["count"]) for periode in periodes["semesters"]
+		]
+
+	def test_periodes_suivent_les_mouvements(self):
+		# Remplit le cache avant les mouvements
+		avant = self.periodes_servies()
+		self.assertEqual(avant, self.periodes_attendues())
+
+		creer_mouvements_test()
+		apres = self.periodes_servies()
+		self.assertEqual(apres, self.periodes_attendues())
+		self.assertNotEqual(apres, avant)
+
+
+class TestStylesClasseur(FrappeTestCase):
+	def liste_clients(self, nb_clients):
+		clients = [
+			{
+				"raison_sociale": f"Client Test {i}",
+				"siren": "123456789" if i % 2 else "",
+				"volume_hl": 10 * i,
+				"tarif_accise": 3.86,
+			}
+			for i in range(nb_clients)
+		]
+		contenu = ListeClientsGenerator().generate("2019-01-01", "2019-06-30", SOCIETE_TEST, "987654321", clients)
+		return load_workbook(BytesIO(contenu))
+
+	def test_registre_interne_les_styles(self):
+		registre = StyleRegistry(load_workbook(BytesIO(ListeClientsGenerator().save_to_bytes())))
+		bordure = registre.get_style(border=True, alignment="left")
+		self.assertIs(registre.get_style(border=True, alignment="left"), bordure)
+		self.assertIsNot(registre.get_style(border=True), bordure)
+
+	def test_styles_des_cellules_de_donnees(self):
+		feuille = self.liste_clients(3).active
+		for ligne in range(3, 6):
+			for colonne, alignement in (("A", "left"), ("B", "center"), ("C", "left"), ("E", "center"), ("F", "center")):
+				cellule = feuille[f"{colonne}{ligne}"]
+				with self.subTest(cellule=cellule.coordinate):
+					self.assertEqual(cellule.border.left.style, "thin")
+					self.assertEqual(cellule.alignment.horizontal, alignement)
+					self.assertTrue(cellule.alignment.wrap_text)
+					self.assertEqual((cellule.font.sz, cellule.font.b), (10, False))
+
+		# SIREN client stylé seulement quand il est renseigné
+		self.assertIsNone(feuille["D3"].border.left.style)
+		self.assertEqual(feuille["D4"].border.left.style, "thin")
+
+	def test_nombre_de_styles_independant_du_nombre_de_lignes(self):
+		self.assertEqual(len(self.liste_clients(3)._cell_styles), len(self.liste_clients(300)._cell_styles))
+
+
+class TestJeuPeriode(FrappeTestCase):
+	def setUp(self):
+		self.addCleanup(oublier_datasets_periode)
+		self.addCleanup(frappe.db.rollback)
+		oublier_datasets_periode()
+
+	def test_sous_periodes_extraites_sans_relecture(self):
+		creer_mouvements_test()
+		with patch.object(period_dataset, "_lire_mouvements", wraps=period_dataset._lire_mouvements) as lecture:
+			annee = get_dataset_periode(DEBUT_ANNEE, FIN_ANNEE, SOCIETE_TEST)
+			# Aucune lecture tant qu'aucune vue ne parcourt les mouvements
+			lecture.assert_not_called()
+			self.assertEqual(
+				len(annee),
+				frappe.db.count(
+					"Mouvement GNR",
+					{"company": SOCIETE_TEST, "docstatus": 1, "date_mouvement": ["between", [DEBUT_ANNEE, FIN_ANNEE]]},
+				),
+			)
+
+			for debut, fin in TRIMESTRES + list(SEMESTRES.values()):
+				jeu = get_dataset_periode(debut, fin, SOCIETE_TEST)
+				attendus = frappe.get_all(
+					"Mouvement GNR",
+					filters={"company": SOCIETE_TEST, "docstatus": 1, "date_mouvement": ["between", [debut, fin]]},
+					fields=["date_mouvement", "name"],
+				)
+				with self.subTest(debut=debut, fin=fin):
+					self.assertEqual(
+						sorted((jeu.date(mouvement.jour), mouvement.name) for mouvement in jeu.mouvements()),
+						sorted((ligne.date_mouvement, ligne.name) for ligne in attendus),
+					)
+					self.assertEqual(jeu.qualite(), GNRPeriodDataset(debut, fin, SOCIETE_TEST).qualite())
+
+			# Une seule lecture pour l'année (les jeux directs ci-dessus en plus)
+			self.assertEqual(lecture.call_count, 1 + len(TRIMESTRES) + len(SEMESTRES))
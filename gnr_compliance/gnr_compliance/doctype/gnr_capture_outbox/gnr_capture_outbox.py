@@ -0,0 +1,208 @@
+# Copyright (c) 2025, Mohamed Kachtit and contributors
+# For license information, please see license.txt
+
+import frappe
+from frappe.model.document import Document
+from frappe.utils import add_to_date, cint, now_datetime
+
+STATUT_EN_ATTENTE = "En attente"
+STATUT_EN_COURS = "En cours"
+STATUT_TRAITE = "Traité"
+STATUT_ECHEC = "Échec"
+
+# Statut de capture affiché sur la facture (champ gnr_capture_status)
+CAPTURE_EN_ATTENTE = "GNR en attente"
+CAPTURE_EFFECTUEE = "GNR capturé"
+CAPTURE_EN_ECHEC = "GNR en échec"
+
+# Une ligne "En cours" plus ancienne appartient à un worker interrompu
+DELAI_REPRISE_MINUTES = 60
+DELAI_MAX_MINUTES = 60
+JOURS_CONSERVATION = 7
+
+
+class GNRCaptureOutbox(Document):
+    pass
+
+
+def on_doctype_update():
+    """Une seule ligne par document source, index de sélection des lots"""
+    frappe.db.add_unique(
+        "GNR Capture Outbox",
+        ["reference_doctype", "reference_name"],
+        constraint_name="unique_capture_document",
+    )
+    frappe.db.add_index("GNR Capture Outbox", ["statut", "prochaine_tentative"])
+
+
+def mettre_en_file(doc):
+    """
+    Enregistre une facture soumise dans la file de capture GNR
+
+    Appelée depuis on_submit en mode différé : une seule écriture légère,
+    le traitement est fait par traiter_file_capture en arrière-plan.
+    """
+    horodatage = now_datetime()
+    frappe.db.bulk_insert(
+        "GNR Capture Outbox",
+        fields=[
+            "name", "creation", "modified", "owner", "modified_by",
+            "reference_doctype", "reference_name", "reference_modified",
+            "statut", "tentatives",
+        ],
+        values=[(
+            frappe.generate_hash(length=10), horodatage, horodatage,
+            frappe.session.user, frappe.session.user,
+            doc.doctype, doc.name, doc.modified,
+            STATUT_EN_ATTENTE, 0,
+        )],
+        ignore_duplicates=True,
+    )
+    doc.db_set("gnr_capture_status", CAPTURE_EN_ATTENTE, update_modified=False)
+
+    frappe.enqueue(
+        "gnr_compliance.gnr_compliance.doctype.gnr_capture_outbox.gnr_capture_outbox.traiter_file_capture",
+        queue="short",
+        job_id="gnr_capture_outbox",
+        deduplicate=True,
+        enqueue_after_commit=True,
+    )
+
+
+def traiter_file_capture():
+    """
+    Vide la file de capture GNR par lots (job en arrière-plan et scheduler)
+
+    Chaque document est traité dans sa propre transaction. La capture est
+    idempotente (lignes déjà capturées ignorées, contrainte d'unicité en
+    base) : une ligne reprise après une interruption ne crée pas de doublon.
+    En cas d'erreur, nouvelle tentative avec un délai exponentiel.
+    """
+    taille_lot = cint(frappe.db.get_single_value("GNR Settings", "taille_lot_capture")) or 50
+    tentatives_max = cint(frappe.db.get_single_value("GNR Settings", "tentatives_max_capture")) or 5
+
+    while True:
+        lot = _reserver_lot(taille_lot, tentatives_max)
+        if not lot:
+            break
+        for ligne in lot:
+            _traiter_ligne(ligne, tentatives_max)
+
+    # Purger les lignes traitées depuis plus d'une semaine
+    frappe.db.delete(
+        "GNR Capture Outbox",
+        {"statut": STATUT_TRAITE, "modified": ["<", add_to_date(now_datetime(), days=-JOURS_CONSERVATION)]},
+    )
+    frappe.db.commit()
+
+
+def _reserver_lot(taille_lot, tentatives_max):
+    """Réserve un lot de lignes éligibles sans bloquer un autre worker"""
+    maintenant = now_datetime()
+    lot = frappe.db.sql(
+        """
+        SELECT name, reference_doctype, reference_name, tentatives
+        FROM `tabGNR Capture Outbox`
+        WHERE (
+            (statut IN (%(en_attente)s, %(echec)s) AND tentatives < %(tentatives_max)s
+                AND (prochaine_tentative IS NULL OR prochaine_tentative <= %(maintenant)s))
+            OR (statut = %(en_cours)s AND modified < %(reprise)s)
+        )
+        ORDER BY creation
+        LIMIT %(taille_lot)s
+        FOR UPDATE SKIP LOCKED
+        """,
+        {
+            "en_attente": STATUT_EN_ATTENTE,
+            "echec": STATUT_ECHEC,
+            "en_cours": STATUT_EN_COURS,
+            "tentatives_max": tentatives_max,
+            "maintenant": maintenant,
+            "reprise": add_to_date(maintenant, minutes=-DELAI_REPRISE_MINUTES),
+            "taille_lot": taille_lot,
+        },
+        as_dict=True,
+    )
+
+    if lot:
+        frappe.db.sql(
+            """UPDATE `tabGNR Capture Outbox` SET statut = %s, modified = %s
+            WHERE name IN %s""",
+            (STATUT_EN_COURS, maintenant, tuple(ligne.name for ligne in lot)),
+        )
+    frappe.db.commit()
+    return lot
+
+
+def _traiter_ligne(ligne, tentatives_max):
+    """Capture un document de la file et met à jour son statut"""
+    from gnr_compliance.integrations.sales import capturer_achat, capturer_vente
+
+    capteurs = {"Sales Invoice": capturer_vente, "Purchase Invoice": capturer_achat}
+
+    try:
+        if not frappe.db.exists(ligne.reference_doctype, {"name": ligne.reference_name, "docstatus": 1}):
+            # Document annulé ou supprimé entre-temps : plus rien à capturer
+            _marquer(ligne.name, STATUT_TRAITE)
+            frappe.db.commit()
+            return
+
+        doc = frappe.get_doc(ligne.reference_doctype, ligne.reference_name)
+        capteurs[ligne.reference_doctype](doc)
+
+        doc.db_set("gnr_capture_status", CAPTURE_EFFECTUEE, update_modified=False)
+        _marquer(ligne.name, STATUT_TRAITE, derniere_erreur=None)
+        frappe.db.commit()
+
+    except Exception:
+        frappe.db.rollback()
+        tentatives = cint(ligne.tentatives) + 1
+        erreur = frappe.get_traceback()
+
+        _marquer(
+            ligne.name,
+            STATUT_ECHEC,
+            tentatives=tentatives,
+            prochaine_tentative=add_to_date(
+                now_datetime(), minutes=min(2 ** tentatives, DELAI_MAX_MINUTES)
+            ),
+            derniere_erreur=erreur,
+        )
+        if tentatives >= tentatives_max:
+            frappe.db.set_value(
+                ligne.reference_doctype, ligne.reference_name,
+                "gnr_capture_status", CAPTURE_EN_ECHEC, update_modified=False,
+            )
+            frappe.log_error(
+                f"Capture GNR abandonnée après {tentatives} tentatives pour "
+                f"{ligne.reference_doctype} {ligne.reference_name}:\n{erreur}"
+            )
+        frappe.db.commit()
+
+
+def _marquer(name, statut, **valeurs):
+    """Met à jour une ligne de la file sans passer par le document"""
+    frappe.db.set_value(
+        "GNR Capture Outbox", name, {"statut": statut, **valeurs}, update_modified=True
+    )
+
+
+@frappe.whitelist()
+def relancer_echecs():
+    """Remet en file les captures abandonnées (après correction de la cause)"""
+    frappe.only_for("System Manager")
+
+    frappe.db.sql(
+        """UPDATE `tabGNR Capture Outbox`
+        SET statut = %s, tentatives = 0, prochaine_tentative = NULL
+        WHERE statut = %s""",
+        (STATUT_EN_ATTENTE, STATUT_ECHEC),
+    )
+    frappe.enqueue(
+        "gnr_compliance.gnr_compliance.doctype.gnr_capture_outbox.gnr_capture_outbox.traiter_file_capture",
+        queue="short",
+        job_id="gnr_capture_outbox",
+        deduplicate=True,
+        enqueue_after_commit=True,
+    )
+    return {"success": True, "message": "Captures en échec remises en file"}
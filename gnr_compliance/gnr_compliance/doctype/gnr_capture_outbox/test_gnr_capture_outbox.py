@@ -0,0 +1,84 @@
+# Copyright (c) 2025, Mohamed Kachtit and Contributors
+# See license.txt
+
+import frappe
+from erpnext.accounts.doctype.sales_invoice.test_sales_invoice import create_sales_invoice
+from erpnext.stock.doctype.item.test_item import make_item
+from frappe.tests.utils import FrappeTestCase
+
+from gnr_compliance.gnr_compliance.doctype.gnr_capture_outbox.gnr_capture_outbox import (
+	CAPTURE_EFFECTUEE,
+	CAPTURE_EN_ATTENTE,
+	STATUT_EN_ATTENTE,
+	STATUT_TRAITE,
+	traiter_file_capture,
+)
+
+ARTICLE_TEST = "TEST-GNR-OUTBOX-ITEM"
+CHAMPS_MOUVEMENT = [
+	"code_produit", "quantite", "prix_unitaire", "taux_gnr", "montant_taxe_gnr", "avec_attestation", "company",
+]
+
+
+class TestGNRCaptureOutbox(FrappeTestCase):
+	@classmethod
+	def setUpClass(cls):
+		super().setUpClass()
+		make_item(ARTICLE_TEST, {"is_stock_item": 0, "stock_uom": "Nos", "is_gnr_tracked": 1, "gnr_tax_rate": 3.86})
+		cls.mode_capture = frappe.db.get_single_value("GNR Settings", "mode_capture")
+		# Le registre des articles GNR n'est republié qu'après le commit
+		frappe.db.commit()
+
+	@classmethod
+	def tearDownClass(cls):
+		frappe.db.set_single_value("GNR Settings", "mode_capture", cls.mode_capture or "Synchrone")
+		frappe.db.commit()
+		super().tearDownClass()
+
+	def soumettre_facture(self, mode_capture):
+		frappe.db.set_single_value("GNR Settings", "mode_capture", mode_capture)
+		facture = create_sales_invoice(item_code=ARTICLE_TEST, qty=250, rate=1.45)
+		# Le traitement de la file valide ses transactions : nettoyage explicite
+		self.addCleanup(self.annuler_facture, facture.name)
+		return facture
+
+	def annuler_facture(self, nom):
+		frappe.get_doc("Sales Invoice", nom).cancel()
+		frappe.db.delete("GNR Capture Outbox", {"reference_name": nom})
+		frappe.db.commit()
+
+	def mouvements(self, facture):
+		return frappe.get_all(
+			"Mouvement GNR",
+			filters={"reference_document": "Sales Invoice", "reference_name": facture.name, "docstatus": 1},
+			fields=CHAMPS_MOUVEMENT,
+			order_by="code_produit",
+		)
+
+	def test_capture_differee_identique_a_la_capture_synchrone(self):
+		synchrone = self.soumettre_facture("Synchrone")
+		differee = self.soumettre_facture("Différé")
+
+		self.assertEqual(self.mouvements(differee), [])
+		self.assertEqual(frappe.db.get_value("Sales Invoice", differee.name, "gnr_capture_status"), CAPTURE_EN_ATTENTE)
+
+		traiter_file_capture()
+
+		self.assertTrue(self.mouvements(synchrone))
+		self.assertEqual(self.mouvements(differee), self.mouvements(synchrone))
+		self.assertEqual(
+			frappe.db.get_value("GNR Capture Outbox", {"reference_name": differee.name}, "statut"), STATUT_TRAITE
+		)
+		self.assertEqual(frappe.db.get_value("Sales Invoice", differee.name, "gnr_capture_status"), CAPTURE_EFFECTUEE)
+
+	def test_ligne_reprise_sans_doublon(self):
+		facture = self.soumettre_facture("Différé")
+		traiter_file_capture()
+		captures = self.mouvements(facture)
+
+		# Ligne reprise comme après l'interruption d'un worker
+		frappe.db.set_value("GNR Capture Outbox", {"reference_name": facture.name}, "statut", STATUT_EN_ATTENTE)
+		traiter_file_capture()
+
+		self.assertTrue(captures)
+		self.assertEqual(self.mouvements(facture), captures)
@@ -0,0 +1,299 @@
+# Copyright (c) 2025, Mohamed Kachtit and contributors
+# For license information, please see license.txt
+
+import frappe
+from frappe.model.document import Document
+from frappe.utils import flt, getdate, now
+
+from gnr_compliance.gnr_compliance.doctype.gnr_daily_ledger.gnr_daily_ledger import get_societe_mouvement
+from gnr_compliance.utils.attestation_resolver import attestation_mouvement, condition_attestation_sql
+
+# Colonnes cumulées (les extrêmes sont traités à part)
+COLONNES_CUMULS = ("quantite", "montant_ht", "montant_taxe", "nb_mouvements")
+
+
+class GNRClientSemesterSummary(Document):
+    pass
+
+
+def on_doctype_update():
+    """Une ligne par société, semestre et client, lue par semestre"""
+    frappe.db.add_unique(
+        "GNR Client Semester Summary",
+        ["company", "annee", "semestre", "client"],
+        constraint_name="unique_synthese_societe_semestre_client",
+    )
+    frappe.db.add_index("GNR Client Semester Summary", ["annee", "semestre"])
+
+
+def semestre_de(date):
+    date = getdate(date)
+    return date.year, "1" if date.month <= 6 else "2"
+
+
+def bornes_semestre(annee, semestre):
+    if semestre == "1":
+        return f"{annee}-01-01", f"{annee}-06-30"
+    return f"{annee}-07-01", f"{annee}-12-31"
+
+
+def semestres_couverts(from_date, to_date):
+    """
+    Semestres exactement couverts par la période
+
+    Returns:
+        list: (annee, semestre), ou None si la période ne commence ou ne
+        finit pas sur une borne de semestre
+    """
+    debut, fin = getdate(from_date), getdate(to_date)
+    if (debut.month, debut.day) not in ((1, 1), (7, 1)) or (fin.month, fin.day) not in ((6, 30), (12, 31)):
+        return None
+    if debut > fin:
+        return None
+
+    semestres = []
+    annee, semestre = semestre_de(debut)
+    while (annee, semestre) <= semestre_de(fin):
+        semestres.append((annee, semestre))
+        annee, semestre = (annee, "2") if semestre == "1" else (annee + 1, "1")
+    return semestres
+
+
+def mettre_a_jour_syntheses_clients(mouvements, signe):
+    """
+    Ajoute (+1) ou retire (-1) les ventes des synthèses semestrielles clients
+    """
+    deltas = {}
+    for mouvement in mouvements:
+        if mouvement.get("type_mouvement") != "Vente" or not mouvement.get("client"):
+            continue
+
+        date_mouvement = getdate(mouvement.get("date_mouvement"))
+        quantite = flt(mouvement.get("quantite"))
+        taux = flt(mouvement.get("taux_gnr"))
+        cle = (get_societe_mouvement(mouvement), *semestre_de(date_mouvement), mouvement.get("client"))
+        delta = deltas.setdefault(
+            cle,
+            {
+                **dict.fromkeys(COLONNES_CUMULS, 0),
+                "premiere_vente": date_mouvement, "derniere_vente": date_mouvement,
+                "taux_min": taux, "taux_max": taux,
+            },
+        )
+        delta["quantite"] += signe * quantite
+        delta["montant_ht"] += signe * quantite * flt(mouvement.get("prix_unitaire"))
+        delta["montant_taxe"] += signe * flt(mouvement.get("montant_taxe_gnr"))
+        delta["nb_mouvements"] += signe
+        delta["premiere_vente"] = min(delta["premiere_vente"], date_mouvement)
+        delta["derniere_vente"] = max(delta["derniere_vente"], date_mouvement)
+        delta["taux_min"] = min(delta["taux_min"], taux)
+        delta["taux_max"] = max(delta["taux_max"], taux)
+        delta.update(attestation_mouvement(mouvement))
+
+    if not deltas:
+        return
+
+    _ecrire_deltas(deltas)
+
+    if signe < 0:
+        # Une date ou un taux extrême retiré ne se décrémente pas : relire ces clients
+        cles = list(deltas)
+        frappe.db.sql(
+            """DELETE FROM `tabGNR Client Semester Summary`
+            WHERE nb_mouvements <= 0
+            AND (company, annee, semestre, client) IN ({})""".format(
+                ", ".join(["(%s, %s, %s, %s)"] * len(cles))
+            ),
+            [valeur for cle in cles for valeur in cle],
+        )
+        for company, annee, semestre, client in cles:
+            _recalculer_extremes(company, annee, semestre, client)
+
+
+def _ecrire_deltas(deltas):
+    """Applique les écarts par société, semestre et client en une requête"""
+    horodatage = now()
+    utilisateur = frappe.session.user
+    valeurs = []
+    for (company, annee, semestre, client), delta in deltas.items():
+        valeurs.extend([frappe.generate_hash(length=10), company, annee, semestre, client])
+        valeurs.extend([delta["avec_attestation"], delta["reference_attestation"]])
+        valeurs.extend(delta[colonne] for colonne in COLONNES_CUMULS)
+        valeurs.extend(
+            [
+                delta["premiere_vente"], delta["derniere_vente"], delta["taux_min"], delta["taux_max"],
+                horodatage, horodatage, utilisateur, utilisateur,
+            ]
+        )
+
+    marqueurs = "({})".format(", ".join(["%s"] * (len(COLONNES_CUMULS) + 15)))
+    frappe.db.sql(
+        """
+        INSERT INTO `tabGNR Client Semester Summary`
+            (name, company, annee, semestre, client, avec_attestation, reference_attestation,
+            {colonnes}, premiere_vente, derniere_vente, taux_min, taux_max,
+            creation, modified, owner, modified_by)
+        VALUES {valeurs}
+        ON DUPLICATE KEY UPDATE
+            {cumuls},
+            avec_attestation = VALUES(avec_attestation),
+            reference_attestation = VALUES(reference_attestation),
+            premiere_vente = LEAST(COALESCE(premiere_vente, VALUES(premiere_vente)), VALUES(premiere_vente)),
+            derniere_vente = GREATEST(COALESCE(derniere_vente, VALUES(derniere_vente)), VALUES(derniere_vente)),
+            taux_min = LEAST(COALESCE(taux_min, VALUES(taux_min)), VALUES(taux_min)),
+            taux_max = GREATEST(COALESCE(taux_max, VALUES(taux_max)), VALUES(taux_max)),
+            modified = VALUES(modified),
+            modified_by = VALUES(modified_by)
+        """.format(
+            colonnes=", ".join(COLONNES_CUMULS),
+            valeurs=", ".join([marqueurs] * len(deltas)),
+            cumuls=",\n            ".join(f"{c} = {c} + VALUES({c})" for c in COLONNES_CUMULS),
+        ),
+        valeurs,
+    )
+
+
+def _recalculer_extremes(company, annee, semestre, client):
+    """Relit dates et taux extrêmes d'un client sur le semestre"""
+    date_debut, date_fin = bornes_semestre(annee, semestre)
+    frappe.db.sql(
+        """
+        UPDATE `tabGNR Client Semester Summary` s
+        JOIN (
+            SELECT MIN(date_mouvement) AS premiere_vente, MAX(date_mouvement) AS derniere_vente,
+                MIN(taux_gnr) AS taux_min, MAX(taux_gnr) AS taux_max
+            FROM `tabMouvement GNR`
+            WHERE client = %(client)s
+            AND company = %(company)s
+            AND type_mouvement = 'Vente'
+            AND docstatus = 1
+            AND date_mouvement BETWEEN %(date_debut)s AND %(date_fin)s
+        ) m
+        SET s.premiere_vente = m.premiere_vente, s.derniere_vente = m.derniere_vente,
+            s.taux_min = m.taux_min, s.taux_max = m.taux_max
+        WHERE s.company = %(company)s AND s.annee = %(annee)s
+        AND s.semestre = %(semestre)s AND s.client = %(client)s
+        """,
+        {
+            "company": company, "annee": annee, "semestre": semestre, "client": client,
+            "date_debut": date_debut, "date_fin": date_fin,
+        },
+    )
+
+
+def get_clients_semestres(semestres, company=None):
+    """
+    Ventes par client cumulées sur des semestres, avec l'attestation relevée
+    sur les synthèses (même forme que get_clients_avec_attestation_reels ;
+    siret : SIRET du client, sinon son numéro fiscal)
+    """
+    if not semestres:
+        return []
+
+    condition = "AND s.company = %s" if company else ""
+    parametres = [valeur for semestre in semestres for valeur in semestre]
+    if company:
+        parametres.append(company)
+
+    return frappe.db.sql(
+        f"""
+        SELECT
+            s.client as code_client,
+            COALESCE(c.customer_name, s.client) as nom_client,
+            COALESCE(NULLIF(c.siret, ''), c.tax_id) as siret,
+            SUM(s.quantite) as quantite_totale,
+            SUM(s.montant_ht) as montant_ht_reel,
+            SUM(s.montant_taxe) as montant_taxe_reel,
+            CASE
+                WHEN SUM(s.quantite) > 0
+                THEN SUM(s.montant_taxe) / (SUM(s.quantite) / 100)  -- Conversion L vers hL
+                ELSE 0
+            END as taux_reel_par_hl,
+            MAX(COALESCE(s.avec_attestation, 0)) as avec_attestation,
+            MAX(s.reference_attestation) as numero_dossier,
+            c.custom_date_de_depot as date_depot,
+            SUM(s.nb_mouvements) as nb_mouvements,
+            MIN(s.premiere_vente) as premiere_vente,
+            MAX(s.derniere_vente) as derniere_vente,
+            MIN(s.taux_min) as taux_min,
+            MAX(s.taux_max) as taux_max
+        FROM `tabGNR Client Semester Summary` s
+        LEFT JOIN `tabCustomer` c ON s.client = c.name
+        WHERE (s.annee, s.semestre) IN ({", ".join(["(%s, %s)"] * len(semestres))})
+        {condition}
+        GROUP BY s.client, c.customer_name, c.siret, c.tax_id, c.custom_date_de_depot
+        HAVING SUM(s.quantite) > 0
+        ORDER BY nom_client
+        """,
+        parametres,
+        as_dict=True,
+    )
+
+
+def tamponner_syntheses_clients(clients=None):
+    """
+    Recopie l'attestation des clients sur leurs synthèses, en une requête
+
+    Args:
+        clients: codes client (None : toutes les synthèses)
+    """
+    condition = ""
+    parametres = []
+    if clients:
+        condition = "WHERE s.client IN ({})".format(", ".join(["%s"] * len(clients)))
+        parametres = list(clients)
+
+    # Comme MAX(avec_attestation) sur les ventes : en vigueur à la dernière vente
+    en_vigueur = condition_attestation_sql("s.derniere_vente")
+    frappe.db.sql(
+        f"""
+        UPDATE `tabGNR Client Semester Summary` s
+        LEFT JOIN `tabCustomer` c ON s.client = c.name
+        SET s.avec_attestation = CASE WHEN {en_vigueur} THEN 1 ELSE 0 END,
+            s.reference_attestation = CASE
+                WHEN {en_vigueur} THEN TRIM(c.custom_n_dossier_) ELSE NULL
+            END
+        {condition}
+        """,
+        parametres,
+    )
+
+
+def reconstruire_syntheses_clients():
+    """Recalcule toutes les synthèses depuis les ventes soumises"""
+    frappe.db.delete("GNR Client Semester Summary")
+    frappe.db.sql(
+        """
+        INSERT INTO `tabGNR Client Semester Summary`
+            (name, company, annee, semestre, client, avec_attestation, reference_attestation,
+            quantite, montant_ht, montant_taxe, nb_mouvements,
+            premiere_vente, derniere_vente, taux_min, taux_max,
+            creation, modified, owner, modified_by)
+        SELECT
+            SUBSTRING(SHA2(CONCAT(company, '|', annee, '|', semestre, '|', client), 256), 1, 10),
+            company, annee, semestre, client,
+            MAX(avec_attestation), MAX(reference_attestation),
+            SUM(quantite), SUM(quantite * prix_unitaire), SUM(montant_taxe_gnr),
+            COUNT(*), MIN(date_mouvement), MAX(date_mouvement), MIN(taux_gnr), MAX(taux_gnr),
+            NOW(), NOW(), 'Administrator', 'Administrator'
+        FROM (
+            SELECT
+                company,
+                YEAR(date_mouvement) AS annee,
+                IF(MONTH(date_mouvement) <= 6, '1', '2') AS semestre,
+                client, date_mouvement,
+                COALESCE(avec_attestation, 0) AS avec_attestation,
+                reference_attestation,
+                COALESCE(quantite, 0) AS quantite,
+                COALESCE(prix_unitaire, 0) AS prix_unitaire,
+                COALESCE(montant_taxe_gnr, 0) AS montant_taxe_gnr,
+                taux_gnr
+            FROM `tabMouvement GNR`
+            WHERE docstatus = 1
+            AND type_mouvement = 'Vente'
+            AND client IS NOT NULL
+            AND client != ''
+        ) ventes
+        GROUP BY company, annee, semestre, client
+        """
+    )
@@ -0,0 +1,45 @@
+# Copyright (c) 2025, Mohamed Kachtit and Contributors
+# See license.txt
+
+from datetime import date
+
+import frappe
+from frappe.tests.utils import FrappeTestCase
+from frappe.utils import flt
+
+from gnr_compliance.gnr_compliance.doctype.gnr_daily_ledger.test_gnr_daily_ledger import (
+	SOCIETE_TEST,
+	creer_mouvements_test,
+)
+from gnr_compliance.utils.period_dataset import GNRPeriodDataset
+
+CHAMPS_COMPARES = (
+	"code_client",
+	"siret",
+	"quantite_totale",
+	"montant_ht_reel",
+	"montant_taxe_reel",
+	"avec_attestation",
+	"nb_mouvements",
+	"premiere_vente",
+	"derniere_vente",
+)
+
+
+def resume(clients):
+	return [
+		{champ: flt(client[champ], 2) if isinstance(client[champ], float) else client[champ] for champ in CHAMPS_COMPARES}
+		for client in clients
+	]
+
+
+class TestGNRClientSemesterSummary(FrappeTestCase):
+	def setUp(self):
+		self.addCleanup(frappe.db.rollback)
+
+	def test_clients_du_semestre_lus_sur_les_syntheses(self):
+		creer_mouvements_test()
+		dataset = GNRPeriodDataset.charger(date(2019, 1, 1), date(2019, 6, 30), SOCIETE_TEST)
+
+		self.assertEqual(resume(dataset.clients()), resume(dataset._clients_mouvements()))
+		self.assertIn("_Test Customer", [client.code_client for client in dataset.clients()])
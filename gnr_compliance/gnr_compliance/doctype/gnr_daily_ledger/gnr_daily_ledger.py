@@ -0,0 +1,223 @@
+# Copyright (c) 2025, Mohamed Kachtit and contributors
+# For license information, please see license.txt
+
+import frappe
+from frappe.model.document import Document
+from frappe.utils import flt, getdate, now
+
+from gnr_compliance.utils.attestation_resolver import attestation_mouvement
+
+TYPES_ENTREE = ("Achat", "Entrée")
+TYPES_SORTIE = ("Vente", "Sortie")
+
+# Colonnes cumulées du journal, dans l'ordre d'écriture
+COLONNES_JOURNAL = (
+    "entrees",
+    "sorties",
+    "volume_ventes",
+    "volume_agricole",
+    "volume_sans_attestation",
+    "taxe_agricole",
+    "taxe_sans_attestation",
+    "montant_taxe",
+    "chiffre_affaires",
+    "nb_mouvements",
+)
+
+
+class GNRDailyLedger(Document):
+    pass
+
+
+def on_doctype_update():
+    """Une ligne par société, jour et produit, lue par plage de dates"""
+    frappe.db.add_unique(
+        "GNR Daily Ledger",
+        ["company", "date_mouvement", "code_produit"],
+        constraint_name="unique_journal_societe_jour_produit",
+    )
+    frappe.db.add_index("GNR Daily Ledger", ["date_mouvement"])
+
+
+def get_societe_mouvement(mouvement):
+    """Société du mouvement, sinon société par défaut"""
+    return mouvement.get("company") or frappe.defaults.get_global_default("company")
+
+
+def resoudre_societe(company=None):
+    """
+    Société d'un export ou d'une déclaration : celle demandée, sinon celle
+    de l'utilisateur, sinon la société par défaut, sinon la première
+    """
+    return (
+        company
+        or frappe.defaults.get_user_default("Company")
+        or frappe.defaults.get_global_default("company")
+        or frappe.db.get_value("Company", {}, "name")
+    )
+
+
+def ecritures_mouvement(mouvement):
+    """
+    Contributions d'un mouvement aux colonnes du journal
+
+    L'attestation est celle relevée sur le mouvement (avec_attestation),
+    sinon celle du client : numéro de dossier et date de dépôt renseignés.
+    """
+    type_mouvement = mouvement.get("type_mouvement")
+    quantite = flt(mouvement.get("quantite"))
+    montant_taxe = flt(mouvement.get("montant_taxe_gnr"))
+    ecritures = dict.fromkeys(COLONNES_JOURNAL, 0)
+    ecritures["nb_mouvements"] = 1
+    ecritures["montant_taxe"] = montant_taxe
+
+    if type_mouvement in TYPES_ENTREE:
+        ecritures["entrees"] = quantite
+    if type_mouvement in TYPES_SORTIE:
+        ecritures["sorties"] = quantite
+    if type_mouvement == "Vente":
+        ecritures["volume_ventes"] = quantite
+        ecritures["chiffre_affaires"] = quantite * flt(mouvement.get("prix_unitaire"))
+        if attestation_mouvement(mouvement).avec_attestation:
+            ecritures["volume_agricole"] = quantite
+            ecritures["taxe_agricole"] = montant_taxe
+        else:
+            ecritures["volume_sans_attestation"] = quantite
+            ecritures["taxe_sans_attestation"] = montant_taxe
+    return ecritures
+
+
+def mettre_a_jour_journal(mouvements, signe):
+    """
+    Ajoute (+1) ou retire (-1) les mouvements du journal quotidien
+    """
+    deltas = {}
+    for mouvement in mouvements:
+        cle = (
+            get_societe_mouvement(mouvement),
+            getdate(mouvement.get("date_mouvement")),
+            mouvement.get("code_produit"),
+        )
+        delta = deltas.setdefault(cle, dict.fromkeys(COLONNES_JOURNAL, 0))
+        for colonne, valeur in ecritures_mouvement(mouvement).items():
+            delta[colonne] += signe * valeur
+
+    if not deltas:
+        return
+
+    _ecrire_deltas(deltas)
+
+    if signe < 0:
+        cles = list(deltas)
+        frappe.db.sql(
+            """DELETE FROM `tabGNR Daily Ledger`
+            WHERE nb_mouvements <= 0
+            AND (company, date_mouvement, code_produit) IN ({})""".format(
+                ", ".join(["(%s, %s, %s)"] * len(cles))
+            ),
+            [valeur for cle in cles for valeur in cle],
+        )
+
+
+def _ecrire_deltas(deltas):
+    """Applique les écarts par société, jour et produit en une requête"""
+    horodatage = now()
+    utilisateur = frappe.session.user
+    valeurs = []
+    for (company, date_mouvement, code_produit), delta in deltas.items():
+        valeurs.extend([frappe.generate_hash(length=10), company, date_mouvement, code_produit])
+        valeurs.extend(delta[colonne] for colonne in COLONNES_JOURNAL)
+        valeurs.extend([horodatage, horodatage, utilisateur, utilisateur])
+
+    marqueurs = "({})".format(", ".join(["%s"] * (len(COLONNES_JOURNAL) + 8)))
+    frappe.db.sql(
+        """
+        INSERT INTO `tabGNR Daily Ledger`
+            (name, company, date_mouvement, code_produit, {colonnes},
+            creation, modified, owner, modified_by)
+        VALUES {valeurs}
+        ON DUPLICATE KEY UPDATE
+            {cumuls},
+            modified = VALUES(modified),
+            modified_by = VALUES(modified_by)
+        """.format(
+            colonnes=", ".join(COLONNES_JOURNAL),
+            valeurs=", ".join([marqueurs] * len(deltas)),
+            cumuls=",\n            ".join(f"{c} = {c} + VALUES({c})" for c in COLONNES_JOURNAL),
+        ),
+        valeurs,
+    )
+
+
+def get_totaux_periode(from_date, to_date, company=None):
+    """Colonnes du journal cumulées sur toute la période"""
+    condition = "AND company = %(company)s" if company else ""
+    totaux = frappe.db.sql(
+        f"""
+        SELECT {", ".join(f"COALESCE(SUM({c}), 0) AS {c}" for c in COLONNES_JOURNAL)}
+        FROM `tabGNR Daily Ledger`
+        WHERE date_mouvement BETWEEN %(from_date)s AND %(to_date)s
+        {condition}
+        """,
+        {"from_date": from_date, "to_date": to_date, "company": company},
+        as_dict=True,
+    )
+    return totaux[0] if totaux else frappe._dict(dict.fromkeys(COLONNES_JOURNAL, 0))
+
+
+def reconstruire_journal(jours=None):
+    """
+    Recalcule le journal depuis les mouvements soumis
+
+    Args:
+        jours: triplets (company, code_produit, date_mouvement) à recalculer
+            (None : toute la table)
+    """
+    if jours:
+        marqueurs = ", ".join(["(%s, %s, %s)"] * len(jours))
+        condition = f"AND (m.company, m.code_produit, m.date_mouvement) IN ({marqueurs})"
+        parametres = [valeur for jour in jours for valeur in jour]
+        frappe.db.sql(
+            f"""DELETE FROM `tabGNR Daily Ledger`
+            WHERE (company, code_produit, date_mouvement) IN ({marqueurs})""",
+            parametres,
+        )
+    else:
+        condition = ""
+        parametres = []
+        frappe.db.delete("GNR Daily Ledger")
+
+    frappe.db.sql(
+        f"""
+        INSERT INTO `tabGNR Daily Ledger`
+            (name, company, date_mouvement, code_produit, {", ".join(COLONNES_JOURNAL)},
+            creation, modified, owner, modified_by)
+        SELECT
+            SUBSTRING(SHA2(CONCAT(company, '|', date_mouvement, '|', code_produit), 256), 1, 10),
+            company, date_mouvement, code_produit,
+            SUM(CASE WHEN type_mouvement IN ('Achat', 'Entrée') THEN quantite ELSE 0 END),
+            SUM(CASE WHEN type_mouvement IN ('Vente', 'Sortie') THEN quantite ELSE 0 END),
+            SUM(CASE WHEN type_mouvement = 'Vente' THEN quantite ELSE 0 END),
+            SUM(CASE WHEN type_mouvement = 'Vente' AND agricole THEN quantite ELSE 0 END),
+            SUM(CASE WHEN type_mouvement = 'Vente' AND NOT agricole THEN quantite ELSE 0 END),
+            SUM(CASE WHEN type_mouvement = 'Vente' AND agricole THEN montant_taxe_gnr ELSE 0 END),
+            SUM(CASE WHEN type_mouvement = 'Vente' AND NOT agricole THEN montant_taxe_gnr ELSE 0 END),
+            SUM(montant_taxe_gnr),
+            SUM(CASE WHEN type_mouvement = 'Vente' THEN quantite * prix_unitaire ELSE 0 END),
+            COUNT(*),
+            NOW(), NOW(), 'Administrator', 'Administrator'
+        FROM (
+            SELECT
+                m.company, m.date_mouvement, m.code_produit, m.type_mouvement,
+                COALESCE(m.quantite, 0) AS quantite,
+                COALESCE(m.prix_unitaire, 0) AS prix_unitaire,
+                COALESCE(m.montant_taxe_gnr, 0) AS montant_taxe_gnr,
+                COALESCE(m.avec_attestation, 0) = 1 AS agricole
+            FROM `tabMouvement GNR` m
+            WHERE m.docstatus = 1
+            {condition}
+        ) mouvements
+        GROUP BY company, date_mouvement, code_produit
+        """,
+        parametres,
+    )
@@ -0,0 +1,76 @@
+# Copyright (c) 2025, Mohamed Kachtit and Contributors
+# See license.txt
+
+from datetime import date
+
+import frappe
+from frappe.tests.utils import FrappeTestCase
+
+from gnr_compliance.gnr_compliance.doctype.gnr_daily_ledger.gnr_daily_ledger import (
+	COLONNES_JOURNAL,
+	reconstruire_journal,
+)
+from gnr_compliance.gnr_compliance.doctype.mouvement_gnr.mouvement_gnr import inserer_mouvements_soumis
+
+ARTICLE_TEST = "TEST-GNR-LEDGER-ITEM"
+SOCIETE_TEST = "_Test Company"
+
+# (date, type, quantité en litres)
+MOUVEMENTS_TEST = [
+	(date(2019, 1, 15), "Achat", 5000),
+	(date(2019, 1, 20), "Vente", 1200),
+	(date(2019, 2, 3), "Vente", 800),
+	(date(2019, 2, 3), "Achat", 2000),
+	(date(2019, 3, 10), "Vente", 1500),
+	(date(2019, 4, 2), "Vente", 300),
+]
+
+
+def creer_mouvements_test(mouvements=MOUVEMENTS_TEST, company=SOCIETE_TEST):
+	"""Mouvements soumis de l'article de test, répercutés sur les agrégats"""
+	return inserer_mouvements_soumis(
+		[
+			{
+				"type_mouvement": type_mouvement,
+				"date_mouvement": date_mouvement,
+				"code_produit": ARTICLE_TEST,
+				"quantite": quantite,
+				"prix_unitaire": 1.25,
+				"taux_gnr": 3.86,
+				"client": "_Test Customer" if type_mouvement == "Vente" else None,
+				"company": company,
+			}
+			for date_mouvement, type_mouvement, quantite in mouvements
+		]
+	)
+
+
+def lire_journal():
+	return frappe.get_all(
+		"GNR Daily Ledger",
+		filters={"company": SOCIETE_TEST, "code_produit": ARTICLE_TEST},
+		fields=["date_mouvement", *COLONNES_JOURNAL],
+		order_by="date_mouvement",
+	)
+
+
+class TestGNRDailyLedger(FrappeTestCase):
+	def setUp(self):
+		self.addCleanup(frappe.db.rollback)
+
+	def test_journal_incremental_identique_au_recalcul(self):
+		mouvements = creer_mouvements_test()
+		# Une vente d'un jour qui garde un achat, la seule vente d'un autre jour
+		for mouvement in (mouvements[2], mouvements[5]):
+			frappe.get_doc("Mouvement GNR", mouvement.name).cancel()
+
+		incremental = lire_journal()
+		self.assertEqual(
+			[ligne.date_mouvement for ligne in incremental],
+			[date(2019, 1, 15), date(2019, 1, 20), date(2019, 2, 3), date(2019, 3, 10)],
+		)
+
+		reconstruire_journal(
+			[(SOCIETE_TEST, ARTICLE_TEST, date_mouvement) for date_mouvement, _type, _quantite in MOUVEMENTS_TEST]
+		)
+		self.assertEqual(lire_journal(), incremental)
@@ -0,0 +1,76 @@
+# Copyright (c) 2025, Mohamed Kachtit and Contributors
+# See license.txt
+
+from datetime import date, timedelta
+
+import frappe
+from frappe.tests.utils import FrappeTestCase
+
+from gnr_compliance.gnr_compliance.doctype.gnr_daily_ledger.test_gnr_daily_ledger import (
+	ARTICLE_TEST,
+	MOUVEMENTS_TEST,
+	SOCIETE_TEST,
+	creer_mouvements_test,
+)
+from gnr_compliance.gnr_compliance.doctype.gnr_stock_checkpoint.gnr_stock_checkpoint import (
+	reconstruire_clotures,
+)
+from gnr_compliance.utils.stock_ledger import calculer_grand_livre_stock, fonctions_fenetre_supportees
+
+DEBUT_PERIODE = date(2019, 2, 1)
+FIN_PERIODE = date(2019, 3, 31)
+
+
+def grand_livre_attendu(from_date, to_date):
+	"""(date, stock initial, entrées, sorties, stock final) depuis les mouvements"""
+	stock = sum(
+		quantite if type_mouvement == "Achat" else -quantite
+		for date_mouvement, type_mouvement, quantite in MOUVEMENTS_TEST
+		if date_mouvement < from_date
+	)
+	lignes = []
+	for decalage in range((to_date - from_date).days + 1):
+		jour = from_date + timedelta(days=decalage)
+		flux = [(t, q) for d, t, q in MOUVEMENTS_TEST if d == jour]
+		entrees = sum(q for t, q in flux if t == "Achat")
+		sorties = sum(q for t, q in flux if t == "Vente")
+		lignes.append((jour, stock, entrees, sorties, stock + entrees - sorties))
+		stock += entrees - sorties
+	return lignes
+
+
+class TestGrandLivreStock(FrappeTestCase):
+	def setUp(self):
+		self.addCleanup(frappe.db.rollback)
+		self.addCleanup(setattr, frappe.local, "gnr_fonctions_fenetre", None)
+		creer_mouvements_test()
+		# Stock de début lu sur une clôture puis complété par le journal
+		reconstruire_clotures()
+
+	def test_grand_livre_identique_au_calcul_depuis_les_mouvements(self):
+		attendu = grand_livre_attendu(DEBUT_PERIODE, FIN_PERIODE)
+		chemins = [True, False] if fonctions_fenetre_supportees() else [False]
+
+		for fenetre in chemins:
+			with self.subTest(fonctions_fenetre=fenetre):
+				frappe.local.gnr_fonctions_fenetre = fenetre
+				grand_livre = calculer_grand_livre_stock(DEBUT_PERIODE, FIN_PERIODE, SOCIETE_TEST, par_produit=True)
+				self.assertEqual(
+					[
+						(ligne.date, ligne.stock_initial, ligne.entrees, ligne.sorties, ligne.stock_final)
+						for ligne in grand_livre.lignes()
+						if ligne.code_produit == ARTICLE_TEST
+					],
+					attendu,
+				)
+
+	def test_sous_periode_identique_au_calcul_direct(self):
+		grand_livre = calculer_grand_livre_stock(DEBUT_PERIODE, FIN_PERIODE, SOCIETE_TEST, par_produit=True)
+		mars = grand_livre.sous_periode(date(2019, 3, 1), FIN_PERIODE)
+		direct = calculer_grand_livre_stock(date(2019, 3, 1), FIN_PERIODE, SOCIETE_TEST, par_produit=True)
+
+		self.assertEqual(
+			[ligne for ligne in mars.lignes() if ligne.code_produit == ARTICLE_TEST],
+			[ligne for ligne in direct.lignes() if ligne.code_produit == ARTICLE_TEST],
+		)
+		self.assertEqual(mars.soldes_par_produit()[ARTICLE_TEST], direct.soldes_par_produit()[ARTICLE_TEST])
@@ -0,0 +1,152 @@
+# Copyright (c) 2025, Mohamed Kachtit and contributors
+# For license information, please see license.txt
+
+import hashlib
+
+import frappe
+from frappe.model.document import Document
+from frappe.utils import cint, getdate
+
+from gnr_compliance.gnr_compliance.doctype.gnr_period_version.gnr_period_version import get_version_periode
+
+# Version de la mise en page de chaque export : à incrémenter quand son
+# rendu change, pour que les fichiers déjà en cache soient régénérés
+VERSIONS_GABARITS = {
+    "declaration_trimestrielle": 1,
+    "liste_semestrielle": 1,
+    "arrete_trimestriel": 1,
+    "liste_clients": 1,
+    "export_gnr": 1,
+    "export_gnr_details": 1,
+    "export_annuel": 1,
+}
+
+
+class GNRExportCache(Document):
+    pass
+
+
+def on_doctype_update():
+    """Un fichier par export, société, période et versions"""
+    frappe.db.add_unique(
+        "GNR Export Cache",
+        ["type_export", "company", "date_debut", "date_fin", "version_donnees", "version_gabarit"],
+        constraint_name="unique_export_periode_versions",
+    )
+
+
+def empreinte_donnees(type_export, donnees):
+    """
+    Empreinte SHA-256 du contenu d'un export
+
+    Calculée sur les données avant rendu : un xlsx embarque ses dates de
+    création, deux rendus des mêmes données n'ont jamais les mêmes octets.
+    """
+    contenu = frappe.as_json([type_export, VERSIONS_GABARITS[type_export], donnees], indent=None)
+    return hashlib.sha256(contenu.encode("utf-8")).hexdigest()
+
+
+def obtenir_export(
+    type_export, company, date_debut, date_fin, preparer, rendre, version_donnees=None, en_cache=True, is_private=0
+):
+    """
+    Fichier d'un export, généré seulement s'il n'existe pas déjà
+
+    Le cache est adressé par (type, société, période, version des données,
+    version du gabarit) : soumettre ou annuler un mouvement incrémente la
+    version de son mois, seules les périodes qui le recouvrent changent de
+    clé. À contenu identique (même empreinte), le fichier déjà enregistré
+    est réutilisé sans nouveau rendu.
+
+    Args:
+        preparer: () -> données de l'export (sérialisables en JSON), None
+            s'il n'y a rien à exporter
+        rendre: (données) -> (nom du fichier, contenu)
+        version_donnees: version des données préparées si elles sont figées
+            (instantané d'une déclaration), None : version courante
+        en_cache: False pour des données sans version connue (ni lues ni
+            mémorisées dans le cache, mais dédoublonnées par empreinte)
+
+    Returns:
+        frappe._dict: fichier, file_url, file_name, en_cache (None si
+        rien à exporter)
+    """
+    cle = None
+    if en_cache:
+        # Version lue avant la préparation : un mouvement soumis pendant la
+        # génération rend aussitôt l'entrée périmée
+        if version_donnees is None:
+            version_donnees = get_version_periode(date_debut, date_fin, company)
+        cle = {
+            "type_export": type_export,
+            "company": company,
+            "date_debut": getdate(date_debut),
+            "date_fin": getdate(date_fin),
+            "version_donnees": cint(version_donnees),
+            "version_gabarit": VERSIONS_GABARITS[type_export],
+        }
+        entree = frappe.db.get_value(
+            "GNR Export Cache", cle, ["fichier", "file_url", "nom_fichier"], as_dict=True
+        )
+        if entree and entree.fichier and frappe.db.exists("File", entree.fichier):
+            return frappe._dict(
+                fichier=entree.fichier, file_url=entree.file_url, file_name=entree.nom_fichier, en_cache=True
+            )
+
+    donnees = preparer()
+    if donnees is None:
+        return None
+
+    # La période et la société nomment le fichier : elles font partie du contenu
+    empreinte = empreinte_donnees(
+        type_export, [company, str(getdate(date_debut)), str(getdate(date_fin)), donnees]
+    )
+    export = _export_par_empreinte(empreinte)
+    if export is None:
+        file_name, contenu = rendre(donnees)
+        file_doc = frappe.get_doc(
+            {"doctype": "File", "file_name": file_name, "content": contenu, "is_private": is_private}
+        )
+        file_doc.save(ignore_permissions=True)
+        export = frappe._dict(fichier=file_doc.name, file_url=file_doc.file_url, file_name=file_name)
+    export.en_cache = False
+
+    if cle:
+        _memoriser(cle, empreinte, export)
+    return export
+
+
+def _export_par_empreinte(empreinte):
+    """Fichier encore présent d'un export de même contenu, sinon None"""
+    exports = frappe.db.sql(
+        """
+        SELECT c.fichier, c.file_url, c.nom_fichier AS file_name
+        FROM `tabGNR Export Cache` c
+        JOIN `tabFile` f ON f.name = c.fichier
+        WHERE c.empreinte = %s
+        LIMIT 1
+        """,
+        empreinte,
+        as_dict=True,
+    )
+    return exports[0] if exports else None
+
+
+def _memoriser(cle, empreinte, export):
+    valeurs = {
+        "empreinte": empreinte,
+        "fichier": export.fichier,
+        "file_url": export.file_url,
+        "nom_fichier": export.file_name,
+    }
+    nom = frappe.db.get_value("GNR Export Cache", cle)
+    if nom:
+        # Entrée dont le fichier a été supprimé
+        frappe.db.set_value("GNR Export Cache", nom, valeurs, update_modified=False)
+        return
+
+    try:
+        frappe.get_doc({"doctype": "GNR Export Cache", **cle, **valeurs}).insert(ignore_permissions=True)
+    except (frappe.DuplicateEntryError, frappe.UniqueValidationError):
+        # Même export mémorisé en parallèle : l'autre entrée fait foi
+        pass
@@ -0,0 +1,71 @@
+# Copyright (c) 2025, Mohamed Kachtit and Contributors
+# See license.txt
+
+from datetime import date
+
+import frappe
+from frappe.tests.utils import FrappeTestCase
+
+from gnr_compliance.gnr_compliance.doctype.gnr_export_cache.gnr_export_cache import obtenir_export
+from gnr_compliance.gnr_compliance.doctype.gnr_period_version.gnr_period_version import incrementer_versions
+
+SOCIETE_TEST = "_Test Company"
+DEBUT_PERIODE = date(2019, 1, 1)
+FIN_PERIODE = date(2019, 3, 31)
+
+
+class TestGNRExportCache(FrappeTestCase):
+	def setUp(self):
+		self.addCleanup(frappe.db.rollback)
+		self.fichiers = set()
+		self.addCleanup(self.supprimer_fichiers)
+		self.donnees = {"jours": [["2019-01-15", 5000, 0], ["2019-01-20", 0, 1200]]}
+		self.rendus = []
+
+	def supprimer_fichiers(self):
+		for fichier in self.fichiers:
+			frappe.delete_doc("File", fichier, ignore_permissions=True, force=True)
+
+	def rendre(self, donnees):
+		self.rendus.append(donnees)
+		return "Test_Export_GNR_Cache.xlsx", frappe.as_json(donnees).encode()
+
+	def obtenir(self):
+		export = obtenir_export(
+			"export_gnr", SOCIETE_TEST, DEBUT_PERIODE, FIN_PERIODE, lambda: self.donnees, self.rendre
+		)
+		self.fichiers.add(export.fichier)
+		return export
+
+	def contenu(self, export):
+		return frappe.safe_encode(frappe.get_doc("File", export.fichier).get_content())
+
+	def test_fichier_reutilise_tant_que_la_periode_ne_change_pas(self):
+		premier = self.obtenir()
+		second = self.obtenir()
+
+		self.assertFalse(premier.en_cache)
+		self.assertTrue(second.en_cache)
+		self.assertEqual(second.file_url, premier.file_url)
+		self.assertEqual(len(self.rendus), 1)
+		self.assertEqual(self.contenu(second), self.rendre(self.donnees)[1])
+
+	def test_nouvelle_version_sans_changement_de_contenu(self):
+		premier = self.obtenir()
+		incrementer_versions([(SOCIETE_TEST, DEBUT_PERIODE)])
+		second = self.obtenir()
+
+		# Données relues mais fichier retrouvé par son empreinte, sans nouveau rendu
+		self.assertFalse(second.en_cache)
+		self.assertEqual(second.fichier, premier.fichier)
+		self.assertEqual(len(self.rendus), 1)
+
+	def test_donnees_modifiees_regenerent_le_fichier(self):
+		premier = self.obtenir()
+		incrementer_versions([(SOCIETE_TEST, DEBUT_PERIODE)])
+		self.donnees = {"jours": [["2019-01-15", 5000, 0], ["2019-01-20", 0, 1500]]}
+		second = self.obtenir()
+
+		self.assertNotEqual(second.fichier, premier.fichier)
+		self.assertEqual(len(self.rendus), 2)
+		self.assertEqual(self.contenu(second), self.rendre(self.donnees)[1])
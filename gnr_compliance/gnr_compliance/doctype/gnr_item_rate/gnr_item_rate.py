@@ -0,0 +1,194 @@
+# Copyright (c) 2025, Mohamed Kachtit and contributors
+# For license information, please see license.txt
+
+from datetime import datetime
+
+import frappe
+from frappe.model.document import Document
+from frappe.utils import flt, get_datetime, getdate, now
+
+# Bornes des taux retenus comme "dernier taux connu" (exclusives)
+TAUX_MIN = 0.1
+TAUX_MAX = 50
+
+
+class GNRItemRate(Document):
+    pass
+
+
+def on_doctype_update():
+    """Retrouver l'article dont un mouvement annulé était la source"""
+    frappe.db.add_index("GNR Item Rate", ["mouvement_source"])
+
+
+def get_derniers_taux(item_codes):
+    """
+    Dernier taux connu de chaque article, en une requête
+
+    Returns:
+        dict: {item_code: dernier_taux}
+    """
+    if not item_codes:
+        return {}
+    return dict(
+        frappe.db.sql(
+            "SELECT name, dernier_taux FROM `tabGNR Item Rate` WHERE name IN %s",
+            (tuple(item_codes),),
+        )
+    )
+
+
+def get_dernier_taux(item_code):
+    """
+    Dernier taux connu d'un article
+
+    Returns:
+        frappe._dict: dernier_taux, date_dernier_taux, mouvement_source ou None
+    """
+    return frappe.db.get_value(
+        "GNR Item Rate",
+        item_code,
+        ["dernier_taux", "date_dernier_taux", "mouvement_source"],
+        as_dict=True,
+    )
+
+
+def mettre_a_jour_derniers_taux(mouvements, signe):
+    """
+    Maintient la table des derniers taux à la soumission (+1) ou à
+    l'annulation (-1) de mouvements GNR
+    """
+    if signe > 0:
+        _appliquer_soumissions(mouvements)
+    else:
+        # Seuls les articles dont le mouvement source disparaît sont relus
+        sources = frappe.db.sql(
+            """SELECT name FROM `tabGNR Item Rate`
+            WHERE mouvement_source IN %s""",
+            (tuple(m.get("name") for m in mouvements),),
+        )
+        if sources:
+            reconstruire_derniers_taux([source[0] for source in sources])
+
+
+def _appliquer_soumissions(mouvements):
+    """Remplace le taux connu si le mouvement soumis est plus récent"""
+    candidats = {}
+    for mouvement in mouvements:
+        if not TAUX_MIN < flt(mouvement.get("taux_gnr")) < TAUX_MAX:
+            continue
+        ligne = _ligne_depuis_mouvement(mouvement)
+        actuel = candidats.get(ligne["code_produit"])
+        if actuel is None or _cle_tri(ligne) >= _cle_tri(actuel):
+            candidats[ligne["code_produit"]] = ligne
+
+    if not candidats:
+        return
+
+    existants = {
+        r.name: r
+        for r in frappe.db.sql(
+            """SELECT name, date_dernier_taux, creation_source
+            FROM `tabGNR Item Rate` WHERE name IN %s FOR UPDATE""",
+            (tuple(candidats),),
+            as_dict=True,
+        )
+    }
+
+    _ecrire(
+        [
+            ligne
+            for code, ligne in candidats.items()
+            if code not in existants or _cle_tri(ligne) >= _cle_tri(existants[code])
+        ]
+    )
+
+
+def reconstruire_derniers_taux(item_codes=None):
+    """
+    Recalcule les derniers taux depuis les mouvements soumis
+
+    Args:
+        item_codes: articles à recalculer (None : toute la table)
+    """
+    condition = "AND code_produit IN %(codes)s" if item_codes else ""
+    derniers = frappe.db.sql(
+        f"""
+        SELECT name, code_produit, taux_gnr, date_mouvement, creation
+        FROM (
+            SELECT name, code_produit, taux_gnr, date_mouvement, creation,
+                ROW_NUMBER() OVER (
+                    PARTITION BY code_produit ORDER BY date_mouvement DESC, creation DESC
+                ) AS rang
+            FROM `tabMouvement GNR`
+            WHERE docstatus = 1
+            AND taux_gnr > %(taux_min)s
+            AND taux_gnr < %(taux_max)s
+            {condition}
+        ) historique
+        WHERE rang = 1
+        """,
+        {"codes": tuple(item_codes or ()), "taux_min": TAUX_MIN, "taux_max": TAUX_MAX},
+        as_dict=True,
+    )
+
+    if item_codes:
+        frappe.db.delete("GNR Item Rate", {"name": ["in", list(item_codes)]})
+    else:
+        frappe.db.delete("GNR Item Rate")
+
+    _ecrire([_ligne_depuis_mouvement(m) for m in derniers])
+
+
+def _ligne_depuis_mouvement(mouvement):
+    return {
+        "code_produit": mouvement.get("code_produit"),
+        "dernier_taux": flt(mouvement.get("taux_gnr"), 3),
+        "date_dernier_taux": getdate(mouvement.get("date_mouvement")),
+        "creation_source": get_datetime(mouvement.get("creation")),
+        "mouvement_source": mouvement.get("name"),
+    }
+
+
+def _cle_tri(ligne):
+    """Ordre des mouvements : date puis création (comme l'ancien ORDER BY)"""
+    creation = ligne["creation_source"]
+    return (
+        getdate(ligne["date_dernier_taux"]),
+        get_datetime(creation) if creation else datetime.min,
+    )
+
+
+def _ecrire(lignes):
+    """Insère ou remplace les lignes en une requête"""
+    if not lignes:
+        return
+
+    horodatage = now()
+    utilisateur = frappe.session.user
+    valeurs = []
+    for ligne in lignes:
+        valeurs.extend(
+            [
+                ligne["code_produit"], ligne["code_produit"], ligne["dernier_taux"],
+                ligne["date_dernier_taux"], ligne["creation_source"], ligne["mouvement_source"],
+                horodatage, horodatage, utilisateur, utilisateur,
+            ]
+        )
+
+    frappe.db.sql(
+        """
+        INSERT INTO `tabGNR Item Rate`
+            (name, code_produit, dernier_taux, date_dernier_taux, creation_source,
+            mouvement_source, creation, modified, owner, modified_by)
+        VALUES {}
+        ON DUPLICATE KEY UPDATE
+            dernier_taux = VALUES(dernier_taux),
+            date_dernier_taux = VALUES(date_dernier_taux),
+            creation_source = VALUES(creation_source),
+            mouvement_source = VALUES(mouvement_source),
+            modified = VALUES(modified),
+            modified_by = VALUES(modified_by)
+        """.format(", ".join(["(%s, %s, %s, %s, %s, %s, %s, %s, %s, %s)"] * len(lignes))),
+        valeurs,
+    )
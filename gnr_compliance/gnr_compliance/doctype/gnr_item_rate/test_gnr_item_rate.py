@@ -0,0 +1,55 @@
+# Copyright (c) 2025, Mohamed Kachtit and Contributors
+# See license.txt
+
+from datetime import date
+
+import frappe
+from frappe.tests.utils import FrappeTestCase
+
+from gnr_compliance.gnr_compliance.doctype.gnr_item_rate.gnr_item_rate import (
+	get_dernier_taux,
+	get_derniers_taux,
+	reconstruire_derniers_taux,
+)
+from gnr_compliance.gnr_compliance.doctype.mouvement_gnr.mouvement_gnr import inserer_mouvements_soumis
+
+ARTICLE_TEST = "TEST-GNR-RATE-ITEM"
+
+# (date, taux en €/L), soumis dans cet ordre
+TAUX_TEST = [
+	(date(2019, 1, 10), 3.86),
+	(date(2019, 3, 5), 2.84),
+	(date(2019, 2, 1), 24.81),
+]
+
+
+class TestGNRItemRate(FrappeTestCase):
+	def setUp(self):
+		self.addCleanup(frappe.db.rollback)
+
+	def test_dernier_taux_incremental_identique_au_recalcul(self):
+		mouvements = inserer_mouvements_soumis(
+			[
+				{
+					"type_mouvement": "Achat",
+					"date_mouvement": date_mouvement,
+					"code_produit": ARTICLE_TEST,
+					"quantite": 1000,
+					"prix_unitaire": 1.2,
+					"taux_gnr": taux,
+					"company": "_Test Company",
+				}
+				for date_mouvement, taux in TAUX_TEST
+			]
+		)
+		# Mouvement le plus récent par date, pas par ordre de soumission
+		self.assertEqual(get_derniers_taux([ARTICLE_TEST]), {ARTICLE_TEST: 2.84})
+
+		# Annulation du mouvement source : taux du mouvement précédent
+		frappe.get_doc("Mouvement GNR", mouvements[1].name).cancel()
+		self.assertEqual(get_derniers_taux([ARTICLE_TEST]), {ARTICLE_TEST: 24.81})
+
+		incremental = get_dernier_taux(ARTICLE_TEST)
+		self.assertEqual(incremental.mouvement_source, mouvements[2].name)
+		reconstruire_derniers_taux([ARTICLE_TEST])
+		self.assertEqual(get_dernier_taux(ARTICLE_TEST), incremental)
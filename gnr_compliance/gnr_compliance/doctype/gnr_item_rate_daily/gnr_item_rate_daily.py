@@ -0,0 +1,197 @@
+# Copyright (c) 2025, Mohamed Kachtit and contributors
+# For license information, please see license.txt
+
+import frappe
+from frappe.model.document import Document
+from frappe.utils import flt, getdate, now
+
+# Fourchette et tolérance des taux "cohérents" (historique dynamique)
+TAUX_COHERENT_MIN = 0.1
+TAUX_COHERENT_MAX = 100
+
+
+class GNRItemRateDaily(Document):
+    pass
+
+
+def on_doctype_update():
+    """Une ligne par article et par jour, lue par plage de dates"""
+    frappe.db.add_unique(
+        "GNR Item Rate Daily",
+        ["code_produit", "date_mouvement"],
+        constraint_name="unique_taux_article_jour",
+    )
+
+
+def taux_coherent(mouvement):
+    """
+    Taux exploitable pour l'historique : dans la fourchette réaliste et
+    montant de taxe égal à quantité × taux (écart < 5% ou < 0.10€)
+    """
+    taux = flt(mouvement.get("taux_gnr"))
+    if not TAUX_COHERENT_MIN < taux < TAUX_COHERENT_MAX:
+        return False
+    montant_attendu = flt(mouvement.get("quantite")) * taux
+    ecart = abs(montant_attendu - flt(mouvement.get("montant_taxe_gnr")))
+    return ecart < max(montant_attendu * 0.05, 0.10)
+
+
+def mettre_a_jour_statistiques_taux(mouvements, signe):
+    """
+    Ajoute (+1) ou retire (-1) les taux des mouvements des agrégats journaliers
+    """
+    deltas = {}
+    for mouvement in mouvements:
+        taux = flt(mouvement.get("taux_gnr"))
+        if taux <= 0:
+            continue
+
+        cle = (mouvement.get("code_produit"), getdate(mouvement.get("date_mouvement")))
+        delta = deltas.setdefault(
+            cle,
+            {"nb_taux": 0, "somme_taux": 0, "somme_carres": 0, "taux_min": taux,
+             "taux_max": taux, "nb_coherents": 0, "somme_coherents": 0},
+        )
+        delta["nb_taux"] += signe
+        delta["somme_taux"] += signe * taux
+        delta["somme_carres"] += signe * taux * taux
+        delta["taux_min"] = min(delta["taux_min"], taux)
+        delta["taux_max"] = max(delta["taux_max"], taux)
+        if taux_coherent(mouvement):
+            delta["nb_coherents"] += signe
+            delta["somme_coherents"] += signe * taux
+
+    if not deltas:
+        return
+
+    _ecrire_deltas(deltas)
+
+    if signe < 0:
+        # Un minimum ou maximum retiré ne se décrémente pas : relire ces jours
+        cles = list(deltas)
+        _recalculer_extremes(cles)
+        frappe.db.sql(
+            """DELETE FROM `tabGNR Item Rate Daily`
+            WHERE nb_taux <= 0 AND nb_coherents <= 0
+            AND (code_produit, date_mouvement) IN ({})""".format(", ".join(["(%s, %s)"] * len(cles))),
+            [valeur for cle in cles for valeur in cle],
+        )
+
+
+def _ecrire_deltas(deltas):
+    """Applique les écarts par article et par jour en une requête"""
+    horodatage = now()
+    utilisateur = frappe.session.user
+    valeurs = []
+    for (code_produit, date_mouvement), delta in deltas.items():
+        valeurs.extend(
+            [
+                frappe.generate_hash(length=10), code_produit, date_mouvement,
+                delta["nb_taux"], delta["somme_taux"], delta["somme_carres"],
+                delta["taux_min"], delta["taux_max"],
+                delta["nb_coherents"], delta["somme_coherents"],
+                horodatage, horodatage, utilisateur, utilisateur,
+            ]
+        )
+
+    frappe.db.sql(
+        """
+        INSERT INTO `tabGNR Item Rate Daily`
+            (name, code_produit, date_mouvement, nb_taux, somme_taux, somme_carres,
+            taux_min, taux_max, nb_coherents, somme_coherents,
+            creation, modified, owner, modified_by)
+        VALUES {}
+        ON DUPLICATE KEY UPDATE
+            nb_taux = nb_taux + VALUES(nb_taux),
+            somme_taux = somme_taux + VALUES(somme_taux),
+            somme_carres = somme_carres + VALUES(somme_carres),
+            taux_min = LEAST(COALESCE(taux_min, VALUES(taux_min)), VALUES(taux_min)),
+            taux_max = GREATEST(COALESCE(taux_max, VALUES(taux_max)), VALUES(taux_max)),
+            nb_coherents = nb_coherents + VALUES(nb_coherents),
+            somme_coherents = somme_coherents + VALUES(somme_coherents),
+            modified = VALUES(modified),
+            modified_by = VALUES(modified_by)
+        """.format(", ".join(["(%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)"] * len(deltas))),
+        valeurs,
+    )
+
+
+def _recalculer_extremes(cles):
+    """Relit le minimum et le maximum des jours touchés par une annulation"""
+    frappe.db.sql(
+        """
+        UPDATE `tabGNR Item Rate Daily` d
+        JOIN (
+            SELECT code_produit, date_mouvement,
+                MIN(taux_gnr) AS taux_min, MAX(taux_gnr) AS taux_max
+            FROM `tabMouvement GNR`
+            WHERE docstatus = 1
+            AND taux_gnr > 0
+            AND (code_produit, date_mouvement) IN ({})
+            GROUP BY code_produit, date_mouvement
+        ) m ON m.code_produit = d.code_produit AND m.date_mouvement = d.date_mouvement
+        SET d.taux_min = m.taux_min, d.taux_max = m.taux_max
+        """.format(", ".join(["(%s, %s)"] * len(cles))),
+        [valeur for cle in cles for valeur in cle],
+    )
+
+
+def get_taux_journaliers(item_code, date_debut, coherents=True):
+    """
+    Agrégats journaliers d'un article depuis une date, du plus récent au plus ancien
+
+    Returns:
+        list: date_mouvement, nb, somme (taux cohérents ou tous les taux)
+    """
+    nb, somme = ("nb_coherents", "somme_coherents") if coherents else ("nb_taux", "somme_taux")
+    return frappe.db.sql(
+        f"""
+        SELECT date_mouvement, {nb} AS nb, {somme} AS somme
+        FROM `tabGNR Item Rate Daily`
+        WHERE code_produit = %s
+        AND date_mouvement >= %s
+        AND {nb} > 0
+        ORDER BY date_mouvement DESC
+        """,
+        (item_code, date_debut),
+        as_dict=True,
+    )
+
+
+def reconstruire_statistiques_taux():
+    """Recalcule tous les agrégats journaliers depuis les mouvements soumis"""
+    frappe.db.delete("GNR Item Rate Daily")
+    frappe.db.sql(
+        """
+        INSERT INTO `tabGNR Item Rate Daily`
+            (name, code_produit, date_mouvement, nb_taux, somme_taux, somme_carres,
+            taux_min, taux_max, nb_coherents, somme_coherents,
+            creation, modified, owner, modified_by)
+        SELECT
+            SUBSTRING(SHA2(CONCAT(code_produit, '|', date_mouvement), 256), 1, 10),
+            code_produit,
+            date_mouvement,
+            COUNT(*),
+            SUM(taux_gnr),
+            SUM(taux_gnr * taux_gnr),
+            MIN(taux_gnr),
+            MAX(taux_gnr),
+            SUM(coherent),
+            SUM(coherent * taux_gnr),
+            NOW(), NOW(), 'Administrator', 'Administrator'
+        FROM (
+            SELECT code_produit, date_mouvement, taux_gnr,
+                CASE
+                    WHEN taux_gnr > %(taux_min)s AND taux_gnr < %(taux_max)s
+                    AND ABS(quantite * taux_gnr - COALESCE(montant_taxe_gnr, 0))
+                        < GREATEST(quantite * taux_gnr * 0.05, 0.10)
+                    THEN 1 ELSE 0
+                END AS coherent
+            FROM `tabMouvement GNR`
+            WHERE docstatus = 1
+            AND taux_gnr > 0
+        ) m
+        GROUP BY code_produit, date_mouvement
+        """,
+        {"taux_min": TAUX_COHERENT_MIN, "taux_max": TAUX_COHERENT_MAX},
+    )
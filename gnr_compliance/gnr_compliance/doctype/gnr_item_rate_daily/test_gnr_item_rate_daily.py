@@ -0,0 +1,73 @@
+# Copyright (c) 2025, Mohamed Kachtit and Contributors
+# See license.txt
+
+from datetime import date
+
+import frappe
+from frappe.tests.utils import FrappeTestCase
+from frappe.utils import flt
+
+from gnr_compliance.gnr_compliance.doctype.gnr_item_rate_daily.gnr_item_rate_daily import (
+	get_taux_journaliers,
+	reconstruire_statistiques_taux,
+)
+from gnr_compliance.gnr_compliance.doctype.mouvement_gnr.mouvement_gnr import inserer_mouvements_soumis
+
+ARTICLE_TEST = "TEST-GNR-RATE-DAILY-ITEM"
+CHAMPS_STATISTIQUES = (
+	"date_mouvement", "nb_taux", "somme_taux", "somme_carres", "taux_min", "taux_max",
+	"nb_coherents", "somme_coherents",
+)
+
+# (date, taux en €/L)
+TAUX_TEST = [
+	(date(2019, 5, 2), 3.86),
+	(date(2019, 5, 2), 2.84),
+	(date(2019, 5, 2), 24.81),
+	(date(2019, 5, 9), 3.86),
+]
+
+
+def lire_statistiques():
+	return [
+		{champ: flt(ligne[champ], 6) if champ != "date_mouvement" else ligne[champ] for champ in CHAMPS_STATISTIQUES}
+		for ligne in frappe.get_all(
+			"GNR Item Rate Daily",
+			filters={"code_produit": ARTICLE_TEST},
+			fields=list(CHAMPS_STATISTIQUES),
+			order_by="date_mouvement",
+		)
+	]
+
+
+class TestGNRItemRateDaily(FrappeTestCase):
+	def setUp(self):
+		self.addCleanup(frappe.db.rollback)
+
+	def test_statistiques_incrementales_identiques_au_recalcul(self):
+		mouvements = inserer_mouvements_soumis(
+			[
+				{
+					"type_mouvement": "Vente",
+					"date_mouvement": date_mouvement,
+					"code_produit": ARTICLE_TEST,
+					"quantite": 500,
+					"prix_unitaire": 1.2,
+					"taux_gnr": taux,
+					"company": "_Test Company",
+				}
+				for date_mouvement, taux in TAUX_TEST
+			]
+		)
+		# Minimum du jour annulé : extrêmes relus sur les mouvements restants
+		frappe.get_doc("Mouvement GNR", mouvements[1].name).cancel()
+
+		incrementales = lire_statistiques()
+		self.assertEqual([(ligne["taux_min"], ligne["taux_max"]) for ligne in incrementales], [(3.86, 24.81), (3.86, 3.86)])
+		self.assertEqual(
+			[ligne.date_mouvement for ligne in get_taux_journaliers(ARTICLE_TEST, date(2019, 1, 1))],
+			[date(2019, 5, 9), date(2019, 5, 2)],
+		)
+
+		reconstruire_statistiques_taux()
+		self.assertEqual(lire_statistiques(), incrementales)
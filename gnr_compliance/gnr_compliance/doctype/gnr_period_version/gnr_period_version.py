@@ -0,0 +1,72 @@
+# Copyright (c) 2025, Mohamed Kachtit and contributors
+# For license information, please see license.txt
+
+import frappe
+from frappe.model.document import Document
+from frappe.utils import getdate, now
+
+
+class GNRPeriodVersion(Document):
+    pass
+
+
+def on_doctype_update():
+    """Une version par société et par mois"""
+    frappe.db.add_unique(
+        "GNR Period Version", ["company", "periode"], constraint_name="unique_version_societe_mois"
+    )
+
+
+def cle_mois(date):
+    date = getdate(date)
+    return f"{date.year:04d}-{date.month:02d}"
+
+
+def incrementer_versions(dates):
+    """
+    Marque comme modifiés les mois des dates données, en une requête
+
+    Args:
+        dates: couples (société, date)
+    """
+    periodes = sorted({(company, cle_mois(date)) for company, date in dates if company and date})
+    if not periodes:
+        return
+
+    horodatage = now()
+    utilisateur = frappe.session.user
+    frappe.db.sql(
+        """
+        INSERT INTO `tabGNR Period Version`
+            (name, company, periode, version, creation, modified, owner, modified_by)
+        VALUES {}
+        ON DUPLICATE KEY UPDATE
+            version = version + 1,
+            modified = VALUES(modified),
+            modified_by = VALUES(modified_by)
+        """.format(", ".join(["(%s, %s, %s, 1, %s, %s, %s, %s)"] * len(periodes))),
+        [
+            valeur
+            for company, periode in periodes
+            for valeur in (
+                frappe.generate_hash(length=10), company, periode,
+                horodatage, horodatage, utilisateur, utilisateur,
+            )
+        ],
+    )
+
+
+def get_version_periode(date_debut, date_fin, company=None):
+    """
+    Version des données d'une période : somme des versions de ses mois,
+    qui augmente à chaque changement dans l'un d'eux
+
+    Args:
+        company: société (None : toutes)
+    """
+    condition = " AND company = %(company)s" if company else ""
+    return frappe.db.sql(
+        f"""SELECT COALESCE(SUM(version), 0) FROM `tabGNR Period Version`
+        WHERE periode BETWEEN %(debut)s AND %(fin)s{condition}""",
+        {"debut": cle_mois(date_debut), "fin": cle_mois(date_fin), "company": company},
+    )[0][0]
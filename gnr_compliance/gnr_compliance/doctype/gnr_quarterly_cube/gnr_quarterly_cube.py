@@ -0,0 +1,241 @@
+# Copyright (c) 2025, Mohamed Kachtit and contributors
+# For license information, please see license.txt
+
+import frappe
+from frappe.model.document import Document
+from frappe.utils import cint, cstr, flt, getdate, now
+
+from gnr_compliance.gnr_compliance.doctype.gnr_daily_ledger.gnr_daily_ledger import (
+    ecritures_mouvement,
+    get_societe_mouvement,
+)
+from gnr_compliance.gnr_compliance.doctype.gnr_stock_checkpoint.gnr_stock_checkpoint import get_stock_initial
+
+# Flux cumulés du trimestre (les stocks sont traités à part)
+COLONNES_FLUX = ("entrees", "sorties", "taxe_gnr", "nb_mouvements")
+
+
+class GNRQuarterlyCube(Document):
+    pass
+
+
+def on_doctype_update():
+    """Une ligne par société, trimestre et produit, lue par trimestre"""
+    frappe.db.add_unique(
+        "GNR Quarterly Cube",
+        ["company", "annee", "trimestre", "code_produit"],
+        constraint_name="unique_cube_societe_trimestre_produit",
+    )
+    frappe.db.add_index("GNR Quarterly Cube", ["annee", "trimestre"])
+
+
+def trimestre_de(date):
+    date = getdate(date)
+    return date.year, str((date.month - 1) // 3 + 1)
+
+
+def debut_trimestre(annee, trimestre):
+    return f"{annee}-{(cint(trimestre) - 1) * 3 + 1:02d}-01"
+
+
+def mettre_a_jour_cube(mouvements, signe):
+    """
+    Ajoute (+1) ou retire (-1) les mouvements du cube trimestriel
+
+    Le stock de fin du trimestre du mouvement et les stocks des trimestres
+    suivants du produit sont décalés de la variation nette.
+    """
+    deltas = {}
+    for mouvement in mouvements:
+        ecritures = ecritures_mouvement(mouvement)
+        cle = (
+            get_societe_mouvement(mouvement),
+            *trimestre_de(mouvement.get("date_mouvement")),
+            mouvement.get("code_produit"),
+        )
+        delta = deltas.setdefault(cle, dict.fromkeys(COLONNES_FLUX, 0))
+        delta["entrees"] += signe * ecritures["entrees"]
+        delta["sorties"] += signe * ecritures["sorties"]
+        delta["taxe_gnr"] += signe * ecritures["montant_taxe"]
+        delta["nb_mouvements"] += signe
+
+    if not deltas:
+        return
+
+    cles = list(deltas)
+    _ecrire_deltas(deltas, _stocks_debut_nouvelles_lignes(deltas))
+
+    horodatage = now()
+    for (company, annee, trimestre, code_produit), delta in deltas.items():
+        variation = delta["entrees"] - delta["sorties"]
+        if not variation:
+            continue
+        frappe.db.sql(
+            """
+            UPDATE `tabGNR Quarterly Cube`
+            SET stock_debut = stock_debut + %(variation)s,
+                stock_fin = stock_fin + %(variation)s,
+                modified = %(horodatage)s
+            WHERE company = %(company)s
+            AND code_produit = %(code_produit)s
+            AND (annee, trimestre) > (%(annee)s, %(trimestre)s)
+            """,
+            {
+                "variation": variation,
+                "horodatage": horodatage,
+                "company": company,
+                "code_produit": code_produit,
+                "annee": annee,
+                "trimestre": trimestre,
+            },
+        )
+
+    if signe < 0:
+        frappe.db.sql(
+            """DELETE FROM `tabGNR Quarterly Cube`
+            WHERE nb_mouvements <= 0
+            AND (company, annee, trimestre, code_produit) IN ({})""".format(
+                ", ".join(["(%s, %s, %s, %s)"] * len(cles))
+            ),
+            [valeur for cle in cles for valeur in cle],
+        )
+
+
+def _stocks_debut_nouvelles_lignes(deltas):
+    """
+    Stock de début des trimestres pas encore présents dans le cube
+
+    Le journal inclut déjà tout le lot : les variations du lot sur les
+    trimestres antérieurs en sont retirées, elles sont reportées ensuite
+    comme sur les lignes existantes.
+    """
+    cles = list(deltas)
+    existantes = {
+        (company, cint(annee), cstr(trimestre), code_produit)
+        for company, annee, trimestre, code_produit in frappe.db.sql(
+            """SELECT company, annee, trimestre, code_produit FROM `tabGNR Quarterly Cube`
+            WHERE (company, annee, trimestre, code_produit) IN ({})""".format(
+                ", ".join(["(%s, %s, %s, %s)"] * len(cles))
+            ),
+            [valeur for cle in cles for valeur in cle],
+        )
+    }
+    stocks_debut = {}
+    for cle in cles:
+        if cle in existantes:
+            continue
+        company, annee, trimestre, code_produit = cle
+        stocks_debut[cle] = get_stock_initial(debut_trimestre(annee, trimestre), company, code_produit) - sum(
+            delta["entrees"] - delta["sorties"]
+            for (autre_societe, autre_annee, autre_trimestre, autre_produit), delta in deltas.items()
+            if (autre_societe, autre_produit) == (company, code_produit)
+            and (autre_annee, autre_trimestre) < (annee, trimestre)
+        )
+    return stocks_debut
+
+
+def _ecrire_deltas(deltas, stocks_debut):
+    """Applique les flux par société, trimestre et produit en une requête"""
+    horodatage = now()
+    utilisateur = frappe.session.user
+    valeurs = []
+    for cle, delta in deltas.items():
+        company, annee, trimestre, code_produit = cle
+        stock_debut = flt(stocks_debut.get(cle))
+        valeurs.extend([frappe.generate_hash(length=10), company, annee, trimestre, code_produit])
+        valeurs.extend(delta[colonne] for colonne in COLONNES_FLUX)
+        valeurs.extend(
+            [
+                stock_debut, stock_debut + delta["entrees"] - delta["sorties"],
+                horodatage, horodatage, utilisateur, utilisateur,
+            ]
+        )
+
+    marqueurs = "({})".format(", ".join(["%s"] * (len(COLONNES_FLUX) + 11)))
+    frappe.db.sql(
+        """
+        INSERT INTO `tabGNR Quarterly Cube`
+            (name, company, annee, trimestre, code_produit, {colonnes},
+            stock_debut, stock_fin, creation, modified, owner, modified_by)
+        VALUES {valeurs}
+        ON DUPLICATE KEY UPDATE
+            stock_fin = stock_fin + VALUES(entrees) - VALUES(sorties),
+            {cumuls},
+            modified = VALUES(modified),
+            modified_by = VALUES(modified_by)
+        """.format(
+            colonnes=", ".join(COLONNES_FLUX),
+            valeurs=", ".join([marqueurs] * len(deltas)),
+            cumuls=",\n            ".join(f"{c} = {c} + VALUES({c})" for c in COLONNES_FLUX),
+        ),
+        valeurs,
+    )
+
+
+def get_cube(from_date, to_date, company=None, code_produit=None):
+    """
+    Lignes du cube des trimestres qui recoupent la période
+
+    Returns:
+        list: une ligne par trimestre et produit (toutes sociétés confondues
+        si company n'est pas donnée), du plus récent au plus ancien
+    """
+    debut_annee, debut_trimestre = trimestre_de(from_date)
+    fin_annee, fin_trimestre = trimestre_de(to_date)
+    filtres = {
+        "debut_annee": debut_annee, "debut_trimestre": debut_trimestre,
+        "fin_annee": fin_annee, "fin_trimestre": fin_trimestre,
+    }
+    conditions = ""
+    for champ, valeur in (("company", company), ("code_produit", code_produit)):
+        if valeur:
+            conditions += f" AND {champ} = %({champ})s"
+            filtres[champ] = valeur
+
+    return frappe.db.sql(
+        f"""
+        SELECT annee, trimestre, code_produit,
+            SUM(stock_debut) AS stock_debut, SUM(entrees) AS entrees, SUM(sorties) AS sorties,
+            SUM(stock_fin) AS stock_fin, SUM(taxe_gnr) AS taxe_gnr, SUM(nb_mouvements) AS nb_mouvements
+        FROM `tabGNR Quarterly Cube`
+        WHERE (annee, trimestre) >= (%(debut_annee)s, %(debut_trimestre)s)
+        AND (annee, trimestre) <= (%(fin_annee)s, %(fin_trimestre)s)
+        {conditions}
+        GROUP BY annee, trimestre, code_produit
+        ORDER BY annee DESC, trimestre DESC, code_produit
+        """,
+        filtres,
+        as_dict=True,
+    )
+
+
+def reconstruire_cube():
+    """Recalcule tout le cube depuis le journal quotidien"""
+    frappe.db.delete("GNR Quarterly Cube")
+    trimestres = frappe.db.sql(
+        """
+        SELECT company, YEAR(date_mouvement) AS annee, QUARTER(date_mouvement) AS trimestre,
+            code_produit, SUM(entrees) AS entrees, SUM(sorties) AS sorties,
+            SUM(montant_taxe) AS taxe_gnr, SUM(nb_mouvements) AS nb_mouvements
+        FROM `tabGNR Daily Ledger`
+        GROUP BY company, annee, trimestre, code_produit
+        ORDER BY company, code_produit, annee, trimestre
+        """,
+        as_dict=True,
+    )
+
+    # Le journal couvre tout l'historique : le stock part de zéro
+    stocks = {}
+    deltas = {}
+    stocks_debut = {}
+    for ligne in trimestres:
+        cle = (ligne.company, cint(ligne.annee), cstr(ligne.trimestre), ligne.code_produit)
+        serie = (ligne.company, ligne.code_produit)
+        stocks_debut[cle] = stocks.get(serie, 0)
+        deltas[cle] = {colonne: flt(ligne[colonne]) for colonne in COLONNES_FLUX}
+        stocks[serie] = stocks_debut[cle] + flt(ligne.entrees) - flt(ligne.sorties)
+
+    cles = list(deltas)
+    for debut in range(0, len(cles), 500):
+        lot = cles[debut:debut + 500]
+        _ecrire_deltas({cle: deltas[cle] for cle in lot}, stocks_debut)
@@ -0,0 +1,48 @@
+# Copyright (c) 2025, Mohamed Kachtit and Contributors
+# See license.txt
+
+from datetime import date
+
+import frappe
+from frappe.tests.utils import FrappeTestCase
+from frappe.utils import flt
+
+from gnr_compliance.gnr_compliance.doctype.gnr_daily_ledger.test_gnr_daily_ledger import (
+	ARTICLE_TEST,
+	SOCIETE_TEST,
+	creer_mouvements_test,
+)
+from gnr_compliance.gnr_compliance.doctype.gnr_quarterly_cube.gnr_quarterly_cube import (
+	get_cube,
+	reconstruire_cube,
+)
+
+COLONNES_CUBE = ("stock_debut", "entrees", "sorties", "stock_fin", "taxe_gnr", "nb_mouvements")
+
+
+def lire_cube():
+	return [
+		(ligne.annee, ligne.trimestre, *(flt(ligne[colonne], 3) for colonne in COLONNES_CUBE))
+		for ligne in get_cube(date(2019, 1, 1), date(2019, 12, 31), SOCIETE_TEST, ARTICLE_TEST)
+	]
+
+
+class TestGNRQuarterlyCube(FrappeTestCase):
+	def setUp(self):
+		self.addCleanup(frappe.db.rollback)
+
+	def test_cube_incremental_identique_au_recalcul(self):
+		mouvements = creer_mouvements_test()
+		# Un achat dans un trimestre déjà présent : le stock du trimestre suivant est décalé
+		creer_mouvements_test([(date(2019, 3, 20), "Achat", 1000)])
+		frappe.get_doc("Mouvement GNR", mouvements[4].name).cancel()
+
+		incremental = lire_cube()
+		# (année, trimestre, stock_debut, entrees, sorties, stock_fin)
+		self.assertEqual(
+			[ligne[:6] for ligne in incremental],
+			[(2019, "2", 6000, 0, 300, 5700), (2019, "1", 0, 8000, 2000, 6000)],
+		)
+
+		reconstruire_cube()
+		self.assertEqual(lire_cube(), incremental)
@@ -0,0 +1,14 @@
+# Copyright (c) 2025, Mohamed Kachtit and contributors
+# For license information, please see license.txt
+
+import frappe
+from frappe.model.document import Document
+
+
+class GNRSettings(Document):
+    pass
+
+
+def capture_differee():
+    """Indique si la capture GNR des factures passe par la file d'attente"""
+    return frappe.db.get_single_value("GNR Settings", "mode_capture") == "Différé"
@@ -0,0 +1,254 @@
+# Copyright (c) 2025, Mohamed Kachtit and contributors
+# For license information, please see license.txt
+
+import frappe
+from frappe.model.document import Document
+from frappe.utils import add_days, add_months, flt, get_last_day, getdate, now, today
+
+from gnr_compliance.gnr_compliance.doctype.gnr_daily_ledger.gnr_daily_ledger import (
+    ecritures_mouvement,
+    get_societe_mouvement,
+)
+
+MOIS_PAR_PERIODE = {"Mensuel": 1, "Trimestriel": 3}
+
+
+class GNRStockCheckpoint(Document):
+    pass
+
+
+def on_doctype_update():
+    """Un solde par société, produit et date de clôture"""
+    frappe.db.add_unique(
+        "GNR Stock Checkpoint",
+        ["company", "code_produit", "date_cloture"],
+        constraint_name="unique_cloture_societe_produit_date",
+    )
+    frappe.db.add_index("GNR Stock Checkpoint", ["date_cloture"])
+
+
+def get_frequence_cloture():
+    return frappe.db.get_single_value("GNR Settings", "frequence_cloture_stock") or "Mensuel"
+
+
+def fins_de_periode(date_debut, date_fin, frequence=None):
+    """Dates de fin de période comprises entre deux dates (incluses)"""
+    pas = MOIS_PAR_PERIODE[frequence or get_frequence_cloture()]
+    date_debut, date_fin = getdate(date_debut), getdate(date_fin)
+
+    # Premier mois de fin de période (mois multiple du pas) à partir de date_debut
+    fin = get_last_day(add_months(date_debut.replace(day=1), -date_debut.month % pas))
+
+    fins = []
+    while fin <= date_fin:
+        fins.append(fin)
+        fin = get_last_day(add_months(fin, pas))
+    return fins
+
+
+def get_derniere_cloture(avant=None):
+    """Date de la dernière clôture enregistrée (strictement avant une date)"""
+    condition = "WHERE date_cloture < %s" if avant else ""
+    resultat = frappe.db.sql(
+        f"SELECT MAX(date_cloture) FROM `tabGNR Stock Checkpoint` {condition}",
+        (avant,) if avant else (),
+    )
+    return resultat[0][0] if resultat else None
+
+
+def cloturer_periodes_stock():
+    """
+    Enregistre les soldes des périodes terminées depuis la dernière clôture
+    (tâche planifiée quotidienne)
+    """
+    frequence = get_frequence_cloture()
+    precedente = get_derniere_cloture()
+    if precedente:
+        debut = add_days(precedente, 1)
+    else:
+        debut = frappe.db.sql("SELECT MIN(date_mouvement) FROM `tabGNR Daily Ledger`")[0][0]
+        if not debut:
+            return
+
+    for fin in fins_de_periode(debut, add_days(today(), -1), frequence):
+        _ecrire_cloture(fin, precedente)
+        precedente = fin
+
+
+def _ecrire_cloture(date_cloture, precedente):
+    """Solde de clôture = solde précédent + flux du journal sur la période"""
+    soldes = {}
+    if precedente:
+        for company, code_produit, solde in frappe.db.sql(
+            """SELECT company, code_produit, solde FROM `tabGNR Stock Checkpoint`
+            WHERE date_cloture = %s""",
+            (precedente,),
+        ):
+            soldes[(company, code_produit)] = flt(solde)
+
+    condition = "AND date_mouvement > %(precedente)s" if precedente else ""
+    for company, code_produit, flux in frappe.db.sql(
+        f"""
+        SELECT company, code_produit, SUM(entrees - sorties)
+        FROM `tabGNR Daily Ledger`
+        WHERE date_mouvement <= %(date_cloture)s
+        {condition}
+        GROUP BY company, code_produit
+        """,
+        {"date_cloture": date_cloture, "precedente": precedente},
+    ):
+        soldes[(company, code_produit)] = soldes.get((company, code_produit), 0) + flt(flux)
+
+    if not soldes:
+        return
+
+    horodatage = now()
+    utilisateur = frappe.session.user
+    valeurs = []
+    for (company, code_produit), solde in soldes.items():
+        valeurs.extend(
+            [
+                frappe.generate_hash(length=10), company, code_produit, date_cloture, solde,
+                horodatage, horodatage, utilisateur, utilisateur,
+            ]
+        )
+
+    frappe.db.sql(
+        """
+        INSERT INTO `tabGNR Stock Checkpoint`
+            (name, company, code_produit, date_cloture, solde,
+            creation, modified, owner, modified_by)
+        VALUES {}
+        ON DUPLICATE KEY UPDATE
+            solde = VALUES(solde),
+            modified = VALUES(modified),
+            modified_by = VALUES(modified_by)
+        """.format(", ".join(["(%s, %s, %s, %s, %s, %s, %s, %s, %s)"] * len(soldes))),
+        valeurs,
+    )
+
+
+def ajuster_clotures(mouvements, signe):
+    """
+    Répercute sur les clôtures suivantes un mouvement daté avant la
+    dernière clôture (saisie antidatée, annulation, correction)
+    """
+    derniere = get_derniere_cloture()
+    if not derniere:
+        return
+
+    deltas = {}
+    for mouvement in mouvements:
+        date_mouvement = getdate(mouvement.get("date_mouvement"))
+        if date_mouvement > derniere:
+            continue
+        ecritures = ecritures_mouvement(mouvement)
+        cle = (get_societe_mouvement(mouvement), mouvement.get("code_produit"), date_mouvement)
+        deltas[cle] = deltas.get(cle, 0) + signe * (ecritures["entrees"] - ecritures["sorties"])
+
+    horodatage = now()
+    for (company, code_produit, date_mouvement), delta in deltas.items():
+        if not delta:
+            continue
+        # Toutes les clôtures à partir de la date, y compris celles où le
+        # produit n'avait pas encore de solde
+        frappe.db.sql(
+            """
+            INSERT INTO `tabGNR Stock Checkpoint`
+                (name, company, code_produit, date_cloture, solde,
+                creation, modified, owner, modified_by)
+            SELECT
+                SUBSTRING(SHA2(CONCAT(%(company)s, '|', %(code_produit)s, '|', date_cloture), 256), 1, 10),
+                %(company)s, %(code_produit)s, date_cloture, %(delta)s,
+                %(horodatage)s, %(horodatage)s, %(utilisateur)s, %(utilisateur)s
+            FROM (
+                SELECT DISTINCT date_cloture FROM `tabGNR Stock Checkpoint`
+                WHERE date_cloture >= %(date_mouvement)s
+            ) clotures
+            ON DUPLICATE KEY UPDATE
+                solde = solde + VALUES(solde),
+                modified = VALUES(modified),
+                modified_by = VALUES(modified_by)
+            """,
+            {
+                "company": company,
+                "code_produit": code_produit,
+                "date_mouvement": date_mouvement,
+                "delta": delta,
+                "horodatage": horodatage,
+                "utilisateur": frappe.session.user,
+            },
+        )
+
+
+def get_stock_initial(from_date, company=None, code_produit=None):
+    """
+    Stock au début d'une date : dernier solde de clôture antérieur puis
+    flux du journal entre cette clôture et la date
+
+    Returns:
+        float: stock en litres
+    """
+    filtres = {"company": company, "code_produit": code_produit, "from_date": from_date}
+    conditions = "".join(
+        f" AND {champ} = %({champ})s" for champ in ("company", "code_produit") if filtres[champ]
+    )
+
+    cloture = get_derniere_cloture(avant=from_date)
+    stock = 0
+    if cloture:
+        filtres["cloture"] = cloture
+        stock = flt(
+            frappe.db.sql(
+                f"""SELECT SUM(solde) FROM `tabGNR Stock Checkpoint`
+                WHERE date_cloture = %(cloture)s{conditions}""",
+                filtres,
+            )[0][0]
+        )
+
+    condition_cloture = " AND date_mouvement > %(cloture)s" if cloture else ""
+    flux = frappe.db.sql(
+        f"""SELECT SUM(entrees - sorties) FROM `tabGNR Daily Ledger`
+        WHERE date_mouvement < %(from_date)s{condition_cloture}{conditions}""",
+        filtres,
+    )[0][0]
+    return stock + flt(flux)
+
+
+def get_stocks_initiaux(from_date, company=None):
+    """
+    Stock au début d'une date pour chaque produit (même calcul que get_stock_initial)
+
+    Returns:
+        dict: {code_produit: stock en litres}
+    """
+    filtres = {"company": company, "from_date": from_date}
+    condition_societe = " AND company = %(company)s" if company else ""
+
+    stocks = {}
+    cloture = get_derniere_cloture(avant=from_date)
+    if cloture:
+        filtres["cloture"] = cloture
+        for code_produit, solde in frappe.db.sql(
+            f"""SELECT code_produit, SUM(solde) FROM `tabGNR Stock Checkpoint`
+            WHERE date_cloture = %(cloture)s{condition_societe}
+            GROUP BY code_produit""",
+            filtres,
+        ):
+            stocks[code_produit] = flt(solde)
+
+    condition_cloture = " AND date_mouvement > %(cloture)s" if cloture else ""
+    for code_produit, flux in frappe.db.sql(
+        f"""SELECT code_produit, SUM(entrees - sorties) FROM `tabGNR Daily Ledger`
+        WHERE date_mouvement < %(from_date)s{condition_cloture}{condition_societe}
+        GROUP BY code_produit""",
+        filtres,
+    ):
+        stocks[code_produit] = stocks.get(code_produit, 0) + flt(flux)
+    return stocks
+
+
+def reconstruire_clotures():
+    """Recalcule toutes les clôtures depuis le journal quotidien"""
+    frappe.db.delete("GNR Stock Checkpoint")
+    cloturer_periodes_stock()
@@ -0,0 +1,67 @@
+# Copyright (c) 2025, Mohamed Kachtit and Contributors
+# See license.txt
+
+from datetime import date
+
+import frappe
+from frappe.tests.utils import FrappeTestCase
+
+from gnr_compliance.gnr_compliance.doctype.gnr_daily_ledger.test_gnr_daily_ledger import (
+	ARTICLE_TEST,
+	MOUVEMENTS_TEST,
+	SOCIETE_TEST,
+	creer_mouvements_test,
+)
+from gnr_compliance.gnr_compliance.doctype.gnr_stock_checkpoint.gnr_stock_checkpoint import (
+	get_stock_initial,
+	reconstruire_clotures,
+)
+
+DEBUT_PERIODE = date(2019, 3, 1)
+
+
+def stock_attendu(mouvements, avant):
+	"""Stock recalculé depuis tous les mouvements antérieurs"""
+	return sum(
+		quantite if type_mouvement == "Achat" else -quantite
+		for date_mouvement, type_mouvement, quantite in mouvements
+		if date_mouvement < avant
+	)
+
+
+def lire_clotures():
+	return frappe.get_all(
+		"GNR Stock Checkpoint",
+		filters={"company": SOCIETE_TEST, "code_produit": ARTICLE_TEST},
+		fields=["date_cloture", "solde"],
+		order_by="date_cloture",
+	)
+
+
+class TestGNRStockCheckpoint(FrappeTestCase):
+	def setUp(self):
+		self.addCleanup(frappe.db.rollback)
+		frappe.db.delete("GNR Stock Checkpoint")
+		creer_mouvements_test()
+
+	def test_stock_initial_identique_avec_et_sans_clotures(self):
+		sans_clotures = get_stock_initial(DEBUT_PERIODE, SOCIETE_TEST, ARTICLE_TEST)
+		reconstruire_clotures()
+
+		self.assertTrue(lire_clotures())
+		self.assertEqual(sans_clotures, stock_attendu(MOUVEMENTS_TEST, DEBUT_PERIODE))
+		self.assertEqual(get_stock_initial(DEBUT_PERIODE, SOCIETE_TEST, ARTICLE_TEST), sans_clotures)
+
+	def test_mouvement_antidate_ajuste_les_clotures(self):
+		reconstruire_clotures()
+		antidate = [(date(2019, 1, 25), "Vente", 400)]
+		creer_mouvements_test(antidate)
+
+		ajustees = lire_clotures()
+		reconstruire_clotures()
+
+		self.assertEqual(ajustees, lire_clotures())
+		self.assertEqual(
+			get_stock_initial(DEBUT_PERIODE, SOCIETE_TEST, ARTICLE_TEST),
+			stock_attendu(MOUVEMENTS_TEST + antidate, DEBUT_PERIODE),
+		)
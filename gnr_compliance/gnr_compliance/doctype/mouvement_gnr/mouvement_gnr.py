@@ -3,13 +3,59 @@
 
 import frappe
 from frappe.model.document import Document
-from frappe.utils import flt, getdate
+from frappe.model.naming import parse_naming_series
+from frappe.utils import cint, flt, getdate, now
+from gnr_compliance.utils.attestation_resolver import get_attestation_stamp
+from gnr_compliance.gnr_compliance.doctype.gnr_daily_ledger.gnr_daily_ledger import get_societe_mouvement
+from gnr_compliance.utils.gnr_aggregates import propager_mouvements
+from gnr_compliance.utils.gnr_item_registry import get_gnr_item
+from gnr_compliance.gnr_compliance.doctype.gnr_item_rate.gnr_item_rate import get_derniers_taux
+
+# Une ligne de document source ne produit qu'un seul mouvement actif :
+# l'unicité est garantie par la base, pas par une lecture préalable
+CONTRAINTE_CAPTURE = "unique_capture_ligne"
+CHAMPS_CAPTURE = ["reference_document", "reference_name", "code_produit", "reference_detail"]
+
+# Index composites des requêtes fréquentes (hooks, déclarations, exports).
+# Les lectures par période filtrent toujours une société : elle mène l'index.
+# Le filtre reference_document + reference_name + code_produit est servi par
+# le préfixe de la contrainte d'unicité CONTRAINTE_CAPTURE, et les lectures
+# par client (retamponnage, extrêmes) par idx_mgnr_client_date_type.
+INDEX_MOUVEMENT = {
+    "idx_mgnr_societe_statut_date": ["company", "docstatus", "date_mouvement"],
+    "idx_mgnr_client_date_type": ["client", "date_mouvement", "type_mouvement"],
+    "idx_mgnr_societe_produit_date": ["company", "code_produit", "date_mouvement"],
+    # Requêtes sans société : taux par article (GNR Item Rate, taux journaliers)
+    # et contrôles transverses sur les mouvements soumis récents
+    "idx_mgnr_produit_date": ["code_produit", "date_mouvement"],
+    "idx_mgnr_statut_date": ["docstatus", "date_mouvement"],
+    # Couvrant pour la liste semestrielle des clients : aucune lecture de ligne
+    "idx_mgnr_societe_ventes_clients": [
+        "company", "type_mouvement", "docstatus", "date_mouvement", "client",
+        "quantite", "prix_unitaire", "montant_taxe_gnr", "taux_gnr",
+    ],
+    # Ventilation avec / sans attestation sans jointure sur tabCustomer
+    "idx_mgnr_societe_attestation_date": ["company", "avec_attestation", "date_mouvement"],
+}
+
+# Index remplacés par leur version menée par la société
+INDEX_MOUVEMENT_OBSOLETES = (
+    "idx_mgnr_ventes_clients",
+    "idx_mgnr_attestation_date",
+)
+
+SERIE_MOUVEMENT = "MGNR-.YYYY.-"
+TYPES_MOUVEMENT = ("Vente", "Achat", "Stock", "Transfert")
+CHAMPS_OBLIGATOIRES = ("type_mouvement", "date_mouvement", "code_produit")
+TAUX_GNR_STANDARD = 24.81
 
 class MouvementGNR(Document):
     def validate(self):
         """Validation avec calculs automatiques"""
         self.calculer_taux_et_montants()
         self.calculer_periodes()
+        self.tamponner_attestation()
+        self.company = get_societe_mouvement(self)
     
     def calculer_taux_et_montants(self):
         """Calcule automatiquement le taux GNR et le montant de taxe"""
@@ -31,14 +77,7 @@ class MouvementGNR(Document):
             return 0
         
         try:
-            # Récupérer depuis l'article
-            taux_article = frappe.get_value("Item", self.code_produit, "gnr_tax_rate")
-            
-            if taux_article and taux_article > 0:
-                return taux_article
-            
-            # Si pas de taux sur l'article, utiliser le taux GNR standard
-            return 24.81
+            return taux_par_defaut(self.code_produit)
             
         except Exception as e:
             frappe.log_error(f"Erreur récupération taux pour article {self.code_produit}: {str(e)}")
@@ -53,9 +92,19 @@ class MouvementGNR(Document):
             self.trimestre = str((date_obj.month - 1) // 3 + 1)
             self.semestre = "1" if date_obj.month <= 6 else "2"
     
-    def before_save(self):
-        """Actions avant sauvegarde"""
-        self.calculer_taux_et_montants()
+    def tamponner_attestation(self):
+        """Relève l'attestation du client à l'écriture du mouvement"""
+        self.update(get_attestation_stamp(self.client, self.date_mouvement))
+    
+    def on_submit(self):
+        """Mise à jour des tables agrégées"""
+        propager_mouvements([self], 1)
+    
+    def on_cancel(self):
+        """Libère la ligne source pour permettre une nouvelle capture"""
+        if self.reference_detail:
+            self.db_set("reference_detail", None, update_modified=False)
+        propager_mouvements([self], -1)
     
     @frappe.whitelist()
     def recalculer_taux_et_montants(self):
@@ -66,4 +115,219 @@ class MouvementGNR(Document):
             "taux_gnr": self.taux_gnr,
             "montant_taxe_gnr": self.montant_taxe_gnr,
             "message": "Calculs mis à jour"
-        }
\ No newline at end of file
+        }
+
+
+def on_doctype_update():
+    """Contrainte d'unicité composite sur la ligne source du mouvement"""
+    frappe.db.add_unique("Mouvement GNR", CHAMPS_CAPTURE, constraint_name=CONTRAINTE_CAPTURE)
+    creer_index_mouvement()
+
+
+def creer_index_mouvement():
+    """Crée les index composites manquants (sans effet s'ils existent déjà)"""
+    for nom_index, champs in INDEX_MOUVEMENT.items():
+        frappe.db.add_index("Mouvement GNR", champs, index_name=nom_index)
+
+
+def supprimer_index_obsoletes():
+    """Supprime les index remplacés par leur version menée par la société"""
+    for nom_index in INDEX_MOUVEMENT_OBSOLETES:
+        if frappe.db.sql("SHOW INDEX FROM `tabMouvement GNR` WHERE Key_name = %s", nom_index):
+            frappe.db.sql_ddl(f"ALTER TABLE `tabMouvement GNR` DROP INDEX `{nom_index}`")
+
+
+def get_lignes_capturees(reference_document, reference_name, verrouiller=False):
+    """
+    Récupère en une requête les lignes d'un document déjà capturées
+
+    Args:
+        reference_document: DocType source (Sales Invoice, Purchase Invoice, Stock Entry)
+        reference_name: Nom du document source
+        verrouiller: lecture verrouillante (voit les captures validées par
+            une transaction concurrente depuis le début de la nôtre)
+
+    Returns:
+        tuple: (noms des lignes capturées, codes produit capturés sans référence
+        de ligne - mouvements antérieurs à l'ajout de reference_detail)
+    """
+    mouvements = frappe.get_all(
+        "Mouvement GNR",
+        filters={
+            "reference_document": reference_document,
+            "reference_name": reference_name,
+            "docstatus": ["<", 2],
+        },
+        fields=["code_produit", "reference_detail"],
+        for_update=verrouiller,
+    )
+
+    lignes = {m.reference_detail for m in mouvements if m.reference_detail}
+    codes_sans_ligne = {m.code_produit for m in mouvements if not m.reference_detail}
+    return lignes, codes_sans_ligne
+
+
+def inserer_mouvements_soumis(mouvements):
+    """
+    Écrit en masse des mouvements GNR générés par le système
+
+    Les lignes sont validées en mémoire (mêmes calculs que validate) puis
+    persistées en une seule requête multi-lignes, directement soumises
+    (docstatus=1), sans passer par insert() + submit() document par document.
+    La série de nommage est réservée une seule fois pour tout le lot.
+
+    Args:
+        mouvements: liste de dicts de champs Mouvement GNR
+
+    Returns:
+        list: lignes insérées (frappe._dict avec leur name)
+
+    Raises:
+        frappe.UniqueValidationError: une ligne source est déjà capturée ;
+        aucune ligne du lot n'est alors écrite
+    """
+    if not mouvements:
+        return []
+
+    lignes = [preparer_mouvement(mouvement) for mouvement in mouvements]
+
+    horodatage = now()
+    utilisateur = frappe.session.user
+    for ligne, nom in zip(lignes, reserver_noms_mouvements(len(lignes)), strict=True):
+        ligne.update(
+            {
+                "name": nom,
+                "creation": horodatage,
+                "modified": horodatage,
+                "owner": utilisateur,
+                "modified_by": utilisateur,
+                "docstatus": 1,
+                "idx": 0,
+            }
+        )
+
+    colonnes_valides = set(frappe.get_meta("Mouvement GNR").get_valid_columns())
+    champs = sorted({champ for ligne in lignes for champ in ligne} & colonnes_valides)
+
+    try:
+        frappe.db.bulk_insert(
+            "Mouvement GNR",
+            fields=champs,
+            values=[tuple(ligne.get(champ) for champ in champs) for ligne in lignes],
+        )
+    except Exception as e:
+        if frappe.db.is_unique_key_violation(e):
+            raise frappe.UniqueValidationError(
+                f"Ligne source déjà capturée: {lignes[0].reference_document} {lignes[0].reference_name}"
+            ) from e
+        raise
+
+    propager_mouvements(lignes, 1)
+    return lignes
+
+
+def inserer_mouvements_document(reference_document, reference_name, mouvements):
+    """
+    Écrit les mouvements des lignes non capturées d'un document source
+
+    Si une capture concurrente du même document a été validée entre la
+    lecture des lignes capturées et l'écriture, la base rejette le lot :
+    il est annulé jusqu'au point de sauvegarde, les lignes capturées sont
+    relues et seules les autres sont écrites. Un second rejet est propagé.
+
+    Returns:
+        list: lignes insérées
+    """
+    frappe.db.savepoint("gnr_mouvements_document")
+    try:
+        return inserer_mouvements_soumis(mouvements)
+    except frappe.UniqueValidationError:
+        frappe.db.rollback(save_point="gnr_mouvements_document")
+
+    lignes_capturees, codes_sans_ligne = get_lignes_capturees(reference_document, reference_name, verrouiller=True)
+    restants = [
+        mouvement
+        for mouvement in mouvements
+        if mouvement.get("reference_detail") not in lignes_capturees
+        and mouvement.get("code_produit") not in codes_sans_ligne
+    ]
+    frappe.logger().info(
+        f"[GNR] {reference_name} capturé en parallèle, {len(restants)} ligne(s) sur {len(mouvements)} restante(s)"
+    )
+    return inserer_mouvements_soumis(restants)
+
+
+def preparer_mouvement(mouvement):
+    """
+    Valide un mouvement en mémoire et complète les champs calculés
+
+    Reprend les règles de MouvementGNR.validate : taux par défaut depuis le
+    registre des articles, montant de taxe arrondi, périodes, attestation
+    du client et société.
+    """
+    ligne = frappe._dict(mouvement)
+
+    manquants = [champ for champ in CHAMPS_OBLIGATOIRES if not ligne.get(champ)]
+    if manquants:
+        frappe.throw(f"Mouvement GNR incomplet, champs manquants: {', '.join(manquants)}")
+    if ligne.type_mouvement not in TYPES_MOUVEMENT:
+        frappe.throw(f"Type de mouvement GNR invalide: {ligne.type_mouvement}")
+
+    ligne.naming_series = ligne.naming_series or SERIE_MOUVEMENT
+    ligne.quantite = flt(ligne.quantite)
+
+    if not flt(ligne.taux_gnr):
+        ligne.taux_gnr = taux_par_defaut(ligne.code_produit)
+
+    if ligne.quantite and ligne.taux_gnr:
+        ligne.montant_taxe_gnr = flt(ligne.quantite * ligne.taux_gnr, 2)
+
+    date_obj = getdate(ligne.date_mouvement)
+    ligne.date_mouvement = date_obj
+    ligne.annee = date_obj.year
+    ligne.trimestre = str((date_obj.month - 1) // 3 + 1)
+    ligne.semestre = "1" if date_obj.month <= 6 else "2"
+    ligne.update(get_attestation_stamp(ligne.client, ligne.date_mouvement))
+    ligne.company = get_societe_mouvement(ligne)
+
+    return ligne
+
+
+def taux_par_defaut(code_produit):
+    """
+    Taux d'un mouvement saisi sans taux : taux de l'article, sinon dernier
+    taux connu de l'article, sinon taux GNR standard
+    """
+    article = get_gnr_item(code_produit)
+    taux_article = flt(article.gnr_tax_rate) if article else 0
+    if taux_article > 0:
+        return taux_article
+
+    dernier_taux = flt(get_derniers_taux([code_produit]).get(code_produit))
+    if dernier_taux > 0:
+        return dernier_taux
+
+    return TAUX_GNR_STANDARD
+
+
+def reserver_noms_mouvements(nombre):
+    """
+    Réserve d'un coup `nombre` noms consécutifs dans la série MGNR-.YYYY.-
+
+    Une seule écriture atomique dans tabSeries pour tout le lot (création du
+    compteur ou incrément), au lieu d'un appel au compteur par document :
+    deux premières captures de l'année ne peuvent pas créer le compteur en
+    même temps. La valeur relue est celle de notre écriture, la ligne
+    restant verrouillée jusqu'à la fin de la transaction.
+    """
+    prefixe = parse_naming_series(SERIE_MOUVEMENT)
+
+    frappe.db.sql(
+        """INSERT INTO `tabSeries` (`name`, `current`) VALUES (%s, %s)
+        ON DUPLICATE KEY UPDATE `current` = COALESCE(`current`, 0) + %s""",
+        (prefixe, nombre, nombre),
+    )
+    fin = cint(frappe.db.sql("SELECT `current` FROM `tabSeries` WHERE `name` = %s", prefixe)[0][0])
+    debut = fin - nombre
+
+    return [f"{prefixe}{numero:05d}" for numero in range(debut + 1, debut + nombre + 1)]
@@ -1,8 +1,389 @@
 # Copyright (c) 2025, Mohamed Kachtit and Contributors
 # See license.txt
 
-# import frappe
+import json
+from datetime import date, timedelta
+from unittest.mock import Mock, patch
+
+import frappe
+from frappe.model.naming import parse_naming_series
 from frappe.tests.utils import FrappeTestCase
+from frappe.utils import now
+
+from gnr_compliance.gnr_compliance.doctype.gnr_capture_outbox.gnr_capture_outbox import CAPTURE_EN_ECHEC
+from gnr_compliance.gnr_compliance.doctype.mouvement_gnr.mouvement_gnr import (
+	SERIE_MOUVEMENT,
+	creer_index_mouvement,
+	get_lignes_capturees,
+	inserer_mouvements_document,
+	inserer_mouvements_soumis,
+	reserver_noms_mouvements,
+)
+from gnr_compliance.integrations import sales
+from gnr_compliance.integrations.stock import capture_mouvement_stock
+from gnr_compliance.utils.attestation_resolver import (
+	get_attestation_stamp,
+	get_customer_category,
+	invalidate_customer_attestation,
+	tamponner_mouvements,
+)
+from gnr_compliance.utils.export_formats_exacts import export_donnees_brutes_excel
+from gnr_compliance.utils.gnr_item_registry import (
+	REGISTRY_VERSION_KEY,
+	get_gnr_item,
+	invalidate_gnr_item_registry,
+	is_gnr_item,
+)
+from gnr_compliance.utils.query_plans import requetes_en_parcours_complet
+from gnr_compliance.utils.tax_resolution import TAUX_STANDARD, get_tax_resolution_context
+
+PREFIXE_TEST = "TEST-MGNR-PLAN-"
+SOCIETES_TEST = ("_Test Company", "_Test Company 1")
+NB_MOUVEMENTS = 5000
+
 
 class TestMouvementGNR(FrappeTestCase):
-	pass
+	@classmethod
+	def setUpClass(cls):
+		super().setUpClass()
+		creer_index_mouvement()
+
+		debut = date(2020, 1, 1)
+		horodatage = now()
+		types = ("Vente", "Vente", "Achat", "Stock")
+		lignes = []
+		for i in range(NB_MOUVEMENTS):
+			lignes.append((
+				f"{PREFIXE_TEST}{i:05d}", horodatage, horodatage, "Administrator", "Administrator", 1,
+				types[i % len(types)], debut + timedelta(days=i % 1800), f"TEST-GNR-ITEM-{i % 20}",
+				100 + i % 7, 1.2, 24.81, round((100 + i % 7) * 24.81, 2), f"TEST-GNR-CLIENT-{i % 200}",
+				"Sales Invoice", f"TEST-SINV-{i // 3}", f"TEST-SINV-ITEM-{i}",
+				SOCIETES_TEST[(i // 3) % len(SOCIETES_TEST)],
+			))
+
+		frappe.db.bulk_insert(
+			"Mouvement GNR",
+			fields=[
+				"name", "creation", "modified", "owner", "modified_by", "docstatus",
+				"type_mouvement", "date_mouvement", "code_produit",
+				"quantite", "prix_unitaire", "taux_gnr", "montant_taxe_gnr", "client",
+				"reference_document", "reference_name", "reference_detail", "company",
+			],
+			values=lignes,
+		)
+		# ANALYZE valide implicitement la transaction : nettoyage explicite en fin de classe
+		frappe.db.commit()
+		frappe.db.sql("ANALYZE TABLE `tabMouvement GNR`")
+
+	@classmethod
+	def tearDownClass(cls):
+		frappe.db.delete("Mouvement GNR", {"name": ["like", f"{PREFIXE_TEST}%"]})
+		frappe.db.commit()
+		super().tearDownClass()
+
+	def test_requetes_connues_sans_parcours_complet(self):
+		parametres = {
+			"reference_document": "Sales Invoice",
+			"reference_name": "TEST-SINV-42",
+			"client": "TEST-GNR-CLIENT-7",
+			"code_produit": "TEST-GNR-ITEM-3",
+			"from_date": date(2023, 1, 1),
+			"to_date": date(2023, 6, 30),
+			"company": SOCIETES_TEST[0],
+		}
+		self.assertEqual(requetes_en_parcours_complet(parametres), [])
+
+	def test_export_donnees_brutes_non_vide(self):
+		resultat = export_donnees_brutes_excel(date(2023, 1, 1), date(2023, 6, 30), SOCIETES_TEST[0])
+		self.assertTrue(resultat["success"], resultat.get("message"))
+
+		fichier = frappe.get_doc("File", {"file_url": resultat["file_url"]})
+		self.addCleanup(fichier.delete)
+		self.assertTrue(fichier.get_content())
+
+
+class TestAttestationMouvement(FrappeTestCase):
+	client = "_Test Customer"
+	date_depot = date(2024, 6, 1)
+
+	def setUp(self):
+		frappe.db.set_value(
+			"Customer",
+			self.client,
+			{"custom_n_dossier_": "TEST-DOSSIER-GNR", "custom_date_de_depot": self.date_depot},
+		)
+		self.addCleanup(frappe.db.rollback)
+		invalidate_customer_attestation(frappe.get_doc("Customer", self.client), "on_trash")
+
+	def test_vente_avant_depot_sans_attestation(self):
+		veille = self.date_depot - timedelta(days=1)
+		self.assertEqual(get_attestation_stamp(self.client, veille).avec_attestation, 0)
+		self.assertEqual(get_attestation_stamp(self.client, self.date_depot).avec_attestation, 1)
+
+	def test_categorie_memorisee_par_date_et_oubliee_a_la_sauvegarde(self):
+		veille = self.date_depot - timedelta(days=1)
+		self.assertEqual(get_customer_category(self.client, veille), "Autre")
+		self.assertEqual(get_customer_category(self.client, self.date_depot), "Agricole")
+
+		client = frappe.get_doc("Customer", self.client)
+		client.custom_n_dossier_ = None
+		client.save()
+
+		self.assertEqual(get_customer_category(self.client, self.date_depot), "Autre")
+
+	def test_tamponnage_en_masse_suit_la_date_de_depot(self):
+		horodatage = now()
+		dates = {f"{PREFIXE_TEST}ATT-0": self.date_depot - timedelta(days=1), f"{PREFIXE_TEST}ATT-1": self.date_depot}
+		frappe.db.bulk_insert(
+			"Mouvement GNR",
+			fields=[
+				"name", "creation", "modified", "owner", "modified_by", "docstatus",
+				"type_mouvement", "date_mouvement", "code_produit", "quantite", "client", "company",
+			],
+			values=[
+				(nom, horodatage, horodatage, "Administrator", "Administrator", 1,
+				"Vente", date_mouvement, "TEST-GNR-ITEM-0", 100, self.client, SOCIETES_TEST[0])
+				for nom, date_mouvement in dates.items()
+			],
+		)
+
+		tamponner_mouvements([self.client])
+
+		etats = dict(frappe.get_all(
+			"Mouvement GNR",
+			filters={"name": ["in", list(dates)]},
+			fields=["name", "avec_attestation"],
+			as_list=True,
+		))
+		self.assertEqual(etats, {f"{PREFIXE_TEST}ATT-0": 0, f"{PREFIXE_TEST}ATT-1": 1})
+
+
+class TestInsertionMasse(FrappeTestCase):
+	champs_calcules = (
+		"docstatus", "taux_gnr", "montant_taxe_gnr", "annee", "trimestre", "semestre",
+		"avec_attestation", "reference_attestation", "company",
+	)
+
+	def setUp(self):
+		self.addCleanup(frappe.db.rollback)
+
+	def mouvement(self, reference_detail, **valeurs):
+		return {
+			"type_mouvement": "Vente",
+			"date_mouvement": date(2024, 5, 14),
+			"code_produit": "_Test Item",
+			"quantite": 1234.5,
+			"prix_unitaire": 1.1,
+			"taux_gnr": 3.86,
+			"client": "_Test Customer",
+			"company": SOCIETES_TEST[0],
+			"reference_document": "Sales Invoice",
+			"reference_name": "TEST-SINV-MASSE",
+			"reference_detail": reference_detail,
+			**valeurs,
+		}
+
+	def test_memes_valeurs_que_insert_submit(self):
+		for valeurs in ({}, {"taux_gnr": 0}, {"type_mouvement": "Achat", "client": None}):
+			doc = frappe.get_doc(
+				{"doctype": "Mouvement GNR", "naming_series": "MGNR-.YYYY.-", **self.mouvement("DOC", **valeurs)}
+			)
+			doc.insert()
+			doc.submit()
+
+			(ligne,) = inserer_mouvements_soumis([self.mouvement("MASSE", **valeurs)])
+			enregistre = frappe.db.get_value("Mouvement GNR", ligne.name, self.champs_calcules, as_dict=True)
+
+			self.assertEqual(
+				{champ: enregistre[champ] for champ in self.champs_calcules},
+				{champ: doc.get(champ) for champ in self.champs_calcules},
+			)
+			frappe.db.delete("Mouvement GNR", {"name": ["in", [doc.name, ligne.name]]})
+
+	def test_lignes_capturees_du_document(self):
+		lignes = inserer_mouvements_soumis(
+			[
+				self.mouvement("LIGNE-1"),
+				self.mouvement("LIGNE-2"),
+				# Mouvement antérieur à reference_detail : reconnu par son produit
+				self.mouvement(None, code_produit="TEST-GNR-ANCIEN"),
+			]
+		)
+		frappe.db.set_value("Mouvement GNR", lignes[1].name, "docstatus", 2)
+
+		self.assertEqual(
+			get_lignes_capturees("Sales Invoice", "TEST-SINV-MASSE"), ({"LIGNE-1"}, {"TEST-GNR-ANCIEN"})
+		)
+		self.assertEqual(get_lignes_capturees("Sales Invoice", "TEST-SINV-AUTRE"), (set(), set()))
+
+	def test_ligne_deja_capturee_rejette_tout_le_lot(self):
+		inserer_mouvements_soumis([self.mouvement("LIGNE-1")])
+
+		with self.assertRaises(frappe.UniqueValidationError):
+			inserer_mouvements_soumis([self.mouvement("LIGNE-2"), self.mouvement("LIGNE-1")])
+
+		self.assertFalse(
+			frappe.db.exists("Mouvement GNR", {"reference_name": "TEST-SINV-MASSE", "reference_detail": "LIGNE-2"})
+		)
+
+	def test_capture_concurrente_ecrit_les_lignes_restantes(self):
+		# Ligne écrite par une autre capture après notre lecture des lignes capturées
+		inserer_mouvements_soumis([self.mouvement("LIGNE-1")])
+
+		crees = inserer_mouvements_document(
+			"Sales Invoice", "TEST-SINV-MASSE", [self.mouvement("LIGNE-1"), self.mouvement("LIGNE-2")]
+		)
+
+		self.assertEqual([ligne.reference_detail for ligne in crees], ["LIGNE-2"])
+		self.assertEqual(
+			frappe.db.count("Mouvement GNR", {"reference_name": "TEST-SINV-MASSE", "reference_detail": "LIGNE-1"}), 1
+		)
+
+	def test_echec_de_capture_annule_les_mouvements_ecrits(self):
+		facture = frappe._dict(name="TEST-SINV-MASSE", items=[frappe._dict(item_code="_Test Item")], db_set=Mock())
+
+		def capture_interrompue(doc):
+			inserer_mouvements_soumis([self.mouvement("LIGNE-1")])
+			raise frappe.ValidationError("Capture interrompue après l'écriture")
+
+		with (
+			patch.object(sales, "check_if_gnr_item_for_sales", return_value=True),
+			patch.object(sales, "capture_differee", return_value=False),
+			patch.object(sales, "capturer_vente", capture_interrompue),
+		):
+			sales.capture_vente_gnr(facture, "on_submit")
+
+		self.assertFalse(frappe.db.exists("Mouvement GNR", {"reference_name": "TEST-SINV-MASSE"}))
+		facture.db_set.assert_called_once_with("gnr_capture_status", CAPTURE_EN_ECHEC, update_modified=False)
+
+	def test_reservation_cree_puis_incremente_le_compteur(self):
+		prefixe = parse_naming_series(SERIE_MOUVEMENT)
+		# Première capture de l'année : pas encore de compteur
+		frappe.db.delete("Series", {"name": prefixe})
+
+		self.assertEqual(reserver_noms_mouvements(2), [f"{prefixe}00001", f"{prefixe}00002"])
+		self.assertEqual(reserver_noms_mouvements(1), [f"{prefixe}00003"])
+
+		doc = frappe.get_doc({"doctype": "Mouvement GNR", "naming_series": SERIE_MOUVEMENT, **self.mouvement("SERIE")})
+		doc.insert()
+		self.assertEqual(doc.name, f"{prefixe}00004")
+
+
+class TestRegistreArticlesGNR(FrappeTestCase):
+	article = "_Test Item"
+
+	def setUp(self):
+		self.addCleanup(frappe.db.rollback)
+		self.addCleanup(invalidate_gnr_item_registry)
+		frappe.db.set_value("Item", self.article, {"is_gnr_tracked": 0, "gnr_tax_rate": 0})
+		# Mise à jour SQL hors sauvegarde : invalidation explicite
+		invalidate_gnr_item_registry()
+
+	def test_sauvegarde_article_invalide_le_registre(self):
+		self.assertFalse(is_gnr_item(self.article))
+		version = frappe.cache().get_value(REGISTRY_VERSION_KEY)
+
+		article = frappe.get_doc("Item", self.article)
+		article.is_gnr_tracked = 1
+		article.gnr_tax_rate = 3.86
+		article.save()
+
+		# Lecture directe dans la transaction qui a modifié l'article
+		self.assertTrue(is_gnr_item(self.article))
+		self.assertEqual(get_gnr_item(self.article).gnr_tax_rate, 3.86)
+		# Les autres processus ne voient la nouvelle version qu'après commit
+		self.assertEqual(frappe.cache().get_value(REGISTRY_VERSION_KEY), version)
+
+	def test_sauvegarde_sans_champ_du_registre_ne_l_invalide_pas(self):
+		self.assertFalse(is_gnr_item(self.article))
+		frappe.local.gnr_item_registry_modifie = False
+
+		article = frappe.get_doc("Item", self.article)
+		article.description = "Article de test GNR"
+		article.save()
+
+		self.assertFalse(frappe.local.gnr_item_registry_modifie)
+		self.assertIsNotNone(frappe.local.gnr_item_registry)
+
+
+class TestResolutionTaux(FrappeTestCase):
+	def facture(self, terms=None):
+		return frappe._dict(
+			name="TEST-SINV-TAUX",
+			customer=None,
+			posting_date=date(2024, 5, 14),
+			terms=terms,
+			flags=frappe._dict(),
+			items=[
+				frappe._dict(item_code="TEST-GNR-A", qty=1000, uom="L"),
+				frappe._dict(item_code="TEST-GNR-A", qty=500, uom="L"),
+				frappe._dict(item_code="TEST-GNR-B", qty=200, uom="L"),
+			],
+			taxes=[
+				frappe._dict(
+					description="Accise GNR",
+					tax_amount=5790,
+					item_wise_tax_detail=json.dumps({"TEST-GNR-A": [3.86, 5790]}),
+				)
+			],
+		)
+
+	def test_contexte_construit_une_fois_par_facture(self):
+		facture = self.facture()
+		self.assertIs(get_tax_resolution_context(facture), get_tax_resolution_context(facture))
+
+	def test_taux_par_ligne_selon_les_priorites(self):
+		facture = self.facture(terms="Accise : 2,84 €/L")
+		contexte = get_tax_resolution_context(facture)
+
+		# Montant de l'article réparti sur toutes ses lignes
+		for item in facture.items[:2]:
+			taux, source = contexte.resoudre(item)
+			self.assertAlmostEqual(taux, 3.86)
+			self.assertEqual(source, "taxes facture (détail par article)")
+		self.assertEqual(contexte.resoudre(facture.items[2]), (2.84, "termes facture"))
+
+		# Ni taxe, ni terme, ni historique : taux de l'attestation client
+		sans_termes = self.facture()
+		self.assertEqual(
+			get_tax_resolution_context(sans_termes).resoudre(sans_termes.items[2]),
+			(TAUX_STANDARD, "attestation client"),
+		)
+
+
+class TestCaptureStock(FrappeTestCase):
+	article = "_Test Item"
+
+	def setUp(self):
+		self.addCleanup(frappe.db.rollback)
+		self.addCleanup(invalidate_gnr_item_registry)
+		frappe.db.set_value("Item", self.article, {"is_gnr_tracked": 1, "gnr_tax_rate": 3.86})
+		invalidate_gnr_item_registry()
+
+	def test_lignes_gnr_capturees_une_seule_fois(self):
+		entree_stock = frappe._dict(
+			name="TEST-STE-GNR",
+			stock_entry_type="Material Transfer",
+			posting_date=date(2024, 5, 14),
+			company=SOCIETES_TEST[0],
+			items=[
+				frappe._dict(name="STE-LIGNE-1", item_code=self.article, qty=2, uom="hL", basic_rate=250, s_warehouse="Stores - _TC"),
+				frappe._dict(name="STE-LIGNE-2", item_code=self.article, qty=500, uom="L", basic_rate=1.2, t_warehouse="Stores - _TC"),
+				frappe._dict(name="STE-LIGNE-3", item_code="TEST-NON-GNR", qty=1, uom="L", t_warehouse="Stores - _TC"),
+			],
+		)
+
+		# Seconde soumission (retraitement) : lignes déjà capturées ignorées
+		for _passage in range(2):
+			capture_mouvement_stock(entree_stock, "on_submit")
+
+		mouvements = frappe.get_all(
+			"Mouvement GNR",
+			filters={"reference_document": "Stock Entry", "reference_name": entree_stock.name},
+			fields=["reference_detail", "type_mouvement", "quantite", "prix_unitaire", "taux_gnr", "docstatus"],
+			order_by="reference_detail",
+		)
+		self.assertEqual(
+			[(m.reference_detail, m.type_mouvement, m.quantite, m.prix_unitaire, m.taux_gnr, m.docstatus) for m in mouvements],
+			[("STE-LIGNE-1", "Vente", 200, 2.5, 3.86, 1), ("STE-LIGNE-2", "Achat", 500, 1.2, 3.86, 1)],
+		)
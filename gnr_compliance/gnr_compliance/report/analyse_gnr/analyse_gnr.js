@@ -0,0 +1,34 @@
+// Copyright (c) 2025, Mohamed Kachtit and contributors
+// For license information, please see license.txt
+
+frappe.query_reports["Analyse GNR"] = {
+	filters: [
+		{
+			fieldname: "company",
+			label: __("Société"),
+			fieldtype: "Link",
+			options: "Company",
+			default: frappe.defaults.get_user_default("Company"),
+		},
+		{
+			fieldname: "from_date",
+			label: __("Date Début"),
+			fieldtype: "Date",
+			default: frappe.datetime.year_start(),
+			reqd: 1,
+		},
+		{
+			fieldname: "to_date",
+			label: __("Date Fin"),
+			fieldtype: "Date",
+			default: frappe.datetime.year_end(),
+			reqd: 1,
+		},
+		{
+			fieldname: "code_produit",
+			label: __("Code Produit"),
+			fieldtype: "Link",
+			options: "Item",
+		},
+	],
+};
@@ -0,0 +1,120 @@
+# gnr_compliance/gnr_compliance/report/analyse_gnr/analyse_gnr.py
+"""
+Analyse GNR par trimestre et par produit
+
+Lue dans le cube trimestriel (GNR Quarterly Cube) tenu à jour à chaque
+mouvement : l'année en cours se lit en quelques lignes. Les plages de
+plusieurs années restent compatibles avec le mode « Prepared Report ».
+"""
+import frappe
+from frappe import _
+from frappe.utils import flt, getdate, nowdate
+
+from gnr_compliance.gnr_compliance.doctype.gnr_quarterly_cube.gnr_quarterly_cube import get_cube
+
+def execute(filters=None):
+    filters = frappe._dict(filters or {})
+    columns = get_columns()
+    data = get_data(filters)
+    chart = get_chart_data(data)
+    summary = get_summary(data)
+    
+    return columns, data, None, chart, summary
+
+def get_columns():
+    return [
+        {
+            "label": _("Trimestre"),
+            "fieldname": "trimestre",
+            "fieldtype": "Data",
+            "width": 100
+        },
+        {
+            "label": _("Code Produit"),
+            "fieldname": "code_produit",
+            "fieldtype": "Link",
+            "options": "Item",
+            "width": 120
+        },
+        {
+            "label": _("Stock Début"),
+            "fieldname": "stock_debut",
+            "fieldtype": "Float",
+            "width": 100
+        },
+        {
+            "label": _("Entrées"),
+            "fieldname": "entrees",
+            "fieldtype": "Float",
+            "width": 100
+        },
+        {
+            "label": _("Sorties"),
+            "fieldname": "sorties",
+            "fieldtype": "Float",
+            "width": 100
+        },
+        {
+            "label": _("Stock Fin"),
+            "fieldname": "stock_fin",
+            "fieldtype": "Float",
+            "width": 100
+        },
+        {
+            "label": _("Taxe GNR (€)"),
+            "fieldname": "taxe_gnr",
+            "fieldtype": "Currency",
+            "width": 120
+        }
+    ]
+
+def get_data(filters):
+    annee = getdate(nowdate()).year
+    from_date = filters.get("from_date") or f"{annee}-01-01"
+    to_date = filters.get("to_date") or f"{annee}-12-31"
+
+    return [
+        {
+            "trimestre": f"T{ligne.trimestre}-{ligne.annee}",
+            "code_produit": ligne.code_produit,
+            "stock_debut": flt(ligne.stock_debut),
+            "entrees": flt(ligne.entrees),
+            "sorties": flt(ligne.sorties),
+            "stock_fin": flt(ligne.stock_fin),
+            "taxe_gnr": flt(ligne.taxe_gnr),
+        }
+        for ligne in get_cube(from_date, to_date, filters.get("company"), filters.get("code_produit"))
+    ]
+
+def get_chart_data(data):
+    """Entrées et sorties par trimestre, tous produits confondus"""
+    if not data:
+        return None
+
+    trimestres = {}
+    for ligne in reversed(data):
+        totaux = trimestres.setdefault(ligne["trimestre"], {"entrees": 0, "sorties": 0})
+        totaux["entrees"] += ligne["entrees"]
+        totaux["sorties"] += ligne["sorties"]
+
+    return {
+        "data": {
+            "labels": list(trimestres),
+            "datasets": [
+                {"name": _("Entrées"), "values": [t["entrees"] for t in trimestres.values()]},
+                {"name": _("Sorties"), "values": [t["sorties"] for t in trimestres.values()]},
+            ],
+        },
+        "type": "bar",
+    }
+
+def get_summary(data):
+    total_entrees = sum(ligne["entrees"] for ligne in data)
+    total_sorties = sum(ligne["sorties"] for ligne in data)
+    total_taxe = sum(ligne["taxe_gnr"] for ligne in data)
+
+    return [
+        {"label": _("Total Entrées (L)"), "value": total_entrees, "datatype": "Float", "indicator": "Green"},
+        {"label": _("Total Sorties (L)"), "value": total_sorties, "datatype": "Float", "indicator": "Red"},
+        {"label": _("Taxe GNR"), "value": total_taxe, "datatype": "Currency", "indicator": "Blue"},
+    ]
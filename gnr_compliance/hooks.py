@@ -26,9 +26,36 @@ doc_events = {
     "Stock Entry": {
         "on_submit": "gnr_compliance.integrations.stock.capture_mouvement_stock",
         "before_cancel": "gnr_compliance.integrations.stock.cancel_mouvement_stock"
+    },
+    "Item": {
+        "on_update": "gnr_compliance.utils.gnr_item_registry.invalidate_gnr_item_registry",
+        "on_trash": "gnr_compliance.utils.gnr_item_registry.invalidate_gnr_item_registry",
+        "after_rename": "gnr_compliance.utils.gnr_item_registry.invalidate_gnr_item_registry"
+    },
+    "Customer": {
+        "on_update": [
+            "gnr_compliance.utils.attestation_resolver.invalidate_customer_attestation",
+            "gnr_compliance.utils.gnr_aggregates.propager_attestation_client"
+        ],
+        "on_trash": "gnr_compliance.utils.attestation_resolver.invalidate_customer_attestation",
+        "after_rename": "gnr_compliance.utils.attestation_resolver.invalidate_customer_attestation"
     }
 }
 
+# === Tâches planifiées ===
+scheduler_events = {
+    "cron": {
+        # Reprise de la file de capture différée (retries et jobs perdus)
+        "*/5 * * * *": [
+            "gnr_compliance.gnr_compliance.doctype.gnr_capture_outbox.gnr_capture_outbox.traiter_file_capture"
+        ]
+    },
+    # Soldes de clôture des périodes de stock terminées
+    "daily": [
+        "gnr_compliance.gnr_compliance.doctype.gnr_stock_checkpoint.gnr_stock_checkpoint.cloturer_periodes_stock"
+    ]
+}
+
 # === Scripts personnalisés par DocType ===
 doctype_js = {
     "Sales Invoice": "public/js/sales_invoice_gnr_minimal.js",  # VERSION MINIMALE SANS BOUCLE
@@ -92,6 +119,32 @@ custom_fields = {
             "insert_after": "gnr_auto_assigned"
         }
     ],
+    "Sales Invoice": [
+        {
+            "fieldname": "gnr_capture_status",
+            "label": "Statut Capture GNR",
+            "fieldtype": "Select",
+            "options": "\nGNR en attente\nGNR capturé\nGNR en échec",
+            "read_only": 1,
+            "allow_on_submit": 1,
+            "no_copy": 1,
+            "in_standard_filter": 1,
+            "insert_after": "posting_time"
+        }
+    ],
+    "Purchase Invoice": [
+        {
+            "fieldname": "gnr_capture_status",
+            "label": "Statut Capture GNR",
+            "fieldtype": "Select",
+            "options": "\nGNR en attente\nGNR capturé\nGNR en échec",
+            "read_only": 1,
+            "allow_on_submit": 1,
+            "no_copy": 1,
+            "in_standard_filter": 1,
+            "insert_after": "posting_time"
+        }
+    ],
     "Stock Entry": [
         {
             "fieldname": "gnr_processing_section",
@@ -135,7 +188,9 @@ fixtures = [
                 "Item-gnr_last_updated",
                 "Stock Entry-gnr_processing_section",
                 "Stock Entry-gnr_items_detected",
-                "Stock Entry-gnr_categories_processed"
+                "Stock Entry-gnr_categories_processed",
+                "Sales Invoice-gnr_capture_status",
+                "Purchase Invoice-gnr_capture_status"
             ]]
         ]
     }
@@ -3,45 +3,36 @@ import frappe
 from frappe import _
 from frappe.utils import getdate, flt
 from gnr_compliance.utils.unit_conversions import convert_to_litres, get_item_unit
-from gnr_compliance.utils.date_utils import get_quarter_from_date, get_semestre_from_date
-import re
-
-def determine_customer_category_from_attestation(customer_code):
+from gnr_compliance.utils.gnr_item_registry import is_gnr_item
+from gnr_compliance.utils.attestation_resolver import get_customer_category
+from gnr_compliance.utils.tax_resolution import get_tax_resolution_context
+from gnr_compliance.utils.gnr_aggregates import propager_correction
+from gnr_compliance.gnr_compliance.doctype.gnr_item_rate.gnr_item_rate import get_derniers_taux
+from gnr_compliance.gnr_compliance.doctype.mouvement_gnr.mouvement_gnr import (
+    get_lignes_capturees,
+    inserer_mouvements_document,
+)
+from gnr_compliance.gnr_compliance.doctype.gnr_capture_outbox.gnr_capture_outbox import (
+    CAPTURE_EFFECTUEE,
+    CAPTURE_EN_ECHEC,
+    mettre_en_file,
+)
+from gnr_compliance.gnr_compliance.doctype.gnr_settings.gnr_settings import capture_differee
+
+def determine_customer_category_from_attestation(customer_code, posting_date=None):
     """
     Détermine la catégorie du client basée sur son attestation d'accise
     
     Args:
         customer_code: Code du client
+        posting_date: Date de l'opération (attestation en vigueur à cette date)
         
     Returns:
         str: "Agricole" si attestation complète, "Autre" sinon
     """
     try:
-        # Récupérer les champs d'attestation du client
-        customer_data = frappe.db.get_value(
-            "Customer", 
-            customer_code, 
-            ["custom_n_dossier_", "custom_date_de_depot"], 
-            as_dict=True
-        )
-        
-        if customer_data:
-            # Vérifier si l'attestation est complète (numéro ET date)
-            has_complete_attestation = (
-                customer_data.get('custom_n_dossier_') and 
-                str(customer_data.get('custom_n_dossier_', '')).strip() != '' and
-                customer_data.get('custom_date_de_depot')
-            )
-            
-            if has_complete_attestation:
-                frappe.logger().info(f"[GNR] Client {customer_code} avec attestation complète → Catégorie Agricole (3.86€/hL)")
-                return "Agricole"
-            else:
-                frappe.logger().info(f"[GNR] Client {customer_code} sans attestation complète → Catégorie Autre (24.81€/hL)")
-                return "Autre"
-        else:
-            frappe.logger().warning(f"[GNR] Client {customer_code} non trouvé → Catégorie Autre par défaut")
-            return "Autre"
+        # Résolution mémoïsée : pas de lecture de tabCustomer par ligne
+        return get_customer_category(customer_code, posting_date)
             
     except Exception as e:
         frappe.log_error(f"Erreur détermination catégorie client {customer_code}: {str(e)}")
@@ -68,22 +59,8 @@ def get_tax_rate_from_customer_category(customer_category):
 def get_historical_rate_for_item(item_code):
     """Récupère le taux historique le plus récent pour un article"""
     try:
-        result = frappe.db.sql(
-            """
-            SELECT taux_gnr 
-            FROM `tabMouvement GNR` 
-            WHERE code_produit = %s 
-            AND taux_gnr IS NOT NULL 
-            AND taux_gnr > 0.1
-            AND taux_gnr < 50
-            AND docstatus = 1
-            ORDER BY date_mouvement DESC, creation DESC
-            LIMIT 1
-        """,
-            (item_code,),
-        )
-
-        return result[0][0] if result else None
+        # Table des derniers taux maintenue à la soumission des mouvements
+        return get_derniers_taux([item_code]).get(item_code)
     except:
         return None
 
@@ -92,6 +69,9 @@ def get_real_gnr_tax_from_invoice(item, invoice_doc):
     """
     RÉCUPÈRE LE VRAI TAUX GNR DEPUIS UNE FACTURE
 
+    Le contexte de résolution (taxes, termes, historique) est construit une
+    seule fois par facture puis réutilisé pour chaque ligne.
+
     Args:
         item: Ligne d'article de la facture
         invoice_doc: Document facture (Sales Invoice ou Purchase Invoice)
@@ -100,97 +80,11 @@ def get_real_gnr_tax_from_invoice(item, invoice_doc):
         float: Taux GNR réel en €/L
     """
     try:
-        # 1. PRIORITÉ 1: Chercher dans les taxes de la facture
-        if hasattr(invoice_doc, "taxes") and invoice_doc.taxes:
-            for tax_row in invoice_doc.taxes:
-                if tax_row.description:
-                    description_lower = tax_row.description.lower()
-                    # Mots-clés pour identifier les taxes GNR
-                    gnr_keywords = [
-                        "gnr",
-                        "accise",
-                        "ticpe",
-                        "gazole",
-                        "fioul",
-                        "carburant",
-                        "tipp",
-                        "diesel",
-                    ]
-
-                    if any(keyword in description_lower for keyword in gnr_keywords):
-                        if item.qty > 0 and tax_row.tax_amount:
-                            # Convertir la quantité en litres si nécessaire
-                            item_unit = item.uom or get_item_unit(item.item_code)
-                            quantity_in_litres = convert_to_litres(item.qty, item_unit)
-
-                            if quantity_in_litres > 0:
-                                taux_calcule = (
-                                    abs(tax_row.tax_amount) / quantity_in_litres
-                                )
-                                # Vérification de cohérence (taux entre 0.1 et 50 €/L)
-                                if 0.1 <= taux_calcule <= 50:
-                                    frappe.logger().info(
-                                        f"[GNR] Taux RÉEL trouvé dans taxes facture {invoice_doc.name}: {taux_calcule}€/L (taxe: {tax_row.tax_amount}€ / {quantity_in_litres}L)"
-                                    )
-                                    return taux_calcule
-
-        # 2. PRIORITÉ 2: Chercher dans un champ personnalisé de l'item
-        if hasattr(item, "gnr_tax_rate") and item.gnr_tax_rate:
-            if 0.1 <= item.gnr_tax_rate <= 50:
-                frappe.logger().info(
-                    f"[GNR] Taux trouvé dans champ item facture: {item.gnr_tax_rate}€/L"
-                )
-                return item.gnr_tax_rate
-
-        # 3. PRIORITÉ 3: Chercher dans les termes/commentaires de la facture
-        if hasattr(invoice_doc, "terms") and invoice_doc.terms:
-            # Patterns pour chercher "3.86€/L", "taxe 2.84", etc.
-            patterns = [
-                r"(\d+[.,]\d+)\s*[€]\s*[/]\s*[Ll]",  # "3.86€/L"
-                r"taxe[:\s]+(\d+[.,]\d+)",  # "taxe: 3.86"
-                r"tipp[:\s]+(\d+[.,]\d+)",  # "tipp: 3.86"
-                r"accise[:\s]+(\d+[.,]\d+)",  # "accise: 3.86"
-                r"gnr[:\s]+(\d+[.,]\d+)",  # "gnr: 3.86"
-            ]
-
-            for pattern in patterns:
-                matches = re.findall(pattern, invoice_doc.terms, re.IGNORECASE)
-                if matches:
-                    for match in matches:
-                        taux_potentiel = float(match.replace(",", "."))
-                        if 0.1 <= taux_potentiel <= 50:
-                            frappe.logger().info(
-                                f"[GNR] Taux trouvé dans termes facture: {taux_potentiel}€/L"
-                            )
-                            return taux_potentiel
-
-        # 4. PRIORITÉ 4: Chercher dans l'historique des mouvements de cet article
-        historical_rate = get_historical_rate_for_item(item.item_code)
-        if historical_rate and 0.1 <= historical_rate <= 50:
-            frappe.logger().info(f"[GNR] Taux historique utilisé: {historical_rate}€/L")
-            return historical_rate
-
-        # 5. PRIORITÉ 5: Utiliser le taux défini sur l'article maître
-        item_rate = frappe.get_value("Item", item.item_code, "gnr_tax_rate")
-        if item_rate and 0.1 <= item_rate <= 50:
-            frappe.logger().info(f"[GNR] Taux article maître utilisé: {item_rate}€/L")
-            return item_rate
-
-        # 6. DERNIER RECOURS: Utiliser le taux basé sur l'attestation du client
-        try:
-            customer_category = determine_customer_category_from_attestation(invoice_doc.customer)
-            fallback_rate = get_tax_rate_from_customer_category(customer_category)
-            frappe.logger().warning(
-                f"[GNR] Aucun taux réel trouvé pour {item.item_code}, utilisation taux basé sur attestation client: {fallback_rate}€/L (catégorie: {customer_category})"
-            )
-            return fallback_rate
-        except:
-            # Si même la récupération de l'attestation échoue, taux standard par défaut
-            default_rate = 24.81
-            frappe.logger().warning(
-                f"[GNR] Aucun taux trouvé pour {item.item_code}, utilisation taux standard par défaut: {default_rate}€/L"
-            )
-            return default_rate
+        taux, source = get_tax_resolution_context(invoice_doc).resoudre(item)
+        frappe.logger().info(
+            f"[GNR] Taux {taux}€/L pour {item.item_code} (source: {source}, facture {invoice_doc.name})"
+        )
+        return taux
 
     except Exception as e:
         frappe.log_error(
@@ -201,11 +95,10 @@ def get_real_gnr_tax_from_invoice(item, invoice_doc):
 def check_if_gnr_item_for_sales(item_code):
     """
     Vérifie si un article est GNR basé UNIQUEMENT sur le marquage manuel
+    (lecture du registre des articles GNR, sans requête)
     """
     try:
-        # Vérifier uniquement le champ is_gnr_tracked
-        is_tracked = frappe.get_value("Item", item_code, "is_gnr_tracked")
-        return bool(is_tracked)
+        return is_gnr_item(item_code)
 
     except Exception as e:
         frappe.logger().error(
@@ -217,114 +110,23 @@ def capture_vente_gnr(doc, method):
     """
     Capture automatique des ventes GNR depuis Sales Invoice
     AVEC RÉCUPÉRATION DES VRAIS TAUX DEPUIS LES FACTURES
-    """
-
-    try:
-        movements_created = 0
-        posting_date = getdate(doc.posting_date)
 
-        frappe.logger().info(
-            f"[GNR] Capture vente avec VRAIS TAUX: {doc.name}, Date: {posting_date}"
-        )
+    En mode de capture différé (GNR Settings), la soumission ne fait
+    qu'inscrire la facture dans la file traitée en arrière-plan.
+    """
+    # Documents sans article GNR : aucune requête
+    if not any(check_if_gnr_item_for_sales(item.item_code) for item in doc.items):
+        return
 
-        for item in doc.items:
-            # Vérifier si l'article est tracké GNR
-            is_gnr = check_if_gnr_item_for_sales(item.item_code)
-
-            if is_gnr:
-                # Vérifier si mouvement déjà créé
-                existing = frappe.get_all(
-                    "Mouvement GNR",
-                    filters={
-                        "reference_document": "Sales Invoice",
-                        "reference_name": doc.name,
-                        "code_produit": item.item_code,
-                    },
-                )
+    if method == "on_submit" and capture_differee():
+        mettre_en_file(doc)
+        return
 
-                if not existing:
-                    # Récupérer l'unité de mesure de la ligne de facture
-                    item_unit = item.uom or get_item_unit(item.item_code)
-
-                    # Convertir la quantité en LITRES
-                    quantity_in_litres = convert_to_litres(item.qty, item_unit)
-
-                    # Log de la conversion avec prix
-                    if item_unit != "L" and item_unit != "l":
-                        prix_unitaire_original = item.rate / item.qty if item.qty else 0
-                        frappe.logger().info(
-                            f"[GNR] Conversion: {item.qty} {item_unit} = {quantity_in_litres} litres"
-                        )
-                        frappe.logger().info(
-                            f"[GNR] Prix: {prix_unitaire_original:.2f}€/{item_unit} → {prix_unitaire_par_litre:.4f}€/L"
-                        )
-
-                    # Déterminer la catégorie client basée sur l'attestation d'accise
-                    customer_category = determine_customer_category_from_attestation(doc.customer)
-                    
-                    # Catégorie GNR fixe (un seul type)
-                    gnr_category = "GNR"
-
-                    # RÉCUPÉRER LE VRAI TAUX GNR DEPUIS LA FACTURE
-                    taux_gnr_reel = get_real_gnr_tax_from_invoice(item, doc)
-
-                    # Calculer le montant de taxe réel EN LITRES
-                    montant_taxe_reel = (
-                        quantity_in_litres * taux_gnr_reel if taux_gnr_reel else 0
-                    )
-
-                    # Prix unitaire par litre (depuis le prix total de la ligne facture)
-                    if item.qty and quantity_in_litres > 0:
-                        prix_unitaire_par_litre = item.rate / (quantity_in_litres / item.qty)
-                    else:
-                        prix_unitaire_par_litre = item.rate
-                    
-                    # Validation du prix calculé
-                    if prix_unitaire_par_litre <= 0:
-                        frappe.logger().warning(f"[GNR] Prix par litre invalide: {prix_unitaire_par_litre}€/L pour {item.item_code}")
-                        prix_unitaire_par_litre = 0
-
-                    # Créer le mouvement GNR AVEC QUANTITÉ EN LITRES
-                    mouvement = frappe.new_doc("Mouvement GNR")
-                    mouvement.update(
-                        {
-                            "type_mouvement": "Vente",
-                            "date_mouvement": posting_date,
-                            "code_produit": item.item_code,
-                            "quantite": quantity_in_litres,  # QUANTITÉ EN LITRES
-                            "prix_unitaire": prix_unitaire_par_litre,  # Prix par litre
-                            "client": doc.customer,
-                            "customer_category": customer_category,  # CATÉGORIE POUR AFFICHAGE ET EXPORT
-                            "reference_document": "Sales Invoice",
-                            "reference_name": doc.name,
-                            "categorie_gnr": gnr_category,
-                            "trimestre": get_quarter_from_date(posting_date),
-                            "annee": posting_date.year,
-                            "semestre": get_semestre_from_date(posting_date),
-                            "taux_gnr": taux_gnr_reel,  # TAUX RÉEL CALCULÉ DEPUIS LA FACTURE
-                            "montant_taxe_gnr": montant_taxe_reel,  # MONTANT RÉEL CALCULÉ DEPUIS LA FACTURE
-                        }
-                    )
-
-                    # Ajouter des champs pour traçabilité
-                    mouvement.db_set("custom_original_qty", item.qty)
-                    mouvement.db_set("custom_original_uom", item_unit)
-                    mouvement.db_set("custom_tax_source", "Analyse facture automatique")
-
-                    mouvement.insert(ignore_permissions=True)
-
-                    # Soumettre automatiquement
-                    try:
-                        mouvement.submit()
-                        movements_created += 1
-                        frappe.logger().info(
-                            f"[GNR] Mouvement créé avec TAUX RÉEL: {mouvement.name} - {quantity_in_litres}L à {taux_gnr_reel}€/L = {montant_taxe_reel}€"
-                        )
-                    except Exception as submit_error:
-                        frappe.log_error(
-                            f"Erreur soumission mouvement {mouvement.name}: {str(submit_error)}"
-                        )
-                        movements_created += 1
+    # Mouvements et agrégats de la capture annulés ensemble en cas d'erreur
+    frappe.db.savepoint("gnr_capture")
+    try:
+        movements_created = len(capturer_vente(doc))
+        doc.db_set("gnr_capture_status", CAPTURE_EFFECTUEE, update_modified=False)
 
         if movements_created > 0:
             frappe.msgprint(
@@ -334,12 +136,117 @@ def capture_vente_gnr(doc, method):
             )
 
     except Exception as e:
+        frappe.db.rollback(save_point="gnr_capture")
         frappe.log_error(
             f"Erreur capture GNR vente avec taux réels pour facture {doc.name}: {str(e)}"
         )
         frappe.msgprint(
             _("Erreur lors de la création des mouvements GNR: {0}").format(str(e))
         )
+        doc.db_set("gnr_capture_status", CAPTURE_EN_ECHEC, update_modified=False)
+
+def capturer_vente(doc):
+    """
+    Crée les mouvements GNR d'une facture de vente soumise
+
+    Idempotente : les lignes déjà capturées sont ignorées. Les erreurs sont
+    propagées à l'appelant (hook de soumission ou worker de la file).
+
+    Returns:
+        list: mouvements créés
+    """
+    gnr_items = [item for item in doc.items if check_if_gnr_item_for_sales(item.item_code)]
+    if not gnr_items:
+        return []
+
+    posting_date = getdate(doc.posting_date)
+
+    frappe.logger().info(
+        f"[GNR] Capture vente avec VRAIS TAUX: {doc.name}, Date: {posting_date}"
+    )
+
+    # Mouvements déjà créés pour ce document : une seule requête
+    lignes_capturees, codes_sans_ligne = get_lignes_capturees("Sales Invoice", doc.name)
+
+    mouvements = []
+    for item in gnr_items:
+        existing = item.name in lignes_capturees or item.item_code in codes_sans_ligne
+
+        if not existing:
+            # Récupérer l'unité de mesure de la ligne de facture
+            item_unit = item.uom or get_item_unit(item.item_code)
+
+            # Convertir la quantité en LITRES
+            quantity_in_litres = convert_to_litres(item.qty, item_unit)
+
+            # Déterminer la catégorie client basée sur l'attestation d'accise
+            customer_category = determine_customer_category_from_attestation(doc.customer, posting_date)
+                
+            # Catégorie GNR fixe (un seul type)
+            gnr_category = "GNR"
+
+            # RÉCUPÉRER LE VRAI TAUX GNR DEPUIS LA FACTURE
+            taux_gnr_reel = get_real_gnr_tax_from_invoice(item, doc)
+
+            # Calculer le montant de taxe réel EN LITRES
+            montant_taxe_reel = (
+                quantity_in_litres * taux_gnr_reel if taux_gnr_reel else 0
+            )
+
+            # Prix unitaire par litre (depuis le prix total de la ligne facture)
+            if item.qty and quantity_in_litres > 0:
+                prix_unitaire_par_litre = item.rate / (quantity_in_litres / item.qty)
+            else:
+                prix_unitaire_par_litre = item.rate
+                
+            # Validation du prix calculé
+            if prix_unitaire_par_litre <= 0:
+                frappe.logger().warning(f"[GNR] Prix par litre invalide: {prix_unitaire_par_litre}€/L pour {item.item_code}")
+                prix_unitaire_par_litre = 0
+
+            # Log de la conversion avec prix
+            if item_unit != "L" and item_unit != "l":
+                prix_unitaire_original = item.rate / item.qty if item.qty else 0
+                frappe.logger().info(
+                    f"[GNR] Conversion: {item.qty} {item_unit} = {quantity_in_litres} litres"
+                )
+                frappe.logger().info(
+                    f"[GNR] Prix: {prix_unitaire_original:.2f}€/{item_unit} → {prix_unitaire_par_litre:.4f}€/L"
+                )
+
+            # Mouvement GNR AVEC QUANTITÉ EN LITRES
+            mouvements.append(
+                {
+                    "type_mouvement": "Vente",
+                    "date_mouvement": posting_date,
+                    "code_produit": item.item_code,
+                    "quantite": quantity_in_litres,  # QUANTITÉ EN LITRES
+                    "prix_unitaire": prix_unitaire_par_litre,  # Prix par litre
+                    "client": doc.customer,
+                    "company": doc.company,
+                    "customer_category": customer_category,  # CATÉGORIE POUR AFFICHAGE ET EXPORT
+                    "reference_document": "Sales Invoice",
+                    "reference_name": doc.name,
+                    "reference_detail": item.name,
+                    "categorie_gnr": gnr_category,
+                    "taux_gnr": taux_gnr_reel,  # TAUX RÉEL CALCULÉ DEPUIS LA FACTURE
+                    "montant_taxe_gnr": montant_taxe_reel,  # MONTANT RÉEL CALCULÉ DEPUIS LA FACTURE
+                    # Champs de traçabilité (écrits s'ils existent sur le doctype)
+                    "custom_original_qty": item.qty,
+                    "custom_original_uom": item_unit,
+                    "custom_tax_source": "Analyse facture automatique",
+                }
+            )
+
+    # Écriture en masse, déjà soumise (lignes capturées en parallèle écartées)
+    crees = inserer_mouvements_document("Sales Invoice", doc.name, mouvements)
+
+    for mouvement in crees:
+        frappe.logger().info(
+            f"[GNR] Mouvement créé avec TAUX RÉEL: {mouvement.name} - {mouvement.quantite}L à {mouvement.taux_gnr}€/L = {mouvement.montant_taxe_gnr}€"
+        )
+
+    return crees
 
 def capture_achat_gnr(doc, method):
     """
@@ -350,97 +257,19 @@ def capture_achat_gnr(doc, method):
         doc: Document Purchase Invoice
         method: Méthode appelée (on_submit, etc.)
     """
+    # Documents sans article GNR : aucune requête (même fonction que pour les ventes)
+    if not any(check_if_gnr_item_for_sales(item.item_code) for item in doc.items):
+        return
 
-    try:
-        movements_created = 0
-        posting_date = getdate(doc.posting_date)  # Convertir une seule fois
-
-        frappe.logger().info(
-            f"[GNR] Capture achat avec VRAIS TAUX: {doc.name}, Date: {posting_date}"
-        )
+    if method == "on_submit" and capture_differee():
+        mettre_en_file(doc)
+        return
 
-        for item in doc.items:
-            # Vérifier si l'article est tracké GNR
-            is_gnr = check_if_gnr_item_for_sales(
-                item.item_code
-            )  # Même fonction que pour les ventes
-
-            if is_gnr:
-                # Vérifier si mouvement déjà créé
-                existing = frappe.get_all(
-                    "Mouvement GNR",
-                    filters={
-                        "reference_document": "Purchase Invoice",
-                        "reference_name": doc.name,
-                        "code_produit": item.item_code,
-                    },
-                )
-
-                if not existing:
-                    # Convertir en litres
-                    item_unit = item.uom or get_item_unit(item.item_code)
-                    quantity_in_litres = convert_to_litres(item.qty, item_unit)
-
-                    # Déterminer la catégorie client basée sur l'attestation d'accise
-                    customer_category = determine_customer_category_from_attestation(doc.customer)
-                    
-                    # Catégorie GNR fixe (un seul type)
-                    gnr_category = "GNR"
-
-                    # RÉCUPÉRER LE VRAI TAUX GNR DEPUIS LA FACTURE D'ACHAT
-                    taux_gnr_reel = get_real_gnr_tax_from_invoice(item, doc)
-
-                    # Calculer le montant de taxe réel
-                    montant_taxe_reel = (
-                        quantity_in_litres * taux_gnr_reel if taux_gnr_reel else 0
-                    )
-
-                    # Prix unitaire par litre (depuis le prix total de la ligne facture)
-                    if item.qty and quantity_in_litres > 0:
-                        prix_unitaire_par_litre = item.rate / (quantity_in_litres / item.qty)
-                    else:
-                        prix_unitaire_par_litre = item.rate
-                    
-                    # Validation du prix calculé
-                    if prix_unitaire_par_litre <= 0:
-                        frappe.logger().warning(f"[GNR] Prix par litre invalide: {prix_unitaire_par_litre}€/L pour {item.item_code}")
-                        prix_unitaire_par_litre = 0
-
-                    # Créer le mouvement GNR
-                    mouvement = frappe.new_doc("Mouvement GNR")
-                    mouvement.update(
-                        {
-                            "type_mouvement": "Achat",
-                            "date_mouvement": posting_date,
-                            "code_produit": item.item_code,
-                            "quantite": quantity_in_litres,
-                            "prix_unitaire": prix_unitaire_par_litre,  # Prix réel payé par litre
-                            "fournisseur": doc.supplier,
-                            "reference_document": "Purchase Invoice",
-                            "reference_name": doc.name,
-                            "categorie_gnr": gnr_category,
-                            "trimestre": get_quarter_from_date(posting_date),
-                            "annee": posting_date.year,
-                            "semestre": get_semestre_from_date(posting_date),
-                            "taux_gnr": taux_gnr_reel,  # TAUX RÉEL
-                            "montant_taxe_gnr": montant_taxe_reel,  # MONTANT RÉEL
-                        }
-                    )
-
-                    mouvement.insert(ignore_permissions=True)
-
-                    # Soumettre automatiquement le mouvement
-                    try:
-                        mouvement.submit()
-                        movements_created += 1
-                        frappe.logger().info(
-                            f"[GNR] Mouvement GNR achat créé avec taux réel {taux_gnr_reel}€/L: {mouvement.name} pour facture {doc.name}"
-                        )
-                    except Exception as submit_error:
-                        frappe.log_error(
-                            f"Erreur soumission mouvement achat {mouvement.name}: {str(submit_error)}"
-                        )
-                        movements_created += 1  # Compter quand même comme créé
+    # Mouvements et agrégats de la capture annulés ensemble en cas d'erreur
+    frappe.db.savepoint("gnr_capture")
+    try:
+        movements_created = len(capturer_achat(doc))
+        doc.db_set("gnr_capture_status", CAPTURE_EFFECTUEE, update_modified=False)
 
         if movements_created > 0:
             frappe.msgprint(
@@ -450,12 +279,95 @@ def capture_achat_gnr(doc, method):
             )
 
     except Exception as e:
+        frappe.db.rollback(save_point="gnr_capture")
         frappe.log_error(
             f"Erreur capture GNR achat avec taux réels pour facture {doc.name}: {str(e)}"
         )
         frappe.msgprint(
             _("Erreur lors de la création des mouvements GNR achat: {0}").format(str(e))
         )
+        doc.db_set("gnr_capture_status", CAPTURE_EN_ECHEC, update_modified=False)
+
+def capturer_achat(doc):
+    """
+    Crée les mouvements GNR d'une facture d'achat soumise
+
+    Idempotente, les erreurs sont propagées (voir capturer_vente).
+
+    Returns:
+        list: mouvements créés
+    """
+    gnr_items = [item for item in doc.items if check_if_gnr_item_for_sales(item.item_code)]
+    if not gnr_items:
+        return []
+
+    posting_date = getdate(doc.posting_date)  # Convertir une seule fois
+
+    frappe.logger().info(
+        f"[GNR] Capture achat avec VRAIS TAUX: {doc.name}, Date: {posting_date}"
+    )
+
+    # Mouvements déjà créés pour ce document : une seule requête
+    lignes_capturees, codes_sans_ligne = get_lignes_capturees("Purchase Invoice", doc.name)
+
+    mouvements = []
+    for item in gnr_items:
+        existing = item.name in lignes_capturees or item.item_code in codes_sans_ligne
+
+        if not existing:
+            # Convertir en litres
+            item_unit = item.uom or get_item_unit(item.item_code)
+            quantity_in_litres = convert_to_litres(item.qty, item_unit)
+
+            # Catégorie GNR fixe (un seul type)
+            gnr_category = "GNR"
+
+            # RÉCUPÉRER LE VRAI TAUX GNR DEPUIS LA FACTURE D'ACHAT
+            taux_gnr_reel = get_real_gnr_tax_from_invoice(item, doc)
+
+            # Calculer le montant de taxe réel
+            montant_taxe_reel = (
+                quantity_in_litres * taux_gnr_reel if taux_gnr_reel else 0
+            )
+
+            # Prix unitaire par litre (depuis le prix total de la ligne facture)
+            if item.qty and quantity_in_litres > 0:
+                prix_unitaire_par_litre = item.rate / (quantity_in_litres / item.qty)
+            else:
+                prix_unitaire_par_litre = item.rate
+                
+            # Validation du prix calculé
+            if prix_unitaire_par_litre <= 0:
+                frappe.logger().warning(f"[GNR] Prix par litre invalide: {prix_unitaire_par_litre}€/L pour {item.item_code}")
+                prix_unitaire_par_litre = 0
+
+            mouvements.append(
+                {
+                    "type_mouvement": "Achat",
+                    "date_mouvement": posting_date,
+                    "code_produit": item.item_code,
+                    "quantite": quantity_in_litres,
+                    "prix_unitaire": prix_unitaire_par_litre,  # Prix réel payé par litre
+                    "fournisseur": doc.supplier,
+                    "company": doc.company,
+                    "reference_document": "Purchase Invoice",
+                    "reference_name": doc.name,
+                    "reference_detail": item.name,
+                    "categorie_gnr": gnr_category,
+                    "taux_gnr": taux_gnr_reel,  # TAUX RÉEL
+                    "montant_taxe_gnr": montant_taxe_reel,  # MONTANT RÉEL
+                }
+            )
+
+    # Écriture en masse, déjà soumise (lignes capturées en parallèle écartées)
+    crees = inserer_mouvements_document("Purchase Invoice", doc.name, mouvements)
+
+    for mouvement in crees:
+        frappe.logger().info(
+            f"[GNR] Mouvement GNR achat créé avec taux réel {mouvement.taux_gnr}€/L: {mouvement.name} pour facture {doc.name}"
+        )
+
+    return crees
 
 def cancel_vente_gnr(doc, method):
     """
@@ -651,7 +563,8 @@ def recalculer_tous_les_taux_reels_factures(limite=100):
         # Chercher les mouvements avec taux par défaut suspects
         mouvements_suspects = frappe.db.sql(
             """
-            SELECT name, code_produit, taux_gnr, reference_document, reference_name, quantite
+            SELECT name, type_mouvement, code_produit, taux_gnr, montant_taxe_gnr, reference_document,
+                reference_name, client, avec_attestation, quantite, prix_unitaire, date_mouvement, creation, company
             FROM `tabMouvement GNR`
             WHERE docstatus = 1
             AND reference_document IN ('Sales Invoice', 'Purchase Invoice')
@@ -683,14 +596,12 @@ def recalculer_tous_les_taux_reels_factures(limite=100):
                             nouveau_montant = mouvement.quantite * nouveau_taux
 
                             # Mettre à jour le mouvement
-                            frappe.db.set_value(
-                                "Mouvement GNR",
-                                mouvement.name,
-                                {
-                                    "taux_gnr": nouveau_taux,
-                                    "montant_taxe_gnr": nouveau_montant,
-                                },
-                            )
+                            nouvelles_valeurs = {
+                                "taux_gnr": nouveau_taux,
+                                "montant_taxe_gnr": nouveau_montant,
+                            }
+                            frappe.db.set_value("Mouvement GNR", mouvement.name, nouvelles_valeurs)
+                            propager_correction(mouvement, nouvelles_valeurs)
 
                             corriges += 1
                             frappe.logger().info(
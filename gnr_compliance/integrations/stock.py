@@ -1,9 +1,13 @@
 import frappe
 from frappe import _
-from frappe.utils import flt, now_datetime, getdate
+from frappe.utils import flt, getdate
 import logging
 from gnr_compliance.utils.unit_conversions import convert_to_litres, get_item_unit
-from gnr_compliance.utils.date_utils import get_quarter_from_date, get_semestre_from_date
+from gnr_compliance.utils.gnr_item_registry import is_gnr_item, get_gnr_item
+from gnr_compliance.gnr_compliance.doctype.mouvement_gnr.mouvement_gnr import (
+    get_lignes_capturees,
+    inserer_mouvements_document,
+)
 
 logger = logging.getLogger(__name__)
 
@@ -11,6 +15,10 @@ def capture_mouvement_stock(doc, method):
     """
     Capture des mouvements de stock pour produits GNR
     FONCTION PRINCIPALE - CORRIGÉE ET SIMPLIFIÉE
+
+    Tout est fait dans la transaction de soumission : attributs articles lus
+    dans le registre GNR, mouvements écrits en un lot, compteurs du Stock
+    Entry mis à jour en une requête.
     """
     try:
         # Log pour debug
@@ -18,40 +26,27 @@ def capture_mouvement_stock(doc, method):
         
         # Traiter TOUS les types de Stock Entry sans restriction
         # Accepte tous les types: Sales, Purchase, Custom types, etc.
-        
-        gnr_items = []
-        gnr_count = 0
-        
-        # Parcourir tous les items du Stock Entry
-        for item in doc.items:
-            # Vérifier si l'article est tracké GNR - MÉTHODE CORRIGÉE
-            is_gnr = check_if_gnr_item(item.item_code)
-            
-            if is_gnr:
-                gnr_items.append(item)
-                gnr_count += 1
-                frappe.logger().info(f"[GNR] Article GNR détecté: {item.item_code}")
+        gnr_items = [item for item in doc.items if check_if_gnr_item(item.item_code)]
         
         if gnr_items:
-            # Mettre à jour le compteur (si le champ existe)
+            # Mouvements et agrégats de la capture annulés ensemble en cas d'erreur
+            frappe.db.savepoint("gnr_capture")
             try:
-                frappe.db.set_value("Stock Entry", doc.name, "gnr_items_detected", gnr_count, update_modified=False)
-            except:
-                pass  # Le champ n'existe peut-être pas
-            
-            # Créer les mouvements GNR pour chaque article
-            movements_created = 0
-            for item in gnr_items:
-                if create_gnr_movement_from_stock(doc, item):
-                    movements_created += 1
+                movements_created = len(capturer_stock(doc, gnr_items))
+            except Exception:
+                frappe.db.rollback(save_point="gnr_capture")
+                raise
             
-            # Marquer comme traité
+            # Compteur et marqueur de traitement en une seule requête (si les champs existent)
             try:
-                frappe.db.set_value("Stock Entry", doc.name, "gnr_categories_processed", 1, update_modified=False)
-            except:
-                pass
-            
-            frappe.db.commit()
+                frappe.db.set_value(
+                    "Stock Entry",
+                    doc.name,
+                    {"gnr_items_detected": len(gnr_items), "gnr_categories_processed": 1},
+                    update_modified=False,
+                )
+            except Exception:
+                pass  # Les champs n'existent peut-être pas
             
             # Message de confirmation
             if movements_created > 0:
@@ -67,88 +62,100 @@ def capture_mouvement_stock(doc, method):
         frappe.logger().error(f"[GNR] Erreur capture mouvement stock {doc.name}: {str(e)}")
         frappe.log_error(f"Erreur traitement mouvement stock GNR: {str(e)}", "GNR Stock Error")
 
+def capturer_stock(stock_doc, gnr_items):
+    """
+    Crée en un lot les mouvements GNR des lignes GNR d'un Stock Entry
+
+    Les lignes déjà capturées (retraitement) sont ignorées.
+
+    Returns:
+        list: mouvements créés
+    """
+    lignes_capturees, codes_sans_ligne = get_lignes_capturees("Stock Entry", stock_doc.name)
+    
+    mouvements = []
+    for item in gnr_items:
+        if item.name in lignes_capturees or item.item_code in codes_sans_ligne:
+            continue
+        mouvement = build_gnr_movement_from_stock(stock_doc, item)
+        if mouvement:
+            mouvements.append(mouvement)
+    
+    # Lignes capturées par une soumission concurrente écartées
+    crees = inserer_mouvements_document("Stock Entry", stock_doc.name, mouvements)
+    
+    for mouvement in crees:
+        frappe.logger().info(f"[GNR] Mouvement stock créé et soumis: {mouvement.name}")
+    return crees
+
 def check_if_gnr_item(item_code):
     """
     Vérifie si un article est GNR basé UNIQUEMENT sur le marquage manuel
+    (lecture du registre des articles GNR, sans requête)
     """
     try:
-        # Vérifier uniquement le champ is_gnr_tracked
-        is_tracked = frappe.get_value("Item", item_code, "is_gnr_tracked")
-        return bool(is_tracked)
+        return is_gnr_item(item_code)
         
     except Exception as e:
         frappe.logger().error(f"[GNR] Erreur vérification article {item_code}: {str(e)}")
         return False
 
 
-def create_gnr_movement_from_stock(stock_doc, item):
+def build_gnr_movement_from_stock(stock_doc, item):
     """
-    Crée un mouvement GNR depuis un mouvement de stock
+    Prépare (sans l'écrire) le mouvement GNR d'une ligne de Stock Entry
     AVEC CONVERSION EN LITRES
+
+    Returns:
+        dict: champs du mouvement, ou None si la ligne ne génère pas de mouvement
     """
-    try:
-        # Déterminer le type de mouvement
-        type_mouvement = determine_movement_type(stock_doc.stock_entry_type, item)
-        
-        if not type_mouvement:
-            return False
-        
-        # Récupérer les informations de l'article
-        item_doc = frappe.get_doc("Item", item.item_code)
-        
-        # Date de posting
-        posting_date = getdate(stock_doc.posting_date)
-        
-        # Taux GNR de l'article
-        taux_gnr = getattr(item_doc, 'gnr_tax_rate', 0) or 0
-        
-        # NOUVEAU : Récupérer l'unité de mesure
-        item_unit = item.uom or get_item_unit(item.item_code)
-        
-        # NOUVEAU : Convertir en litres
-        quantity_in_litres = convert_to_litres(item.qty, item_unit)
-        
-        # Log de la conversion avec prix
-        if item_unit != "L" and item_unit != "l":
-            prix_original_par_unite = (item.basic_rate or item.valuation_rate or 0) / item.qty if item.qty else 0
-            prix_par_litre = (item.basic_rate or item.valuation_rate or 0) / (quantity_in_litres / item.qty) if item.qty else 0
-            frappe.logger().info(f"[GNR] Conversion Stock: {item.qty} {item_unit} = {quantity_in_litres} litres")
-            frappe.logger().info(f"[GNR] Prix Stock: {prix_original_par_unite:.2f}€/{item_unit} → {prix_par_litre:.4f}€/L")
-        
-        # Créer le mouvement GNR
-        mouvement_gnr = frappe.new_doc("Mouvement GNR")
-        mouvement_gnr.update({
-            "type_mouvement": type_mouvement,
-            "date_mouvement": posting_date,
-            "reference_document": "Stock Entry",
-            "reference_name": stock_doc.name,
-            "code_produit": item.item_code,
-            "quantite": quantity_in_litres,  # EN LITRES
-            "prix_unitaire": flt(item.basic_rate or item.valuation_rate or 0) / (quantity_in_litres / item.qty) if item.qty else 0,
-            "taux_gnr": taux_gnr,
-            "categorie_gnr": getattr(item_doc, 'gnr_tracked_category', 'GNR'),
-            "trimestre": get_quarter_from_date(posting_date),
-            "annee": posting_date.year,
-            "semestre": get_semestre_from_date(posting_date)
-        })
-        
-        # Calculer le montant de taxe GNR (en litres)
-        mouvement_gnr.montant_taxe_gnr = flt(mouvement_gnr.quantite * mouvement_gnr.taux_gnr)
-        
-        # Sauvegarder
-        mouvement_gnr.insert(ignore_permissions=True)
-        
-        try:
-            mouvement_gnr.submit()
-            frappe.logger().info(f"[GNR] Mouvement stock créé et soumis: {mouvement_gnr.name}")
-            return True
-        except Exception as submit_error:
-            frappe.log_error(f"Erreur soumission mouvement stock {mouvement_gnr.name}: {str(submit_error)}")
-            return True  # Compter comme créé même si pas soumis
-            
-    except Exception as e:
-        frappe.log_error(f"Erreur création mouvement GNR depuis stock: {str(e)}")
-        return False
+    # Déterminer le type de mouvement
+    type_mouvement = determine_movement_type(stock_doc.stock_entry_type, item)
+    
+    if not type_mouvement:
+        return None
+    
+    # Informations de l'article depuis le registre GNR (aucune requête)
+    article = get_gnr_item(item.item_code) or frappe._dict()
+    
+    # Date de posting
+    posting_date = getdate(stock_doc.posting_date)
+    
+    # Taux GNR de l'article
+    taux_gnr = flt(article.gnr_tax_rate)
+    
+    # Unité de mesure de la ligne, sinon unité de stock de l'article
+    item_unit = item.uom or article.stock_uom or get_item_unit(item.item_code)
+    
+    # Convertir en litres
+    quantity_in_litres = convert_to_litres(item.qty, item_unit)
+    
+    # Prix par litre
+    prix_ligne = flt(item.basic_rate or item.valuation_rate or 0)
+    if item.qty and quantity_in_litres:
+        prix_par_litre = prix_ligne / (quantity_in_litres / item.qty)
+    else:
+        prix_par_litre = 0
+    
+    # Log de la conversion avec prix
+    if item_unit != "L" and item_unit != "l":
+        prix_original_par_unite = prix_ligne / item.qty if item.qty else 0
+        frappe.logger().info(f"[GNR] Conversion Stock: {item.qty} {item_unit} = {quantity_in_litres} litres")
+        frappe.logger().info(f"[GNR] Prix Stock: {prix_original_par_unite:.2f}€/{item_unit} → {prix_par_litre:.4f}€/L")
+    
+    return {
+        "type_mouvement": type_mouvement,
+        "date_mouvement": posting_date,
+        "company": stock_doc.company,
+        "reference_document": "Stock Entry",
+        "reference_name": stock_doc.name,
+        "reference_detail": item.name,
+        "code_produit": item.item_code,
+        "quantite": quantity_in_litres,  # EN LITRES
+        "prix_unitaire": prix_par_litre,
+        "taux_gnr": taux_gnr,
+        "categorie_gnr": article.gnr_tracked_category or "GNR",
+    }
 
 def determine_movement_type(stock_entry_type, item):
     """Détermine le type de mouvement GNR selon le type de Stock Entry
@@ -253,6 +260,8 @@ def reprocess_stock_entries(from_date=None, to_date=None):
                 frappe.logger().info(f"[GNR] Traitement de {entry.name} avec {entry.nb_items_gnr} articles GNR")
                 doc = frappe.get_doc("Stock Entry", entry.name)
                 capture_mouvement_stock(doc, "reprocess")
+                # La capture ne valide plus elle-même : un commit par Stock Entry retraité
+                frappe.db.commit()
                 processed += 1
             except Exception as e:
                 error_msg = f"Erreur {entry.name}: {str(e)}"
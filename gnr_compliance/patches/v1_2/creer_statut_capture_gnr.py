@@ -0,0 +1,11 @@
+import frappe
+from frappe.custom.doctype.custom_field.custom_field import create_custom_fields
+
+
+def execute():
+    """Crée le champ de statut de capture GNR sur les factures"""
+    custom_fields = frappe.get_hooks("custom_fields", app_name="gnr_compliance")
+    create_custom_fields(
+        {doctype: custom_fields[doctype] for doctype in ("Sales Invoice", "Purchase Invoice")},
+        update=True,
+    )
@@ -0,0 +1,6 @@
+from gnr_compliance.gnr_compliance.doctype.mouvement_gnr.mouvement_gnr import creer_index_mouvement
+
+
+def execute():
+    """Index composites des requêtes fréquentes sur Mouvement GNR"""
+    creer_index_mouvement()
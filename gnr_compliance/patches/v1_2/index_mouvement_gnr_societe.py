@@ -0,0 +1,10 @@
+from gnr_compliance.gnr_compliance.doctype.mouvement_gnr.mouvement_gnr import (
+    creer_index_mouvement,
+    supprimer_index_obsoletes,
+)
+
+
+def execute():
+    """Remplace les index de Mouvement GNR par leur version menée par la société"""
+    supprimer_index_obsoletes()
+    creer_index_mouvement()
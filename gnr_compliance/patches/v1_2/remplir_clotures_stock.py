@@ -0,0 +1,6 @@
+from gnr_compliance.gnr_compliance.doctype.gnr_stock_checkpoint.gnr_stock_checkpoint import reconstruire_clotures
+
+
+def execute():
+    """Initialise les soldes de clôture de stock depuis le journal quotidien"""
+    reconstruire_clotures()
@@ -0,0 +1,6 @@
+from gnr_compliance.gnr_compliance.doctype.gnr_quarterly_cube.gnr_quarterly_cube import reconstruire_cube
+
+
+def execute():
+    """Initialise le cube trimestriel depuis le journal quotidien"""
+    reconstruire_cube()
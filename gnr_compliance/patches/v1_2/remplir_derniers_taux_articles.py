@@ -0,0 +1,6 @@
+from gnr_compliance.gnr_compliance.doctype.gnr_item_rate.gnr_item_rate import reconstruire_derniers_taux
+
+
+def execute():
+    """Initialise la table des derniers taux depuis les mouvements existants"""
+    reconstruire_derniers_taux()
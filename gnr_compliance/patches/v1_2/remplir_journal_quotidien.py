@@ -0,0 +1,6 @@
+from gnr_compliance.gnr_compliance.doctype.gnr_daily_ledger.gnr_daily_ledger import reconstruire_journal
+
+
+def execute():
+    """Initialise le journal quotidien GNR depuis les mouvements existants"""
+    reconstruire_journal()
@@ -0,0 +1,42 @@
+import frappe
+
+# Documents sources des mouvements, qui portent tous une société
+DOCUMENTS_SOURCES = ("Sales Invoice", "Purchase Invoice", "Stock Entry")
+
+
+def execute():
+    """
+    Renseigne la société des mouvements, versions de période et déclarations
+    existants : celle du document source, sinon la société par défaut
+    """
+    for reference_document in DOCUMENTS_SOURCES:
+        frappe.db.sql(
+            f"""
+            UPDATE `tabMouvement GNR` m
+            JOIN `tab{reference_document}` d ON d.name = m.reference_name
+            SET m.company = d.company
+            WHERE m.reference_document = %s
+            AND (m.company IS NULL OR m.company = '')
+            """,
+            reference_document,
+        )
+
+    company = frappe.defaults.get_global_default("company") or frappe.db.get_value("Company", {}, "name")
+    if not company:
+        return
+
+    for doctype in ("Mouvement GNR", "GNR Period Version", "Declaration Periode GNR"):
+        frappe.db.sql(
+            f"""UPDATE `tab{doctype}` SET company = %s
+            WHERE company IS NULL OR company = ''""",
+            company,
+        )
+
+    frappe.db.sql(
+        """
+        UPDATE `tabDeclaration Periode GNR` d
+        JOIN `tabCompany` c ON c.name = d.company
+        SET d.abbr_societe = c.abbr
+        WHERE d.abbr_societe IS NULL OR d.abbr_societe = ''
+        """
+    )
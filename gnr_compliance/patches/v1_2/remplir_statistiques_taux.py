@@ -0,0 +1,8 @@
+from gnr_compliance.gnr_compliance.doctype.gnr_item_rate_daily.gnr_item_rate_daily import (
+    reconstruire_statistiques_taux,
+)
+
+
+def execute():
+    """Initialise les agrégats journaliers de taux depuis les mouvements existants"""
+    reconstruire_statistiques_taux()
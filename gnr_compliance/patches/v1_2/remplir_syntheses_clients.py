@@ -0,0 +1,8 @@
+from gnr_compliance.gnr_compliance.doctype.gnr_client_semester_summary.gnr_client_semester_summary import (
+    reconstruire_syntheses_clients,
+)
+
+
+def execute():
+    """Initialise les synthèses semestrielles clients depuis les ventes existantes"""
+    reconstruire_syntheses_clients()
@@ -0,0 +1,6 @@
+from gnr_compliance.utils.gnr_aggregates import retamponner_attestations
+
+
+def execute():
+    """Relève l'attestation client sur les mouvements et synthèses existants"""
+    retamponner_attestations()
@@ -23,6 +23,15 @@ class GNRExportDialog {
                     reqd: 1,
                     change: () => this.update_period_options()
                 },
+                {
+                    fieldtype: 'Link',
+                    fieldname: 'company',
+                    label: 'Société',
+                    options: 'Company',
+                    default: frappe.defaults.get_user_default('Company'),
+                    reqd: 1,
+                    change: () => this.load_available_periods()
+                },
                 {
                     fieldtype: 'Column Break'
                 },
@@ -89,6 +98,9 @@ class GNRExportDialog {
     load_available_periods() {
         frappe.call({
             method: 'gnr_compliance.api_excel.get_available_periods',
+            args: {
+                company: this.dialog.get_value('company')
+            },
             callback: (r) => {
                 if (r.message) {
                     this.available_periods = r.message;
@@ -178,7 +190,8 @@ class GNRExportDialog {
             args: {
                 declaration_type: declaration_type,
                 period_start: period_start,
-                period_end: period_end
+                period_end: period_end,
+                company: values.company
             },
             callback: (r) => {
                 if (r.message) {
@@ -270,7 +283,7 @@ class GNRExportDialog {
         }
         
         let period_start, period_end;
-        let api_method, api_args = {};
+        let api_method, api_args = {company: values.company};
         
         if (values.period_selection === 'Prédéfinie' && values.predefined_period) {
             const selected_period = this.get_period_dates(values.declaration_type, values.predefined_period);
@@ -0,0 +1,223 @@
+# gnr_compliance/utils/attestation_resolver.py
+"""
+Résolution mémoïsée de la catégorie d'attestation des clients
+
+Les champs d'attestation d'accise (custom_n_dossier_, custom_date_de_depot)
+sont gardés en mémoire pour la requête et dans un hash Redis partagé, pour
+que les factures à nombreuses lignes et les retraitements en masse ne
+relisent pas tabCustomer à chaque ligne. Le cache est invalidé par le
+doc_event Customer quand un champ d'attestation change.
+
+L'attestation est aussi relevée sur chaque Mouvement GNR (avec_attestation,
+reference_attestation) pour que les agrégats n'aient pas à joindre
+tabCustomer ; les mouvements d'un client sont retamponnés en une requête
+quand son attestation change.
+"""
+import frappe
+from frappe.utils import cstr, getdate
+
+ATTESTATION_CACHE_KEY = "gnr_customer_attestation"
+CHAMPS_ATTESTATION = ("custom_n_dossier_", "custom_date_de_depot")
+
+# Même règle que _categorie, sur l'alias c de tabCustomer, à la date de
+# l'opération {date_operation}
+_CONDITION_ATTESTATION = (
+    "(TRIM(COALESCE(c.custom_n_dossier_, '')) != '' AND c.custom_date_de_depot IS NOT NULL"
+    " AND c.custom_date_de_depot <= {date_operation})"
+)
+# Condition pour un mouvement d'alias m
+CONDITION_ATTESTATION_SQL = _CONDITION_ATTESTATION.format(date_operation="m.date_mouvement")
+
+
+def condition_attestation_sql(date_operation):
+    """Règle d'attestation SQL à la date donnée par l'expression date_operation"""
+    return _CONDITION_ATTESTATION.format(date_operation=date_operation)
+
+
+def get_customer_category(customer, posting_date=None):
+    """
+    Catégorie GNR d'un client à une date donnée
+
+    Le client est "Agricole" s'il a un numéro de dossier et une date de dépôt,
+    et si cette date est antérieure ou égale à la date de l'opération.
+
+    Args:
+        customer: Code du client
+        posting_date: Date de l'opération (None : pas de contrôle de date)
+
+    Returns:
+        str: "Agricole" ou "Autre"
+    """
+    if not customer:
+        return "Autre"
+
+    date_operation = getdate(posting_date) if posting_date else None
+    memo = _memo_requete()
+    cle = (customer, date_operation)
+    if cle not in memo:
+        memo[cle] = _categorie(get_customer_attestation(customer), date_operation)
+    return memo[cle]
+
+
+def get_customer_attestation(customer):
+    """
+    Champs d'attestation d'un client (mémoire de la requête → Redis → base)
+
+    Returns:
+        dict: custom_n_dossier_, custom_date_de_depot ou {} si client introuvable
+    """
+    attestations = _memo_requete(attestations=True)
+    if customer in attestations:
+        return attestations[customer]
+
+    cache = frappe.cache()
+    attestation = cache.hget(ATTESTATION_CACHE_KEY, customer)
+    if attestation is None:
+        donnees = frappe.db.get_value("Customer", customer, CHAMPS_ATTESTATION, as_dict=True)
+        attestation = {champ: donnees.get(champ) for champ in CHAMPS_ATTESTATION} if donnees else {}
+        cache.hset(ATTESTATION_CACHE_KEY, customer, attestation)
+
+    attestations[customer] = attestation
+    return attestation
+
+
+def get_attestation_stamp(customer, date_operation=None):
+    """
+    Attestation à relever sur un mouvement du client
+
+    Args:
+        customer: Code du client
+        date_operation: Date du mouvement (l'attestation doit être déposée
+            au plus tard ce jour-là)
+
+    Returns:
+        frappe._dict: avec_attestation (0/1), reference_attestation (n° de dossier)
+    """
+    if not customer:
+        return frappe._dict(avec_attestation=0, reference_attestation=None)
+
+    attestation = get_customer_attestation(customer)
+    date_operation = getdate(date_operation) if date_operation else None
+    if _categorie(attestation, date_operation) != "Agricole":
+        return frappe._dict(avec_attestation=0, reference_attestation=None)
+    return frappe._dict(
+        avec_attestation=1,
+        reference_attestation=cstr(attestation.get("custom_n_dossier_")).strip(),
+    )
+
+
+def attestation_mouvement(mouvement):
+    """
+    Attestation relevée sur un mouvement (dict ou Document), sinon celle
+    de son client pour les mouvements pas encore tamponnés
+    """
+    if mouvement.get("avec_attestation") is None:
+        return get_attestation_stamp(mouvement.get("client"), mouvement.get("date_mouvement"))
+    return frappe._dict(
+        avec_attestation=1 if mouvement.get("avec_attestation") else 0,
+        reference_attestation=mouvement.get("reference_attestation"),
+    )
+
+
+def tamponner_mouvements(clients=None):
+    """
+    Recopie l'attestation des clients sur leurs mouvements, en une requête
+
+    Args:
+        clients: codes client à retamponner (None : tous les mouvements)
+
+    Returns:
+        list: (company, code_produit, date_mouvement) des ventes soumises
+        dont l'attestation a changé
+    """
+    condition = ""
+    parametres = []
+    if clients:
+        condition = "AND m.client IN ({})".format(", ".join(["%s"] * len(clients)))
+        parametres = list(clients)
+
+    nouvel_etat = f"""
+        CASE WHEN {CONDITION_ATTESTATION_SQL} THEN 1 ELSE 0 END
+    """
+    nouvelle_reference = f"""
+        CASE WHEN {CONDITION_ATTESTATION_SQL} THEN TRIM(c.custom_n_dossier_) ELSE NULL END
+    """
+    difference = f"""
+        (COALESCE(m.avec_attestation, 0) != {nouvel_etat}
+        OR NOT (m.reference_attestation <=> {nouvelle_reference}))
+    """
+
+    jours = frappe.db.sql(
+        f"""
+        SELECT DISTINCT m.company, m.code_produit, m.date_mouvement
+        FROM `tabMouvement GNR` m
+        LEFT JOIN `tabCustomer` c ON m.client = c.name
+        WHERE m.docstatus = 1
+        AND m.type_mouvement = 'Vente'
+        AND {difference}
+        {condition}
+        """,
+        parametres,
+    )
+
+    frappe.db.sql(
+        f"""
+        UPDATE `tabMouvement GNR` m
+        LEFT JOIN `tabCustomer` c ON m.client = c.name
+        SET m.avec_attestation = {nouvel_etat},
+            m.reference_attestation = {nouvelle_reference}
+        WHERE {difference}
+        {condition}
+        """,
+        parametres,
+    )
+    return jours
+
+
+def _categorie(attestation, date_operation):
+    """Applique la règle d'attestation complète et en vigueur"""
+    numero = cstr(attestation.get("custom_n_dossier_")).strip()
+    date_depot = attestation.get("custom_date_de_depot")
+
+    if not numero or not date_depot:
+        return "Autre"
+    if date_operation and getdate(date_depot) > date_operation:
+        # Attestation déposée après l'opération : pas encore en vigueur
+        return "Autre"
+    return "Agricole"
+
+
+def _memo_requete(attestations=False):
+    """Mémoire locale à la requête (catégories ou attestations brutes)"""
+    cle = "gnr_attestations" if attestations else "gnr_categories_clients"
+    memo = getattr(frappe.local, cle, None)
+    if memo is None:
+        memo = {}
+        setattr(frappe.local, cle, memo)
+    return memo
+
+
+def invalidate_customer_attestation(doc, method=None, *args, **kwargs):
+    """
+    Invalide l'attestation mise en cache d'un client
+    (doc_event Customer on_update / on_trash / after_rename)
+    """
+    if method == "on_update" and not any(doc.has_value_changed(champ) for champ in CHAMPS_ATTESTATION):
+        return
+
+    clients = [doc.name]
+    if method == "after_rename" and args:
+        # after_rename(doc, method, old, new, merge)
+        clients.append(args[0])
+
+    _oublier(clients)
+    # Une lecture concurrente a pu remettre l'ancienne valeur avant le commit
+    frappe.db.after_commit.add(lambda: _oublier(clients))
+
+
+def _oublier(clients):
+    cache = frappe.cache()
+    for client in clients:
+        cache.hdel(ATTESTATION_CACHE_KEY, client)
+    frappe.local.gnr_attestations = None
+    frappe.local.gnr_categories_clients = None
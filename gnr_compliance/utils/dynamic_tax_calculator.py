@@ -3,6 +3,9 @@ from frappe import _
 from frappe.utils import flt, getdate, nowdate
 import re
 from datetime import datetime, timedelta
+from gnr_compliance.utils.gnr_aggregates import propager_correction
+from gnr_compliance.gnr_compliance.doctype.gnr_item_rate.gnr_item_rate import get_dernier_taux, get_derniers_taux
+from gnr_compliance.gnr_compliance.doctype.gnr_item_rate_daily.gnr_item_rate_daily import get_taux_journaliers
 
 # Groupe d'articles GNR officiel
 GNR_ITEM_GROUP = "Combustibles/Carburants/GNR"
@@ -29,17 +32,25 @@ def get_dynamic_gnr_rate_for_item(item_code, source_document=None, source_name=N
 				log_rate_source(item_code, source_rate, f"Document {source_document} {source_name}")
 				return source_rate
 		
+		# Dernier taux connu : inutile de parcourir l'historique si le dernier
+		# mouvement de l'article est antérieur à la fenêtre
+		dernier = get_dernier_taux(item_code)
+		date_dernier = getdate(dernier.date_dernier_taux) if dernier and dernier.date_dernier_taux else None
+		aujourd_hui = getdate(nowdate())
+		
 		# 2. PRIORITÉ 2: Historique récent de cet article (30 derniers jours)
-		historical_rate = get_recent_item_rate(item_code, days=30)
-		if historical_rate and is_valid_rate(historical_rate):
-			log_rate_source(item_code, historical_rate, "Historique récent (30j)")
-			return historical_rate
+		if date_dernier and date_dernier >= aujourd_hui - timedelta(days=30):
+			historical_rate = get_recent_item_rate(item_code, days=30)
+			if historical_rate and is_valid_rate(historical_rate):
+				log_rate_source(item_code, historical_rate, "Historique récent (30j)")
+				return historical_rate
 		
 		# 3. PRIORITÉ 3: Historique étendu (90 jours)
-		extended_rate = get_recent_item_rate(item_code, days=90)
-		if extended_rate and is_valid_rate(extended_rate):
-			log_rate_source(item_code, extended_rate, "Historique étendu (90j)")
-			return extended_rate
+		if date_dernier and date_dernier >= aujourd_hui - timedelta(days=90):
+			extended_rate = get_recent_item_rate(item_code, days=90)
+			if extended_rate and is_valid_rate(extended_rate):
+				log_rate_source(item_code, extended_rate, "Historique étendu (90j)")
+				return extended_rate
 		
 		# 4. ÉCHEC: Aucun taux trouvé
 		frappe.logger().warning(f"[GNR] AUCUN TAUX TROUVÉ pour {item_code} - Retour 0")
@@ -192,49 +203,30 @@ def extract_rate_from_stock_entry(item_code, doc_name):
 def get_recent_item_rate(item_code, days=30):
 	"""
 	Récupère le taux récent moyen pour un article spécifique
+	(agrégats journaliers des taux cohérents, au plus `days` lignes)
 	"""
 	try:
 		date_limit = getdate(nowdate()) - timedelta(days=days)
 		
-		# Récupérer les taux récents (excluant le taux 0)
-		result = frappe.db.sql("""
-			SELECT taux_gnr, date_mouvement, montant_taxe_gnr, quantite
-			FROM `tabMouvement GNR`
-			WHERE code_produit = %s 
-			AND taux_gnr > 0.1 AND taux_gnr < 100
-			AND docstatus = 1
-			AND date_mouvement >= %s
-			ORDER BY date_mouvement DESC
-			LIMIT 10
-		""", (item_code, date_limit), as_dict=True)
-		
-		if not result:
+		# Taux cohérents (montant_taxe = quantite * taux) agrégés par jour
+		jours = get_taux_journaliers(item_code, date_limit)
+		
+		if not jours:
 			return None
 		
-		# Filtrer les taux cohérents (vérifier calcul montant_taxe = quantite * taux)
-		taux_coherents = []
-		for row in result:
-			montant_attendu = row.quantite * row.taux_gnr
-			ecart = abs(montant_attendu - (row.montant_taxe_gnr or 0))
-			
-			# Accepter si écart < 5% ou < 0.10€
-			if ecart < max(montant_attendu * 0.05, 0.10):
-				taux_coherents.append(row.taux_gnr)
-		
-		if taux_coherents:
-			# Moyenne pondérée (plus récent = plus de poids)
-			total_weight = 0
-			weighted_sum = 0
-			
-			for i, taux in enumerate(taux_coherents):
-				weight = len(taux_coherents) - i  # Plus récent = poids plus élevé
-				weighted_sum += taux * weight
-				total_weight += weight
-			
-			if total_weight > 0:
-				average_rate = weighted_sum / total_weight
-				frappe.logger().info(f"[GNR] Taux historique calculé pour {item_code}: {average_rate:.3f}€/L (basé sur {len(taux_coherents)} mouvements)")
-				return flt(average_rate, 3)
+		# Moyenne pondérée par jour (plus récent = plus de poids)
+		total_weight = 0
+		weighted_sum = 0
+		
+		for i, jour in enumerate(jours):
+			weight = len(jours) - i
+			weighted_sum += jour.somme * weight
+			total_weight += jour.nb * weight
+		
+		if total_weight > 0:
+			average_rate = weighted_sum / total_weight
+			frappe.logger().info(f"[GNR] Taux historique calculé pour {item_code}: {average_rate:.3f}€/L (basé sur {sum(j.nb for j in jours)} mouvements)")
+			return flt(average_rate, 3)
 		
 		return None
 		
@@ -428,15 +420,11 @@ def detecter_articles_sans_taux():
 		
 		articles_sans_taux = []
 		
+		# Articles ayant au moins un mouvement avec taux valide : une seule lecture
+		articles_avec_taux = get_derniers_taux([article.name for article in articles_gnr])
+		
 		for article in articles_gnr:
-			# Vérifier s'il y a des mouvements avec taux valide
-			mouvements_avec_taux = frappe.db.count("Mouvement GNR", {
-				"code_produit": article.name,
-				"taux_gnr": [">", 0.1],
-				"docstatus": 1
-			})
-			
-			if mouvements_avec_taux == 0:
+			if article.name not in articles_avec_taux:
 				# Vérifier s'il y a des mouvements du tout
 				total_mouvements = frappe.db.count("Mouvement GNR", {
 					"code_produit": article.name,
@@ -469,7 +457,8 @@ def recalculer_avec_taux_dynamiques(limite=50):
 	try:
 		# Récupérer les mouvements avec taux zéro ou suspects
 		mouvements = frappe.db.sql("""
-			SELECT name, code_produit, reference_document, reference_name, quantite, taux_gnr
+			SELECT name, type_mouvement, code_produit, reference_document, reference_name, client,
+				avec_attestation, quantite, prix_unitaire, taux_gnr, montant_taxe_gnr, date_mouvement, creation, company
 			FROM `tabMouvement GNR`
 			WHERE docstatus = 1
 			AND (taux_gnr = 0 OR taux_gnr IN (1.77, 3.86, 6.83, 2.84, 24.81))
@@ -494,10 +483,12 @@ def recalculer_avec_taux_dynamiques(limite=50):
 					# Mettre à jour
 					nouveau_montant = flt(mouvement.quantite * nouveau_taux, 2)
 					
-					frappe.db.set_value("Mouvement GNR", mouvement.name, {
+					nouvelles_valeurs = {
 						"taux_gnr": nouveau_taux,
 						"montant_taxe_gnr": nouveau_montant
-					})
+					}
+					frappe.db.set_value("Mouvement GNR", mouvement.name, nouvelles_valeurs)
+					propager_correction(mouvement, nouvelles_valeurs)
 					
 					ameliorations.append({
 						"mouvement": mouvement.name,
@@ -4,18 +4,63 @@ Générateurs Excel pour les déclarations GNR avec formats exacts
 
 import frappe
 from openpyxl import Workbook
+from openpyxl.cell import Cell
 from openpyxl.styles import Font, Alignment, Border, Side, PatternFill
 from openpyxl.utils import get_column_letter
+from copy import copy
 from datetime import datetime, timedelta
 from typing import List, Dict, Any
 import io
 
+from gnr_compliance.gnr_compliance.doctype.gnr_daily_ledger.gnr_daily_ledger import resoudre_societe
+from gnr_compliance.utils.period_dataset import get_dataset_periode
+
+class StyleRegistry:
+    """
+    Styles internés d'un classeur
+    
+    Chaque combinaison (taille, gras, alignement, retour à la ligne, fond,
+    bordure) n'est construite et enregistrée dans les tables de styles du
+    classeur qu'une fois. Les cellules reçoivent ensuite la référence de
+    style (identifiants police, alignement, fond, bordure) en une affectation.
+    """
+    
+    def __init__(self, wb: Workbook):
+        self.wb = wb
+        self._styles = {}
+        
+    def get_style(self, font_size: int = 10, bold: bool = False, alignment: str = "center",
+                  wrap_text: bool = True, background_color: str = None, border: bool = False):
+        """Référence de style de la combinaison, construite au premier appel"""
+        key = (font_size, bold, alignment, wrap_text, background_color, border)
+        style = self._styles.get(key)
+        if style is None:
+            # Cellule détachée : les setters d'openpyxl enregistrent chaque
+            # objet de style dans les tables du classeur
+            cell = Cell(self.wb.active)
+            cell.font = Font(size=font_size, bold=bold)
+            cell.alignment = Alignment(horizontal=alignment, vertical="center", wrap_text=wrap_text or None)
+            if background_color:
+                cell.fill = PatternFill(start_color=background_color, end_color=background_color, fill_type="solid")
+            if border:
+                thin_border = Side(style='thin')
+                cell.border = Border(left=thin_border, right=thin_border, top=thin_border, bottom=thin_border)
+            style = self._styles[key] = cell._style
+        return style
+    
+    def apply(self, cells, style):
+        """Affecte une référence de style à des cellules (remplace leur style)"""
+        for cell in cells:
+            cell._style = copy(style)
+
+
 class GNRExcelGenerator:
     """Classe de base pour générer les fichiers Excel GNR avec formatage exact"""
     
     def __init__(self):
         self.wb = Workbook()
         self.ws = self.wb.active
+        self.styles = StyleRegistry(self.wb)
         
     def set_column_widths(self, widths: Dict[str, float]):
         """Définir les largeurs de colonnes exactes"""
@@ -32,8 +77,7 @@ class GNRExcelGenerator:
         self.ws.merge_cells(range_str)
         cell = self.ws[range_str.split(':')[0]]
         cell.value = value
-        cell.font = Font(size=font_size, bold=bold)
-        cell.alignment = Alignment(horizontal=alignment, vertical="center")
+        self.styles.apply([cell], self.styles.get_style(font_size, bold, alignment, wrap_text=False))
         
     def set_cell_style(self, cell_ref: str, value: Any = None, font_size: int = 10, 
                       bold: bool = False, alignment: str = "center", 
@@ -42,15 +86,16 @@ class GNRExcelGenerator:
         cell = self.ws[cell_ref]
         if value is not None:
             cell.value = value
-        cell.font = Font(size=font_size, bold=bold)
-        cell.alignment = Alignment(horizontal=alignment, vertical="center", wrap_text=True)
-        
-        if background_color:
-            cell.fill = PatternFill(start_color=background_color, end_color=background_color, fill_type="solid")
-            
-        if border:
-            thin_border = Side(style='thin')
-            cell.border = Border(left=thin_border, right=thin_border, top=thin_border, bottom=thin_border)
+        self.styles.apply([cell], self.styles.get_style(font_size, bold, alignment, True, background_color, border))
+    
+    def set_range_style(self, min_col: int, max_col: int, min_row: int, max_row: int, font_size: int = 10,
+                        bold: bool = False, alignment: str = "center", border: bool = False):
+        """Appliquer un même style à un bloc de cellules (sans effet si le bloc est vide)"""
+        if max_row < min_row:
+            return
+        style = self.styles.get_style(font_size, bold, alignment, True, None, border)
+        for row in self.ws.iter_rows(min_row=min_row, max_row=max_row, min_col=min_col, max_col=max_col):
+            self.styles.apply(row, style)
     
     def save_to_bytes(self) -> bytes:
         """Sauvegarder le workbook en bytes pour téléchargement"""
@@ -139,41 +184,40 @@ class ArreteTrimestrielGenerator(GNRExcelGenerator):
             movement_date = datetime.strptime(movement['date'], '%Y-%m-%d')
             excel_date = self._date_to_excel(movement_date)
             
-            # Date
-            self.set_cell_style(f'A{current_row}', excel_date, alignment='center', border=True)
-            
             # Stock initial (report du stock final précédent)
             if current_row == 9:
                 running_stock = movement.get('stock_initial', 0)
-            self.set_cell_style(f'B{current_row}', running_stock, alignment='center', border=True)
             
             # Entrées - N° BL (optionnel)
             bl_number = movement.get('bl_number', '')
             if bl_number:
                 self.set_cell_style(f'C{current_row}', bl_number, alignment='center', border=True)
             
-            # Entrées - Volume
             entrees = movement.get('entrees', 0)
-            self.set_cell_style(f'D{current_row}', entrees, alignment='center', border=True)
-            
-            # Sorties - Agricole/Forestier
             sorties_agricole = movement.get('sorties_agricole', 0)
-            self.set_cell_style(f'E{current_row}', sorties_agricole, alignment='center', border=True)
-            
-            # Sorties - Sans Attestation  
             sorties_sans_attestation = movement.get('sorties_sans_attestation', 0)
-            self.set_cell_style(f'F{current_row}', sorties_sans_attestation, alignment='center', border=True)
             
-            # Stock Final - Formule Excel
-            stock_final_formula = f'=B{current_row}+D{current_row}-E{current_row}-F{current_row}'
-            self.ws[f'G{current_row}'].value = stock_final_formula
-            self.set_cell_style(f'G{current_row}', alignment='center', border=True)
+            # Date, stock initial, entrées, sorties agricole / sans attestation
+            # et stock final (formule Excel)
+            for column, value in (
+                (1, excel_date),
+                (2, running_stock),
+                (4, entrees),
+                (5, sorties_agricole),
+                (6, sorties_sans_attestation),
+                (7, f'=B{current_row}+D{current_row}-E{current_row}-F{current_row}'),
+            ):
+                self.ws.cell(row=current_row, column=column, value=value)
             
             # Calculer le stock pour la ligne suivante
             running_stock = running_stock + entrees - sorties_agricole - sorties_sans_attestation
             
             current_row += 1
         
+        # Styles des données appliqués par blocs (colonne C : seulement les BL)
+        self.set_range_style(1, 2, 9, current_row - 1, border=True)
+        self.set_range_style(4, 7, 9, current_row - 1, border=True)
+        
         # Ligne de cumuls (equivalent à la ligne 68 dans l'original)
         cumul_row = current_row + 1
         self.set_row_height(cumul_row, 15.75)
@@ -288,122 +332,126 @@ class ListeClientsGenerator(GNRExcelGenerator):
         current_row = 3
         
         for client in clients_data:
-            # Distributeur (toujours le même)
-            self.set_cell_style(f'A{current_row}', company_name, border=True, alignment='left')
-            
-            # SIREN distributeur (si fourni)
+            # Distributeur (toujours le même) et SIREN distributeur (si fourni)
+            self.ws.cell(row=current_row, column=1, value=company_name)
             if company_siren:
-                self.set_cell_style(f'B{current_row}', company_siren, border=True, alignment='center')
+                self.ws.cell(row=current_row, column=2, value=company_siren)
             
             # Raison sociale client
-            self.set_cell_style(f'C{current_row}', client.get('raison_sociale', ''), 
-                               border=True, alignment='left')
+            self.ws.cell(row=current_row, column=3, value=client.get('raison_sociale', ''))
             
             # SIREN client
             client_siren = client.get('siren', '')
             if client_siren:
                 self.set_cell_style(f'D{current_row}', client_siren, border=True, alignment='center')
             
-            # Volume en hectolitres
-            volume_hl = client.get('volume_hl', 0)
-            self.set_cell_style(f'E{current_row}', volume_hl, border=True, alignment='center')
-            
-            # Tarif d'accise
-            tarif_accise = client.get('tarif_accise', 0)
-            self.set_cell_style(f'F{current_row}', tarif_accise, border=True, alignment='center')
+            # Volume en hectolitres et tarif d'accise
+            self.ws.cell(row=current_row, column=5, value=client.get('volume_hl', 0))
+            self.ws.cell(row=current_row, column=6, value=client.get('tarif_accise', 0))
             
             current_row += 1
         
+        # Styles des données appliqués par blocs (colonne D : seulement les SIREN)
+        last_row = current_row - 1
+        self.set_range_style(1, 1, 3, last_row, border=True, alignment='left')
+        if company_siren:
+            self.set_range_style(2, 2, 3, last_row, border=True)
+        self.set_range_style(3, 3, 3, last_row, border=True, alignment='left')
+        self.set_range_style(5, 6, 3, last_row, border=True)
+        
         return self.save_to_bytes()
 
 
-def generate_arrete_trimestriel(period_start: str, period_end: str) -> bytes:
+def generate_arrete_trimestriel(period_start: str, period_end: str, company: str = None) -> bytes:
     """
     API fonction pour générer l'arrêté trimestriel
     """
+    return ArreteTrimestrielGenerator().generate(**get_arrete_trimestriel_data(period_start, period_end, company))
+
+
+def get_arrete_trimestriel_data(period_start: str, period_end: str, company: str = None) -> Dict:
+    """
+    Données de l'arrêté trimestriel (arguments de ArreteTrimestrielGenerator.generate)
+    """
     # Récupérer les informations de la société
-    company = frappe.defaults.get_user_default("Company") or frappe.get_all("Company", limit=1)[0].name
+    company = resoudre_societe(company)
     company_doc = frappe.get_doc("Company", company)
     
     # Récupérer le numéro d'autorisation depuis les paramètres
     autorisation_number = frappe.db.get_single_value('GNR Settings', 'autorisation_number') or "08/2024/AMIENS"
     
-    # Récupérer les mouvements de stock pour la période
-    stock_movements = get_stock_movements_for_period(period_start, period_end)
-    
-    generator = ArreteTrimestrielGenerator()
-    return generator.generate(
-        period_start=period_start,
-        period_end=period_end,
-        company_name=company_doc.company_name,
-        autorisation_number=autorisation_number,
-        stock_movements=stock_movements
-    )
+    return {
+        "period_start": period_start,
+        "period_end": period_end,
+        "company_name": company_doc.company_name,
+        "autorisation_number": autorisation_number,
+        # Récupérer les mouvements de stock pour la période
+        "stock_movements": get_stock_movements_for_period(period_start, period_end, company),
+    }
 
 
-def generate_liste_clients(period_start: str, period_end: str) -> bytes:
+def generate_liste_clients(period_start: str, period_end: str, company: str = None) -> bytes:
     """
     API fonction pour générer la liste semestrielle des clients
     """
+    return ListeClientsGenerator().generate(**get_liste_clients_data(period_start, period_end, company))
+
+
+def get_liste_clients_data(period_start: str, period_end: str, company: str = None) -> Dict:
+    """
+    Données de la liste semestrielle (arguments de ListeClientsGenerator.generate)
+    """
     # Récupérer les informations de la société
-    company = frappe.defaults.get_user_default("Company") or frappe.get_all("Company", limit=1)[0].name
+    company = resoudre_societe(company)
     company_doc = frappe.get_doc("Company", company)
     
-    # Récupérer les données clients pour la période
-    clients_data = get_clients_data_for_period(period_start, period_end)
-    
-    generator = ListeClientsGenerator()
-    return generator.generate(
-        period_start=period_start,
-        period_end=period_end,
-        company_name=company_doc.company_name,
-        company_siren=company_doc.tax_id or "",
-        clients_data=clients_data
-    )
+    return {
+        "period_start": period_start,
+        "period_end": period_end,
+        "company_name": company_doc.company_name,
+        "company_siren": company_doc.tax_id or "",
+        # Récupérer les données clients pour la période
+        "clients_data": get_clients_data_for_period(period_start, period_end, company),
+    }
 
 
-def get_stock_movements_for_period(period_start: str, period_end: str) -> List[Dict]:
+def get_stock_movements_for_period(period_start: str, period_end: str, company: str = None) -> List[Dict]:
     """
-    Récupérer les mouvements de stock pour la période donnée
+    Récupérer les mouvements de stock de la société pour la période donnée
+    (stock journalier du jeu de données de la période, une ligne par jour)
     """
-    movements = frappe.db.sql("""
-        SELECT 
-            date,
-            SUM(CASE WHEN purpose = 'Receipt' THEN qty_in_liters ELSE 0 END) as entrees,
-            SUM(CASE WHEN purpose = 'Material Issue' AND customer_category = 'Agricole' 
-                THEN qty_in_liters ELSE 0 END) as sorties_agricole,
-            SUM(CASE WHEN purpose = 'Material Issue' AND (customer_category != 'Agricole' OR customer_category IS NULL) 
-                THEN qty_in_liters ELSE 0 END) as sorties_sans_attestation,
-            bl_number,
-            stock_physique
-        FROM `tabMouvement GNR`
-        WHERE date BETWEEN %s AND %s
-        GROUP BY date
-        ORDER BY date
-    """, (period_start, period_end), as_dict=True)
+    grand_livre = get_dataset_periode(period_start, period_end, resoudre_societe(company)).grand_livre()
     
-    return movements or []
+    return [
+        {
+            'date': jour.date.strftime('%Y-%m-%d'),
+            'stock_initial': jour.stock_initial,
+            'entrees': jour.entrees,
+            'sorties_agricole': jour.volume_agricole,
+            # Toute sortie sans attestation agricole (ventes et autres sorties)
+            'sorties_sans_attestation': jour.sorties - jour.volume_agricole,
+            'stock_final': jour.stock_final,
+            'nb_operations': jour.nb_mouvements,
+        }
+        for jour in grand_livre.lignes()
+    ]
 
 
-def get_clients_data_for_period(period_start: str, period_end: str) -> List[Dict]:
+def get_clients_data_for_period(period_start: str, period_end: str, company: str = None) -> List[Dict]:
     """
-    Récupérer les données clients pour la période donnée
+    Récupérer les données clients de la société pour la période donnée
+    (ventes par client du jeu de données de la période)
     """
-    clients = frappe.db.sql("""
-        SELECT 
-            c.customer_name as raison_sociale,
-            c.tax_id as siren,
-            SUM(m.qty_in_liters / 100) as volume_hl,
-            CASE 
-                WHEN m.customer_category = 'Agricole' THEN 3.86
-                ELSE 24.81 
-            END as tarif_accise
-        FROM `tabMouvement GNR` m
-        JOIN `tabCustomer` c ON m.customer = c.name
-        WHERE m.date BETWEEN %s AND %s
-        AND m.purpose = 'Material Issue'
-        GROUP BY c.name, m.customer_category
-        ORDER BY c.customer_name
-    """, (period_start, period_end), as_dict=True)
+    clients = get_dataset_periode(period_start, period_end, resoudre_societe(company)).clients()
     
-    return clients or []
\ No newline at end of file
+    return [
+        {
+            'raison_sociale': client.nom_client,
+            'siren': client.siret or '',
+            'volume_hl': client.quantite_totale / 100,  # Litres vers hectolitres
+            'tarif_accise': client.taux_reel_par_hl,
+            'avec_attestation': client.avec_attestation,
+            'nb_livraisons': client.nb_mouvements,
+        }
+        for client in clients
+    ]
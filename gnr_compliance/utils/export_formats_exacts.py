@@ -1,22 +1,35 @@
 import frappe
-from frappe.utils import getdate, flt, format_date
+from frappe.utils import date_diff, getdate, flt, format_date
 from datetime import datetime, timedelta
 from io import BytesIO
 
+from gnr_compliance.gnr_compliance.doctype.gnr_daily_ledger.gnr_daily_ledger import resoudre_societe
+from gnr_compliance.gnr_compliance.doctype.gnr_export_cache.gnr_export_cache import obtenir_export
+from gnr_compliance.utils.date_utils import get_period_dates
+from gnr_compliance.utils.period_dataset import get_dataset_periode
+
 @frappe.whitelist()
-def generer_declaration_trimestrielle_exacte(from_date, to_date):
+def generer_declaration_trimestrielle_exacte(from_date, to_date, company=None):
     """
     Génère la Déclaration Trimestrielle au format exact TIPAccEne
     Comptabilité Matière - Gasoil Non Routier
     Respecte exactement le format fourni par l'utilisateur
     """
+    return creer_declaration_trimestrielle(from_date, to_date, company=company)
+
+def creer_declaration_trimestrielle(from_date, to_date, mouvements_journaliers=None, company=None, version_donnees=None):
+    """
+    Déclaration trimestrielle d'une société depuis les mouvements journaliers
+    fournis (instantané d'une déclaration soumise, de version version_donnees)
+    ou calculés sur la période
+
+    Le fichier est servi depuis le cache des exports tant que les données
+    de la période n'ont pas changé.
+    """
     try:
         # Vérifier que openpyxl est disponible
         try:
-            import openpyxl
-            from openpyxl.styles import Font, Alignment, Border, Side, PatternFill
-            from openpyxl.utils import get_column_letter
-            from io import BytesIO
+            from gnr_compliance.utils.xlsx_streaming import rendre_declaration_trimestrielle
         except ImportError:
             return {
                 "success": False,
@@ -24,195 +37,34 @@ def generer_declaration_trimestrielle_exacte(from_date, to_date):
             }
 
         # Récupérer les informations de la société
-        company = frappe.get_single("Global Defaults").default_company
-        company_doc = frappe.get_doc("Company", company) if company else None
-
-        # Créer le classeur
-        wb = openpyxl.Workbook()
-        ws = wb.active
-        ws.title = "Comptabilité Matière GNR"
-
-        # === STYLES ===
-        title_font = Font(name="Arial", size=14, bold=True)
-        header_font = Font(name="Arial", size=11, bold=True)
-        normal_font = Font(name="Arial", size=10)
-
-        center_align = Alignment(horizontal="center", vertical="center")
-        left_align = Alignment(horizontal="left", vertical="center")
-        right_align = Alignment(horizontal="right", vertical="center")
-
-        thin_border = Border(
-            left=Side(style="thin"),
-            right=Side(style="thin"),
-            top=Side(style="thin"),
-            bottom=Side(style="thin"),
-        )
-
-        # === EN-TÊTE SELON FORMAT EXACT TIPAccEne ===
-        # Ligne 1 : Titre principal (fusionné sur toute la largeur)
-        ws.merge_cells("A1:G1")
-        ws["A1"] = "Comptabilité Matière - Gasoil Non Routier"
-        ws["A1"].font = title_font
-        ws["A1"].alignment = center_align
-
-        # Ligne 2 : Informations société
-        company_name = company_doc.company_name if company_doc else "ETS STEPHANE JOSSEAUME"
-        ws["A2"] = f"Société : {company_name}"
-        ws["A2"].font = header_font
-
-        # Ligne 3 : Numéro d'autorisation
-        try:
-            numero_autorisation = frappe.get_single_value("GNR Settings", "numero_autorisation")
-        except:
-            numero_autorisation = "08/2024/AMIENS"
-        
-        ws["A3"] = f"Numéro d'autorisation : {numero_autorisation}"
-        ws["A3"].font = normal_font
-
-        # Ligne 4 : Période (format exact)
-        periode_text = generer_texte_periode_trimestre_exact(from_date, to_date)
-        ws["A4"] = periode_text
-        ws["A4"].font = header_font
-
-        # Ligne 5 : Ligne vide
-        ws["A5"] = ""
-
-        # Ligne 6 : Sous-titre avec alignement exact
-        ws["A6"] = ""
-        ws["B6"] = "Volume réel en Litres"
-        ws["B6"].font = header_font
-
-        # === EN-TÊTES COLONNES (Ligne 8) ===
-        headers = [
-            "Date",
-            "Stock Initial",
-            "Entrées",
-            "Sorties",
-            "Stock Final",
-            "N° BL",
-            "Volume",
-            "AGRICOLE /\nFORESTIER",
-            "Volume",
-            "Sans\nAttestation",
-            "Volume",
-        ]
-
-        for col, header in enumerate(headers, 1):
-            cell = ws.cell(row=8, column=col, value=header)
-            cell.font = header_font
-            cell.alignment = center_align
-            cell.border = thin_border
-
-        # === DONNÉES AVEC VRAIS MONTANTS ===
-        try:
-            mouvements_journaliers = calculer_mouvements_journaliers_reels(
-                from_date, to_date
-            )
-        except Exception as e:
-            frappe.log_error(f"Erreur calcul mouvements réels: {str(e)}")
-            mouvements_journaliers = []
-
-        row = 9
-        for mouvement in mouvements_journaliers:
-            # Date
-            ws.cell(
-                row=row, column=1, value=mouvement.get("date_format", "")
-            ).border = thin_border
-
-            # Stock Initial
-            ws.cell(
-                row=row, column=2, value=mouvement.get("stock_initial", 0)
-            ).border = thin_border
-            ws.cell(row=row, column=2).number_format = "#,##0"
-
-            # Entrées
-            ws.cell(
-                row=row, column=3, value=mouvement.get("entrees", 0)
-            ).border = thin_border
-            ws.cell(row=row, column=3).number_format = "#,##0"
-
-            # Sorties
-            ws.cell(
-                row=row, column=4, value=mouvement.get("sorties", 0)
-            ).border = thin_border
-            ws.cell(row=row, column=4).number_format = "#,##0"
-
-            # Stock Final
-            ws.cell(
-                row=row, column=5, value=mouvement.get("stock_final", 0)
-            ).border = thin_border
-            ws.cell(row=row, column=5).number_format = "#,##0"
-
-            # N° BL (vide pour l'instant)
-            ws.cell(row=row, column=6, value="").border = thin_border
-
-            # Volume (copie des sorties)
-            ws.cell(
-                row=row, column=7, value=mouvement.get("sorties", 0)
-            ).border = thin_border
-            ws.cell(row=row, column=7).number_format = "#,##0"
-
-            # AGRICOLE/FORESTIER (VOLUMES RÉELS AVEC ATTESTATION)
-            ws.cell(
-                row=row, column=8, value=mouvement.get("volume_agricole_reel", 0)
-            ).border = thin_border
-            ws.cell(row=row, column=8).number_format = "#,##0"
-
-            # Volume agricole (répétition pour clarté)
-            ws.cell(
-                row=row, column=9, value=mouvement.get("volume_agricole_reel", 0)
-            ).border = thin_border
-            ws.cell(row=row, column=9).number_format = "#,##0"
-
-            # Sans Attestation (VOLUMES RÉELS SANS ATTESTATION)
-            ws.cell(
-                row=row,
-                column=10,
-                value=mouvement.get("volume_sans_attestation_reel", 0),
-            ).border = thin_border
-            ws.cell(row=row, column=10).number_format = "#,##0"
-
-            # Volume sans attestation (répétition)
-            ws.cell(
-                row=row,
-                column=11,
-                value=mouvement.get("volume_sans_attestation_reel", 0),
-            ).border = thin_border
-            ws.cell(row=row, column=11).number_format = "#,##0"
-
-            row += 1
-
-        # === AJUSTEMENTS COLONNES ===
-        column_widths = [12, 12, 10, 10, 12, 8, 10, 12, 10, 12, 10]
-        for i, width in enumerate(column_widths, 1):
-            ws.column_dimensions[get_column_letter(i)].width = width
-
-        # === SAUVEGARDE ===
-        output = BytesIO()
-        wb.save(output)
-        output.seek(0)
-
-        # Nom de fichier exact
-        trimestre_text = determiner_trimestre_text(from_date, to_date)
-        file_name = (
-            f"TIPAccEne Arrêté Trimestriel de Stock Détaillé {trimestre_text}.xlsx"
-        )
-
-        file_doc = frappe.get_doc(
-            {
-                "doctype": "File",
-                "file_name": file_name,
-                "content": output.getvalue(),
-                "is_private": 0,
-            }
+        company = resoudre_societe(company)
+        infos = {}
+
+        def preparer():
+            donnees = donnees_declaration_trimestrielle(from_date, to_date, company, mouvements_journaliers)
+            infos["jours"] = len(donnees["mouvements_journaliers"])
+            return donnees
+
+        def rendre(donnees):
+            # === RENDU EN FLUX (une ligne écrite par jour) ===
+            return nom_declaration_trimestrielle(from_date, to_date), rendre_declaration_trimestrielle(**donnees)
+
+        export = obtenir_export(
+            "declaration_trimestrielle", company, from_date, to_date, preparer, rendre,
+            version_donnees=version_donnees,
+            en_cache=mouvements_journaliers is None or version_donnees is not None,
         )
-        file_doc.save()
 
         return {
             "success": True,
-            "file_url": file_doc.file_url,
-            "file_name": file_name,
-            "message": f"Déclaration trimestrielle générée avec taux réels - {len(mouvements_journaliers)} jours",
+            "file_url": export.file_url,
+            "file_name": export.file_name,
+            "en_cache": export.en_cache,
+            "message": (
+                "Déclaration trimestrielle inchangée depuis sa dernière génération"
+                if export.en_cache
+                else f"Déclaration trimestrielle générée avec taux réels - {infos.get('jours', 0)} jours"
+            ),
         }
 
     except Exception as e:
@@ -222,364 +74,320 @@ def generer_declaration_trimestrielle_exacte(from_date, to_date):
         return {"success": False, "message": f"Erreur: {str(e)}"}
 
 @frappe.whitelist()
-def generer_liste_semestrielle_exacte(from_date, to_date):
+def generer_liste_semestrielle_exacte(from_date, to_date, company=None):
     """
     Génère la Liste Semestrielle des Clients au format exact
     AVEC RÉCUPÉRATION DES VRAIS TARIFS ET MONTANTS
     """
+    return creer_liste_semestrielle(from_date, to_date, company=company)
+
+def creer_liste_semestrielle(from_date, to_date, clients_data=None, company=None, version_donnees=None):
+    """
+    Liste semestrielle d'une société depuis les clients fournis (instantané
+    d'une déclaration soumise, de version version_donnees) ou calculés sur
+    la période
+
+    Le fichier est servi depuis le cache des exports tant que les données
+    de la période n'ont pas changé.
+    """
     try:
         # Vérifier que openpyxl est disponible
         try:
-            import openpyxl
-            from openpyxl.styles import Font, Alignment, Border, Side, PatternFill
-            from openpyxl.utils import get_column_letter
-            from io import BytesIO
+            from gnr_compliance.utils.xlsx_streaming import rendre_liste_semestrielle
         except ImportError:
             return {
                 "success": False,
                 "message": "Module openpyxl non installé. Exécutez : bench pip install openpyxl",
             }
 
-        # Récupérer les données clients avec VRAIS TARIFS
-        try:
-            clients_data = get_clients_avec_attestation_reels(from_date, to_date)
-        except Exception as e:
-            frappe.log_error(f"Erreur récupération clients réels: {str(e)}")
-            clients_data = []
+        company = resoudre_societe(company)
+        infos = {}
+
+        def preparer():
+            donnees = donnees_liste_semestrielle(from_date, to_date, company, clients_data)
+            if donnees:
+                infos["clients"] = len(donnees["clients_data"])
+            return donnees
 
-        if not clients_data:
+        def rendre(donnees):
+            # === RENDU EN FLUX (une ligne écrite par client) ===
+            return nom_liste_semestrielle(from_date, to_date), rendre_liste_semestrielle(**donnees)
+
+        export = obtenir_export(
+            "liste_semestrielle", company, from_date, to_date, preparer, rendre,
+            version_donnees=version_donnees,
+            en_cache=clients_data is None or version_donnees is not None,
+        )
+
+        if export is None:
             return {
                 "success": False,
                 "message": "Aucun client trouvé pour cette période",
             }
 
-        # Créer le classeur
-        wb = openpyxl.Workbook()
-        ws = wb.active
-        ws.title = "Liste Clients Semestrielle"
-
-        # === STYLES ===
-        header_font = Font(name="Arial", size=11, bold=True)
-        normal_font = Font(name="Arial", size=10)
-
-        center_align = Alignment(horizontal="center", vertical="center")
-        left_align = Alignment(horizontal="left", vertical="center")
-
-        thin_border = Border(
-            left=Side(style="thin"),
-            right=Side(style="thin"),
-            top=Side(style="thin"),
-            bottom=Side(style="thin"),
-        )
+        return {
+            "success": True,
+            "file_url": export.file_url,
+            "file_name": export.file_name,
+            "en_cache": export.en_cache,
+            "message": (
+                "Liste semestrielle inchangée depuis sa dernière génération"
+                if export.en_cache
+                else f"Liste semestrielle générée avec tarifs réels - {infos.get('clients', 0)} clients"
+            ),
+        }
 
-        # === EN-TÊTES COLONNES ===
-        headers = [
-            [
-                "Informations distributeur autorisé ou fournisseur",
-                "",
-                "Informations client",
-                "",
-                "Données carburant GNR",
-                "",
-            ],
-            [
-                "Raison sociale",
-                "SIREN",
-                "Raison sociale du client",
-                "SIREN du client",
-                "Volumes (en hL) de GNR livrés au client au cours du dernier semestre civil écoulé",
-                "Tarif d'accise RÉEL appliqué (en euro par hectolitres)",
-            ],
-        ]
+    except Exception as e:
+        frappe.log_error(f"Erreur génération liste semestrielle réelle: {str(e)}")
+        return {"success": False, "message": f"Erreur: {str(e)}"}
 
-        # Première ligne d'en-têtes (groupements)
-        ws.merge_cells("A1:B1")
-        ws["A1"] = headers[0][0]
-        ws["A1"].font = header_font
-        ws["A1"].alignment = center_align
-        ws["A1"].border = thin_border
-
-        ws.merge_cells("C1:D1")
-        ws["C1"] = headers[0][2]
-        ws["C1"].font = header_font
-        ws["C1"].alignment = center_align
-        ws["C1"].border = thin_border
-
-        ws.merge_cells("E1:F1")
-        ws["E1"] = headers[0][4]
-        ws["E1"].font = header_font
-        ws["E1"].alignment = center_align
-        ws["E1"].border = thin_border
-
-        # Deuxième ligne d'en-têtes (détails)
-        for col, header in enumerate(headers[1], 1):
-            cell = ws.cell(row=2, column=col, value=header)
-            cell.font = header_font
-            cell.alignment = center_align
-            cell.border = thin_border
+@frappe.whitelist()
+def generer_export_annuel_exact(from_date, to_date, company=None):
+    """
+    Génère l'export annuel : arrêtés de l'année et des trimestres, listes
+    clients des semestres, réunis dans une archive ZIP
+    """
+    return creer_export_annuel(from_date, to_date, company=company)
 
-        # === DONNÉES CLIENTS AVEC VRAIS TARIFS ===
-        # Récupérer le nom de la société
+@frappe.whitelist()
+def preparer_export_annuel(from_date, to_date, company=None):
+    """
+    Génère l'export annuel dans un job en arrière-plan, documents rendus en
+    parallèle ; generer_export_annuel_exact le sert ensuite depuis le cache
+    """
+    frappe.enqueue(
+        "gnr_compliance.utils.export_formats_exacts.creer_export_annuel",
+        queue="long",
+        job_id=f"gnr_export_annuel::{company}::{from_date}::{to_date}",
+        deduplicate=True,
+        from_date=from_date,
+        to_date=to_date,
+        company=company,
+        parallele=True,
+    )
+    return {"success": True, "message": "Export annuel en cours de génération en arrière-plan"}
+
+def creer_export_annuel(
+    from_date, to_date, mouvements_journaliers=None, clients_semestres=None, company=None, version_donnees=None,
+    parallele=False,
+):
+    """
+    Archive ZIP de l'année : arrêté annuel, arrêtés des quatre trimestres
+    et listes clients des deux semestres
+
+    Les sept documents sont préparés depuis un seul jeu de données de
+    l'année (trimestres et semestres en sont extraits sans relecture) ou
+    depuis l'instantané d'une déclaration soumise, puis rendus à la suite
+    dans le processus courant.
+
+    Args:
+        mouvements_journaliers: stock journalier figé de l'année
+            (None : calculé sur la période)
+        clients_semestres: {semestre: clients} figés (None : calculés sur
+            la période)
+        parallele: rendu dans des processus fils (job en arrière-plan
+            uniquement, voir rendre_en_parallele)
+    """
+    try:
+        # Vérifier que openpyxl est disponible
         try:
-            company = frappe.get_single("Global Defaults").default_company
-            company_doc = frappe.get_doc("Company", company) if company else None
-            company_name = (
-                company_doc.company_name if company_doc else "ETS STEPHANE JOSSEAUME"
-            )
-            # Récupérer le SIREN de la société si disponible
-            company_siren = (
-                company_doc.tax_id
-                if company_doc and hasattr(company_doc, "tax_id")
-                else ""
+            from gnr_compliance.utils.xlsx_streaming import (
+                archive_zip,
+                rendre_declaration_trimestrielle,
+                rendre_en_parallele,
+                rendre_liste_semestrielle,
             )
-        except:
-            company_name = "ETS STEPHANE JOSSEAUME"
-            company_siren = ""
-
-        row = 3
-        for client in clients_data:
-            # Raison sociale distributeur
-            ws.cell(row=row, column=1, value=company_name).border = thin_border
-
-            # SIREN distributeur
-            ws.cell(row=row, column=2, value=company_siren).border = thin_border
-
-            # Raison sociale client
-            nom_client = client.get("nom_client", "")
-            ws.cell(row=row, column=3, value=nom_client).border = thin_border
-
-            # SIREN client
-            siren_client = client.get("siret", "") or client.get("siren", "")
-            ws.cell(row=row, column=4, value=siren_client).border = thin_border
-
-            # Volume en hL (conversion de L vers hL)
-            quantite_l = client.get("quantite_totale", 0)  # Déjà en litres
-            volume_hl = quantite_l / 100  # Conversion litres vers hectolitres
-            ws.cell(row=row, column=5, value=volume_hl).border = thin_border
-            ws.cell(row=row, column=5).number_format = "#,##0.00"
-
-            # VRAI TARIF D'ACCISE CALCULÉ DEPUIS LES MOUVEMENTS RÉELS
-            tarif_reel = client.get("taux_reel_par_hl", 0)
-            ws.cell(row=row, column=6, value=tarif_reel).border = thin_border
-            ws.cell(row=row, column=6).number_format = "#,##0.00"
-
-            row += 1
-
-        # === AJUSTEMENTS COLONNES ===
-        column_widths = [25, 15, 30, 15, 35, 30]
-        for i, width in enumerate(column_widths, 1):
-            ws.column_dimensions[get_column_letter(i)].width = width
-
-        # === SAUVEGARDE ===
-        output = BytesIO()
-        wb.save(output)
-        output.seek(0)
+        except ImportError:
+            return {
+                "success": False,
+                "message": "Module openpyxl non installé. Exécutez : bench pip install openpyxl",
+            }
 
-        # Nom de fichier exact
-        periode_text = generer_texte_periode_semestre(from_date, to_date)
-        file_name = (
-            f"TIPAccEne Liste Semestrielle des Clients Douane {periode_text}.xlsx"
-        )
+        company = resoudre_societe(company)
+        from_date, to_date = getdate(from_date), getdate(to_date)
+        annee = from_date.year
+        rendus = {"arrete": rendre_declaration_trimestrielle, "liste": rendre_liste_semestrielle}
+        infos = {}
+
+        def preparer():
+            # === ARRÊTÉ ANNUEL (jeu de données de l'année chargé ici) ===
+            arrete = donnees_declaration_trimestrielle(from_date, to_date, company, mouvements_journaliers)
+            arrete["periode_text"] = f"Année {annee} (Janvier - Décembre)"
+            jours = arrete["mouvements_journaliers"]
+            documents = [[f"TIPAccEne Arrêté Annuel de Stock Détaillé {annee}.xlsx", "arrete", arrete]]
+
+            # === ARRÊTÉS TRIMESTRIELS : une ligne par jour de l'année, découpée ===
+            for trimestre in range(1, 5):
+                debut, fin = get_period_dates("Trimestriel", f"T{trimestre}", annee)
+                debut, fin = max(debut, from_date), min(fin, to_date)
+                if debut > fin:
+                    continue
+                donnees = dict(
+                    arrete,
+                    periode_text=generer_texte_periode_trimestre(str(debut), str(fin)),
+                    mouvements_journaliers=jours[date_diff(debut, from_date) : date_diff(fin, from_date) + 1],
+                )
+                documents.append([nom_declaration_trimestrielle(debut, fin), "arrete", donnees])
+
+            # === LISTES SEMESTRIELLES ===
+            for semestre in (1, 2):
+                debut, fin = get_period_dates("Semestriel", f"S{semestre}", annee)
+                debut, fin = max(debut, from_date), min(fin, to_date)
+                if debut > fin:
+                    continue
+                clients = None
+                if clients_semestres is not None:
+                    clients = clients_semestres.get(str(semestre)) or []
+                donnees = donnees_liste_semestrielle(debut, fin, company, clients)
+                if donnees:
+                    documents.append([nom_liste_semestrielle(debut, fin), "liste", donnees])
+
+            infos["documents"] = [nom for nom, _type, _donnees in documents]
+            return {"documents": documents}
+
+        def rendre(donnees):
+            # === RENDU, PARALLÈLE EN ARRIÈRE-PLAN (arrêté annuel, le plus long, en premier) ===
+            fichiers = rendre_en_parallele(
+                {nom: (rendus[type_document], arguments) for nom, type_document, arguments in donnees["documents"]},
+                nb_processus=None if parallele else 1,
+            )
+            return f"TIPAccEne Déclarations GNR {annee}.zip", archive_zip(fichiers)
 
-        file_doc = frappe.get_doc(
-            {
-                "doctype": "File",
-                "file_name": file_name,
-                "content": output.getvalue(),
-                "is_private": 0,
-            }
+        export = obtenir_export(
+            "export_annuel", company, from_date, to_date, preparer, rendre,
+            version_donnees=version_donnees,
+            en_cache=mouvements_journaliers is None or version_donnees is not None,
         )
-        file_doc.save()
 
         return {
             "success": True,
-            "file_url": file_doc.file_url,
-            "file_name": file_name,
-            "message": f"Liste semestrielle générée avec tarifs réels - {len(clients_data)} clients",
+            "file_url": export.file_url,
+            "file_name": export.file_name,
+            "en_cache": export.en_cache,
+            "message": (
+                "Export annuel inchangé depuis sa dernière génération"
+                if export.en_cache
+                else f"Export annuel généré avec taux réels - {len(infos.get('documents', []))} documents"
+            ),
         }
 
     except Exception as e:
-        frappe.log_error(f"Erreur génération liste semestrielle réelle: {str(e)}")
+        frappe.log_error(f"Erreur génération export annuel: {str(e)}")
         return {"success": False, "message": f"Erreur: {str(e)}"}
 
-def calculer_mouvements_journaliers_reels(from_date, to_date):
+def donnees_declaration_trimestrielle(from_date, to_date, company, mouvements_journaliers=None):
     """
-    Calcule les mouvements jour par jour avec stocks ET VRAIS MONTANTS
+    Données de rendu de l'arrêté de stock (arguments de
+    rendre_declaration_trimestrielle), mouvements journaliers calculés
+    sur la période s'ils ne sont pas fournis
     """
+    company_doc = frappe.get_doc("Company", company) if company else None
     try:
-        # Récupérer tous les mouvements de la période AVEC LES VRAIS TAUX ET MONTANTS
-        mouvements = frappe.db.sql(
-            """
-            SELECT 
-                DATE(m.date_mouvement) as date_mouvement,
-                SUM(CASE WHEN m.type_mouvement IN ('Achat', 'Entrée') THEN m.quantite ELSE 0 END) as entrees,
-                SUM(CASE WHEN m.type_mouvement IN ('Vente', 'Sortie') THEN m.quantite ELSE 0 END) as sorties,
-                -- VOLUMES RÉELS BASÉS SUR LES CHAMPS ATTESTATION DU CLIENT
-                SUM(CASE 
-                    WHEN m.type_mouvement = 'Vente' 
-                    AND (c.custom_n_dossier_ IS NOT NULL AND c.custom_n_dossier_ != '' AND c.custom_date_de_depot IS NOT NULL) 
-                    THEN m.quantite 
-                    ELSE 0 
-                END) as volume_agricole_reel,
-                SUM(CASE 
-                    WHEN m.type_mouvement = 'Vente' 
-                    AND (c.custom_n_dossier_ IS NULL OR c.custom_n_dossier_ = '' OR c.custom_date_de_depot IS NULL) 
-                    THEN m.quantite 
-                    ELSE 0 
-                END) as volume_sans_attestation_reel,
-                -- MONTANTS RÉELS DE TAXE
-                SUM(COALESCE(m.montant_taxe_gnr, 0)) as montant_taxe_reel,
-                -- CHIFFRE D'AFFAIRES RÉEL
-                SUM(CASE 
-                    WHEN m.type_mouvement = 'Vente' 
-                    THEN COALESCE(m.quantite * m.prix_unitaire, 0) 
-                    ELSE 0 
-                END) as ca_reel
-            FROM `tabMouvement GNR` m
-            LEFT JOIN `tabCustomer` c ON m.client = c.name
-            WHERE m.date_mouvement BETWEEN %s AND %s
-            AND m.docstatus = 1
-            GROUP BY DATE(m.date_mouvement)
-            ORDER BY DATE(m.date_mouvement)
-        """,
-            (from_date, to_date),
-            as_dict=True,
-        )
+        numero_autorisation = frappe.get_single_value("GNR Settings", "numero_autorisation")
+    except:
+        numero_autorisation = "08/2024/AMIENS"
 
-        # Calculer le stock initial (avant la période) AVEC VRAIS MOUVEMENTS
+    # === DONNÉES AVEC VRAIS MONTANTS ===
+    if mouvements_journaliers is None:
         try:
-            stock_initial_result = frappe.db.sql(
-                """
-                SELECT COALESCE(SUM(
-                    CASE 
-                        WHEN type_mouvement IN ('Achat', 'Entrée') THEN quantite
-                        WHEN type_mouvement IN ('Vente', 'Sortie') THEN -quantite
-                        ELSE 0
-                    END
-                ), 0) as stock
-                FROM `tabMouvement GNR`
-                WHERE date_mouvement < %s
-                AND docstatus = 1
-            """,
-                (from_date,),
-            )
+            mouvements_journaliers = calculer_mouvements_journaliers_reels(from_date, to_date, company)
+        except Exception as e:
+            frappe.log_error(f"Erreur calcul mouvements réels: {str(e)}")
+            mouvements_journaliers = []
 
-            stock_initial = stock_initial_result[0][0] if stock_initial_result else 0
-        except:
-            stock_initial = 0
+    return {
+        "company_name": company_doc.company_name if company_doc else "ETS STEPHANE JOSSEAUME",
+        "numero_autorisation": numero_autorisation,
+        "periode_text": generer_texte_periode_trimestre(str(from_date), str(to_date)),
+        "mouvements_journaliers": mouvements_journaliers,
+    }
 
-        # Construire les données jour par jour
-        resultats = []
-        stock_courant = stock_initial
+def donnees_liste_semestrielle(from_date, to_date, company, clients_data=None):
+    """
+    Données de rendu de la liste clients (arguments de
+    rendre_liste_semestrielle), clients calculés sur la période s'ils ne
+    sont pas fournis ; None s'il n'y a aucun client
+    """
+    # Récupérer les données clients avec VRAIS TARIFS
+    if clients_data is None:
+        try:
+            clients_data = get_clients_avec_attestation_reels(from_date, to_date, company)
+        except Exception as e:
+            frappe.log_error(f"Erreur récupération clients réels: {str(e)}")
+            clients_data = []
 
-        if not mouvements:
-            return resultats
+    if not clients_data:
+        return None
 
-        # Créer toutes les dates de la période
-        from datetime import datetime, timedelta
+    # Récupérer le nom de la société
+    try:
+        company_doc = frappe.get_doc("Company", company) if company else None
+        company_name = (
+            company_doc.company_name if company_doc else "ETS STEPHANE JOSSEAUME"
+        )
+        # Récupérer le SIREN de la société si disponible
+        company_siren = (
+            company_doc.tax_id
+            if company_doc and hasattr(company_doc, "tax_id")
+            else ""
+        )
+    except:
+        company_name = "ETS STEPHANE JOSSEAUME"
+        company_siren = ""
 
-        current_date = datetime.strptime(from_date, "%Y-%m-%d").date()
-        end_date = datetime.strptime(to_date, "%Y-%m-%d").date()
+    return {"company_name": company_name, "company_siren": company_siren, "clients_data": clients_data}
 
-        mouvements_dict = {m.date_mouvement: m for m in mouvements}
+def nom_declaration_trimestrielle(from_date, to_date):
+    """Nom de fichier exact de l'arrêté trimestriel"""
+    trimestre_text = determiner_trimestre_text(str(from_date), str(to_date))
+    return f"TIPAccEne Arrêté Trimestriel de Stock Détaillé {trimestre_text}.xlsx"
 
-        while current_date <= end_date:
-            mouvement = mouvements_dict.get(current_date)
+def nom_liste_semestrielle(from_date, to_date):
+    """Nom de fichier exact de la liste semestrielle"""
+    periode_text = generer_texte_periode_semestre(str(from_date), str(to_date))
+    return f"TIPAccEne Liste Semestrielle des Clients Douane {periode_text}.xlsx"
 
-            if mouvement:
-                entrees = int(mouvement.entrees or 0)
-                sorties = int(mouvement.sorties or 0)
-                volume_agricole_reel = int(mouvement.volume_agricole_reel or 0)
-                volume_sans_attestation_reel = int(
-                    mouvement.volume_sans_attestation_reel or 0
-                )
-                montant_taxe_reel = mouvement.montant_taxe_reel or 0
-                ca_reel = mouvement.ca_reel or 0
-            else:
-                entrees = (
-                    sorties
-                ) = volume_agricole_reel = volume_sans_attestation_reel = 0
-                montant_taxe_reel = ca_reel = 0
-
-            stock_initial_jour = int(stock_courant)
-            stock_courant += entrees - sorties
-            stock_final_jour = int(stock_courant)
-
-            # Format de date comme dans l'exemple : "2-janv."
-            date_format = format_date_french(current_date)
-
-            resultats.append(
-                {
-                    "date_format": date_format,
-                    "stock_initial": stock_initial_jour,
-                    "entrees": entrees,
-                    "sorties": sorties,
-                    "stock_final": stock_final_jour,
-                    "volume_agricole_reel": volume_agricole_reel,  # VOLUMES RÉELS
-                    "volume_sans_attestation_reel": volume_sans_attestation_reel,  # VOLUMES RÉELS
-                    "montant_taxe_reel": montant_taxe_reel,
-                    "ca_reel": ca_reel,
-                }
-            )
+def calculer_mouvements_journaliers_reels(from_date, to_date, company=None):
+    """
+    Calcule les mouvements jour par jour avec stocks ET VRAIS MONTANTS
+    (company : société, None : toutes)
+    """
+    try:
+        # Stocks et flux de chaque jour depuis le jeu de données de la période
+        dataset = get_dataset_periode(from_date, to_date, company)
 
-            current_date += timedelta(days=1)
+        if not len(dataset):
+            return []
 
-        return resultats
+        return [
+            {
+                # Format de date comme dans l'exemple : "2-janv."
+                "date_format": format_date_french(jour.date),
+                "stock_initial": jour.stock_initial,
+                "entrees": jour.entrees,
+                "sorties": jour.sorties,
+                "stock_final": jour.stock_final,
+                "volume_agricole_reel": jour.volume_agricole,  # VOLUMES RÉELS
+                "volume_sans_attestation_reel": jour.volume_sans_attestation,  # VOLUMES RÉELS
+                "montant_taxe_reel": jour.montant_taxe,
+                "ca_reel": jour.chiffre_affaires,
+            }
+            for jour in dataset.grand_livre().lignes()
+        ]
 
     except Exception as e:
         frappe.log_error(f"Erreur calcul mouvements journaliers réels: {str(e)}")
         return []
 
-def get_clients_avec_attestation_reels(from_date, to_date):
+def get_clients_avec_attestation_reels(from_date, to_date, company=None):
     """
     Récupère les clients avec distinction attestation/sans attestation
     ET CALCUL DES VRAIS TARIFS depuis les mouvements GNR
+    (company : société, None : toutes)
     """
     try:
-        return frappe.db.sql(
-            """
-            SELECT 
-                m.client as code_client,
-                COALESCE(c.customer_name, m.client) as nom_client,
-                c.siret,
-                SUM(COALESCE(m.quantite, 0)) as quantite_totale,
-                -- VRAIS MONTANTS DEPUIS LES MOUVEMENTS
-                SUM(COALESCE(m.quantite * m.prix_unitaire, 0)) as montant_ht_reel,
-                SUM(COALESCE(m.montant_taxe_gnr, 0)) as montant_taxe_reel,
-                -- CALCUL DU VRAI TAUX MOYEN PAR HECTOLITRE
-                CASE 
-                    WHEN SUM(m.quantite) > 0 
-                    THEN SUM(COALESCE(m.montant_taxe_gnr, 0)) / (SUM(m.quantite) / 100)  -- Conversion L vers hL
-                    ELSE 0 
-                END as taux_reel_par_hl,
-                -- ATTESTATION BASÉE SUR LES CHAMPS DOSSIER
-                CASE 
-                    WHEN c.custom_n_dossier_ IS NOT NULL AND c.custom_n_dossier_ != '' AND c.custom_date_de_depot IS NOT NULL 
-                    THEN 1 
-                    ELSE 0 
-                END as avec_attestation,
-                c.custom_n_dossier_ as numero_dossier,
-                c.custom_date_de_depot as date_depot,
-                -- STATISTIQUES ADDITIONNELLES
-                COUNT(DISTINCT m.name) as nb_mouvements,
-                MIN(m.date_mouvement) as premiere_vente,
-                MAX(m.date_mouvement) as derniere_vente,
-                -- TAUX MIN/MAX POUR VÉRIFICATION
-                MIN(m.taux_gnr) as taux_min,
-                MAX(m.taux_gnr) as taux_max
-            FROM `tabMouvement GNR` m
-            LEFT JOIN `tabCustomer` c ON m.client = c.name
-            WHERE m.date_mouvement BETWEEN %s AND %s
-            AND m.docstatus = 1
-            AND m.type_mouvement = 'Vente'
-            AND m.client IS NOT NULL
-            GROUP BY m.client, c.customer_name, c.siret, c.custom_n_dossier_, c.custom_date_de_depot
-            HAVING SUM(COALESCE(m.quantite, 0)) > 0
-            ORDER BY c.customer_name
-        """,
-            (from_date, to_date),
-            as_dict=True,
-        )
+        # Ventes par client du jeu de données de la période
+        return get_dataset_periode(from_date, to_date, company).clients()
     except Exception as e:
         frappe.log_error(f"Erreur récupération clients avec vrais tarifs: {str(e)}")
         return []
@@ -642,75 +450,23 @@ def determiner_trimestre_text(from_date, to_date):
         return f"{start.year} Octobre à Décembre"
 
 @frappe.whitelist()
-def analyser_coherence_donnees(from_date, to_date):
+def analyser_coherence_donnees(from_date, to_date, company=None):
     """
     Analyse la cohérence des données GNR pour une période
     Utile pour vérifier que les vrais taux sont corrects
     """
     try:
-        # Analyser les taux par produit
-        analyse_taux = frappe.db.sql(
-            """
-            SELECT 
-                m.code_produit,
-                i.item_name,
-                COUNT(*) as nb_mouvements,
-                MIN(m.taux_gnr) as taux_min,
-                MAX(m.taux_gnr) as taux_max,
-                AVG(m.taux_gnr) as taux_moyen,
-                SUM(m.quantite) as quantite_totale,
-                SUM(m.montant_taxe_gnr) as taxe_totale,
-                -- Calculer le taux pondéré réel
-                SUM(m.montant_taxe_gnr) / SUM(m.quantite) as taux_pondere_reel,
-                -- Détecter les taux suspects (valeurs par défaut)
-                SUM(CASE WHEN m.taux_gnr IN (1.77, 3.86, 6.83, 2.84, 24.81) THEN 1 ELSE 0 END) as nb_taux_suspects
-            FROM `tabMouvement GNR` m
-            LEFT JOIN `tabItem` i ON m.code_produit = i.name
-            WHERE m.date_mouvement BETWEEN %s AND %s
-            AND m.docstatus = 1
-            AND m.quantite > 0
-            GROUP BY m.code_produit, i.item_name
-            ORDER BY quantite_totale DESC
-        """,
-            (from_date, to_date),
-            as_dict=True,
-        )
+        company = resoudre_societe(company)
 
-        # Analyser les attestations clients
-        analyse_clients = frappe.db.sql(
-            """
-            SELECT 
-                COUNT(DISTINCT m.client) as total_clients,
-                COUNT(DISTINCT CASE 
-                    WHEN c.custom_n_dossier_ IS NOT NULL AND c.custom_n_dossier_ != '' AND c.custom_date_de_depot IS NOT NULL 
-                    THEN m.client 
-                END) as clients_avec_attestation,
-                SUM(CASE 
-                    WHEN c.custom_n_dossier_ IS NOT NULL AND c.custom_n_dossier_ != '' AND c.custom_date_de_depot IS NOT NULL 
-                    THEN m.quantite 
-                    ELSE 0 
-                END) as volume_avec_attestation,
-                SUM(CASE 
-                    WHEN c.custom_n_dossier_ IS NULL OR c.custom_n_dossier_ = '' OR c.custom_date_de_depot IS NULL 
-                    THEN m.quantite 
-                    ELSE 0 
-                END) as volume_sans_attestation
-            FROM `tabMouvement GNR` m
-            LEFT JOIN `tabCustomer` c ON m.client = c.name
-            WHERE m.date_mouvement BETWEEN %s AND %s
-            AND m.docstatus = 1
-            AND m.type_mouvement = 'Vente'
-            AND m.client IS NOT NULL
-        """,
-            (from_date, to_date),
-            as_dict=True,
-        )
+        # Taux par produit et attestations clients du jeu de données de la période
+        qualite = get_dataset_periode(from_date, to_date, company).qualite()
+        analyse_taux = qualite.par_produit
 
         return {
             "success": True,
             "periode": f"{from_date} au {to_date}",
             "analyse_taux": analyse_taux,
-            "analyse_clients": analyse_clients[0] if analyse_clients else {},
+            "analyse_clients": qualite.attestations,
             "resume": {
                 "nb_produits": len(analyse_taux),
                 "total_taux_suspects": sum([p.nb_taux_suspects for p in analyse_taux]),
@@ -725,11 +481,12 @@ def analyser_coherence_donnees(from_date, to_date):
         return {"success": False, "error": str(e)}
 
 @frappe.whitelist()
-def export_donnees_brutes_excel(from_date, to_date):
+def export_donnees_brutes_excel(from_date, to_date, company=None):
     """
     Exporte toutes les données brutes GNR en Excel pour analyse
     """
     try:
+        company = resoudre_societe(company)
         import openpyxl
         from openpyxl.styles import Font, Alignment, Border, Side
         from openpyxl.utils import get_column_letter
@@ -749,10 +506,10 @@ def export_donnees_brutes_excel(from_date, to_date):
                 m.montant_taxe_gnr,
                 m.client,
                 c.customer_name,
-                c.custom_n_dossier_,
+                m.reference_attestation as custom_n_dossier_,
                 c.custom_date_de_depot,
                 CASE 
-                    WHEN c.custom_n_dossier_ IS NOT NULL AND c.custom_n_dossier_ != '' AND c.custom_date_de_depot IS NOT NULL 
+                    WHEN m.avec_attestation = 1 
                     THEN 'Avec attestation' 
                     ELSE 'Sans attestation' 
                 END as statut_attestation,
@@ -764,10 +521,11 @@ def export_donnees_brutes_excel(from_date, to_date):
             LEFT JOIN `tabItem` i ON m.code_produit = i.name
             LEFT JOIN `tabCustomer` c ON m.client = c.name
             WHERE m.date_mouvement BETWEEN %s AND %s
+            AND m.company = %s
             AND m.docstatus = 1
             ORDER BY m.date_mouvement, m.creation
         """,
-            (from_date, to_date),
+            (from_date, to_date, company),
             as_dict=True,
         )
 
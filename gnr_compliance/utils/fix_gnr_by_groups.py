@@ -1,4 +1,5 @@
 import frappe
+from gnr_compliance.utils.gnr_item_registry import invalidate_gnr_item_registry
 
 # Groupes d'articles GNR valides
 GNR_ITEM_GROUPS = [
@@ -77,6 +78,8 @@ def fix_gnr_items_by_group(dry_run=True):
                     print(f"       - {item.item_code}: {item.item_name or 'Sans nom'}")
     
     if not dry_run:
+        # Mises à jour SQL directes : le doc_event Item ne passe pas
+        invalidate_gnr_item_registry()
         frappe.db.commit()
     
     # 3. Résumé
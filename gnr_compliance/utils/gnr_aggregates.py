@@ -0,0 +1,128 @@
+# gnr_compliance/utils/gnr_aggregates.py
+"""
+Propagation des mouvements GNR vers les tables agrégées
+
+Point d'entrée unique appelé à chaque changement d'état d'un mouvement :
+soumission (document ou écriture en masse), annulation, correction de taux
+ou de montant sur un mouvement soumis. Chaque table agrégée y branche sa
+mise à jour incrémentale, dans la transaction du mouvement.
+
+Un changement d'attestation client est répercuté de la même façon : les
+mouvements et synthèses du client sont retamponnés en une requête, puis ses
+jours de vente sont recalculés dans le journal.
+"""
+import frappe
+
+from gnr_compliance.gnr_compliance.doctype.gnr_client_semester_summary.gnr_client_semester_summary import (
+    mettre_a_jour_syntheses_clients,
+    tamponner_syntheses_clients,
+)
+from gnr_compliance.gnr_compliance.doctype.gnr_daily_ledger.gnr_daily_ledger import (
+    get_societe_mouvement,
+    mettre_a_jour_journal,
+    reconstruire_journal,
+)
+from gnr_compliance.gnr_compliance.doctype.gnr_item_rate.gnr_item_rate import mettre_a_jour_derniers_taux
+from gnr_compliance.gnr_compliance.doctype.gnr_item_rate_daily.gnr_item_rate_daily import (
+    mettre_a_jour_statistiques_taux,
+)
+from gnr_compliance.gnr_compliance.doctype.gnr_period_version.gnr_period_version import incrementer_versions
+from gnr_compliance.gnr_compliance.doctype.gnr_quarterly_cube.gnr_quarterly_cube import mettre_a_jour_cube
+from gnr_compliance.gnr_compliance.doctype.gnr_stock_checkpoint.gnr_stock_checkpoint import ajuster_clotures
+from gnr_compliance.utils.attestation_resolver import CHAMPS_ATTESTATION, tamponner_mouvements
+from gnr_compliance.utils.period_dataset import oublier_datasets_periode
+
+# Périodes disponibles à l'export (api_excel.get_available_periods)
+PERIODES_CACHE_KEY = "gnr_available_periods"
+
+
+def propager_mouvements(mouvements, signe):
+    """
+    Répercute des mouvements soumis (signe=+1) ou annulés (signe=-1)
+
+    Args:
+        mouvements: Documents Mouvement GNR ou dicts (name, type_mouvement,
+            code_produit, date_mouvement, creation, client, avec_attestation,
+            quantite, prix_unitaire, taux_gnr, montant_taxe_gnr)
+        signe: +1 à la soumission, -1 à l'annulation
+    """
+    if not mouvements:
+        return
+
+    mettre_a_jour_derniers_taux(mouvements, signe)
+    mettre_a_jour_statistiques_taux(mouvements, signe)
+    mettre_a_jour_journal(mouvements, signe)
+    mettre_a_jour_syntheses_clients(mouvements, signe)
+    ajuster_clotures(mouvements, signe)
+    # Après le journal et les clôtures : le stock de début d'un nouveau trimestre en dépend
+    mettre_a_jour_cube(mouvements, signe)
+    incrementer_versions(
+        [(get_societe_mouvement(mouvement), mouvement.get("date_mouvement")) for mouvement in mouvements]
+    )
+    invalider_periodes_disponibles()
+    oublier_datasets_periode()
+
+
+def propager_correction(mouvement, nouvelles_valeurs):
+    """
+    Répercute la correction d'un mouvement soumis déjà écrite en base
+    (frappe.db.set_value) : retrait de l'ancienne version puis ajout de la
+    nouvelle.
+
+    Args:
+        mouvement: valeurs avant correction
+        nouvelles_valeurs: dict des champs modifiés
+    """
+    propager_mouvements([mouvement], -1)
+    propager_mouvements([{**mouvement, **nouvelles_valeurs}], 1)
+
+
+def invalider_periodes_disponibles():
+    """Oublie les périodes disponibles, maintenant et après le commit"""
+    frappe.cache().delete_value(PERIODES_CACHE_KEY)
+    # Une lecture concurrente a pu remettre l'ancienne liste avant le commit
+    frappe.db.after_commit.add(lambda: frappe.cache().delete_value(PERIODES_CACHE_KEY))
+
+
+def propager_attestation_client(doc, method=None):
+    """
+    Retamponne les mouvements d'un client dont l'attestation change et
+    reclasse ses ventes (doc_event Customer on_update)
+    """
+    if not any(doc.has_value_changed(champ) for champ in CHAMPS_ATTESTATION):
+        return
+
+    retamponner_attestations([doc.name])
+
+
+def retamponner_attestations(clients=None):
+    """
+    Recopie l'attestation des clients sur les mouvements et synthèses, puis
+    recalcule les jours du journal dont des ventes ont changé de catégorie
+
+    Returns:
+        int: nombre de jours (société, produit, date) recalculés
+    """
+    jours = tamponner_mouvements(clients)
+    tamponner_syntheses_clients(clients)
+    if jours:
+        reconstruire_journal(jours)
+        incrementer_versions([(company, date_mouvement) for company, _code, date_mouvement in jours])
+        oublier_datasets_periode()
+    return len(jours)
+
+
+@frappe.whitelist()
+def retamponner_attestations_mouvements():
+    """Relève l'attestation client sur tous les mouvements existants"""
+    frappe.only_for("System Manager")
+
+    try:
+        nb_jours = retamponner_attestations()
+        return {
+            "success": True,
+            "message": f"Attestations retamponnées, {nb_jours} jour(s) de journal recalculé(s)",
+        }
+    except Exception as e:
+        frappe.log_error(f"Erreur retamponnage attestations: {str(e)}")
+        return {"success": False, "message": f"Erreur: {str(e)}"}
@@ -1,5 +1,6 @@
 import frappe
 from frappe.utils import flt
+from gnr_compliance.utils.gnr_item_registry import invalidate_gnr_item_registry
 
 # Groupe d'articles GNR officiel
 GNR_ITEM_GROUP = "Combustibles/Carburants/GNR"
@@ -90,7 +91,8 @@ def nettoyer_configuration_gnr():
 		else:
 			print(f"   ✅ Aucun autre groupe similaire trouvé")
 		
-		# 5. Commit des changements
+		# 5. Commit des changements (le registre GNR est republié après commit)
+		invalidate_gnr_item_registry()
 		frappe.db.commit()
 		
 		print(f"\n✅ NETTOYAGE TERMINÉ")
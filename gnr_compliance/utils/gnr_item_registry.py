@@ -0,0 +1,129 @@
+# gnr_compliance/utils/gnr_item_registry.py
+"""
+Registre des articles GNR trackés
+
+Garde en mémoire (par processus) et dans Redis la liste des articles marqués
+is_gnr_tracked avec leurs métadonnées GNR, pour que les hooks de soumission
+testent l'appartenance sans requête. Le registre est versionné : toute
+modification pertinente d'un Item incrémente la version après commit, ce qui
+force chaque processus à recharger sa copie.
+"""
+import frappe
+
+REGISTRY_CACHE_KEY = "gnr_item_registry"
+REGISTRY_VERSION_KEY = "gnr_item_registry_version"
+
+# Métadonnées conservées pour chaque article GNR
+CHAMPS_REGISTRE = ("gnr_tax_rate", "gnr_tracked_category", "stock_uom", "item_group")
+
+# Copie locale au processus, par site : {site: {"version": str, "items": dict}}
+_registres_locaux = {}
+
+
+def get_gnr_item_registry():
+    """
+    Retourne le registre {item_code: métadonnées} des articles GNR trackés
+
+    Ordre de résolution : mémoire de la requête → copie du processus si sa
+    version est à jour → Redis → base de données.
+    """
+    registre = getattr(frappe.local, "gnr_item_registry", None)
+    if registre is not None:
+        return registre
+
+    if getattr(frappe.local, "gnr_item_registry_modifie", False):
+        # Un Item a été modifié dans la transaction en cours : lire la base
+        # directement sans alimenter les caches partagés avant le commit
+        registre = _charger_articles_gnr()
+        frappe.local.gnr_item_registry = registre
+        return registre
+
+    cache = frappe.cache()
+    version = cache.get_value(REGISTRY_VERSION_KEY)
+    if not version:
+        version = _incrementer_version()
+
+    local = _registres_locaux.get(frappe.local.site)
+    if not local or local["version"] != version:
+        local = cache.get_value(REGISTRY_CACHE_KEY)
+        if not local or local.get("version") != version:
+            local = {"version": version, "items": _charger_articles_gnr()}
+            cache.set_value(REGISTRY_CACHE_KEY, local)
+        _registres_locaux[frappe.local.site] = local
+
+    frappe.local.gnr_item_registry = local["items"]
+    return local["items"]
+
+
+def is_gnr_item(item_code):
+    """Vérifie en O(1) si un article est tracké GNR"""
+    return bool(item_code) and item_code in get_gnr_item_registry()
+
+
+def get_gnr_item(item_code):
+    """
+    Retourne les métadonnées GNR d'un article tracké
+
+    Returns:
+        frappe._dict: gnr_tax_rate, gnr_tracked_category, stock_uom, item_group
+        ou None si l'article n'est pas tracké
+    """
+    data = get_gnr_item_registry().get(item_code)
+    return frappe._dict(data) if data is not None else None
+
+
+def _charger_articles_gnr():
+    """Charge tous les articles trackés GNR en une seule requête"""
+    articles = frappe.get_all(
+        "Item",
+        filters={"is_gnr_tracked": 1},
+        fields=["name", *CHAMPS_REGISTRE],
+    )
+    return {
+        article.name: {champ: article.get(champ) for champ in CHAMPS_REGISTRE}
+        for article in articles
+    }
+
+
+def _incrementer_version():
+    """Publie une nouvelle version du registre pour tous les processus"""
+    version = frappe.generate_hash(length=12)
+    frappe.cache().set_value(REGISTRY_VERSION_KEY, version)
+    return version
+
+
+def _modification_pertinente(doc):
+    """Indique si la sauvegarde d'un Item touche le registre GNR"""
+    if doc.has_value_changed("is_gnr_tracked"):
+        return True
+    return bool(doc.get("is_gnr_tracked")) and any(
+        doc.has_value_changed(champ) for champ in CHAMPS_REGISTRE
+    )
+
+
+def invalidate_gnr_item_registry(doc=None, method=None, *args, **kwargs):
+    """
+    Invalide le registre GNR (doc_event Item on_update / on_trash / after_rename)
+
+    Appelée sans document (ex: après une mise à jour SQL en masse des articles),
+    l'invalidation est inconditionnelle.
+    """
+    if doc is not None:
+        if method == "on_update" and not _modification_pertinente(doc):
+            return
+        if method != "on_update" and not doc.get("is_gnr_tracked"):
+            return
+
+    frappe.local.gnr_item_registry = None
+    frappe.local.gnr_item_registry_modifie = True
+
+    # La nouvelle version n'est publiée qu'après commit, pour qu'aucun autre
+    # processus ne mette en cache une lecture antérieure à la modification
+    frappe.db.after_commit.add(_publier_invalidation)
+
+
+def _publier_invalidation():
+    """Callback après commit : nouvelle version et fin de la lecture directe"""
+    _incrementer_version()
+    frappe.local.gnr_item_registry = None
+    frappe.local.gnr_item_registry_modifie = False
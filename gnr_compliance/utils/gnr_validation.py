@@ -5,6 +5,9 @@ import frappe
 from frappe import _
 from frappe.utils import getdate, flt, now_datetime
 import json
+from gnr_compliance.gnr_compliance.doctype.gnr_daily_ledger.gnr_daily_ledger import resoudre_societe
+from gnr_compliance.gnr_compliance.doctype.mouvement_gnr.mouvement_gnr import inserer_mouvements_soumis
+from gnr_compliance.utils.gnr_aggregates import propager_correction
 
 @frappe.whitelist()
 def analyser_taux_gnr_existants():
@@ -314,16 +317,20 @@ def corriger_mouvement_depuis_facture(mouvement_doc):
                         
                         # Mettre à jour le mouvement (cancel + amend pour traçabilité)
                         try:
+                            # Nouveau mouvement avec les bons taux (copie lue avant
+                            # l'annulation, qui libère la ligne source)
+                            nouveau_mouvement = mouvement_doc.as_dict(no_default_fields=True)
+                            nouveau_mouvement.pop("amended_from", None)
+                            nouveau_mouvement.update({
+                                "taux_gnr": nouveau_taux,
+                                "montant_taxe_gnr": nouveau_montant,
+                                "prix_unitaire": item.rate,  # Mettre à jour aussi le prix
+                            })
+
                             # Annuler l'ancien mouvement
                             mouvement_doc.cancel()
-                            
-                            # Créer un nouveau mouvement avec les bons taux
-                            nouveau_mouvement = frappe.copy_doc(mouvement_doc)
-                            nouveau_mouvement.taux_gnr = nouveau_taux
-                            nouveau_mouvement.montant_taxe_gnr = nouveau_montant
-                            nouveau_mouvement.prix_unitaire = item.rate  # Mettre à jour aussi le prix
-                            nouveau_mouvement.insert(ignore_permissions=True)
-                            nouveau_mouvement.submit()
+
+                            nouveau_mouvement = inserer_mouvements_soumis([nouveau_mouvement])[0]
                             
                             frappe.logger().info(f"Mouvement {mouvement_doc.name} corrigé: taux {mouvement_doc.taux_gnr} → {nouveau_taux} (source: {result['source']})")
                             
@@ -416,9 +423,11 @@ def extraire_taux_gnr_depuis_facture(facture, item):
         return {'success': False, 'message': str(e)}
 
 @frappe.whitelist()
-def rapport_taux_gnr_periode(from_date, to_date):
-    """Génère un rapport détaillé des taux GNR réels sur une période"""
+def rapport_taux_gnr_periode(from_date, to_date, company=None):
+    """Génère un rapport détaillé des taux GNR réels d'une société sur une période"""
     try:
+        company = resoudre_societe(company)
+        
         # Analyse globale des taux
         rapport = frappe.db.sql("""
             SELECT 
@@ -440,25 +449,25 @@ def rapport_taux_gnr_periode(from_date, to_date):
                 COUNT(CASE WHEN m.taux_gnr = 0 THEN 1 END) as nb_taux_zero,
                 -- Analyser par type de client
                 SUM(CASE 
-                    WHEN c.custom_n_dossier_ IS NOT NULL AND c.custom_n_dossier_ != '' AND c.custom_date_de_depot IS NOT NULL 
+                    WHEN m.avec_attestation = 1 
                     THEN m.quantite 
                     ELSE 0 
                 END) as volume_avec_attestation,
                 SUM(CASE 
-                    WHEN c.custom_n_dossier_ IS NULL OR c.custom_n_dossier_ = '' OR c.custom_date_de_depot IS NULL
+                    WHEN COALESCE(m.avec_attestation, 0) = 0
                     THEN m.quantite 
                     ELSE 0 
                 END) as volume_sans_attestation
             FROM `tabMouvement GNR` m
             LEFT JOIN `tabItem` i ON m.code_produit = i.name
-            LEFT JOIN `tabCustomer` c ON m.client = c.name
-            WHERE m.date_mouvement BETWEEN %s AND %s
+            WHERE m.company = %s
+            AND m.date_mouvement BETWEEN %s AND %s
             AND m.docstatus = 1
             AND m.type_mouvement = 'Vente'
             AND m.quantite > 0
             GROUP BY m.code_produit, i.item_name
             ORDER BY quantite_totale DESC
-        """, (from_date, to_date), as_dict=True)
+        """, (company, from_date, to_date), as_dict=True)
         
         # Analyse temporelle (évolution des taux)
         evolution = frappe.db.sql("""
@@ -470,13 +479,14 @@ def rapport_taux_gnr_periode(from_date, to_date):
                 SUM(m.montant_taxe_gnr) / SUM(m.quantite) as taux_pondere,
                 COUNT(CASE WHEN m.taux_gnr IN (1.77, 3.86, 6.83, 2.84, 24.81) THEN 1 END) as nb_suspects
             FROM `tabMouvement GNR` m
-            WHERE m.date_mouvement BETWEEN %s AND %s
+            WHERE m.company = %s
+            AND m.date_mouvement BETWEEN %s AND %s
             AND m.docstatus = 1
             AND m.type_mouvement = 'Vente'
             AND m.quantite > 0
             GROUP BY YEAR(m.date_mouvement), QUARTER(m.date_mouvement)
             ORDER BY annee, trimestre
-        """, (from_date, to_date), as_dict=True)
+        """, (company, from_date, to_date), as_dict=True)
         
         # Top 10 des clients par volume pour analyse des taux
         top_clients = frappe.db.sql("""
@@ -487,20 +497,21 @@ def rapport_taux_gnr_periode(from_date, to_date):
                 AVG(m.taux_gnr) as taux_moyen_client,
                 SUM(m.montant_taxe_gnr) / SUM(m.quantite) as taux_pondere_client,
                 CASE 
-                    WHEN c.custom_n_dossier_ IS NOT NULL AND c.custom_n_dossier_ != '' AND c.custom_date_de_depot IS NOT NULL 
+                    WHEN MAX(COALESCE(m.avec_attestation, 0)) = 1 
                     THEN 'Avec attestation' 
                     ELSE 'Sans attestation' 
                 END as statut_attestation
             FROM `tabMouvement GNR` m
             LEFT JOIN `tabCustomer` c ON m.client = c.name
-            WHERE m.date_mouvement BETWEEN %s AND %s
+            WHERE m.company = %s
+            AND m.date_mouvement BETWEEN %s AND %s
             AND m.docstatus = 1
             AND m.type_mouvement = 'Vente'
             AND m.client IS NOT NULL
-            GROUP BY m.client, c.customer_name, c.custom_n_dossier_, c.custom_date_de_depot
+            GROUP BY m.client, c.customer_name
             ORDER BY volume_total DESC
             LIMIT 10
-        """, (from_date, to_date), as_dict=True)
+        """, (company, from_date, to_date), as_dict=True)
         
         return {
             'success': True,
@@ -531,7 +542,8 @@ def recalculer_montants_taxe(limite=500):
     try:
         # Trouver les mouvements avec des écarts de calcul
         mouvements_incorrects = frappe.db.sql("""
-            SELECT name, quantite, taux_gnr, montant_taxe_gnr,
+            SELECT name, type_mouvement, code_produit, date_mouvement, creation, company, client, avec_attestation,
+                   quantite, prix_unitaire, taux_gnr, montant_taxe_gnr,
                    (quantite * taux_gnr) as montant_calcule,
                    ABS((quantite * taux_gnr) - COALESCE(montant_taxe_gnr, 0)) as ecart
             FROM `tabMouvement GNR`
@@ -553,6 +565,7 @@ def recalculer_montants_taxe(limite=500):
                 # Mettre à jour directement en base (plus rapide)
                 frappe.db.set_value("Mouvement GNR", mouvement.name, 
                                   "montant_taxe_gnr", nouveau_montant)
+                propager_correction(mouvement, {"montant_taxe_gnr": nouveau_montant})
                 corriges += 1
                 
             except Exception as e:
@@ -581,19 +594,20 @@ def detecter_anomalies_taux():
         # Analyser les variations de taux par produit
         anomalies = frappe.db.sql("""
             WITH stats_produit AS (
+                -- Sommes glissantes sur les agrégats journaliers (au plus 366 lignes par article)
                 SELECT 
                     code_produit,
-                    AVG(taux_gnr) as taux_moyen,
-                    STDDEV(taux_gnr) as ecart_type,
-                    MIN(taux_gnr) as taux_min,
-                    MAX(taux_gnr) as taux_max,
-                    COUNT(*) as nb_mouvements
-                FROM `tabMouvement GNR`
-                WHERE docstatus = 1 
-                AND taux_gnr > 0
-                AND date_mouvement >= DATE_SUB(CURDATE(), INTERVAL 12 MONTH)
+                    SUM(somme_taux) / SUM(nb_taux) as taux_moyen,
+                    SQRT(GREATEST(
+                        SUM(somme_carres) / SUM(nb_taux) - POW(SUM(somme_taux) / SUM(nb_taux), 2), 0
+                    )) as ecart_type,
+                    MIN(taux_min) as taux_min,
+                    MAX(taux_max) as taux_max,
+                    SUM(nb_taux) as nb_mouvements
+                FROM `tabGNR Item Rate Daily`
+                WHERE date_mouvement >= DATE_SUB(CURDATE(), INTERVAL 12 MONTH)
                 GROUP BY code_produit
-                HAVING COUNT(*) >= 5  -- Au moins 5 mouvements pour avoir des stats
+                HAVING SUM(nb_taux) >= 5  -- Au moins 5 mouvements pour avoir des stats
             )
             SELECT 
                 m.name,
@@ -0,0 +1,429 @@
+# gnr_compliance/utils/period_dataset.py
+"""
+Jeu de données d'une période GNR, mémorisé pour la requête
+
+Les exports, générateurs Excel, prévisualisations et contrôles de cohérence
+en tirent leurs vues au lieu d'interroger chacun la table avec sa propre
+requête et ses propres noms de colonnes. Les vues tenues à jour par des
+agrégats les lisent : stock journalier depuis le moteur de stock
+(calculer_grand_livre_stock : journal quotidien et clôtures), clients d'une
+période de semestres entiers depuis les synthèses semestrielles.
+
+Seules les vues sans agrégat (produits par taux, contrôle qualité des taux,
+clients d'une période quelconque) parcourent les mouvements soumis : ils
+sont lus en une requête à la première de ces vues et gardés en colonnes
+(tableaux compacts pour les jours, volumes, prix et taux).
+
+Une sous-période d'un jeu déjà mémorisé (trimestre ou semestre d'une année)
+en est extraite sans nouvelle lecture. Toute propagation de mouvements
+oublie les jeux mémorisés.
+"""
+from array import array
+from bisect import bisect_left, bisect_right
+
+import frappe
+from frappe.utils import add_days, date_diff, flt, getdate
+
+from gnr_compliance.gnr_compliance.doctype.gnr_client_semester_summary.gnr_client_semester_summary import (
+    get_clients_semestres,
+    semestres_couverts,
+)
+from gnr_compliance.gnr_compliance.doctype.gnr_daily_ledger.gnr_daily_ledger import (
+    TYPES_ENTREE,
+    TYPES_SORTIE,
+)
+from gnr_compliance.utils.stock_ledger import calculer_grand_livre_stock
+
+# Colonnes chargées, dans l'ordre de la requête ; jour : rang dans la période
+COLONNES = (
+    "jour",
+    "name",
+    "type_mouvement",
+    "code_produit",
+    "client",
+    "reference_attestation",
+    "quantite",
+    "prix_unitaire",
+    "taux_gnr",
+    "montant_taxe_gnr",
+    "avec_attestation",
+)
+# Colonnes numériques en tableaux compacts (les autres en listes)
+TYPES_COLONNES = {
+    "jour": "l",
+    "quantite": "d",
+    "prix_unitaire": "d",
+    "taux_gnr": "d",
+    "montant_taxe_gnr": "d",
+    "avec_attestation": "b",
+}
+
+# Taux par défaut, signe d'un taux non résolu sur le mouvement
+TAUX_SUSPECTS = (1.77, 3.86, 6.83, 2.84, 24.81)
+
+
+class GNRPeriodDataset:
+    """Vues d'une période ; mouvements soumis en colonnes, triés par date, lus à la demande"""
+
+    def __init__(self, from_date, to_date, company, colonnes=None, origine=None):
+        self.from_date = getdate(from_date)
+        self.to_date = getdate(to_date)
+        self.company = company
+        self._colonnes = colonnes
+        # Jeu parent d'une sous-période
+        self.origine = origine
+        self._vues = {}
+
+    @classmethod
+    def charger(cls, from_date, to_date, company=None):
+        """
+        Jeu de la période, sans lecture : les mouvements ne sont lus qu'à la
+        première vue qui les parcourt
+
+        Args:
+            company: société (None : toutes)
+        """
+        return cls(from_date, to_date, company)
+
+    @property
+    def colonnes(self):
+        """Mouvements soumis de la période, lus ou découpés dans le jeu parent au premier accès"""
+        if self._colonnes is None:
+            if self.origine is not None:
+                self._colonnes = self.origine._tranche(self.from_date, self.to_date)
+            else:
+                self._colonnes = _lire_mouvements(self.from_date, self.to_date, self.company)
+        return self._colonnes
+
+    def __len__(self):
+        return len(self.colonnes["jour"])
+
+    def __getitem__(self, colonne):
+        return self.colonnes[colonne]
+
+    def sous_periode(self, from_date, to_date):
+        """Jeu d'une période incluse, dont les vues sont extraites de celles de ce jeu"""
+        from_date, to_date = getdate(from_date), getdate(to_date)
+        if from_date == self.from_date and to_date == self.to_date:
+            return self
+        if from_date < self.from_date or to_date > self.to_date:
+            frappe.throw(f"Période {from_date} - {to_date} hors du jeu {self.from_date} - {self.to_date}")
+        return GNRPeriodDataset(from_date, to_date, self.company, origine=self)
+
+    def _tranche(self, from_date, to_date):
+        """
+        Colonnes d'une période incluse, sans relire la base
+
+        Les mouvements étant triés par date, la sous-période est une tranche
+        de chaque colonne.
+        """
+        decalage = date_diff(from_date, self.from_date)
+        jours = self.colonnes["jour"]
+        debut = bisect_left(jours, decalage)
+        fin = bisect_right(jours, date_diff(to_date, self.from_date))
+
+        colonnes = {colonne: serie[debut:fin] for colonne, serie in self.colonnes.items()}
+        colonnes["jour"] = array("l", (jour - decalage for jour in colonnes["jour"]))
+        return colonnes
+
+    def mouvements(self):
+        """Une frappe._dict par mouvement (colonnes chargées), par date"""
+        for valeurs in zip(*(self.colonnes[colonne] for colonne in COLONNES), strict=True):
+            yield frappe._dict(zip(COLONNES, valeurs, strict=True))
+
+    def date(self, jour):
+        return add_days(self.from_date, jour)
+
+    # === VUE STOCK JOURNALIER ===
+
+    def grand_livre(self, par_produit=False):
+        """
+        Stock jour par jour depuis le journal quotidien et les clôtures
+        (calculer_grand_livre_stock) ; celui d'une sous-période est extrait
+        du grand livre du jeu parent
+
+        Returns:
+            GrandLivreStock
+        """
+        cle = ("grand_livre", par_produit)
+        if cle not in self._vues:
+            if self.origine is not None:
+                grand_livre = self.origine.grand_livre(par_produit).sous_periode(self.from_date, self.to_date)
+            else:
+                grand_livre = calculer_grand_livre_stock(self.from_date, self.to_date, self.company, par_produit)
+            self._vues[cle] = grand_livre
+        return self._vues[cle]
+
+    # === VUE CLIENTS ===
+
+    def clients(self):
+        """
+        Ventes par client, même forme que get_clients_avec_attestation_reels
+        (siret : SIRET du client, sinon son numéro fiscal), par raison sociale
+
+        Lues sur les synthèses semestrielles quand la période couvre des
+        semestres entiers, sinon cumulées depuis les mouvements.
+        """
+        if "clients" not in self._vues:
+            semestres = semestres_couverts(self.from_date, self.to_date)
+            if semestres:
+                self._vues["clients"] = get_clients_semestres(semestres, self.company)
+            else:
+                self._vues["clients"] = self._clients_mouvements()
+        return self._vues["clients"]
+
+    def _clients_mouvements(self):
+        ventes = {}
+        for mouvement in self.mouvements():
+            if mouvement.type_mouvement != "Vente" or not mouvement.client:
+                continue
+            client = ventes.get(mouvement.client)
+            if client is None:
+                client = ventes[mouvement.client] = frappe._dict(
+                    code_client=mouvement.client,
+                    quantite_totale=0,
+                    montant_ht_reel=0,
+                    montant_taxe_reel=0,
+                    avec_attestation=0,
+                    numero_dossier=None,
+                    nb_mouvements=0,
+                    premier_jour=mouvement.jour,
+                    dernier_jour=mouvement.jour,
+                    taux_min=mouvement.taux_gnr,
+                    taux_max=mouvement.taux_gnr,
+                )
+            client.quantite_totale += mouvement.quantite
+            client.montant_ht_reel += mouvement.quantite * mouvement.prix_unitaire
+            client.montant_taxe_reel += mouvement.montant_taxe_gnr
+            client.avec_attestation = max(client.avec_attestation, mouvement.avec_attestation)
+            if mouvement.reference_attestation:
+                client.numero_dossier = max(client.numero_dossier or "", mouvement.reference_attestation)
+            client.nb_mouvements += 1
+            client.dernier_jour = mouvement.jour
+            client.taux_min = min(client.taux_min, mouvement.taux_gnr)
+            client.taux_max = max(client.taux_max, mouvement.taux_gnr)
+
+        fiches = _fiches_clients(list(ventes))
+        clients = []
+        for client in ventes.values():
+            if client.quantite_totale <= 0:
+                continue
+            fiche = fiches.get(client.code_client, {})
+            client.nom_client = fiche.get("customer_name") or client.code_client
+            client.siret = fiche.get("siret") or fiche.get("tax_id")
+            client.date_depot = fiche.get("custom_date_de_depot")
+            # Conversion L vers hL
+            client.taux_reel_par_hl = client.montant_taxe_reel / (client.quantite_totale / 100)
+            client.premiere_vente = self.date(client.pop("premier_jour"))
+            client.derniere_vente = self.date(client.pop("dernier_jour"))
+            clients.append(client)
+
+        clients.sort(key=lambda client: client.nom_client)
+        self._vues["clients"] = clients
+        return self._vues["clients"]
+
+    # === VUE PRODUITS ===
+
+    def produits(self):
+        """Entrées, sorties et taxe par produit et taux, par code produit"""
+        if "produits" not in self._vues:
+            groupes = {}
+            for mouvement in self.mouvements():
+                cle = (mouvement.code_produit, mouvement.taux_gnr)
+                groupe = groupes.get(cle)
+                if groupe is None:
+                    groupe = groupes[cle] = frappe._dict(
+                        code_produit=mouvement.code_produit,
+                        taux_gnr=mouvement.taux_gnr,
+                        entrees=0,
+                        sorties=0,
+                        montant_taxe=0,
+                    )
+                if mouvement.type_mouvement in TYPES_ENTREE:
+                    groupe.entrees += mouvement.quantite
+                if mouvement.type_mouvement in TYPES_SORTIE:
+                    groupe.sorties += mouvement.quantite
+                groupe.montant_taxe += mouvement.montant_taxe_gnr
+
+            designations = _designations_produits({code_produit for code_produit, _taux in groupes})
+            for groupe in groupes.values():
+                groupe.designation = designations.get(groupe.code_produit)
+            self._vues["produits"] = [groupes[cle] for cle in sorted(groupes, key=lambda cle: (cle[0] or "", cle[1]))]
+        return self._vues["produits"]
+
+    # === VUE QUALITÉ ===
+
+    def qualite(self):
+        """
+        Contrôle des taux des mouvements de volume positif, par produit et
+        au global, et répartition des ventes avec ou sans attestation
+
+        Returns:
+            frappe._dict: total_mouvements, taux_suspects, taux_zero,
+            taux_aberrants, calculs_incorrects, taux_moyen, taux_min,
+            taux_max, par_produit (volume décroissant), attestations
+        """
+        if "qualite" not in self._vues:
+            qualite = frappe._dict(
+                total_mouvements=0, taux_suspects=0, taux_zero=0, taux_aberrants=0, calculs_incorrects=0,
+                taux_moyen=None, taux_min=None, taux_max=None,
+            )
+            produits = {}
+            clients, clients_avec_attestation = set(), set()
+            attestations = frappe._dict(volume_avec_attestation=0, volume_sans_attestation=0)
+            somme_taux = 0
+
+            for mouvement in self.mouvements():
+                if mouvement.type_mouvement == "Vente" and mouvement.client:
+                    clients.add(mouvement.client)
+                    if mouvement.avec_attestation:
+                        clients_avec_attestation.add(mouvement.client)
+                        attestations.volume_avec_attestation += mouvement.quantite
+                    else:
+                        attestations.volume_sans_attestation += mouvement.quantite
+
+                if mouvement.quantite <= 0:
+                    continue
+                taux = mouvement.taux_gnr
+                suspect = round(taux, 2) in TAUX_SUSPECTS
+                qualite.total_mouvements += 1
+                qualite.taux_suspects += suspect
+                qualite.taux_zero += taux == 0
+                qualite.taux_aberrants += taux < 0.1 or taux > 50
+                qualite.calculs_incorrects += flt(mouvement.montant_taxe_gnr, 2) != flt(mouvement.quantite * taux, 2)
+                somme_taux += taux
+                qualite.taux_min = taux if qualite.taux_min is None else min(qualite.taux_min, taux)
+                qualite.taux_max = taux if qualite.taux_max is None else max(qualite.taux_max, taux)
+
+                produit = produits.get(mouvement.code_produit)
+                if produit is None:
+                    produit = produits[mouvement.code_produit] = frappe._dict(
+                        code_produit=mouvement.code_produit, nb_mouvements=0, taux_min=taux, taux_max=taux,
+                        somme_taux=0, quantite_totale=0, taxe_totale=0, nb_taux_suspects=0,
+                    )
+                produit.nb_mouvements += 1
+                produit.taux_min = min(produit.taux_min, taux)
+                produit.taux_max = max(produit.taux_max, taux)
+                produit.somme_taux += taux
+                produit.quantite_totale += mouvement.quantite
+                produit.taxe_totale += mouvement.montant_taxe_gnr
+                produit.nb_taux_suspects += suspect
+
+            if qualite.total_mouvements:
+                qualite.taux_moyen = somme_taux / qualite.total_mouvements
+
+            designations = _designations_produits(set(produits))
+            for produit in produits.values():
+                produit.item_name = designations.get(produit.code_produit)
+                produit.taux_moyen = produit.pop("somme_taux") / produit.nb_mouvements
+                produit.taux_pondere_reel = produit.taxe_totale / produit.quantite_totale
+            qualite.par_produit = sorted(produits.values(), key=lambda produit: -produit.quantite_totale)
+
+            attestations.total_clients = len(clients)
+            attestations.clients_avec_attestation = len(clients_avec_attestation)
+            qualite.attestations = attestations
+            self._vues["qualite"] = qualite
+        return self._vues["qualite"]
+
+
+def get_dataset_periode(from_date, to_date, company=None):
+    """
+    Jeu de données de la période pour la requête en cours
+
+    Mémorisé au premier appel ; une période couverte par un jeu déjà
+    mémorisé pour la même société en est extraite sans nouvelle lecture.
+
+    Args:
+        company: société (None : toutes)
+
+    Returns:
+        GNRPeriodDataset
+    """
+    from_date, to_date = getdate(from_date), getdate(to_date)
+    jeux = getattr(frappe.local, "gnr_datasets_periode", None)
+    if jeux is None:
+        jeux = frappe.local.gnr_datasets_periode = {}
+
+    cle = (company, from_date, to_date)
+    if cle not in jeux:
+        parent = next(
+            (
+                jeu
+                for jeu in jeux.values()
+                if jeu.company == company and jeu.from_date <= from_date and to_date <= jeu.to_date
+            ),
+            None,
+        )
+        jeux[cle] = (
+            parent.sous_periode(from_date, to_date) if parent is not None else GNRPeriodDataset.charger(from_date, to_date, company)
+        )
+    return jeux[cle]
+
+
+def oublier_datasets_periode():
+    """Oublie les jeux mémorisés dans la requête (mouvements propagés ou retamponnés)"""
+    frappe.local.gnr_datasets_periode = None
+
+
+def _lire_mouvements(from_date, to_date, company):
+    """
+    Mouvements soumis de la période en colonnes, en une requête
+
+    Args:
+        company: société (None : toutes)
+    """
+    condition = "AND company = %(company)s" if company else ""
+    lignes = frappe.db.sql(
+        f"""
+        SELECT
+            DATEDIFF(date_mouvement, %(from_date)s),
+            name, type_mouvement, code_produit, client, reference_attestation,
+            COALESCE(quantite, 0), COALESCE(prix_unitaire, 0),
+            COALESCE(taux_gnr, 0), COALESCE(montant_taxe_gnr, 0),
+            COALESCE(avec_attestation, 0)
+        FROM `tabMouvement GNR`
+        WHERE docstatus = 1
+        AND date_mouvement BETWEEN %(from_date)s AND %(to_date)s
+        {condition}
+        ORDER BY date_mouvement, creation
+        """,
+        {"from_date": from_date, "to_date": to_date, "company": company},
+    )
+
+    valeurs = list(zip(*lignes, strict=True)) if lignes else [()] * len(COLONNES)
+    colonnes = {}
+    for colonne, serie in zip(COLONNES, valeurs, strict=True):
+        type_colonne = TYPES_COLONNES.get(colonne)
+        colonnes[colonne] = array(type_colonne, serie) if type_colonne else list(serie)
+    return colonnes
+
+
+def _fiches_clients(clients):
+    """{client: customer_name, siret, tax_id, custom_date_de_depot}"""
+    if not clients:
+        return {}
+    return {
+        fiche.name: fiche
+        for fiche in frappe.db.sql(
+            """
+            SELECT name, customer_name, siret, tax_id, custom_date_de_depot
+            FROM `tabCustomer`
+            WHERE name IN %(clients)s
+            """,
+            {"clients": tuple(clients)},
+            as_dict=True,
+        )
+    }
+
+
+def _designations_produits(codes_produits):
+    """{code_produit: nom de l'article}"""
+    codes_produits = [code_produit for code_produit in codes_produits if code_produit]
+    if not codes_produits:
+        return {}
+    return dict(
+        frappe.db.sql(
+            "SELECT name, item_name FROM `tabItem` WHERE name IN %(codes)s",
+            {"codes": tuple(codes_produits)},
+        )
+    )
@@ -0,0 +1,135 @@
+# gnr_compliance/utils/period_snapshot.py
+"""
+Instantanés figés des déclarations GNR soumises
+
+À la soumission d'une Declaration Periode GNR, les données déclarées
+(stock journalier, liste clients, diagnostic et contrôle de cohérence)
+sont enregistrées dans un fichier JSON compressé (gzip, colonnes) attaché
+à la déclaration, avec pour une déclaration annuelle la liste clients de
+chaque semestre. Les lectures ultérieures de la déclaration servent cet
+instantané au lieu de réinterroger les mouvements, qui ont pu changer
+depuis le dépôt.
+"""
+import gzip
+import json
+
+import frappe
+from frappe.utils import getdate
+
+from gnr_compliance.utils.date_utils import get_period_dates
+from gnr_compliance.utils.export_formats_exacts import (
+    calculer_mouvements_journaliers_reels,
+    get_clients_avec_attestation_reels,
+)
+
+INSTANTANE_CACHE_KEY = "gnr_declaration_snapshot"
+VERSION_INSTANTANE = 2
+
+
+def en_colonnes(lignes):
+    """Liste de dicts → {colonne: valeurs} (clés de la première ligne)"""
+    if not lignes:
+        return {}
+    colonnes = list(lignes[0])
+    return {colonne: [ligne.get(colonne) for ligne in lignes] for colonne in colonnes}
+
+
+def depuis_colonnes(colonnes):
+    """{colonne: valeurs} → liste de dicts"""
+    if not colonnes:
+        return []
+    noms = list(colonnes)
+    return [
+        dict(zip(noms, valeurs, strict=True))
+        for valeurs in zip(*(colonnes[nom] for nom in noms), strict=True)
+    ]
+
+
+def construire_instantane(declaration):
+    """Données déclarées de la période, à l'instant de la soumission"""
+    instantane = {
+        "version": VERSION_INSTANTANE,
+        "declaration": declaration.name,
+        "company": declaration.company,
+        "date_debut": str(declaration.date_debut),
+        "date_fin": str(declaration.date_fin),
+        "version_donnees": declaration.version_donnees,
+        "mouvements_journaliers": en_colonnes(
+            calculer_mouvements_journaliers_reels(
+                str(declaration.date_debut), str(declaration.date_fin), declaration.company
+            )
+        ),
+        "clients": en_colonnes(
+            get_clients_avec_attestation_reels(
+                declaration.date_debut, declaration.date_fin, declaration.company
+            )
+        ),
+        "diagnostic": declaration.diagnostiquer_donnees(),
+        "coherence": declaration.valider_coherence_donnees(),
+    }
+
+    if declaration.type_periode == "Annuel":
+        # Listes semestrielles de l'export annuel (extraites du jeu de l'année)
+        annee = getdate(declaration.date_debut).year
+        instantane["clients_semestres"] = {}
+        for semestre in (1, 2):
+            debut, fin = get_period_dates("Semestriel", f"S{semestre}", annee)
+            debut, fin = max(debut, getdate(declaration.date_debut)), min(fin, getdate(declaration.date_fin))
+            if debut <= fin:
+                instantane["clients_semestres"][str(semestre)] = en_colonnes(
+                    get_clients_avec_attestation_reels(debut, fin, declaration.company)
+                )
+    return instantane
+
+
+def enregistrer_instantane(declaration):
+    """
+    Fige l'instantané de la déclaration dans un fichier privé attaché
+
+    Returns:
+        str: URL du fichier
+    """
+    donnees = frappe.as_json(construire_instantane(declaration), indent=None)
+    contenu = gzip.compress(donnees.encode("utf-8"))
+
+    fichier = frappe.get_doc(
+        {
+            "doctype": "File",
+            "file_name": f"{declaration.name}-instantane.json.gz",
+            "content": contenu,
+            "is_private": 1,
+            "attached_to_doctype": declaration.doctype,
+            "attached_to_name": declaration.name,
+            "attached_to_field": "fichier_instantane",
+        }
+    )
+    fichier.save(ignore_permissions=True)
+    declaration.db_set("fichier_instantane", fichier.file_url, update_modified=False)
+    # Mis en cache seulement si la soumission est validée
+    frappe.db.after_commit.add(
+        lambda: frappe.cache().hset(INSTANTANE_CACHE_KEY, declaration.name, json.loads(donnees))
+    )
+    return fichier.file_url
+
+
+def charger_instantane(declaration):
+    """
+    Instantané figé d'une déclaration soumise (cache Redis, sinon fichier)
+
+    Returns:
+        dict ou None si la déclaration n'a pas d'instantané
+    """
+    if declaration.docstatus != 1 or not declaration.get("fichier_instantane"):
+        return None
+
+    cache = frappe.cache()
+    instantane = cache.hget(INSTANTANE_CACHE_KEY, declaration.name)
+    if instantane is None:
+        fichier = frappe.get_doc("File", {"file_url": declaration.fichier_instantane})
+        instantane = json.loads(gzip.decompress(fichier.get_content()))
+        cache.hset(INSTANTANE_CACHE_KEY, declaration.name, instantane)
+    return instantane
+
+
+def oublier_instantane(declaration):
+    frappe.cache().hdel(INSTANTANE_CACHE_KEY, declaration.name)
@@ -0,0 +1,136 @@
+# gnr_compliance/utils/query_plans.py
+"""
+Contrôle des plans d'exécution des requêtes connues sur Mouvement GNR
+
+Chaque requête fréquente de l'application (hooks de capture, déclarations,
+listes clients, historique des taux) est passée à EXPLAIN. Une requête qui
+retombe sur un parcours complet de tabMouvement GNR (type ALL) est signalée.
+"""
+import frappe
+
+TABLE_MOUVEMENT = "tabMouvement GNR"
+
+# (nom, requête avec paramètres nommés)
+REQUETES_CONNUES = [
+    (
+        "lignes_capturees",
+        """SELECT code_produit, reference_detail FROM `tabMouvement GNR`
+        WHERE reference_document = %(reference_document)s
+        AND reference_name = %(reference_name)s AND docstatus < 2""",
+    ),
+    (
+        "totaux_periode",
+        """SELECT SUM(m.quantite), SUM(m.montant_taxe_gnr) FROM `tabMouvement GNR` m
+        WHERE m.company = %(company)s AND m.docstatus = 1
+        AND m.date_mouvement BETWEEN %(from_date)s AND %(to_date)s""",
+    ),
+    (
+        "liste_clients_semestrielle",
+        """SELECT m.client, SUM(m.quantite), SUM(m.quantite * m.prix_unitaire),
+            SUM(m.montant_taxe_gnr), COUNT(DISTINCT m.name), MIN(m.date_mouvement),
+            MAX(m.date_mouvement), MIN(m.taux_gnr), MAX(m.taux_gnr)
+        FROM `tabMouvement GNR` m
+        WHERE m.company = %(company)s
+        AND m.date_mouvement BETWEEN %(from_date)s AND %(to_date)s
+        AND m.docstatus = 1 AND m.type_mouvement = 'Vente' AND m.client IS NOT NULL
+        GROUP BY m.client""",
+    ),
+    (
+        "ventes_client",
+        """SELECT name, quantite, montant_taxe_gnr FROM `tabMouvement GNR`
+        WHERE client = %(client)s AND company = %(company)s
+        AND date_mouvement BETWEEN %(from_date)s AND %(to_date)s
+        AND type_mouvement = 'Vente'""",
+    ),
+    (
+        "historique_article",
+        """SELECT taux_gnr, quantite, montant_taxe_gnr FROM `tabMouvement GNR`
+        WHERE code_produit = %(code_produit)s AND date_mouvement >= %(from_date)s
+        AND docstatus = 1""",
+    ),
+    (
+        "historique_article_societe",
+        """SELECT taux_gnr, quantite, montant_taxe_gnr FROM `tabMouvement GNR`
+        WHERE company = %(company)s AND code_produit = %(code_produit)s
+        AND date_mouvement >= %(from_date)s AND docstatus = 1""",
+    ),
+    (
+        "extremes_taux_jour",
+        """SELECT code_produit, date_mouvement, MIN(taux_gnr), MAX(taux_gnr)
+        FROM `tabMouvement GNR`
+        WHERE docstatus = 1 AND taux_gnr > 0
+        AND (code_produit, date_mouvement) IN ((%(code_produit)s, %(from_date)s))
+        GROUP BY code_produit, date_mouvement""",
+    ),
+]
+
+
+def analyser_plans(parametres):
+    """
+    Passe chaque requête connue à EXPLAIN
+
+    Args:
+        parametres: dict des valeurs des paramètres nommés des requêtes
+
+    Returns:
+        list: {requete, plan, parcours_complet} pour chaque requête
+    """
+    resultats = []
+    for nom, requete in REQUETES_CONNUES:
+        plan = frappe.db.sql(f"EXPLAIN {requete}", parametres, as_dict=True)
+        parcours_complet = [
+            ligne for ligne in plan
+            if ligne.get("table") in (TABLE_MOUVEMENT, "m") and ligne.get("type") == "ALL"
+        ]
+        resultats.append({"requete": nom, "plan": plan, "parcours_complet": bool(parcours_complet)})
+    return resultats
+
+
+def requetes_en_parcours_complet(parametres):
+    """Noms des requêtes connues dont le plan parcourt toute la table"""
+    return [r["requete"] for r in analyser_plans(parametres) if r["parcours_complet"]]
+
+
+@frappe.whitelist()
+def verifier_plans_requetes(from_date=None, to_date=None):
+    """
+    Vérifie les plans d'exécution sur les données du site
+
+    Les paramètres sont pris sur un mouvement existant pour que l'optimiseur
+    estime des valeurs réelles.
+    """
+    frappe.only_for("System Manager")
+
+    try:
+        exemple = frappe.db.get_value(
+            "Mouvement GNR",
+            {"docstatus": 1, "client": ["is", "set"]},
+            ["reference_document", "reference_name", "client", "code_produit", "date_mouvement", "company"],
+            as_dict=True,
+            order_by="creation desc",
+        )
+        if not exemple:
+            return {"success": False, "message": "Aucun mouvement GNR soumis à analyser"}
+
+        parametres = {
+            **exemple,
+            "from_date": from_date or exemple.date_mouvement,
+            "to_date": to_date or exemple.date_mouvement,
+        }
+        resultats = analyser_plans(parametres)
+        en_echec = [r["requete"] for r in resultats if r["parcours_complet"]]
+
+        return {
+            "success": not en_echec,
+            "requetes": resultats,
+            "parcours_complets": en_echec,
+            "message": (
+                f"{len(en_echec)} requête(s) en parcours complet: {', '.join(en_echec)}"
+                if en_echec
+                else "✅ Toutes les requêtes connues utilisent un index"
+            ),
+        }
+
+    except Exception as e:
+        frappe.log_error(f"Erreur vérification plans requêtes GNR: {str(e)}")
+        return {"success": False, "message": str(e)}
@@ -0,0 +1,249 @@
+# gnr_compliance/utils/stock_ledger.py
+"""
+Moteur de stock journalier GNR
+
+Calcule pour chaque jour d'une période (et pour chaque produit si demandé)
+le stock initial, les flux et le stock final depuis le journal quotidien
+(GNR Daily Ledger) et les clôtures de stock. Le cumul est fait en une
+requête SQL avec SUM() OVER quand la base supporte les fonctions de
+fenêtrage, sinon par somme cumulée (NumPy si disponible) sur un index
+dense de jours.
+
+Le résultat est en colonnes (GrandLivreStock) ; les exports lisent les
+lignes ou les soldes par produit.
+"""
+from itertools import accumulate
+
+import frappe
+from frappe.utils import add_days, date_diff, flt, getdate
+
+from gnr_compliance.gnr_compliance.doctype.gnr_daily_ledger.gnr_daily_ledger import COLONNES_JOURNAL
+from gnr_compliance.gnr_compliance.doctype.gnr_stock_checkpoint.gnr_stock_checkpoint import (
+    get_stocks_initiaux,
+)
+
+# Produit unique des grands livres tous produits confondus
+TOUS_PRODUITS = ""
+
+
+class GrandLivreStock:
+    """Stock journalier en colonnes, trié par produit puis par date"""
+
+    COLONNES = ("date", "code_produit", "stock_initial", *COLONNES_JOURNAL, "stock_final")
+
+    def __init__(self):
+        self.colonnes = {colonne: [] for colonne in self.COLONNES}
+
+    def __len__(self):
+        return len(self.colonnes["date"])
+
+    def __getitem__(self, colonne):
+        return self.colonnes[colonne]
+
+    def ajouter_produit(self, code_produit, dates, flux, stock_initial):
+        """
+        Ajoute la série d'un produit
+
+        Args:
+            dates: jours de la période
+            flux: {colonne du journal ou "stock_final": valeurs alignées sur dates}
+            stock_initial: stock au début du premier jour
+        """
+        stocks_finaux = flux.pop("stock_final")
+        precedent = stock_initial
+        for index, date in enumerate(dates):
+            self.colonnes["date"].append(date)
+            self.colonnes["code_produit"].append(code_produit)
+            self.colonnes["stock_initial"].append(precedent)
+            for colonne in COLONNES_JOURNAL:
+                self.colonnes[colonne].append(flux[colonne][index])
+            precedent = stocks_finaux[index]
+            self.colonnes["stock_final"].append(precedent)
+
+    def lignes(self):
+        """Une frappe._dict par jour (et par produit)"""
+        return [
+            frappe._dict(zip(self.COLONNES, valeurs, strict=True))
+            for valeurs in zip(*(self.colonnes[colonne] for colonne in self.COLONNES), strict=True)
+        ]
+
+    def sous_periode(self, from_date, to_date):
+        """
+        Lignes des jours d'une période incluse (chaque ligne garde son stock
+        initial, le découpage ne change pas les soldes)
+        """
+        from_date, to_date = getdate(from_date), getdate(to_date)
+        indices = [index for index, date in enumerate(self.colonnes["date"]) if from_date <= date <= to_date]
+        grand_livre = GrandLivreStock()
+        for colonne in self.COLONNES:
+            serie = self.colonnes[colonne]
+            grand_livre.colonnes[colonne] = [serie[index] for index in indices]
+        return grand_livre
+
+    def soldes_par_produit(self):
+        """
+        Returns:
+            dict: {code_produit: (stock au début de la période, stock à la fin)}
+        """
+        soldes = {}
+        for code_produit, initial, final in zip(
+            self.colonnes["code_produit"], self.colonnes["stock_initial"], self.colonnes["stock_final"],
+            strict=True,
+        ):
+            debut = soldes[code_produit][0] if code_produit in soldes else initial
+            soldes[code_produit] = (debut, final)
+        return soldes
+
+
+def calculer_grand_livre_stock(from_date, to_date, company=None, par_produit=False):
+    """
+    Stock jour par jour sur la période
+
+    Args:
+        company: société (None : toutes)
+        par_produit: une série par produit au lieu d'un total
+
+    Returns:
+        GrandLivreStock
+    """
+    from_date, to_date = getdate(from_date), getdate(to_date)
+    stocks_initiaux = get_stocks_initiaux(from_date, company)
+
+    if fonctions_fenetre_supportees():
+        series = _series_fenetre(from_date, to_date, company, par_produit)
+    else:
+        series = _series_cumul(from_date, to_date, company, par_produit)
+
+    return assembler_grand_livre(from_date, to_date, series, stocks_initiaux, par_produit)
+
+
+def assembler_grand_livre(from_date, to_date, series, stocks_initiaux, par_produit=False):
+    """
+    Grand livre depuis les flux journaliers de chaque produit
+
+    Args:
+        series: {code_produit: {colonne du journal: valeurs par jour,
+            "stock_final": cumul des entrées - sorties}}
+        stocks_initiaux: {code_produit: stock au début de la période}
+        par_produit: False si series est tous produits confondus
+
+    Returns:
+        GrandLivreStock
+    """
+    if not par_produit:
+        stocks_initiaux = {TOUS_PRODUITS: sum(stocks_initiaux.values())}
+
+    dates = [add_days(from_date, jour) for jour in range(date_diff(to_date, from_date) + 1)]
+    sans_flux = {colonne: [0] * len(dates) for colonne in COLONNES_JOURNAL}
+
+    grand_livre = GrandLivreStock()
+    for code_produit in sorted(set(series) | set(stocks_initiaux)):
+        stock_initial = flt(stocks_initiaux.get(code_produit))
+        flux = series.get(code_produit) or {**sans_flux, "stock_final": [0] * len(dates)}
+        flux["stock_final"] = [stock_initial + cumul for cumul in flux["stock_final"]]
+        grand_livre.ajouter_produit(code_produit, dates, flux, stock_initial)
+    return grand_livre
+
+
+def fonctions_fenetre_supportees():
+    """MariaDB ≥ 10.2 ou MySQL ≥ 8.0 (vérifié une fois par requête)"""
+    supportees = getattr(frappe.local, "gnr_fonctions_fenetre", None)
+    if supportees is None:
+        version = frappe.db.sql("SELECT VERSION()")[0][0]
+        numeros = tuple(int(n) for n in version.split("-")[0].split(".")[:2] if n.isdigit())
+        minimum = (10, 2) if "mariadb" in version.lower() else (8, 0)
+        supportees = numeros >= minimum
+        frappe.local.gnr_fonctions_fenetre = supportees
+    return supportees
+
+
+def _filtres(from_date, to_date, company):
+    condition = " AND company = %(company)s" if company else ""
+    return condition, {"from_date": from_date, "to_date": to_date, "company": company}
+
+
+def _series_fenetre(from_date, to_date, company, par_produit):
+    """
+    Flux de chaque jour et cumul (entrées - sorties) en une requête
+
+    Returns:
+        dict: {code_produit: {colonne: valeurs par jour, "stock_final": cumul}}
+    """
+    condition, parametres = _filtres(from_date, to_date, company)
+    produit = "code_produit" if par_produit else f"'{TOUS_PRODUITS}'"
+    groupes = "date_mouvement, code_produit" if par_produit else "date_mouvement"
+    lignes = frappe.db.sql(
+        f"""
+        WITH RECURSIVE jours AS (
+            SELECT CAST(%(from_date)s AS DATE) AS jour
+            UNION ALL
+            SELECT jour + INTERVAL 1 DAY FROM jours WHERE jour < %(to_date)s
+        ),
+        journal AS (
+            SELECT date_mouvement, {produit} AS code_produit,
+                {", ".join(f"SUM({c}) AS {c}" for c in COLONNES_JOURNAL)}
+            FROM `tabGNR Daily Ledger`
+            WHERE date_mouvement BETWEEN %(from_date)s AND %(to_date)s{condition}
+            GROUP BY {groupes}
+        ),
+        produits AS (
+            SELECT DISTINCT code_produit FROM journal
+        )
+        SELECT p.code_produit,
+            {", ".join(f"COALESCE(l.{c}, 0) AS {c}" for c in COLONNES_JOURNAL)},
+            SUM(COALESCE(l.entrees, 0) - COALESCE(l.sorties, 0))
+                OVER (PARTITION BY p.code_produit ORDER BY j.jour) AS stock_final
+        FROM jours j
+        CROSS JOIN produits p
+        LEFT JOIN journal l ON l.date_mouvement = j.jour AND l.code_produit = p.code_produit
+        ORDER BY p.code_produit, j.jour
+        """,
+        parametres,
+        as_dict=True,
+    )
+
+    series = {}
+    for ligne in lignes:
+        serie = series.setdefault(
+            ligne.code_produit, {colonne: [] for colonne in (*COLONNES_JOURNAL, "stock_final")}
+        )
+        for colonne in (*COLONNES_JOURNAL, "stock_final"):
+            serie[colonne].append(flt(ligne[colonne]))
+    return series
+
+
+def _series_cumul(from_date, to_date, company, par_produit):
+    """Même résultat que _series_fenetre, cumul calculé en Python"""
+    condition, parametres = _filtres(from_date, to_date, company)
+    lignes = frappe.db.sql(
+        f"""
+        SELECT date_mouvement, code_produit, {", ".join(COLONNES_JOURNAL)}
+        FROM `tabGNR Daily Ledger`
+        WHERE date_mouvement BETWEEN %(from_date)s AND %(to_date)s{condition}
+        """,
+        parametres,
+        as_dict=True,
+    )
+
+    nb_jours = date_diff(to_date, from_date) + 1
+    series = {}
+    for ligne in lignes:
+        code_produit = ligne.code_produit if par_produit else TOUS_PRODUITS
+        serie = series.setdefault(code_produit, {colonne: [0] * nb_jours for colonne in COLONNES_JOURNAL})
+        jour = date_diff(ligne.date_mouvement, from_date)
+        for colonne in COLONNES_JOURNAL:
+            serie[colonne][jour] += flt(ligne[colonne])
+
+    for serie in series.values():
+        serie["stock_final"] = somme_cumulee(
+            [entree - sortie for entree, sortie in zip(serie["entrees"], serie["sorties"], strict=True)]
+        )
+    return series
+
+
+def somme_cumulee(valeurs):
+    try:
+        import numpy
+    except ImportError:
+        return list(accumulate(valeurs))
+    return numpy.cumsum(valeurs).tolist()
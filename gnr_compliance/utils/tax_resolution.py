@@ -0,0 +1,170 @@
+# gnr_compliance/utils/tax_resolution.py
+"""
+Résolution du taux GNR réel des lignes d'une facture
+
+Le contexte est construit une seule fois par facture : lignes de taxe GNR
+pré-classées, item_wise_tax_detail décodé, taux trouvés dans les termes,
+derniers taux connus (GNR Item Rate) et taux articles préchargés pour
+tous les codes. Chaque ligne résout ensuite son taux sans parcours ni
+requête supplémentaires.
+"""
+import json
+import re
+
+import frappe
+from frappe.utils import flt
+
+from gnr_compliance.utils.attestation_resolver import get_customer_category
+from gnr_compliance.utils.gnr_item_registry import get_gnr_item, is_gnr_item
+from gnr_compliance.utils.unit_conversions import convert_to_litres, get_item_unit
+from gnr_compliance.gnr_compliance.doctype.gnr_item_rate.gnr_item_rate import get_derniers_taux
+
+TAUX_MIN = 0.1
+TAUX_MAX = 50
+TAUX_STANDARD = 24.81
+TAUX_AGRICOLE = 3.86
+
+# Mots-clés pour identifier les taxes GNR
+MOTIF_TAXE_GNR = re.compile(
+    r"gnr|accise|ticpe|gazole|fioul|carburant|tipp|diesel", re.IGNORECASE
+)
+
+# Patterns pour chercher "3.86€/L", "taxe 2.84", etc. (par ordre de priorité)
+MOTIFS_TERMES = [
+    re.compile(r"(\d+[.,]\d+)\s*[€]\s*[/]\s*[Ll]", re.IGNORECASE),  # "3.86€/L"
+    re.compile(r"taxe[:\s]+(\d+[.,]\d+)", re.IGNORECASE),  # "taxe: 3.86"
+    re.compile(r"tipp[:\s]+(\d+[.,]\d+)", re.IGNORECASE),  # "tipp: 3.86"
+    re.compile(r"accise[:\s]+(\d+[.,]\d+)", re.IGNORECASE),  # "accise: 3.86"
+    re.compile(r"gnr[:\s]+(\d+[.,]\d+)", re.IGNORECASE),  # "gnr: 3.86"
+]
+
+
+def taux_coherent(taux):
+    """Vérification de cohérence (taux entre 0.1 et 50 €/L)"""
+    return bool(taux) and TAUX_MIN <= taux <= TAUX_MAX
+
+
+def get_tax_resolution_context(invoice_doc):
+    """Contexte de résolution de la facture, construit une fois par document"""
+    contexte = invoice_doc.flags.get("gnr_tax_context")
+    if contexte is None:
+        contexte = TaxResolutionContext(invoice_doc)
+        invoice_doc.flags.gnr_tax_context = contexte
+    return contexte
+
+
+class TaxResolutionContext:
+    """Données de la facture nécessaires à la résolution du taux de chaque ligne"""
+
+    def __init__(self, invoice_doc):
+        self.doc = invoice_doc
+        self.lignes_taxe_gnr = [
+            row for row in (invoice_doc.get("taxes") or [])
+            if row.description and MOTIF_TAXE_GNR.search(row.description)
+        ]
+        self.montants_par_article = self._montants_par_article()
+        self.litres_par_article = self._litres_par_article()
+        self.taux_termes = self._taux_depuis_termes()
+        self.taux_historiques = get_derniers_taux(
+            {item.item_code for item in invoice_doc.items if is_gnr_item(item.item_code)}
+        )
+        self._taux_client = None
+
+    def _montants_par_article(self):
+        """Montant de taxe GNR par article depuis item_wise_tax_detail"""
+        montants = {}
+        for row in self.lignes_taxe_gnr:
+            detail = row.get("item_wise_tax_detail")
+            if not detail:
+                continue
+            try:
+                detail = json.loads(detail) if isinstance(detail, str) else detail
+            except ValueError:
+                continue
+            for item_code, valeurs in detail.items():
+                montant = valeurs[1] if isinstance(valeurs, (list, tuple)) and len(valeurs) > 1 else None
+                if montant:
+                    montants[item_code] = montants.get(item_code, 0) + abs(flt(montant))
+        return montants
+
+    def _litres_par_article(self):
+        """Quantité totale en litres par article (plusieurs lignes possibles)"""
+        litres = {}
+        for item in self.doc.items:
+            if item.item_code in self.montants_par_article:
+                litres[item.item_code] = litres.get(item.item_code, 0) + self.litres_ligne(item)
+        return litres
+
+    def _taux_depuis_termes(self):
+        """Premier taux cohérent trouvé dans les termes de la facture"""
+        termes = self.doc.get("terms")
+        if not termes:
+            return None
+        for motif in MOTIFS_TERMES:
+            for match in motif.findall(termes):
+                taux = float(match.replace(",", "."))
+                if taux_coherent(taux):
+                    return taux
+        return None
+
+    @staticmethod
+    def litres_ligne(item):
+        """Convertir la quantité de la ligne en litres si nécessaire"""
+        item_unit = item.uom or get_item_unit(item.item_code)
+        return convert_to_litres(item.qty, item_unit)
+
+    def taux_client(self):
+        """Taux basé sur l'attestation du client (dernier recours)"""
+        if self._taux_client is None:
+            categorie = get_customer_category(self.doc.get("customer"), self.doc.get("posting_date"))
+            self._taux_client = TAUX_AGRICOLE if categorie == "Agricole" else TAUX_STANDARD
+        return self._taux_client
+
+    def resoudre(self, item):
+        """
+        Taux GNR réel d'une ligne de la facture
+
+        Returns:
+            tuple: (taux en €/L, source)
+        """
+        # 1. PRIORITÉ 1: Taxes GNR de la facture
+        if self.lignes_taxe_gnr and item.qty > 0:
+            if item.item_code in self.montants_par_article:
+                litres = self.litres_par_article.get(item.item_code)
+                if litres and litres > 0:
+                    taux = self.montants_par_article[item.item_code] / litres
+                    if taux_coherent(taux):
+                        return taux, "taxes facture (détail par article)"
+            elif not self.montants_par_article:
+                # Pas de détail par article : montant total de la ligne de taxe
+                litres = self.litres_ligne(item)
+                if litres > 0:
+                    for row in self.lignes_taxe_gnr:
+                        if row.tax_amount:
+                            taux = abs(row.tax_amount) / litres
+                            if taux_coherent(taux):
+                                return taux, "taxes facture"
+
+        # 2. PRIORITÉ 2: Champ personnalisé de la ligne
+        taux_ligne = item.get("gnr_tax_rate")
+        if taux_coherent(taux_ligne):
+            return taux_ligne, "champ ligne facture"
+
+        # 3. PRIORITÉ 3: Termes/commentaires de la facture
+        if self.taux_termes:
+            return self.taux_termes, "termes facture"
+
+        # 4. PRIORITÉ 4: Historique des mouvements de cet article
+        taux_historique = self.taux_historiques.get(item.item_code)
+        if taux_coherent(taux_historique):
+            return taux_historique, "historique"
+
+        # 5. PRIORITÉ 5: Taux défini sur l'article maître (registre GNR)
+        article = get_gnr_item(item.item_code)
+        taux_article = article.gnr_tax_rate if article else None
+        if taux_coherent(taux_article):
+            return taux_article, "article maître"
+
+        # 6. DERNIER RECOURS: Taux basé sur l'attestation du client
+        return self.taux_client(), "attestation client"
+
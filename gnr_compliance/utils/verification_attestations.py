@@ -4,6 +4,8 @@
 import frappe
 from frappe.utils import format_date, getdate
 
+from gnr_compliance.gnr_compliance.doctype.gnr_daily_ledger.gnr_daily_ledger import resoudre_societe
+
 @frappe.whitelist()
 def verifier_attestations_clients():
     """
@@ -108,38 +110,41 @@ def corriger_attestation_client(client_code, numero_dossier=None, date_depot=Non
         return {"success": False, "message": f"Erreur: {str(e)}"}
 
 @frappe.whitelist()
-def rapport_attestations_periode(from_date, to_date):
+def rapport_attestations_periode(from_date, to_date, company=None):
     """
-    Génère un rapport des attestations pour une période donnée
+    Génère un rapport des attestations d'une société pour une période donnée
     """
     try:
+        company = resoudre_societe(company)
+        
         # Récupérer les ventes GNR avec détail des attestations
         ventes = frappe.db.sql("""
             SELECT 
                 m.client,
                 c.customer_name,
-                c.custom_n_dossier_,
+                MAX(m.reference_attestation) as custom_n_dossier_,
                 c.custom_date_de_depot,
                 SUM(m.quantite) as quantite_totale,
                 CASE 
-                    WHEN c.custom_n_dossier_ IS NOT NULL AND c.custom_n_dossier_ != '' AND c.custom_date_de_depot IS NOT NULL 
+                    WHEN MAX(COALESCE(m.avec_attestation, 0)) = 1 
                     THEN 'Avec attestation (3,86€/hL)' 
                     ELSE 'Sans attestation (24,81€/hL)' 
                 END as statut_attestation,
                 CASE 
-                    WHEN c.custom_n_dossier_ IS NOT NULL AND c.custom_n_dossier_ != '' AND c.custom_date_de_depot IS NOT NULL 
+                    WHEN MAX(COALESCE(m.avec_attestation, 0)) = 1 
                     THEN SUM(m.quantite) * 3.86 / 100
                     ELSE SUM(m.quantite) * 24.81 / 100
                 END as taxe_gnr
             FROM `tabMouvement GNR` m
             LEFT JOIN `tabCustomer` c ON m.client = c.name
-            WHERE m.date_mouvement BETWEEN %s AND %s
+            WHERE m.company = %s
+            AND m.date_mouvement BETWEEN %s AND %s
             AND m.docstatus = 1
             AND m.type_mouvement = 'Vente'
             AND m.client IS NOT NULL
-            GROUP BY m.client, c.customer_name, c.custom_n_dossier_, c.custom_date_de_depot
+            GROUP BY m.client, c.customer_name, c.custom_date_de_depot
             ORDER BY c.customer_name
-        """, (from_date, to_date), as_dict=True)
+        """, (company, from_date, to_date), as_dict=True)
         
         # Calculer les totaux
         total_avec_attestation = sum([v.quantite_totale for v in ventes if 'Avec attestation' in v.statut_attestation])
@@ -0,0 +1,319 @@
+# gnr_compliance/utils/xlsx_benchmark.py
+"""
+Banc d'essai du rendu en flux des exports TIPAccEne
+
+Compare le rendu write-only (utils/xlsx_streaming) au rendu classique,
+classeur complet en mémoire et mise en forme cellule par cellule, conservé
+ici comme référence. Chaque rendu est mesuré dans un processus fils :
+lignes par seconde et pic de mémoire résidente (RSS) du rendu seul. Les
+deux fichiers sont ensuite relus pour vérifier que la mise en page est
+identique cellule par cellule (valeurs, polices, bordures, alignements,
+formats, fusions et largeurs de colonnes).
+"""
+
+import json
+import os
+import resource
+import time
+from datetime import date, timedelta
+from io import BytesIO
+
+import frappe
+
+from gnr_compliance.utils.export_formats_exacts import format_date_french
+from gnr_compliance.utils.xlsx_streaming import (
+    BORDURE_FINE,
+    CENTRE,
+    ENTETES_SEMESTRIEL,
+    ENTETES_TRIMESTRIEL,
+    FEUILLE_SEMESTRIELLE,
+    FEUILLE_TRIMESTRIELLE,
+    GROUPES_SEMESTRIEL,
+    LARGEURS_SEMESTRIEL,
+    LARGEURS_TRIMESTRIEL,
+    TITRE_TRIMESTRIEL,
+    rendre_declaration_trimestrielle,
+    rendre_liste_semestrielle,
+)
+
+
+def rendu_classique_trimestriel(mouvements_journaliers, company_name, numero_autorisation, periode_text):
+    """Référence : classeur en mémoire, bordure et format posés cellule par cellule"""
+    from openpyxl import Workbook
+    from openpyxl.styles import Font
+    from openpyxl.utils import get_column_letter
+
+    wb = Workbook()
+    ws = wb.active
+    ws.title = FEUILLE_TRIMESTRIELLE
+
+    ws.merge_cells("A1:G1")
+    ws["A1"] = TITRE_TRIMESTRIEL
+    ws["A1"].font = Font(name="Arial", size=14, bold=True)
+    ws["A1"].alignment = CENTRE
+    ws["A2"] = f"Société : {company_name}"
+    ws["A2"].font = Font(name="Arial", size=11, bold=True)
+    ws["A3"] = f"Numéro d'autorisation : {numero_autorisation}"
+    ws["A3"].font = Font(name="Arial", size=10)
+    ws["A4"] = periode_text
+    ws["A4"].font = Font(name="Arial", size=11, bold=True)
+    ws["A5"] = ""
+    ws["A6"] = ""
+    ws["B6"] = "Volume réel en Litres"
+    ws["B6"].font = Font(name="Arial", size=11, bold=True)
+
+    for col, header in enumerate(ENTETES_TRIMESTRIEL, 1):
+        cell = ws.cell(row=8, column=col, value=header)
+        cell.font = Font(name="Arial", size=11, bold=True)
+        cell.alignment = CENTRE
+        cell.border = BORDURE_FINE
+
+    row = 9
+    for mouvement in mouvements_journaliers:
+        valeurs = [
+            mouvement.get("date_format", ""),
+            mouvement.get("stock_initial", 0),
+            mouvement.get("entrees", 0),
+            mouvement.get("sorties", 0),
+            mouvement.get("stock_final", 0),
+            "",
+            mouvement.get("sorties", 0),
+            mouvement.get("volume_agricole_reel", 0),
+            mouvement.get("volume_agricole_reel", 0),
+            mouvement.get("volume_sans_attestation_reel", 0),
+            mouvement.get("volume_sans_attestation_reel", 0),
+        ]
+        for col, valeur in enumerate(valeurs, 1):
+            ws.cell(row=row, column=col, value=valeur).border = BORDURE_FINE
+            if col not in (1, 6):
+                ws.cell(row=row, column=col).number_format = "#,##0"
+        row += 1
+
+    for i, width in enumerate(LARGEURS_TRIMESTRIEL, 1):
+        ws.column_dimensions[get_column_letter(i)].width = width
+
+    output = BytesIO()
+    wb.save(output)
+    return output.getvalue()
+
+
+def rendu_classique_semestriel(clients_data, company_name, company_siren):
+    """Référence : classeur en mémoire, bordure et format posés cellule par cellule"""
+    from openpyxl import Workbook
+    from openpyxl.styles import Font
+    from openpyxl.utils import get_column_letter
+
+    wb = Workbook()
+    ws = wb.active
+    ws.title = FEUILLE_SEMESTRIELLE
+
+    for plage, libelle in GROUPES_SEMESTRIEL:
+        ws.merge_cells(plage)
+        cellule = plage.split(":")[0]
+        ws[cellule] = libelle
+        ws[cellule].font = Font(name="Arial", size=11, bold=True)
+        ws[cellule].alignment = CENTRE
+        ws[cellule].border = BORDURE_FINE
+
+    for col, header in enumerate(ENTETES_SEMESTRIEL, 1):
+        cell = ws.cell(row=2, column=col, value=header)
+        cell.font = Font(name="Arial", size=11, bold=True)
+        cell.alignment = CENTRE
+        cell.border = BORDURE_FINE
+
+    row = 3
+    for client in clients_data:
+        ws.cell(row=row, column=1, value=company_name).border = BORDURE_FINE
+        ws.cell(row=row, column=2, value=company_siren).border = BORDURE_FINE
+        ws.cell(row=row, column=3, value=client.get("nom_client", "")).border = BORDURE_FINE
+        ws.cell(
+            row=row, column=4, value=client.get("siret", "") or client.get("siren", "")
+        ).border = BORDURE_FINE
+        ws.cell(row=row, column=5, value=client.get("quantite_totale", 0) / 100).border = BORDURE_FINE
+        ws.cell(row=row, column=5).number_format = "#,##0.00"
+        ws.cell(row=row, column=6, value=client.get("taux_reel_par_hl", 0)).border = BORDURE_FINE
+        ws.cell(row=row, column=6).number_format = "#,##0.00"
+        row += 1
+
+    for i, width in enumerate(LARGEURS_SEMESTRIEL, 1):
+        ws.column_dimensions[get_column_letter(i)].width = width
+
+    output = BytesIO()
+    wb.save(output)
+    return output.getvalue()
+
+
+def donnees_synthetiques(nb_jours, nb_clients):
+    """Jours de stock et clients fictifs, aux formes des exports réels"""
+    debut = date(2025, 1, 1)
+    jours = []
+    stock = 50000.0
+    for numero in range(nb_jours):
+        jour = debut + timedelta(days=numero)
+        entrees = 8000.0 if numero % 7 == 0 else 0.0
+        agricole = float(300 + numero % 40)
+        sans_attestation = float(150 + numero % 25)
+        sorties = agricole + sans_attestation
+        jours.append(
+            {
+                "date_format": format_date_french(jour),
+                "stock_initial": stock,
+                "entrees": entrees,
+                "sorties": sorties,
+                "stock_final": stock + entrees - sorties,
+                "volume_agricole_reel": agricole,
+                "volume_sans_attestation_reel": sans_attestation,
+            }
+        )
+        stock += entrees - sorties
+
+    clients = [
+        {
+            "nom_client": f"CLIENT {numero:05d}",
+            "siret": f"{numero:09d}",
+            "quantite_totale": float(1000 + numero * 7 % 9000),
+            "taux_reel_par_hl": 3.86 if numero % 3 else 24.81,
+        }
+        for numero in range(nb_clients)
+    ]
+    return jours, clients
+
+
+def mesurer_rendu(rendu, *arguments):
+    """
+    Exécute un rendu dans un processus fils
+
+    Le fils part de la mémoire du parent au moment du fork : son pic de RSS
+    moins son RSS de départ est le surcoût du seul rendu.
+
+    Returns:
+        dict: duree_s, pic_rss_mo, surcout_rss_mo, taille_ko
+    """
+    lecture, ecriture = os.pipe()
+    pid = os.fork()
+    if pid == 0:
+        try:
+            os.close(lecture)
+            rss_depart = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+            debut = time.perf_counter()
+            contenu = rendu(*arguments)
+            duree = time.perf_counter() - debut
+            rss_pic = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+            mesure = {
+                "duree_s": round(duree, 3),
+                "pic_rss_mo": round(rss_pic / 1024, 1),
+                "surcout_rss_mo": round((rss_pic - rss_depart) / 1024, 1),
+                "taille_ko": round(len(contenu) / 1024, 1),
+            }
+        except Exception as e:
+            mesure = {"erreur": str(e)}
+        os.write(ecriture, json.dumps(mesure).encode("utf-8"))
+        os._exit(0)
+
+    os.close(ecriture)
+    with os.fdopen(lecture, "rb") as flux:
+        mesure = json.loads(flux.read() or b"{}")
+    os.waitpid(pid, 0)
+    return mesure
+
+
+def empreinte_mise_en_page(contenu):
+    """Mise en page d'un classeur relu : cellules, fusions et largeurs"""
+    from openpyxl import load_workbook
+
+    feuille = load_workbook(BytesIO(contenu)).active
+    cellules = {}
+    for ligne in feuille.iter_rows():
+        for cellule in ligne:
+            if cellule.value in (None, "") and not cellule.has_style:
+                continue
+            cellules[cellule.coordinate] = (
+                cellule.value if cellule.value != "" else None,
+                cellule.number_format,
+                (cellule.font.name, cellule.font.size, cellule.font.bold),
+                tuple(
+                    getattr(getattr(cellule.border, cote), "style", None)
+                    for cote in ("left", "right", "top", "bottom")
+                ),
+                (cellule.alignment.horizontal, cellule.alignment.vertical),
+            )
+    return {
+        "titre": feuille.title,
+        "cellules": cellules,
+        "fusions": sorted(str(plage) for plage in feuille.merged_cells.ranges),
+        "largeurs": {
+            colonne: dimension.width
+            for colonne, dimension in feuille.column_dimensions.items()
+            if dimension.width
+        },
+    }
+
+
+def differences_mise_en_page(reference, flux):
+    """Coordonnées ou éléments de mise en page qui diffèrent entre deux classeurs"""
+    attendu, obtenu = empreinte_mise_en_page(reference), empreinte_mise_en_page(flux)
+    differences = [
+        element for element in ("titre", "fusions", "largeurs") if attendu[element] != obtenu[element]
+    ]
+    for coordonnee in sorted(set(attendu["cellules"]) | set(obtenu["cellules"])):
+        if attendu["cellules"].get(coordonnee) != obtenu["cellules"].get(coordonnee):
+            differences.append(coordonnee)
+    return differences
+
+
+@frappe.whitelist()
+def comparer_rendus_exports(nb_jours=365, nb_clients=5000):
+    """
+    Mesure le rendu classique et le rendu en flux des deux exports sur des
+    données synthétiques, et vérifie que leurs mises en page sont identiques
+    """
+    frappe.only_for("System Manager")
+
+    try:
+        jours, clients = donnees_synthetiques(int(nb_jours), int(nb_clients))
+        cas = {
+            "arrete_trimestriel": (
+                len(jours),
+                (jours, "SOCIÉTÉ TEST", "08/2024/AMIENS", "1er Trimestre 2025 (Janvier - Février - Mars)"),
+                rendu_classique_trimestriel,
+                rendre_declaration_trimestrielle,
+            ),
+            "liste_semestrielle": (
+                len(clients),
+                (clients, "SOCIÉTÉ TEST", "123456789"),
+                rendu_classique_semestriel,
+                rendre_liste_semestrielle,
+            ),
+        }
+
+        resultats = {}
+        for nom, (nb_lignes, arguments, classique, flux) in cas.items():
+            mesures = {
+                "classique": mesurer_rendu(classique, *arguments),
+                "flux": mesurer_rendu(flux, *arguments),
+            }
+            for mesure in mesures.values():
+                if mesure.get("duree_s"):
+                    mesure["lignes_par_seconde"] = round(nb_lignes / mesure["duree_s"])
+            differences = differences_mise_en_page(classique(*arguments), flux(*arguments))
+            resultats[nom] = {
+                "lignes": nb_lignes,
+                **mesures,
+                "mise_en_page_identique": not differences,
+                "differences": differences[:20],
+            }
+
+        identiques = all(resultat["mise_en_page_identique"] for resultat in resultats.values())
+        return {
+            "success": identiques,
+            "resultats": resultats,
+            "message": (
+                "✅ Mises en page identiques, rendu en flux mesuré"
+                if identiques
+                else "Écarts de mise en page entre rendu classique et rendu en flux"
+            ),
+        }
+
+    except Exception as e:
+        frappe.log_error(f"Erreur banc d'essai rendu exports GNR: {e!s}")
+        return {"success": False, "message": str(e)}
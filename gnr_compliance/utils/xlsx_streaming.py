@@ -0,0 +1,280 @@
+# gnr_compliance/utils/xlsx_streaming.py
+"""
+Rendu en flux des exports réglementaires TIPAccEne
+
+Les classeurs sont écrits en mode write-only d'openpyxl : chaque ligne est
+sérialisée dès son ajout, la mémoire ne croît plus avec le nombre de jours
+ou de clients. Les mises en forme sont des styles nommés enregistrés une
+fois par classeur et référencés par chaque cellule, au lieu d'une bordure
+et d'un format numérique affectés cellule par cellule.
+
+Plusieurs classeurs indépendants (export annuel) sont réunis dans une
+archive ZIP ; générés par un job en arrière-plan, ils sont rendus en
+parallèle dans des processus fils.
+"""
+
+import multiprocessing
+import os
+import zipfile
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from copy import copy
+from io import BytesIO
+
+from openpyxl import Workbook
+from openpyxl.cell import WriteOnlyCell
+from openpyxl.styles import Alignment, Border, Font, NamedStyle, Side
+from openpyxl.styles.fonts import DEFAULT_FONT
+from openpyxl.utils import get_column_letter
+
+BORDURE_FINE = Border(
+    left=Side(style="thin"),
+    right=Side(style="thin"),
+    top=Side(style="thin"),
+    bottom=Side(style="thin"),
+)
+CENTRE = Alignment(horizontal="center", vertical="center")
+
+# Styles nommés partagés par toutes les cellules d'un classeur (police par
+# défaut du classeur explicite : un style nommé n'en hérite pas)
+STYLES = {
+    "gnr_titre": {"font": Font(name="Arial", size=14, bold=True), "alignment": CENTRE},
+    "gnr_entete": {"font": Font(name="Arial", size=11, bold=True)},
+    "gnr_texte": {"font": Font(name="Arial", size=10)},
+    "gnr_entete_colonne": {
+        "font": Font(name="Arial", size=11, bold=True),
+        "alignment": CENTRE,
+        "border": BORDURE_FINE,
+    },
+    "gnr_cellule": {"font": DEFAULT_FONT, "border": BORDURE_FINE},
+    "gnr_volume": {"font": DEFAULT_FONT, "border": BORDURE_FINE, "number_format": "#,##0"},
+    "gnr_volume_hl": {"font": DEFAULT_FONT, "border": BORDURE_FINE, "number_format": "#,##0.00"},
+}
+
+# === ARRÊTÉ TRIMESTRIEL DE STOCK ===
+TITRE_TRIMESTRIEL = "Comptabilité Matière - Gasoil Non Routier"
+FEUILLE_TRIMESTRIELLE = "Comptabilité Matière GNR"
+ENTETES_TRIMESTRIEL = [
+    "Date",
+    "Stock Initial",
+    "Entrées",
+    "Sorties",
+    "Stock Final",
+    "N° BL",
+    "Volume",
+    "AGRICOLE /\nFORESTIER",
+    "Volume",
+    "Sans\nAttestation",
+    "Volume",
+]
+LARGEURS_TRIMESTRIEL = [12, 12, 10, 10, 12, 8, 10, 12, 10, 12, 10]
+STYLES_JOUR = ["gnr_cellule"] + ["gnr_volume"] * 4 + ["gnr_cellule"] + ["gnr_volume"] * 5
+
+# === LISTE SEMESTRIELLE DES CLIENTS ===
+FEUILLE_SEMESTRIELLE = "Liste Clients Semestrielle"
+GROUPES_SEMESTRIEL = [
+    ("A1:B1", "Informations distributeur autorisé ou fournisseur"),
+    ("C1:D1", "Informations client"),
+    ("E1:F1", "Données carburant GNR"),
+]
+ENTETES_SEMESTRIEL = [
+    "Raison sociale",
+    "SIREN",
+    "Raison sociale du client",
+    "SIREN du client",
+    "Volumes (en hL) de GNR livrés au client au cours du dernier semestre civil écoulé",
+    "Tarif d'accise RÉEL appliqué (en euro par hectolitres)",
+]
+LARGEURS_SEMESTRIEL = [25, 15, 30, 15, 35, 30]
+STYLES_CLIENT = ["gnr_cellule"] * 4 + ["gnr_volume_hl"] * 2
+
+
+def nouveau_classeur(titre_feuille, largeurs):
+    """
+    Classeur write-only à une feuille, styles nommés enregistrés
+
+    Les largeurs de colonnes sont posées avant la première ligne, seul
+    moment où le mode write-only les accepte.
+
+    Returns:
+        tuple: (classeur, feuille, {nom du style: références de style})
+    """
+    classeur = Workbook(write_only=True)
+    for nom, attributs in STYLES.items():
+        classeur.add_named_style(NamedStyle(name=nom, **attributs))
+
+    feuille = classeur.create_sheet(titre_feuille)
+    for colonne, largeur in enumerate(largeurs, 1):
+        feuille.column_dimensions[get_column_letter(colonne)].width = largeur
+
+    # Références (police, bordure, format...) résolues une fois par style :
+    # affecter un style par son nom le recherche à chaque cellule
+    modeles = {}
+    for nom in STYLES:
+        cellule = WriteOnlyCell(feuille)
+        cellule.style = nom
+        modeles[nom] = cellule._style
+    return classeur, feuille, modeles
+
+
+def ligne_stylee(feuille, valeurs, styles, modeles):
+    """Cellules d'une ligne ; style None : cellule sans mise en forme"""
+    cellules = []
+    for valeur, style in zip(valeurs, styles, strict=True):
+        if style is None:
+            cellules.append(valeur)
+            continue
+        cellule = WriteOnlyCell(feuille, value=valeur)
+        cellule._style = copy(modeles[style])
+        cellules.append(cellule)
+    return cellules
+
+
+def en_octets(classeur):
+    sortie = BytesIO()
+    classeur.save(sortie)
+    return sortie.getvalue()
+
+
+def rendre_declaration_trimestrielle(mouvements_journaliers, company_name, numero_autorisation, periode_text):
+    """
+    Arrêté trimestriel de stock détaillé, une ligne par jour
+
+    Returns:
+        bytes: contenu du fichier xlsx
+    """
+    classeur, feuille, modeles = nouveau_classeur(FEUILLE_TRIMESTRIELLE, LARGEURS_TRIMESTRIEL)
+
+    # === EN-TÊTE SELON FORMAT EXACT TIPAccEne ===
+    feuille.merged_cells.add("A1:G1")
+    feuille.append(ligne_stylee(feuille, [TITRE_TRIMESTRIEL], ["gnr_titre"], modeles))
+    feuille.append(ligne_stylee(feuille, [f"Société : {company_name}"], ["gnr_entete"], modeles))
+    feuille.append(
+        ligne_stylee(feuille, [f"Numéro d'autorisation : {numero_autorisation}"], ["gnr_texte"], modeles)
+    )
+    feuille.append(ligne_stylee(feuille, [periode_text], ["gnr_entete"], modeles))
+    feuille.append([""])
+    feuille.append(ligne_stylee(feuille, ["", "Volume réel en Litres"], [None, "gnr_entete"], modeles))
+    feuille.append([])
+    feuille.append(
+        ligne_stylee(feuille, ENTETES_TRIMESTRIEL, ["gnr_entete_colonne"] * len(ENTETES_TRIMESTRIEL), modeles)
+    )
+
+    # === UNE LIGNE PAR JOUR, ÉMISE AU FIL DE L'EAU ===
+    for mouvement in mouvements_journaliers:
+        sorties = mouvement.get("sorties", 0)
+        volume_agricole = mouvement.get("volume_agricole_reel", 0)
+        volume_sans_attestation = mouvement.get("volume_sans_attestation_reel", 0)
+        valeurs = [
+            mouvement.get("date_format", ""),
+            mouvement.get("stock_initial", 0),
+            mouvement.get("entrees", 0),
+            sorties,
+            mouvement.get("stock_final", 0),
+            "",  # N° BL (vide pour l'instant)
+            sorties,
+            volume_agricole,
+            volume_agricole,
+            volume_sans_attestation,
+            volume_sans_attestation,
+        ]
+        feuille.append(ligne_stylee(feuille, valeurs, STYLES_JOUR, modeles))
+
+    return en_octets(classeur)
+
+
+def rendre_liste_semestrielle(clients_data, company_name, company_siren):
+    """
+    Liste semestrielle des clients, une ligne par client
+
+    Returns:
+        bytes: contenu du fichier xlsx
+    """
+    classeur, feuille, modeles = nouveau_classeur(FEUILLE_SEMESTRIELLE, LARGEURS_SEMESTRIEL)
+
+    # === EN-TÊTES : GROUPEMENTS FUSIONNÉS PUIS DÉTAILS ===
+    groupes = []
+    for plage, libelle in GROUPES_SEMESTRIEL:
+        feuille.merged_cells.add(plage)
+        groupes.extend([libelle, None])
+    feuille.append(
+        ligne_stylee(feuille, groupes, ["gnr_entete_colonne", None] * len(GROUPES_SEMESTRIEL), modeles)
+    )
+    feuille.append(
+        ligne_stylee(feuille, ENTETES_SEMESTRIEL, ["gnr_entete_colonne"] * len(ENTETES_SEMESTRIEL), modeles)
+    )
+
+    # === UNE LIGNE PAR CLIENT, ÉMISE AU FIL DE L'EAU ===
+    for client in clients_data:
+        valeurs = [
+            company_name,
+            company_siren,
+            client.get("nom_client", ""),
+            client.get("siret", "") or client.get("siren", ""),
+            client.get("quantite_totale", 0) / 100,  # Litres vers hectolitres
+            client.get("taux_reel_par_hl", 0),
+        ]
+        feuille.append(ligne_stylee(feuille, valeurs, STYLES_CLIENT, modeles))
+
+    return en_octets(classeur)
+
+
+def rendre_en_parallele(rendus, nb_processus=None):
+    """
+    Exécute des rendus indépendants dans un groupe de processus fils
+
+    Le rendu est du calcul Python pur (sérialisation XML) : des threads
+    resteraient sérialisés par le GIL. À n'appeler que depuis un job en
+    arrière-plan, jamais pendant une requête web. Les fils sont démarrés
+    par spawn : interpréteurs neufs qui n'importent que ce module, sans
+    hériter des connexions à la base et à Redis, de frappe.local ni des
+    verrous du processus parent. Ils reçoivent des données pures (dicts,
+    listes, scalaires) et n'accèdent pas à la base. Repli en séquentiel si
+    les processus ne peuvent pas être créés. Passer les rendus les plus
+    longs en premier : la durée totale tend vers celle du plus long.
+
+    Args:
+        rendus: {clé: (fonction de ce module, arguments nommés)}
+        nb_processus: plafond du nombre de fils (défaut : nombre de CPU ;
+            1 : rendu séquentiel dans le processus courant)
+
+    Returns:
+        dict: {clé: contenu}, dans l'ordre des rendus
+    """
+    nb_processus = min(len(rendus), nb_processus or os.cpu_count() or 1)
+    if nb_processus > 1:
+        try:
+            with ProcessPoolExecutor(
+                max_workers=nb_processus, mp_context=multiprocessing.get_context("spawn")
+            ) as groupe:
+                taches = {
+                    cle: groupe.submit(fonction, **donnees_pures(arguments))
+                    for cle, (fonction, arguments) in rendus.items()
+                }
+                return {cle: tache.result() for cle, tache in taches.items()}
+        except (OSError, BrokenProcessPool):
+            pass
+
+    return {cle: fonction(**arguments) for cle, (fonction, arguments) in rendus.items()}
+
+
+def donnees_pures(valeur):
+    """Copie en dicts et listes simples (frappe._dict et tuples convertis), transmissible à un fils"""
+    if isinstance(valeur, dict):
+        return {cle: donnees_pures(element) for cle, element in valeur.items()}
+    if isinstance(valeur, (list, tuple)):
+        return [donnees_pures(element) for element in valeur]
+    return valeur
+
+
+def archive_zip(fichiers):
+    """
+    Archive ZIP de fichiers {nom: contenu}
+
+    Les xlsx étant déjà compressés, ils sont stockés sans recompression.
+    """
+    sortie = BytesIO()
+    with zipfile.ZipFile(sortie, "w", zipfile.ZIP_STORED) as archive:
+        for nom, contenu in fichiers.items():
+            archive.writestr(nom, contenu)
+    return sortie.getvalue()